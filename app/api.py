@@ -1,52 +1,490 @@
-from fastapi import APIRouter, HTTPException
-from fastapi.responses import JSONResponse
+import asyncio
+import json
+import logging
+import shutil
+import tempfile
+import threading
+import time
+from typing import Optional
 
-from app.models import ConversionRequest, ConversionResponse
-from app.services import PDFConverterService
+from fastapi import APIRouter, HTTPException, Request
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import JSONResponse, StreamingResponse
+from pydantic import ValidationError
+
+from app import metrics
+from app.deadline import DeadlineError
+from app.config import get_int_env, get_str_env
+from app.jobs import ConversionJob, JobFailedError, JobScheduler, QueueFullError
+from app.models import (
+    BatchConversionRequest,
+    ConversionOptions,
+    ConversionRequest,
+    ConversionResponse,
+    JobCreatedResponse,
+    JobStatusResponse,
+)
+from app.pipeline import BatchPipeline
+from app.progress import ProgressReporter
+from app.services import ConversionError, PDFConverterService
+from app.sharding import get_page_count
+from app.uploads import UploadError, UploadTooLargeError, receive_upload
+from app.warmup import Warmup
+
+logger = logging.getLogger(__name__)
 
 router = APIRouter(prefix="/api/v1", tags=["conversion"])
 
-# 创建一个全局的PDF转换服务实例
-pdf_converter_service = PDFConverterService()
+# 全局的PDF转换服务、任务调度器和批量转换的下载/转换/上传流水线在首次使用（或启动预热）时创建，
+# 导入本模块只读取配置，不会创建COS客户端、连接任务代理或启动工作进程
+_pdf_converter_service: Optional[PDFConverterService] = None
+_job_scheduler: Optional[JobScheduler] = None
+_batch_pipeline: Optional[BatchPipeline] = None
+_services_lock = threading.Lock()
+
+
+def get_converter_service() -> PDFConverterService:
+    """获取（必要时创建）全局的PDF转换服务"""
+    global _pdf_converter_service
+    with _services_lock:
+        if _pdf_converter_service is None:
+            _pdf_converter_service = PDFConverterService()
+        return _pdf_converter_service
+
+
+def get_batch_pipeline() -> BatchPipeline:
+    """获取（必要时创建）批量转换的流水线，文档的转换通过任务调度器排队"""
+    global _batch_pipeline
+    service = get_converter_service()
+    scheduler = get_job_scheduler()
+    with _services_lock:
+        if _batch_pipeline is None:
+            _batch_pipeline = BatchPipeline.from_env(service, scheduler)
+        return _batch_pipeline
+
+
+def _run_conversion_job(payload: dict) -> dict:
+    """执行转换任务，批量流水线提交的任务只转换，由流水线上传"""
+    if "batch_item" in payload:
+        return get_batch_pipeline().run_scheduled(payload)
+    return get_converter_service().run_conversion_job(payload)
+
+
+def get_job_scheduler() -> JobScheduler:
+    """获取（必要时创建）全局的任务调度器，它限制同时进行的转换数量"""
+    global _job_scheduler
+    with _services_lock:
+        if _job_scheduler is None:
+            _job_scheduler = JobScheduler.from_env(_run_conversion_job)
+        return _job_scheduler
+
+
+def _scheduler_stat(name: str) -> float:
+    """调度器的统计值，调度器尚未创建时为0"""
+    scheduler = _job_scheduler
+    return scheduler.stats()[name] if scheduler is not None else 0
+
+
+metrics.JOBS_QUEUED.set_function(lambda: _scheduler_stat("queued"))
+metrics.JOBS_RUNNING.set_function(lambda: _scheduler_stat("running"))
+
+# 启动预热：在后台创建转换服务并预热工作进程，完成之前/ready返回503
+warmup = Warmup.from_env(lambda timeout: get_converter_service().warm_up(timeout))
+
+# 一次批量请求允许的最多URL数量
+BATCH_MAX_URLS = get_int_env('BATCH_MAX_URLS', 1000)
+# 批量请求未指定priority时使用的调度优先级
+BATCH_PRIORITY = get_str_env('BATCH_PRIORITY', 'low')
+
+# 流式接口在没有新事件时发送心跳的间隔（秒），避免被HTTP代理判定为空闲超时
+STREAM_HEARTBEAT_SECONDS = get_int_env('STREAM_HEARTBEAT_SECONDS', 15)
+# 流式接口检查新事件的间隔（秒）
+STREAM_POLL_INTERVAL = 0.2
+# 同步接口等待任务时检查客户端是否已断开连接的间隔（秒）
+DISCONNECT_POLL_INTERVAL = 0.5
+
+
+def _build_payload(request: ConversionRequest) -> dict:
+    """把请求转换为任务参数"""
+    return {"pdf_url": str(request.pdf_url), "options": request.to_options().model_dump()}
+
+
+def _submit(
+    payload: dict,
+    http_request: Request,
+    partial_results: bool = False,
+    pages: Optional[int] = None,
+    local_only: bool = False,
+) -> ConversionJob:
+    """
+    提交任务：请求中的timeout覆盖服务端默认的截止时间，按请求头X-API-Key区分租户
+
+    多节点部署时，依赖本节点状态的任务（上传的文件、推送部分结果）需要指定local_only，只由本节点执行
+
+    Raises:
+        HTTPException: 队列已满时返回429并在Retry-After中给出建议的重试等待时间
+    """
+    options = payload["options"]
+    try:
+        return get_job_scheduler().submit(
+            payload,
+            partial_results=partial_results,
+            timeout=options.get("timeout"),
+            priority=options.get("priority"),
+            tenant=http_request.headers.get("x-api-key"),
+            pages=pages,
+            local_only=local_only,
+        )
+    except QueueFullError as e:
+        raise _queue_full(e)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+
+def _queue_full(error: QueueFullError) -> HTTPException:
+    """把拒绝新任务映射为429，并在Retry-After中给出建议的重试等待时间"""
+    return HTTPException(
+        status_code=error.status_code, detail=error.message, headers={"Retry-After": str(error.retry_after)}
+    )
 
 
 @router.post("/convert", response_model=ConversionResponse, summary="将PDF转换为Markdown")
-async def convert_pdf_to_markdown(request: ConversionRequest):
+async def convert_pdf_to_markdown(request: ConversionRequest, http_request: Request):
     """
-    将PDF文件转换为Markdown（使用marker_single命令行工具）
-    
-    - **pdf_url**: PDF文件的URL
-    
+    将PDF文件转换为Markdown，等待转换完成后返回
+
+    与/jobs接口共用同一个调度器，转换在后台线程中执行，不会阻塞其他请求。
+
+    - **pdf_url**: PDF文件的URL（也支持DOCX和HTML文档）
+    - **shard_pages**: 可选，按页拆分并行转换时每个分片的页数
+    - **route**: 可选，转换路径：auto（自动判断）、marker、text（只读取文本层）
+    - **priority**: 可选，调度优先级：high、normal（默认）、low；队列已满时返回429和Retry-After
+    - **timeout**: 可选，截止时间（秒），超时返回504；客户端断开连接时任务随之取消
+
     返回:
     - 转换后的Markdown文件URL (替换完图片引用后的文件)
     """
+    logger.info(f"开始处理PDF URL: {request.pdf_url}")
+    job = _submit(_build_payload(request), http_request)
+    return await _wait_for_job(job, http_request)
+
+
+async def _wait_for_job(job: ConversionJob, http_request: Request) -> ConversionResponse:
+    """等待任务完成并把转换失败映射为HTTP错误，客户端断开连接时取消任务"""
+    future = asyncio.wrap_future(job.future)
     try:
-        # 调用同步方法，确保完全串行处理
-        print(f"开始处理PDF URL: {request.pdf_url}")
-        markdown_text, file_url, files_dict, error = pdf_converter_service.convert_using_command(str(request.pdf_url))
-        
-        # 检查处理结果
-        if not markdown_text:
-            error_message = error if error else "未知错误"
-            print(f"转换失败: {error_message}")
-            raise HTTPException(status_code=400, detail=error_message)
-        
-        if not file_url:
-            print("警告: 未能获取到Markdown文件URL")
-            raise HTTPException(status_code=500, detail="无法获取转换后的Markdown文件URL")
-        
-        print(f"成功转换PDF，Markdown URL: {file_url}")
-            
-        return ConversionResponse(file_url=file_url)
+        while not future.done():
+            await asyncio.wait({future}, timeout=DISCONNECT_POLL_INTERVAL)
+            if not future.done() and not job.deadline.cancelled and await http_request.is_disconnected():
+                get_job_scheduler().cancel(job.job_id)
+        result = future.result()
+    except DeadlineError as e:
+        logger.warning(f"转换中止: {e.message}")
+        raise HTTPException(status_code=e.status_code, detail=e.message)
+    except (ConversionError, JobFailedError) as e:
+        logger.warning(f"转换失败: {e.message}")
+        raise HTTPException(status_code=e.status_code, detail=e.message)
     except Exception as e:
-        print(f"处理请求时发生异常: {str(e)}")
+        logger.error(f"处理请求时发生异常: {str(e)}")
         raise HTTPException(
             status_code=500,
             detail=f"转换过程中发生错误: {str(e)}"
         )
 
+    logger.info(f"成功转换PDF，Markdown URL: {result['file_url']}")
+    return ConversionResponse(file_url=result["file_url"], route=result.get("route"))
+
+
+@router.post("/convert/stream", summary="流式返回转换进度和部分结果")
+async def convert_pdf_streaming(request: ConversionRequest, http_request: Request):
+    """
+    将PDF文件转换为Markdown，转换过程中流式推送进度
+
+    默认以Server-Sent Events返回；请求头Accept为application/x-ndjson时改为每行一个JSON对象。
+    事件类型：
+    - **stage**: 阶段切换（running、downloading、cached、converting、uploading）
+    - **progress**: 已完成的页数和总页数
+    - **markdown**: 按页序完成的一块Markdown，图片引用为相对路径，完整文件中会替换为COS URL
+    - **result**: 转换完成，包含Markdown文件URL
+    - **error**: 转换失败，包含错误信息和状态码
+
+    请求参数与 /convert 相同，客户端断开连接时任务随之取消。
+    """
+    logger.info(f"开始流式处理PDF URL: {request.pdf_url}")
+    job = _submit(_build_payload(request), http_request, partial_results=True, local_only=True)
+    return _stream_progress(job.progress, http_request, cancel_job_id=job.job_id)
+
+
+@router.get("/jobs/{job_id}/events", summary="订阅异步转换任务的进度事件")
+async def stream_job_events(job_id: str, http_request: Request):
+    """
+    以Server-Sent Events（或NDJSON）推送异步任务的进度事件，从任务开始回放
+
+    事件格式与 /convert/stream 相同，但不包含markdown事件。
+    """
+    job = get_job_scheduler().get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail=f"任务不存在或已过期: {job_id}")
+    return _stream_progress(job.progress, http_request)
+
+
+def _stream_progress(
+    reporter: ProgressReporter, http_request: Request, cancel_job_id: Optional[str] = None
+) -> StreamingResponse:
+    """
+    把任务的进度事件转换为SSE或NDJSON流式响应
+
+    Args:
+        reporter: 任务的进度报告器
+        http_request: 当前请求
+        cancel_job_id: 可选，任务结束前响应流被关闭（客户端断开连接）时取消该任务
+    """
+    ndjson = "application/x-ndjson" in http_request.headers.get("accept", "")
+
+    def format_event(event: str, data: dict) -> str:
+        if ndjson:
+            return json.dumps({"event": event, **data}, ensure_ascii=False) + "\n"
+        return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+    async def stream_events():
+        cursor = 0
+        idle = 0.0
+        closed = False
+        try:
+            while True:
+                events, closed = reporter.wait(cursor, timeout=0)
+                cursor += len(events)
+                for event in events:
+                    yield format_event(event["event"], event["data"])
+                if closed:
+                    return
+                if events:
+                    idle = 0.0
+                elif idle >= STREAM_HEARTBEAT_SECONDS:
+                    idle = 0.0
+                    yield format_event("heartbeat", {}) if ndjson else ": keep-alive\n\n"
+                await asyncio.sleep(STREAM_POLL_INTERVAL)
+                idle += STREAM_POLL_INTERVAL
+        finally:
+            # 客户端断开连接时响应流被取消，任务尚未结束则随之取消
+            if not closed and cancel_job_id is not None:
+                get_job_scheduler().cancel(cancel_job_id)
+
+    return StreamingResponse(
+        stream_events(),
+        media_type="application/x-ndjson" if ndjson else "text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
+@router.post("/convert/upload", response_model=ConversionResponse, summary="上传文档并转换为Markdown")
+async def convert_uploaded_file(request: Request):
+    """
+    直接上传PDF（或DOCX、HTML）文件并转换为Markdown，等待转换完成后返回
+
+    请求体为multipart/form-data表单，边接收边写入临时文件（较小的文件先缓存在内存中），
+    超过大小上限时立即返回413；接收完成后直接进入转换流程，不需要先把文件放到可公开访问的位置。
+
+    - **file**: 要转换的文件
+    - **shard_pages**: 可选，按页拆分并行转换时每个分片的页数
+    - **route**: 可选，转换路径：auto（自动判断）、marker、text（只读取文本层）
+    - **priority**: 可选，调度优先级：high、normal（默认）、low；队列已满时返回429和Retry-After
+    - **timeout**: 可选，截止时间（秒），超时返回504
+
+    返回:
+    - 转换后的Markdown文件URL (替换完图片引用后的文件)
+    """
+    service = get_converter_service()
+    temp_dir = tempfile.mkdtemp()
+    try:
+        upload = await receive_upload(
+            request,
+            temp_dir,
+            service.make_temp_filename,
+            max_bytes=service.upload_max_bytes,
+            spool_bytes=service.upload_spool_bytes,
+        )
+        options = ConversionOptions(**{name: value for name, value in upload.fields.items() if value != ""})
+    except UploadTooLargeError as e:
+        shutil.rmtree(temp_dir, ignore_errors=True)
+        raise HTTPException(status_code=413, detail=str(e))
+    except UploadError as e:
+        shutil.rmtree(temp_dir, ignore_errors=True)
+        raise HTTPException(status_code=400, detail=str(e))
+    except ValidationError as e:
+        shutil.rmtree(temp_dir, ignore_errors=True)
+        raise HTTPException(status_code=422, detail=e.errors(include_url=False, include_context=False))
+
+    logger.info(f"已接收上传文件: {upload.filename}，大小: {upload.size} 字节，"
+                f"{'已转存到磁盘' if upload.spooled_to_disk else '在内存中接收'}")
+    # 解析PDF读取页数可能需要数百毫秒（大文件），在线程池中执行，不阻塞事件循环
+    pages = await run_in_threadpool(_count_upload_pages, upload.path)
+    # 临时目录由转换任务在结束时删除；任务在排队期间超时或被取消时不会执行，由这里兜底清理
+    try:
+        job = _submit({
+            "upload_path": upload.path,
+            "content_hash": upload.content_hash,
+            "options": options.model_dump(),
+        }, request, pages=pages, local_only=True)
+    except HTTPException:
+        shutil.rmtree(temp_dir, ignore_errors=True)
+        raise
+    job.future.add_done_callback(lambda _: shutil.rmtree(temp_dir, ignore_errors=True))
+    return await _wait_for_job(job, request)
+
+
+def _count_upload_pages(path: str) -> Optional[int]:
+    """读取上传文件的页数用于估计排队时间，不是PDF或无法解析时返回None"""
+    try:
+        return get_page_count(path)
+    except Exception:
+        return None
+
+
+@router.post("/convert/batch", summary="批量转换多个文档")
+async def convert_batch(request: BatchConversionRequest, http_request: Request):
+    """
+    批量转换多个文档，按完成顺序以NDJSON流式返回每个文档的结果
+
+    下载阶段提前预取后续的文档，下载完成的文档的转换作为任务提交给调度器，
+    与交互式请求一起按优先级和租户（X-API-Key）公平排队，默认使用low优先级；上传与下一个文档的转换重叠执行。
+
+    - **pdf_urls**: 文档URL列表
+    - **shard_pages**: 可选，按页拆分并行转换时每个分片的页数
+    - **route**: 可选，转换路径：auto（自动判断）、marker、text（只读取文本层）
+    - **priority**: 可选，调度优先级，默认low；开始前队列已满时返回429和Retry-After
+    - **timeout**: 可选，每个文档的截止时间（秒，从开始下载时计算）；客户端断开连接时未完成的文档随之取消
+
+    返回:
+    - 每行一个JSON对象：index、pdf_url、status（succeeded/failed/timed_out/cancelled/rejected）、file_url或error、
+      各阶段耗时；最后一行为summary汇总
+    """
+    if len(request.pdf_urls) > BATCH_MAX_URLS:
+        raise HTTPException(status_code=413, detail=f"批量请求的URL数量超过上限: {BATCH_MAX_URLS}")
+
+    scheduler = get_job_scheduler()
+    options = request.to_options()
+    if options.priority is None and BATCH_PRIORITY in scheduler.priority_weights:
+        options.priority = BATCH_PRIORITY
+    tenant = http_request.headers.get("x-api-key")
+    try:
+        scheduler.check_admission(options.priority, tenant)
+    except QueueFullError as e:
+        raise _queue_full(e)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+    logger.info(f"开始批量转换，共{len(request.pdf_urls)}个文档")
+    started = time.perf_counter()
+    cancel_event = threading.Event()
+    futures = get_batch_pipeline().submit(
+        [str(url) for url in request.pdf_urls], options, cancel_event, tenant=tenant
+    )
+
+    async def stream_results():
+        succeeded = 0
+        try:
+            for next_result in asyncio.as_completed([asyncio.wrap_future(future) for future in futures]):
+                item = await next_result
+                succeeded += item["status"] == "succeeded"
+                yield json.dumps(item, ensure_ascii=False) + "\n"
+        finally:
+            # 客户端断开连接时响应流被取消，尚未完成的文档随之中止
+            if not all(future.done() for future in futures):
+                cancel_event.set()
+        summary = {
+            "total": len(futures),
+            "succeeded": succeeded,
+            "failed": len(futures) - succeeded,
+            "elapsed": time.perf_counter() - started,
+        }
+        logger.info(f"批量转换完成: {summary}")
+        yield json.dumps({"summary": summary}, ensure_ascii=False) + "\n"
+
+    return StreamingResponse(stream_results(), media_type="application/x-ndjson")
+
+
+@router.post("/jobs", response_model=JobCreatedResponse, status_code=202, summary="创建异步转换任务")
+async def create_conversion_job(request: ConversionRequest, http_request: Request):
+    """
+    创建PDF转Markdown的异步任务，立即返回任务ID
+
+    - **pdf_url**: PDF文件的URL（也支持DOCX和HTML文档）
+    - **shard_pages**: 可选，按页拆分并行转换时每个分片的页数
+    - **route**: 可选，转换路径：auto（自动判断）、marker、text（只读取文本层）
+    - **priority**: 可选，调度优先级：high、normal（默认）、low；队列已满时返回429和Retry-After
+    - **timeout**: 可选，截止时间（秒，从创建任务时开始计算），超时后任务状态为timed_out
+
+    返回:
+    - 任务ID和当前状态，可通过 GET /api/v1/jobs/{job_id} 查询结果
+    """
+    job = _submit(_build_payload(request), http_request)
+    return JobCreatedResponse(job_id=job.job_id, status=job.status)
+
+
+@router.get("/jobs/{job_id}", response_model=JobStatusResponse, summary="查询异步转换任务")
+async def get_conversion_job(job_id: str):
+    """
+    查询异步转换任务的状态和结果
+
+    返回:
+    - 任务状态（queued/running/succeeded/failed/timed_out/cancelled），成功时包含Markdown文件URL
+    """
+    job = get_job_scheduler().get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail=f"任务不存在或已过期: {job_id}")
+    return JobStatusResponse(**job.to_dict())
+
+
+@router.delete("/jobs/{job_id}", response_model=JobStatusResponse, summary="取消异步转换任务")
+async def cancel_conversion_job(job_id: str):
+    """
+    取消异步转换任务：排队中的任务不再执行，正在执行的任务终止转换进程并清理临时文件
+
+    返回:
+    - 任务当前的状态，取消生效后状态变为cancelled
+    """
+    job = get_job_scheduler().cancel(job_id, reason="任务已被取消")
+    if job is None:
+        raise HTTPException(status_code=404, detail=f"任务不存在或已过期: {job_id}")
+    return JobStatusResponse(**job.to_dict())
+
+
+@router.get("/stats", summary="运行统计")
+async def get_stats():
+    """返回任务调度、请求合并和转换缓存的统计信息"""
+    return JSONResponse(
+        content={"scheduler": get_job_scheduler().stats(), **get_converter_service().get_stats()},
+        status_code=200
+    )
+
 
 @router.get("/health", summary="健康检查")
 async def health_check():
-    """服务健康检查接口"""
-    return JSONResponse(content={"status": "healthy"}, status_code=200) 
\ No newline at end of file
+    """服务健康检查接口（存活探针），只表示进程可以响应请求，不等待预热"""
+    return JSONResponse(content={"status": "healthy"}, status_code=200)
+
+
+@router.get("/ready", summary="就绪检查")
+async def readiness_check():
+    """
+    就绪探针：启动预热完成后返回200，预热中或预热失败时返回503
+
+    返回:
+    - 预热状态（pending/warming/ready/failed）、耗时，失败时包含错误信息
+    """
+    return JSONResponse(content=warmup.status(), status_code=200 if warmup.ready else 503)
+
+
+def shutdown() -> None:
+    """停止已经创建的任务调度器，释放批量流水线和转换服务"""
+    with _services_lock:
+        scheduler, pipeline, service = _job_scheduler, _batch_pipeline, _pdf_converter_service
+    if scheduler is not None:
+        scheduler.shutdown()
+        if scheduler.broker is not None:
+            scheduler.broker.close()
+    if pipeline is not None:
+        pipeline.shutdown()
+    if service is not None:
+        service.shutdown()
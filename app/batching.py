@@ -0,0 +1,336 @@
+"""
+跨请求的页面动态批处理
+
+负载较高时会同时转换很多小PDF，每个文档各自执行一次模型推理，批大小很小，在CPU上效率很低。
+批处理器在一个较短的时间窗口内收集多个进行中任务的页面，合并为一个PDF交给工作进程一次完成
+版面/OCR推理，再按分页分隔行把结果拆回各个任务。
+"""
+import logging
+import os
+import shutil
+import tempfile
+import threading
+import time
+from concurrent.futures import Future
+from dataclasses import dataclass, field
+from typing import Any, Dict, List, Optional
+
+from app.config import get_bool_env, get_float_env, get_int_env
+from app.image_rewriter import ImageURLRewriter
+from app.page_cache import page_image_refs, split_pages
+from app.worker_pool import ConvertedDocument, MarkerWorkerPool
+
+logger = logging.getLogger(__name__)
+
+# 可以参与批处理的任务级选项，其余选项会改变转换行为，这类任务直接提交给工作进程池
+BATCHABLE_OPTIONS = {'page_range', 'paginate_output'}
+
+
+@dataclass
+class _BatchItem:
+    """等待合并的单个任务"""
+    pdf_path: str
+    pages: List[int]
+    paginate_output: bool
+    future: Future = field(default_factory=Future)
+    enqueued_at: float = field(default_factory=time.monotonic)
+
+
+def _paginate(pages: Dict[int, str]) -> str:
+    """按marker的分页输出格式拼接页面"""
+    return "".join(f"\n\n{{{page}}}{'-' * 48}\n\n{markdown}" for page, markdown in sorted(pages.items()))
+
+
+def demultiplex(
+    document: ConvertedDocument,
+    page_maps: List[List[int]],
+    paginate_flags: List[bool],
+) -> List[ConvertedDocument]:
+    """
+    把合并转换的结果按页拆回各个任务
+
+    Args:
+        document: 合并后的PDF开启分页输出的转换结果
+        page_maps: 每个任务在合并PDF中依次对应的原始页码
+        paginate_flags: 每个任务是否需要保留分页分隔行
+
+    Returns:
+        与page_maps顺序一致的各任务转换结果，图片文件名和分页分隔行中的页码还原为各自文档中的页码
+
+    Raises:
+        ValueError: 转换结果中没有分页分隔行
+    """
+    pages = split_pages(document.markdown)
+    if pages is None:
+        raise ValueError("合并转换的结果中没有分页分隔行")
+
+    batch_info = {'jobs': len(page_maps), 'pages': sum(len(page_map) for page_map in page_maps)}
+    results = []
+    offset = 0
+    for page_map, paginate_output in zip(page_maps, paginate_flags):
+        job_pages: Dict[int, str] = {}
+        images: Dict[str, bytes] = {}
+        for combined_page, original_page in enumerate(page_map, start=offset):
+            markdown = pages.get(combined_page, '')
+            renamed = {}
+            for ref in page_image_refs(markdown):
+                if ref not in document.images:
+                    continue
+                new_name = ref.replace(f"_page_{combined_page}_", f"_page_{original_page}_", 1)
+                renamed[ref] = new_name
+                images[new_name] = document.images[ref]
+            if renamed:
+                markdown = ImageURLRewriter(renamed).rewrite(markdown)
+            job_pages[original_page] = markdown
+        offset += len(page_map)
+        if paginate_output:
+            markdown = _paginate(job_pages)
+        else:
+            markdown = "\n\n".join(text for _, text in sorted(job_pages.items()) if text) + "\n"
+        results.append(ConvertedDocument(
+            markdown=markdown,
+            images=images,
+            metadata={'batch': dict(batch_info)},
+        ))
+    return results
+
+
+class PageBatcher:
+    """
+    跨请求的页面批处理器
+
+    小文档的转换请求先进入等待队列，收集到max_batch_pages页或最早的请求等待超过max_wait秒后，
+    把这些页面合并为一个PDF提交给工作进程池；合并转换失败时退回到逐个任务单独转换，避免一个坏文件影响其他任务。
+    """
+
+    def __init__(
+        self,
+        pool: MarkerWorkerPool,
+        max_batch_pages: int = 32,
+        max_wait: float = 0.05,
+        max_document_pages: int = 8,
+    ):
+        """
+        初始化批处理器（首次提交时启动后台线程）
+
+        Args:
+            pool: 工作进程池
+            max_batch_pages: 一个批次最多包含的页数
+            max_wait: 最早的请求最多等待的秒数
+            max_document_pages: 参与批处理的文档最多包含的页数，更大的文档直接提交给工作进程池
+        """
+        self.pool = pool
+        self.max_batch_pages = max(1, max_batch_pages)
+        self.max_wait = max(0.0, max_wait)
+        self.max_document_pages = max(1, max_document_pages)
+        self._condition = threading.Condition()
+        self._pending: List[_BatchItem] = []
+        self._thread: Optional[threading.Thread] = None
+        self._closed = False
+        self._stats = {'batches': 0, 'batched_jobs': 0, 'batched_pages': 0, 'direct_jobs': 0, 'fallbacks': 0}
+
+    @classmethod
+    def from_env(cls, pool: MarkerWorkerPool) -> Optional['PageBatcher']:
+        """根据环境变量创建批处理器，MARKER_BATCH_ENABLED为false时返回None"""
+        if not get_bool_env('MARKER_BATCH_ENABLED', False):
+            return None
+        return cls(
+            pool,
+            max_batch_pages=get_int_env('MARKER_BATCH_MAX_PAGES', 32),
+            max_wait=get_float_env('MARKER_BATCH_MAX_WAIT_MS', 50) / 1000,
+            max_document_pages=get_int_env('MARKER_BATCH_MAX_DOCUMENT_PAGES', 8),
+        )
+
+    def submit(self, pdf_path: str, options: Optional[Dict[str, Any]] = None) -> Future:
+        """
+        提交一个转换任务
+
+        Args:
+            pdf_path: PDF文件路径
+            options: 任务级的marker配置，只包含page_range和paginate_output时可以参与批处理
+
+        Returns:
+            任务结果的Future，结果为ConvertedDocument
+        """
+        from app.sharding import get_page_count
+
+        options = dict(options or {})
+        pages = options.get('page_range')
+        if set(options) - BATCHABLE_OPTIONS:
+            return self._submit_direct(pdf_path, options)
+        try:
+            pages = list(pages) if pages is not None else list(range(get_page_count(pdf_path)))
+        except Exception:
+            # 无法解析的文件交给工作进程处理并返回其错误
+            return self._submit_direct(pdf_path, options)
+        if not pages or len(pages) > self.max_document_pages:
+            return self._submit_direct(pdf_path, options)
+
+        item = _BatchItem(pdf_path, pages, bool(options.get('paginate_output')))
+        with self._condition:
+            if self._closed:
+                return self._submit_direct(pdf_path, options)
+            self._start()
+            self._pending.append(item)
+            self._condition.notify()
+        return item.future
+
+    def convert(self, pdf_path: str, options: Optional[Dict[str, Any]] = None) -> ConvertedDocument:
+        """提交转换任务并阻塞等待结果"""
+        return self.submit(pdf_path, options).result()
+
+    def stats(self) -> Dict[str, Any]:
+        """返回批处理的统计信息"""
+        with self._condition:
+            stats = dict(self._stats)
+            stats['pending_jobs'] = len(self._pending)
+        stats['avg_batch_pages'] = stats['batched_pages'] / stats['batches'] if stats['batches'] else 0.0
+        return stats
+
+    def shutdown(self) -> None:
+        """停止后台线程，仍在等待的任务直接提交给工作进程池"""
+        with self._condition:
+            self._closed = True
+            pending = list(self._pending)
+            self._pending.clear()
+            self._condition.notify_all()
+        for item in pending:
+            self._forward(item)
+        if self._thread is not None:
+            self._thread.join(timeout=5)
+
+    def _start(self) -> None:
+        """启动收集批次的后台线程（调用方需持有锁）"""
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._batch_loop, name='marker-page-batcher', daemon=True)
+            self._thread.start()
+
+    def _submit_direct(self, pdf_path: str, options: Dict[str, Any]) -> Future:
+        """不经过批处理，直接提交给工作进程池"""
+        with self._condition:
+            self._stats['direct_jobs'] += 1
+        return self.pool.submit(pdf_path, options=options or None)
+
+    def _forward(self, item: _BatchItem) -> None:
+        """把单个任务直接提交给工作进程池，结果转发到任务的Future"""
+        options: Dict[str, Any] = {'page_range': item.pages}
+        if item.paginate_output:
+            options['paginate_output'] = True
+        try:
+            source = self._submit_direct(item.pdf_path, options)
+        except Exception as e:
+            if item.future.set_running_or_notify_cancel():
+                item.future.set_exception(e)
+            return
+
+        def forward(future: Future) -> None:
+            if not item.future.set_running_or_notify_cancel():
+                return
+            try:
+                item.future.set_result(future.result())
+            except Exception as e:
+                item.future.set_exception(e)
+
+        source.add_done_callback(forward)
+
+    def _batch_loop(self) -> None:
+        """后台线程：按批次大小和等待时间切分批次"""
+        while True:
+            with self._condition:
+                while not self._closed and not self._batch_ready():
+                    timeout = None
+                    if self._pending:
+                        timeout = max(0.0, self._pending[0].enqueued_at + self.max_wait - time.monotonic())
+                    self._condition.wait(timeout)
+                if self._closed:
+                    return
+                batch = self._take_batch()
+            self._run_batch(batch)
+
+    def _batch_ready(self) -> bool:
+        """是否已经可以切出一个批次（调用方需持有锁）"""
+        if not self._pending:
+            return False
+        if sum(len(item.pages) for item in self._pending) >= self.max_batch_pages:
+            return True
+        return time.monotonic() - self._pending[0].enqueued_at >= self.max_wait
+
+    def _take_batch(self) -> List[_BatchItem]:
+        """按先后顺序取出总页数不超过上限的任务（调用方需持有锁）"""
+        batch: List[_BatchItem] = []
+        pages = 0
+        while self._pending and (not batch or pages + len(self._pending[0].pages) <= self.max_batch_pages):
+            item = self._pending.pop(0)
+            batch.append(item)
+            pages += len(item.pages)
+        return batch
+
+    def _run_batch(self, batch: List[_BatchItem]) -> None:
+        """合并批次中的页面并提交给工作进程池，完成后拆分结果"""
+        if len(batch) == 1:
+            self._forward(batch[0])
+            return
+        try:
+            merged_path = self._merge(batch)
+        except Exception as e:
+            logger.warning(f"合并批次PDF失败，逐个转换: {e}")
+            self._fallback(batch)
+            return
+
+        total_pages = sum(len(item.pages) for item in batch)
+        with self._condition:
+            self._stats['batches'] += 1
+            self._stats['batched_jobs'] += len(batch)
+            self._stats['batched_pages'] += total_pages
+        logger.info(f"合并{len(batch)}个任务共{total_pages}页进行批量转换")
+
+        def on_done(future: Future) -> None:
+            try:
+                documents = demultiplex(
+                    future.result(), [item.pages for item in batch], [item.paginate_output for item in batch]
+                )
+            except Exception as e:
+                logger.warning(f"批量转换失败，逐个转换: {e}")
+                self._fallback(batch)
+                return
+            finally:
+                shutil.rmtree(os.path.dirname(merged_path), ignore_errors=True)
+            for item, document in zip(batch, documents):
+                if item.future.set_running_or_notify_cancel():
+                    item.future.set_result(document)
+
+        try:
+            future = self.pool.submit(merged_path, options={'paginate_output': True})
+        except Exception as e:
+            shutil.rmtree(os.path.dirname(merged_path), ignore_errors=True)
+            for item in batch:
+                if item.future.set_running_or_notify_cancel():
+                    item.future.set_exception(e)
+            return
+        future.add_done_callback(on_done)
+
+    def _merge(self, batch: List[_BatchItem]) -> str:
+        """把批次中各任务的页面按顺序合并为一个临时PDF"""
+        import pypdfium2
+
+        merged = pypdfium2.PdfDocument.new()
+        try:
+            for item in batch:
+                source = pypdfium2.PdfDocument(item.pdf_path)
+                try:
+                    merged.import_pages(source, item.pages)
+                finally:
+                    source.close()
+            merged_dir = tempfile.mkdtemp(prefix='marker_batch_')
+            merged_path = os.path.join(merged_dir, 'batch.pdf')
+            merged.save(merged_path)
+            return merged_path
+        finally:
+            merged.close()
+
+    def _fallback(self, batch: List[_BatchItem]) -> None:
+        """合并转换失败时把每个任务单独提交给工作进程池"""
+        with self._condition:
+            self._stats['fallbacks'] += 1
+        for item in batch:
+            self._forward(item)
@@ -0,0 +1,92 @@
+"""
+图片URL替换的微基准测试
+
+对比逐个文件线性扫描的旧实现与基于索引的单次扫描改写器：
+
+    python -m app.bench_image_replacer --images 5000 --files 5000
+"""
+import argparse
+import os
+import re
+import time
+from typing import Callable, Dict, Tuple
+
+from app.image_rewriter import ImageURLRewriter
+
+
+def legacy_replace_image_urls(markdown_text: str, files_dict: Dict[str, str]) -> str:
+    """旧实现：每个图片引用都线性扫描全部文件，复杂度为 O(图片数 × 文件数)"""
+    sorted_files = sorted(files_dict.items(), key=lambda x: len(x[0]), reverse=True)
+    pattern = r'!\[([^]]*)\]\(([^)]+)\)'
+
+    def replace_url(match):
+        alt_text = match.group(1)
+        image_path = match.group(2).split('#')[0].split('?')[0]
+        if image_path.startswith(('http://', 'https://')):
+            return match.group(0)
+        for local_path, remote_url in sorted_files:
+            if local_path == image_path:
+                return f'![{alt_text}]({remote_url})'
+            image_filename = os.path.basename(image_path)
+            if os.path.basename(local_path) == image_filename:
+                ext = os.path.splitext(image_filename)[1].lower()
+                if ext in ['.png', '.jpg', '.jpeg', '.gif', '.svg', '.webp', '.bmp']:
+                    return f'![{alt_text}]({remote_url})'
+        return match.group(0)
+
+    return re.sub(pattern, replace_url, markdown_text)
+
+
+def build_document(image_count: int, file_count: int) -> Tuple[str, Dict[str, str]]:
+    """生成包含指定数量图片引用的Markdown文本和对应的文件URL字典"""
+    files_dict = {
+        f"_page_{index // 4}_Figure_{index % 4}.jpeg":
+            f"https://bucket.cos.ap-guangzhou.myqcloud.com/tmp/doc_1/_page_{index // 4}_Figure_{index % 4}.jpeg"
+        for index in range(file_count)
+    }
+    lines = []
+    for index in range(image_count):
+        name = f"_page_{(index % file_count) // 4}_Figure_{index % 4}.jpeg"
+        lines.append(f"第{index}段正文，包含一些说明文字。\n")
+        lines.append(f"![图{index}]({name})\n\n")
+    return "".join(lines), files_dict
+
+
+def measure(fn: Callable[[], str], repeat: int) -> float:
+    """返回多次运行中的最短耗时（秒）"""
+    best = float('inf')
+    for _ in range(repeat):
+        started = time.perf_counter()
+        fn()
+        best = min(best, time.perf_counter() - started)
+    return best
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="图片URL替换微基准测试")
+    parser.add_argument('--images', type=int, default=2000, help="Markdown中的图片引用数量")
+    parser.add_argument('--files', type=int, default=2000, help="上传的文件数量")
+    parser.add_argument('--repeat', type=int, default=3, help="每种实现的运行次数")
+    parser.add_argument('--skip-legacy', action='store_true', help="跳过旧实现（规模很大时旧实现非常慢）")
+    args = parser.parse_args()
+
+    markdown_text, files_dict = build_document(args.images, args.files)
+    print(f"文档大小: {len(markdown_text)} 字符，图片引用: {args.images}，文件: {args.files}")
+
+    indexed = measure(lambda: ImageURLRewriter(files_dict).rewrite(markdown_text), args.repeat)
+    print(f"索引改写器: {indexed * 1000:.2f} ms")
+
+    streaming = measure(
+        lambda: "".join(ImageURLRewriter(files_dict).rewrite_lines(markdown_text.splitlines(keepends=True))),
+        args.repeat,
+    )
+    print(f"索引改写器（逐行流式）: {streaming * 1000:.2f} ms")
+
+    if not args.skip_legacy:
+        legacy = measure(lambda: legacy_replace_image_urls(markdown_text, files_dict), args.repeat)
+        print(f"旧实现: {legacy * 1000:.2f} ms，加速比: {legacy / indexed:.1f}x")
+        assert legacy_replace_image_urls(markdown_text, files_dict) == ImageURLRewriter(files_dict).rewrite(markdown_text)
+
+
+if __name__ == "__main__":
+    main()
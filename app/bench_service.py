@@ -0,0 +1,408 @@
+"""
+离线的端到端吞吐量基准测试
+
+不需要COS凭证和marker模型：生成指定页数和图片数量的合成PDF，由本地HTTP服务器提供下载，
+工作进程池加载确定性的假转换器（按页耗时可配置），COS客户端替换为写入本地目录的实现，
+然后以指定并发数调用 /api/v1/convert，输出端到端和各阶段耗时的p50/p95/p99以及每秒请求数：
+
+    python -m app.bench_service --requests 200 --concurrency 8 --pages 20 --images 2 --workers 2
+
+比较两次提交的性能时，在相同参数下分别运行并加上--json保存结果。
+"""
+import argparse
+import asyncio
+import ctypes
+import functools
+import hashlib
+import http.server
+import importlib
+import io
+import json
+import logging
+import os
+import shutil
+import tempfile
+import threading
+import time
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+from qcloud_cos.cos_exception import CosServiceError
+
+from app.worker_pool import ConvertedDocument
+
+
+def write_synthetic_pdf(path: str, pages: int, images_per_page: int, seed: int = 0, image_size: int = 96) -> None:
+    """
+    生成合成PDF：每页若干行文本和指定数量的JPEG图片
+
+    Args:
+        path: 输出路径
+        pages: 页数
+        images_per_page: 每页的图片数量
+        seed: 写入文本中的种子，不同种子生成的文件内容哈希不同，避免命中转换缓存
+        image_size: 图片边长（像素）
+    """
+    import pypdfium2
+    import pypdfium2.raw as pdfium_c
+
+    pdf = pypdfium2.PdfDocument.new()
+    font = pdfium_c.FPDFText_LoadStandardFont(pdf.raw, b"Helvetica")
+    for page_index in range(pages):
+        page = pdf.new_page(612, 792)
+        for line_index in range(20):
+            text = f"Document {seed} page {page_index + 1} line {line_index + 1}: synthetic benchmark text."
+            obj = pdfium_c.FPDFPageObj_CreateTextObj(pdf.raw, font, 10.0)
+            encoded = (text + "\0").encode("utf-16-le")
+            pdfium_c.FPDFText_SetText(obj, ctypes.cast(ctypes.c_char_p(encoded), ctypes.POINTER(pdfium_c.FPDF_WCHAR)))
+            pdfium_c.FPDFPageObj_Transform(obj, 1, 0, 0, 1, 72, 740 - line_index * 14)
+            pdfium_c.FPDFPage_InsertObject(page.raw, obj)
+        for image_index in range(images_per_page):
+            image = pypdfium2.PdfImage.new(pdf)
+            image.load_jpeg(io.BytesIO(_make_jpeg(page_index, image_index, image_size)), pages=[page])
+            image.set_matrix(pypdfium2.PdfMatrix().scale(image_size, image_size).translate(
+                72 + image_index * (image_size + 10), 72
+            ))
+            page.insert_obj(image)
+        page.gen_content()
+        page.close()
+    pdf.save(path)
+    pdf.close()
+
+
+@functools.lru_cache(maxsize=256)
+def _make_jpeg(page_index: int, image_index: int, size: int) -> bytes:
+    """生成确定性的渐变JPEG图片，相同参数生成相同内容"""
+    from PIL import Image
+
+    image = Image.new('RGB', (size, size))
+    offset = (page_index * 31 + image_index * 17) % 256
+    image.putdata([((x + offset) % 256, (y * 2 + offset) % 256, (x ^ y) % 256) for y in range(size) for x in range(size)])
+    buffer = io.BytesIO()
+    image.save(buffer, 'JPEG', quality=85)
+    return buffer.getvalue()
+
+
+class FakeConverter:
+    """
+    确定性的假转换器，替代marker在工作进程中运行
+
+    按页读取PDF的文本层生成Markdown，每页附带指定数量的图片引用，并按页数休眠模拟模型推理耗时；
+    支持page_range和paginate_output选项，因此分片、页面缓存和批处理路径也能正常工作。
+    """
+
+    def __init__(self, config: Optional[Dict[str, Any]] = None):
+        config = config or {}
+        self.seconds_per_page = float(config.get('seconds_per_page', 0.05))
+        self.images_per_page = int(config.get('images_per_page', 1))
+        self.image_size = int(config.get('image_size', 96))
+
+    def __call__(self, pdf_path: str, options: Optional[Dict[str, Any]] = None) -> ConvertedDocument:
+        import pypdfium2
+
+        options = options or {}
+        pdf = pypdfium2.PdfDocument(pdf_path)
+        try:
+            page_indexes = options.get('page_range') or list(range(len(pdf)))
+            pages = []
+            for page_index in page_indexes:
+                page = pdf[page_index]
+                textpage = page.get_textpage()
+                pages.append((page_index, textpage.get_text_range().strip()))
+                textpage.close()
+                page.close()
+        finally:
+            pdf.close()
+        time.sleep(self.seconds_per_page * len(pages))
+
+        images: Dict[str, bytes] = {}
+        chunks = []
+        for page_index, text in pages:
+            lines = [f"## Page {page_index + 1}", "", text]
+            for image_index in range(self.images_per_page):
+                name = f"_page_{page_index}_Picture_{image_index}.jpeg"
+                images[name] = _make_jpeg(page_index, image_index, self.image_size)
+                lines.append(f"\n![]({name})")
+            markdown = "\n".join(lines) + "\n"
+            if options.get('paginate_output'):
+                markdown = f"\n\n{{{page_index}}}{'-' * 48}\n\n{markdown}"
+            chunks.append(markdown)
+        return ConvertedDocument(
+            markdown="".join(chunks),
+            images=images,
+            metadata={'converter': 'fake', 'pages': len(pages)},
+        )
+
+
+def create_fake_converter(config: Optional[Dict[str, Any]] = None) -> FakeConverter:
+    """假转换器工厂，通过MARKER_CONVERTER_FACTORY=app.bench_service:create_fake_converter加载"""
+    return FakeConverter(config)
+
+
+class LocalCOSClient:
+    """
+    写入本地目录的COS客户端，实现COSService用到的put_object、upload_file和head_object
+
+    latency用于模拟每次请求的网络往返耗时。
+    """
+
+    def __init__(self, root: str, latency: float = 0.0):
+        self.root = root
+        self.latency = latency
+        self.requests = 0
+        self.uploaded_bytes = 0
+        self._lock = threading.Lock()
+
+    def _path(self, bucket: str, key: str) -> str:
+        return os.path.join(self.root, bucket, *key.split('/'))
+
+    def put_object(self, Bucket: str, Body: bytes, Key: str, **kwargs: Any) -> Dict[str, str]:
+        return self._write(Bucket, Key, Body)
+
+    def upload_file(self, Bucket: str, LocalFilePath: str, Key: str, **kwargs: Any) -> Dict[str, str]:
+        with open(LocalFilePath, 'rb') as f:
+            return self._write(Bucket, Key, f.read())
+
+    def head_object(self, Bucket: str, Key: str, **kwargs: Any) -> Dict[str, str]:
+        self._request()
+        path = self._path(Bucket, Key)
+        if not os.path.exists(path):
+            raise CosServiceError('HEAD', 'NoSuchResource', 404)
+        return {'Content-Length': str(os.path.getsize(path))}
+
+    def _write(self, bucket: str, key: str, data: bytes) -> Dict[str, str]:
+        self._request()
+        path = self._path(bucket, key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, 'wb') as f:
+            f.write(data)
+        with self._lock:
+            self.uploaded_bytes += len(data)
+        return {'ETag': f'"{hashlib.md5(data).hexdigest()}"'}
+
+    def _request(self) -> None:
+        with self._lock:
+            self.requests += 1
+        if self.latency:
+            time.sleep(self.latency)
+
+
+class _QuietHandler(http.server.SimpleHTTPRequestHandler):
+    """不输出访问日志的静态文件处理器"""
+
+    def log_message(self, format: str, *args: Any) -> None:
+        pass
+
+
+def serve_directory(directory: str) -> Tuple[http.server.ThreadingHTTPServer, str]:
+    """
+    在后台线程中启动本地静态文件服务器
+
+    Returns:
+        元组 (服务器, 基础URL)，使用完后调用server.shutdown()
+    """
+    server = http.server.ThreadingHTTPServer(
+        ('127.0.0.1', 0), functools.partial(_QuietHandler, directory=directory)
+    )
+    threading.Thread(target=server.serve_forever, name='bench-pdf-server', daemon=True).start()
+    return server, f"http://127.0.0.1:{server.server_address[1]}"
+
+
+class _StageCollector(logging.Handler):
+    """收集stage_timer输出的各阶段耗时"""
+
+    def __init__(self):
+        super().__init__(logging.DEBUG)
+        self.durations: Dict[str, List[float]] = {}
+        self._lock_durations = threading.Lock()
+
+    def emit(self, record: logging.LogRecord) -> None:
+        stage = getattr(record, 'stage', None)
+        duration = getattr(record, 'duration', None)
+        if stage is None or duration is None:
+            return
+        with self._lock_durations:
+            self.durations.setdefault(stage, []).append(duration)
+
+
+def percentile(values: Sequence[float], q: float) -> float:
+    """线性插值计算百分位数，q取0-100"""
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    position = (len(ordered) - 1) * q / 100
+    lower = int(position)
+    upper = min(lower + 1, len(ordered) - 1)
+    return ordered[lower] + (ordered[upper] - ordered[lower]) * (position - lower)
+
+
+def summarize(values: Sequence[float]) -> Dict[str, float]:
+    """返回次数和p50/p95/p99（秒）"""
+    return {
+        'count': len(values),
+        'p50': percentile(values, 50),
+        'p95': percentile(values, 95),
+        'p99': percentile(values, 99),
+    }
+
+
+def configure_environment(args: argparse.Namespace, work_dir: str) -> None:
+    """设置基准测试使用的环境变量，必须在导入app.main之前调用"""
+    os.environ.update({
+        'COS_SECRET_ID': 'bench',
+        'COS_SECRET_KEY': 'bench',
+        'COS_REGION': 'ap-guangzhou',
+        'COS_BUCKET': 'bench-1250000000',
+        'MARKER_CONVERTER_FACTORY': 'app.bench_service:create_fake_converter',
+        'MARKER_CONFIG': json.dumps({
+            'seconds_per_page': args.seconds_per_page,
+            'images_per_page': args.images,
+            'image_size': args.image_size,
+        }),
+        'MARKER_WORKER_POOL_SIZE': str(args.workers),
+        'CONVERSION_ROUTE': args.route,
+        'CONVERSION_CACHE_ENABLED': 'true' if args.cache else 'false',
+        'CONVERSION_CACHE_PATH': os.path.join(work_dir, 'cache.sqlite3'),
+        'PAGE_CACHE_ENABLED': 'false',
+        'PDF_STORE_ENABLED': 'false',
+        'COS_IMAGE_INDEX_PATH': os.path.join(work_dir, 'image_index.sqlite3'),
+        'LOG_LEVEL': os.environ.get('LOG_LEVEL', 'WARNING'),
+    })
+
+
+async def drive_requests(app: Any, urls: List[str], concurrency: int) -> Tuple[List[float], List[str]]:
+    """
+    以固定并发数调用 /api/v1/convert
+
+    Returns:
+        元组 (成功请求的耗时列表, 失败原因列表)
+    """
+    import httpx
+
+    latencies: List[float] = []
+    errors: List[str] = []
+    semaphore = asyncio.Semaphore(concurrency)
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench", timeout=None) as client:
+        async def one(url: str) -> None:
+            async with semaphore:
+                started = time.perf_counter()
+                response = await client.post("/api/v1/convert", json={"pdf_url": url})
+                elapsed = time.perf_counter() - started
+            if response.status_code == 200:
+                latencies.append(elapsed)
+            else:
+                errors.append(f"{response.status_code}: {response.text[:200]}")
+
+        await asyncio.gather(*(one(url) for url in urls))
+    return latencies, errors
+
+
+def run_benchmark(args: argparse.Namespace) -> Dict[str, Any]:
+    """生成测试文档、启动服务组件并执行基准测试，返回结果字典"""
+    work_dir = tempfile.mkdtemp(prefix='pdf2md_bench_')
+    pdf_dir = os.path.join(work_dir, 'pdfs')
+    os.makedirs(pdf_dir)
+    server = None
+    try:
+        for index in range(args.documents):
+            write_synthetic_pdf(
+                os.path.join(pdf_dir, f"doc_{index}.pdf"), args.pages, args.images,
+                seed=index, image_size=args.image_size,
+            )
+        server, base_url = serve_directory(pdf_dir)
+        urls = [f"{base_url}/doc_{index % args.documents}.pdf" for index in range(args.requests)]
+
+        configure_environment(args, work_dir)
+        main_module = importlib.import_module('app.main')
+        api_module = importlib.import_module('app.api')
+        service = api_module.get_converter_service()
+        cos_client = LocalCOSClient(os.path.join(work_dir, 'cos'), latency=args.cos_latency_ms / 1000)
+        service.cos_service.client = cos_client
+
+        collector = _StageCollector()
+        stage_logger = logging.getLogger('app.metrics')
+        stage_logger.addHandler(collector)
+        stage_logger.setLevel(logging.DEBUG)
+        stage_logger.propagate = False
+
+        # 预先启动工作进程池，启动耗时不计入结果
+        if service.use_worker_pool:
+            service.get_worker_pool()
+        started = time.perf_counter()
+        latencies, errors = asyncio.run(drive_requests(main_module.app, urls, args.concurrency))
+        elapsed = time.perf_counter() - started
+
+        api_module.shutdown()
+        stage_logger.removeHandler(collector)
+        return {
+            'config': {
+                'requests': args.requests,
+                'concurrency': args.concurrency,
+                'documents': args.documents,
+                'pages': args.pages,
+                'images_per_page': args.images,
+                'workers': args.workers,
+                'seconds_per_page': args.seconds_per_page,
+                'cos_latency_ms': args.cos_latency_ms,
+                'route': args.route,
+            },
+            'succeeded': len(latencies),
+            'failed': len(errors),
+            'errors': errors[:5],
+            'elapsed': elapsed,
+            'requests_per_second': len(latencies) / elapsed if elapsed else 0.0,
+            'pages_per_second': len(latencies) * args.pages / elapsed if elapsed else 0.0,
+            'latency': summarize(latencies),
+            'stages': {stage: summarize(values) for stage, values in sorted(collector.durations.items())},
+            'cos': {'requests': cos_client.requests, 'uploaded_bytes': cos_client.uploaded_bytes},
+        }
+    finally:
+        if server is not None:
+            server.shutdown()
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+
+def print_report(result: Dict[str, Any]) -> None:
+    """以表格形式输出结果"""
+    config = result['config']
+    print(f"请求数: {config['requests']}，并发: {config['concurrency']}，文档: {config['documents']}个 × "
+          f"{config['pages']}页 × 每页{config['images_per_page']}张图片，工作进程: {config['workers']}")
+    print(f"成功: {result['succeeded']}，失败: {result['failed']}，总耗时: {result['elapsed']:.2f}秒，"
+          f"{result['requests_per_second']:.2f} 请求/秒，{result['pages_per_second']:.1f} 页/秒")
+    for error in result['errors']:
+        print(f"  失败示例: {error}")
+    print(f"COS请求: {result['cos']['requests']}次，上传 {result['cos']['uploaded_bytes']} 字节")
+    print(f"{'阶段':<16}{'次数':>8}{'p50(ms)':>12}{'p95(ms)':>12}{'p99(ms)':>12}")
+    rows = [('request', result['latency'])] + list(result['stages'].items())
+    for stage, stats in rows:
+        print(f"{stage:<16}{stats['count']:>8}{stats['p50'] * 1000:>12.1f}"
+              f"{stats['p95'] * 1000:>12.1f}{stats['p99'] * 1000:>12.1f}")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="离线的端到端吞吐量基准测试（假转换器 + 本地COS）")
+    parser.add_argument('--requests', type=int, default=100, help="请求总数")
+    parser.add_argument('--concurrency', type=int, default=8, help="同时进行的请求数")
+    parser.add_argument('--documents', type=int, default=None, help="不同文档的数量，默认与请求数相同（不命中转换缓存）")
+    parser.add_argument('--pages', type=int, default=10, help="每个文档的页数")
+    parser.add_argument('--images', type=int, default=1, help="每页的图片数量")
+    parser.add_argument('--image-size', type=int, default=96, help="图片边长（像素）")
+    parser.add_argument('--workers', type=int, default=2, help="工作进程数（MARKER_WORKER_POOL_SIZE）")
+    parser.add_argument('--seconds-per-page', type=float, default=0.02, help="假转换器每页的耗时（秒）")
+    parser.add_argument('--cos-latency-ms', type=float, default=5, help="本地COS每次请求模拟的网络耗时（毫秒）")
+    parser.add_argument('--route', default='marker', help="转换路径（CONVERSION_ROUTE）：marker、text或auto")
+    parser.add_argument('--cache', action='store_true', help="启用转换缓存（重复的文档直接命中）")
+    parser.add_argument('--json', action='store_true', help="以JSON输出结果，便于保存和比较")
+    args = parser.parse_args()
+    if args.documents is None:
+        args.documents = args.requests
+
+    result = run_benchmark(args)
+    if args.json:
+        print(json.dumps(result, ensure_ascii=False, indent=2))
+    else:
+        print_report(result)
+
+
+if __name__ == "__main__":
+    main()
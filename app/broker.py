@@ -0,0 +1,482 @@
+"""
+多节点共享的转换任务代理
+
+默认情况下任务队列只存在于单个进程的内存中。配置JOB_BROKER后，所有API进程和工作进程通过共享的代理排队：
+任务在提交时写入代理，任意执行节点以租约方式领取任务并定期发送心跳续约；
+节点失联（租约过期）后任务自动回到队列由其他节点重试。任务的状态和结果也保存在代理中，
+因此任何节点都可以查询任务、取消任务，提交任务的节点也能拿到在其他节点上完成的结果。
+
+SQLiteJobBroker适用于同一台机器上的多个进程（或共享文件系统）以及测试；
+需要跨机器部署时可以按JobBroker的接口实现基于数据库或消息队列的代理。
+"""
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+from abc import ABC, abstractmethod
+from dataclasses import dataclass, field
+from typing import Any, Callable, Dict, Iterable, List, Optional
+
+from app.fair_queue import FairQueue
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class JobRecord:
+    """代理中保存的一个任务"""
+
+    job_id: str
+    payload: Dict[str, Any]
+    priority: str
+    tenant: str
+    pages: int
+    status: str = "queued"
+    created_at: float = field(default_factory=time.time)
+    # 绝对截止时间（Unix时间戳），None表示不限制
+    deadline_at: Optional[float] = None
+    # 只能由指定节点执行（例如上传的文件只在该节点的本地磁盘上）
+    affinity: Optional[str] = None
+    request_id: Optional[str] = None
+    owner: Optional[str] = None
+    lease_expires_at: Optional[float] = None
+    attempts: int = 0
+    started_at: Optional[float] = None
+    finished_at: Optional[float] = None
+    result: Optional[Dict[str, Any]] = None
+    error: Optional[str] = None
+    status_code: Optional[int] = None
+    cancel_reason: Optional[str] = None
+
+
+class JobBroker(ABC):
+    """任务代理的接口，具体实现需要提供除close以外的全部方法"""
+
+    @abstractmethod
+    def enqueue(self, record: JobRecord) -> None:
+        """把新任务加入队列"""
+
+    @abstractmethod
+    def lease(
+        self,
+        owner: str,
+        lease_seconds: float,
+        queue: FairQueue,
+        tenant_limit: Callable[[str], int],
+        affinity_only: bool = False,
+    ) -> Optional[JobRecord]:
+        """
+        领取下一个任务，同时续约节点的存活状态，并结束已经超过截止时间的排队任务
+
+        Args:
+            owner: 领取任务的节点ID
+            lease_seconds: 租约时长（秒），在此之前需要通过heartbeat续约
+            queue: 空的公平队列，按其中的优先级和租户权重选择任务
+            tenant_limit: 返回租户的并发上限（0表示不限制），按所有节点上正在执行的任务计算
+            affinity_only: 只领取指定由该节点执行的任务
+
+        Returns:
+            领取到的任务，没有可以执行的任务时返回None
+        """
+
+    @abstractmethod
+    def heartbeat(self, owner: str, job_ids: Iterable[str], lease_seconds: float) -> Dict[str, Optional[str]]:
+        """
+        续约节点的存活状态和正在执行的任务
+
+        节点的存活状态过期后（例如进程重启后节点ID改变），指定由该节点执行的任务以失败结束，不会一直排队。
+
+        Returns:
+            仍由该节点持有的任务ID到取消原因的映射（未被取消时为None）；不在结果中的任务已经失去租约
+        """
+
+    @abstractmethod
+    def complete(
+        self,
+        job_id: str,
+        owner: str,
+        status: str,
+        result: Optional[Dict[str, Any]] = None,
+        error: Optional[str] = None,
+        status_code: Optional[int] = None,
+    ) -> bool:
+        """记录任务结束，租约已经失去（任务被其他节点重新领取）时返回False"""
+
+    @abstractmethod
+    def get(self, job_id: str) -> Optional[JobRecord]:
+        """查询任务"""
+
+    @abstractmethod
+    def get_many(self, job_ids: Iterable[str]) -> Dict[str, JobRecord]:
+        """一次查询多个任务，返回任务ID到任务的映射，不存在的任务不在结果中"""
+
+    @abstractmethod
+    def cancel(self, job_id: str, reason: str) -> Optional[JobRecord]:
+        """取消任务：排队中的任务直接结束，执行中的任务由执行节点在下一次心跳时中止"""
+
+    @abstractmethod
+    def stats(self) -> Dict[str, Any]:
+        """返回排队数量、按优先级的排队页数和执行中的任务数（不包括已超时或执行节点已失联、等待结束的排队任务）"""
+
+    @abstractmethod
+    def prune(self, ttl: float) -> int:
+        """删除结束超过ttl秒的任务，返回删除的数量"""
+
+    def close(self) -> None:
+        """释放资源"""
+
+
+def create_broker(url: Optional[str], max_attempts: int = 3) -> Optional[JobBroker]:
+    """
+    根据配置创建任务代理
+
+    Args:
+        url: 代理地址，目前支持 sqlite:///路径；为空时返回None（使用进程内队列）
+        max_attempts: 每个任务最多被领取的次数（节点失联后重试）
+
+    Raises:
+        ValueError: 不支持的代理地址
+    """
+    if not url:
+        return None
+    if url.startswith('sqlite:///'):
+        return SQLiteJobBroker(url[len('sqlite:///'):], max_attempts=max_attempts)
+    raise ValueError(f"不支持的任务代理: {url}")
+
+
+class SQLiteJobBroker(JobBroker):
+    """
+    基于SQLite的任务代理
+
+    领取任务在写事务（BEGIN IMMEDIATE）中完成，多个进程同时领取时不会拿到同一个任务。
+    公平调度的状态（各优先级和租户的通行值）保存在同一个数据库中，所有节点共享。
+    """
+
+    _COLUMNS = (
+        'job_id', 'payload', 'priority', 'tenant', 'pages', 'status', 'created_at', 'deadline_at', 'affinity',
+        'request_id', 'owner', 'lease_expires_at', 'attempts', 'started_at', 'finished_at', 'result', 'error',
+        'status_code', 'cancel_reason',
+    )
+
+    def __init__(self, db_path: str, max_attempts: int = 3):
+        """
+        初始化代理
+
+        Args:
+            db_path: SQLite数据库文件路径，所有节点需要使用同一个文件
+            max_attempts: 每个任务最多被领取的次数，租约过期次数用完后任务以失败结束
+        """
+        self.db_path = db_path
+        self.max_attempts = max(1, max_attempts)
+        self._lock = threading.Lock()
+        self._read_lock = threading.Lock()
+
+        db_dir = os.path.dirname(os.path.abspath(db_path))
+        os.makedirs(db_dir, exist_ok=True)
+        # 自行管理事务，领取任务时需要BEGIN IMMEDIATE
+        self._conn = sqlite3.connect(db_path, check_same_thread=False, timeout=30, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS jobs (
+                seq INTEGER PRIMARY KEY AUTOINCREMENT,
+                job_id TEXT NOT NULL UNIQUE,
+                payload TEXT NOT NULL,
+                priority TEXT NOT NULL,
+                tenant TEXT NOT NULL,
+                pages INTEGER NOT NULL,
+                status TEXT NOT NULL,
+                created_at REAL NOT NULL,
+                deadline_at REAL,
+                affinity TEXT,
+                request_id TEXT,
+                owner TEXT,
+                lease_expires_at REAL,
+                attempts INTEGER NOT NULL DEFAULT 0,
+                started_at REAL,
+                finished_at REAL,
+                result TEXT,
+                error TEXT,
+                status_code INTEGER,
+                cancel_reason TEXT
+            )
+            """
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_jobs_status ON jobs (status, priority, tenant)")
+        self._conn.execute("CREATE TABLE IF NOT EXISTS broker_state (key TEXT PRIMARY KEY, value TEXT NOT NULL)")
+        # 各节点的存活状态，由领取任务和续约时更新
+        self._conn.execute("CREATE TABLE IF NOT EXISTS nodes (node_id TEXT PRIMARY KEY, expires_at REAL NOT NULL)")
+        # 查询使用单独的连接：WAL模式下读取不会等待领取任务的写事务
+        self._reader = sqlite3.connect(db_path, check_same_thread=False, timeout=30, isolation_level=None)
+
+    def _row_to_record(self, row) -> JobRecord:
+        values = dict(zip(self._COLUMNS, row))
+        values['payload'] = json.loads(values['payload'])
+        values['result'] = json.loads(values['result']) if values['result'] else None
+        return JobRecord(**values)
+
+    def _select(self, where: str, params=(), conn: Optional[sqlite3.Connection] = None) -> List[JobRecord]:
+        conn = conn or self._conn
+        rows = conn.execute(f"SELECT {', '.join(self._COLUMNS)} FROM jobs WHERE {where}", params).fetchall()
+        return [self._row_to_record(row) for row in rows]
+
+    def enqueue(self, record: JobRecord) -> None:
+        with self._lock:
+            self._conn.execute(
+                """
+                INSERT INTO jobs (job_id, payload, priority, tenant, pages, status, created_at, deadline_at,
+                                  affinity, request_id)
+                VALUES (?, ?, ?, ?, ?, 'queued', ?, ?, ?, ?)
+                """,
+                (
+                    record.job_id, json.dumps(record.payload, ensure_ascii=False), record.priority, record.tenant,
+                    record.pages, record.created_at, record.deadline_at, record.affinity, record.request_id,
+                ),
+            )
+
+    def lease(
+        self,
+        owner: str,
+        lease_seconds: float,
+        queue: FairQueue,
+        tenant_limit: Callable[[str], int],
+        affinity_only: bool = False,
+    ) -> Optional[JobRecord]:
+        now = time.time()
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                self._touch_node(owner, now + lease_seconds)
+                self._requeue_expired(now)
+                self._expire_queued(now)
+                affinity_clause = "affinity = ?" if affinity_only else "(affinity IS NULL OR affinity = ?)"
+                heads = self._conn.execute(
+                    f"""
+                    SELECT MIN(seq), priority, tenant FROM jobs
+                    WHERE status = 'queued' AND {affinity_clause}
+                    GROUP BY priority, tenant ORDER BY MIN(seq)
+                    """,
+                    (owner,),
+                ).fetchall()
+                if not heads:
+                    self._conn.execute("COMMIT")
+                    return None
+                running = dict(self._conn.execute(
+                    "SELECT tenant, COUNT(*) FROM jobs WHERE status = 'running' GROUP BY tenant"
+                ).fetchall())
+                state = self._conn.execute("SELECT value FROM broker_state WHERE key = 'fair_queue'").fetchone()
+                if state:
+                    queue.load_state(json.loads(state[0]))
+                for seq, priority, tenant in heads:
+                    if priority in queue.priority_weights:
+                        queue.push(seq, priority, tenant)
+
+                def eligible(tenant: str) -> bool:
+                    limit = tenant_limit(tenant)
+                    return limit <= 0 or running.get(tenant, 0) < limit
+
+                seq = queue.pop(eligible)
+                if seq is None:
+                    self._conn.execute("COMMIT")
+                    return None
+                self._conn.execute(
+                    """
+                    UPDATE jobs SET status = 'running', owner = ?, lease_expires_at = ?,
+                        started_at = COALESCE(started_at, ?), attempts = attempts + 1
+                    WHERE seq = ?
+                    """,
+                    (owner, now + lease_seconds, now, seq),
+                )
+                self._conn.execute(
+                    "INSERT OR REPLACE INTO broker_state (key, value) VALUES ('fair_queue', ?)",
+                    (json.dumps(queue.state()),),
+                )
+                record = self._select("seq = ?", (seq,))[0]
+                self._conn.execute("COMMIT")
+                return record
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                raise
+
+    def _requeue_expired(self, now: float) -> None:
+        """把租约过期（执行节点失联）的任务放回队列，领取次数用完的任务以失败结束（调用方需在事务中）"""
+        expired = self._conn.execute(
+            "SELECT job_id, owner, attempts, affinity FROM jobs WHERE status = 'running' AND lease_expires_at < ?",
+            (now,),
+        ).fetchall()
+        for job_id, owner, attempts, affinity in expired:
+            if affinity is not None:
+                # 只能在失联节点上执行的任务（例如依赖该节点上的上传文件）无法由其他节点重新执行
+                logger.warning(f"只能在本节点执行的任务的执行节点失联: {job_id}，节点: {owner}")
+                self._conn.execute(
+                    """
+                    UPDATE jobs SET status = 'failed', finished_at = ?, owner = NULL, lease_expires_at = NULL,
+                        error = ?, status_code = 503
+                    WHERE job_id = ?
+                    """,
+                    (now, "执行任务的节点失联，任务只能在该节点执行，请重新提交", job_id),
+                )
+            elif attempts >= self.max_attempts:
+                logger.warning(f"任务的执行节点失联且重试次数已用完: {job_id}，节点: {owner}")
+                self._conn.execute(
+                    """
+                    UPDATE jobs SET status = 'failed', finished_at = ?, owner = NULL, lease_expires_at = NULL,
+                        error = ?, status_code = 500
+                    WHERE job_id = ?
+                    """,
+                    (now, f"执行任务的节点失联，已尝试{attempts}次", job_id),
+                )
+            else:
+                logger.warning(f"任务的执行节点失联，重新排队: {job_id}，节点: {owner}")
+                self._conn.execute(
+                    "UPDATE jobs SET status = 'queued', owner = NULL, lease_expires_at = NULL WHERE job_id = ?",
+                    (job_id,),
+                )
+
+    def _expire_queued(self, now: float) -> None:
+        """结束已经超过截止时间、或指定由已失联节点执行的排队任务（调用方需持有锁）"""
+        timed_out = self._conn.execute(
+            """
+            UPDATE jobs SET status = 'timed_out', finished_at = ?, error = ?, status_code = 504
+            WHERE status = 'queued' AND deadline_at < ?
+            """,
+            (now, "请求超时: 任务排队期间已超过截止时间", now),
+        ).rowcount
+        orphaned = self._conn.execute(
+            """
+            UPDATE jobs SET status = 'failed', finished_at = ?, error = ?, status_code = 503
+            WHERE status = 'queued' AND affinity IN (SELECT node_id FROM nodes WHERE expires_at < ?)
+            """,
+            (now, "执行任务的节点失联，任务只能在该节点执行，请重新提交", now),
+        ).rowcount
+        if timed_out or orphaned:
+            logger.warning(f"结束排队任务：已超时{timed_out}个，执行节点已失联{orphaned}个")
+
+    def _touch_node(self, node_id: str, expires_at: float) -> None:
+        """更新节点的存活状态（调用方需持有锁）"""
+        self._conn.execute(
+            "INSERT OR REPLACE INTO nodes (node_id, expires_at) VALUES (?, ?)", (node_id, expires_at)
+        )
+
+    def heartbeat(self, owner: str, job_ids: Iterable[str], lease_seconds: float) -> Dict[str, Optional[str]]:
+        job_ids = list(job_ids)
+        with self._lock:
+            self._touch_node(owner, time.time() + lease_seconds)
+        if not job_ids:
+            return {}
+        placeholders = ', '.join('?' for _ in job_ids)
+        with self._lock:
+            self._conn.execute(
+                f"""
+                UPDATE jobs SET lease_expires_at = ?
+                WHERE owner = ? AND status = 'running' AND job_id IN ({placeholders})
+                """,
+                (time.time() + lease_seconds, owner, *job_ids),
+            )
+            rows = self._conn.execute(
+                f"""
+                SELECT job_id, cancel_reason FROM jobs
+                WHERE owner = ? AND status = 'running' AND job_id IN ({placeholders})
+                """,
+                (owner, *job_ids),
+            ).fetchall()
+        return dict(rows)
+
+    def complete(
+        self,
+        job_id: str,
+        owner: str,
+        status: str,
+        result: Optional[Dict[str, Any]] = None,
+        error: Optional[str] = None,
+        status_code: Optional[int] = None,
+    ) -> bool:
+        with self._lock:
+            cursor = self._conn.execute(
+                """
+                UPDATE jobs SET status = ?, finished_at = ?, result = ?, error = ?, status_code = ?,
+                    lease_expires_at = NULL
+                WHERE job_id = ? AND owner = ? AND status = 'running'
+                """,
+                (
+                    status, time.time(), json.dumps(result, ensure_ascii=False, default=str) if result is not None else None,
+                    error, status_code, job_id, owner,
+                ),
+            )
+            return cursor.rowcount > 0
+
+    def get(self, job_id: str) -> Optional[JobRecord]:
+        with self._read_lock:
+            records = self._select("job_id = ?", (job_id,), self._reader)
+        return records[0] if records else None
+
+    def get_many(self, job_ids: Iterable[str]) -> Dict[str, JobRecord]:
+        job_ids = list(job_ids)
+        records: Dict[str, JobRecord] = {}
+        # 分批查询，避免超过SQLite的参数数量上限
+        for start in range(0, len(job_ids), 500):
+            batch = job_ids[start:start + 500]
+            placeholders = ', '.join('?' for _ in batch)
+            with self._read_lock:
+                for record in self._select(f"job_id IN ({placeholders})", batch, self._reader):
+                    records[record.job_id] = record
+        return records
+
+    def cancel(self, job_id: str, reason: str) -> Optional[JobRecord]:
+        with self._lock:
+            now = time.time()
+            self._conn.execute(
+                """
+                UPDATE jobs SET status = 'cancelled', finished_at = ?, error = ?, status_code = 499,
+                    cancel_reason = ?
+                WHERE job_id = ? AND status = 'queued'
+                """,
+                (now, f"请求已取消: {reason}", reason, job_id),
+            )
+            self._conn.execute(
+                "UPDATE jobs SET cancel_reason = ? WHERE job_id = ? AND status = 'running' AND cancel_reason IS NULL",
+                (reason, job_id),
+            )
+            records = self._select("job_id = ?", (job_id,))
+        return records[0] if records else None
+
+    def stats(self) -> Dict[str, Any]:
+        now = time.time()
+        with self._read_lock:
+            # 已超时、或指定由已失联节点执行的排队任务会在下一次领取时结束，不计入排队数量
+            rows = self._reader.execute(
+                """
+                SELECT status, priority, COUNT(*), SUM(pages) FROM jobs
+                WHERE status = 'running'
+                    OR status = 'queued' AND (deadline_at IS NULL OR deadline_at >= ?)
+                        AND (affinity IS NULL OR affinity NOT IN (SELECT node_id FROM nodes WHERE expires_at < ?))
+                GROUP BY status, priority
+                """,
+                (now, now),
+            ).fetchall()
+        queued_by_priority = {priority: count for status, priority, count, _ in rows if status == 'queued'}
+        return {
+            "queued": sum(queued_by_priority.values()),
+            "queued_by_priority": queued_by_priority,
+            "queued_pages": {priority: pages for status, priority, _, pages in rows if status == 'queued'},
+            "running": sum(count for status, _, count, _ in rows if status == 'running'),
+        }
+
+    def prune(self, ttl: float) -> int:
+        now = time.time()
+        with self._lock:
+            self._expire_queued(now)
+            cursor = self._conn.execute(
+                "DELETE FROM jobs WHERE finished_at IS NOT NULL AND finished_at < ?", (now - ttl,)
+            )
+            # 失联已久的节点不会再有排队任务
+            self._conn.execute("DELETE FROM nodes WHERE expires_at < ?", (now - ttl,))
+            return cursor.rowcount
+
+    def close(self) -> None:
+        with self._lock:
+            self._conn.close()
+        with self._read_lock:
+            self._reader.close()
@@ -0,0 +1,226 @@
+"""
+以PDF内容哈希为键的转换结果缓存
+"""
+import hashlib
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+from importlib import metadata
+from typing import Any, Dict, Optional
+
+from app.config import get_bool_env, get_cache_path, get_float_env, get_int_env, get_str_env
+
+logger = logging.getLogger(__name__)
+
+# 计算文件哈希时每次读取的字节数
+HASH_CHUNK_SIZE = 1024 * 1024
+
+
+def hash_file(file_path: str) -> str:
+    """分块计算文件内容的SHA-256"""
+    digest = hashlib.sha256()
+    with open(file_path, 'rb') as f:
+        for chunk in iter(lambda: f.read(HASH_CHUNK_SIZE), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def get_marker_version() -> str:
+    """获取已安装的marker版本，未安装时返回unknown"""
+    try:
+        return metadata.version('marker-pdf')
+    except metadata.PackageNotFoundError:
+        return 'unknown'
+
+
+class ConversionCache:
+    """
+    转换结果缓存
+
+    以 "PDF内容SHA-256 + marker版本 + 转换选项" 为键，记录之前生成的Markdown文本、
+    Markdown文件URL以及资源文件URL映射。索引保存在本地SQLite中，
+    按TTL过期，并在条目数或Markdown总字节数超过上限时按最近最少使用淘汰。
+    """
+
+    def __init__(
+        self,
+        db_path: str,
+        ttl: float = 7 * 24 * 3600,
+        max_entries: int = 10000,
+        max_bytes: int = 1024 * 1024 * 1024,
+    ):
+        """
+        初始化缓存
+
+        Args:
+            db_path: SQLite数据库文件路径
+            ttl: 缓存条目的有效期（秒），小于等于0表示不过期
+            max_entries: 最多保留的条目数
+            max_bytes: 缓存的Markdown文本最多占用的字节数
+        """
+        self.db_path = db_path
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.marker_version = get_marker_version()
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+
+        db_dir = os.path.dirname(os.path.abspath(db_path))
+        os.makedirs(db_dir, exist_ok=True)
+        self._conn = sqlite3.connect(db_path, check_same_thread=False, timeout=30)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS conversion_cache (
+                cache_key TEXT PRIMARY KEY,
+                content_hash TEXT NOT NULL,
+                markdown_text TEXT NOT NULL,
+                file_url TEXT NOT NULL,
+                files_json TEXT NOT NULL,
+                size_bytes INTEGER NOT NULL,
+                created_at REAL NOT NULL,
+                last_access_at REAL NOT NULL
+            )
+            """
+        )
+        self._conn.execute(
+            "CREATE INDEX IF NOT EXISTS idx_conversion_cache_access ON conversion_cache (last_access_at)"
+        )
+        self._conn.commit()
+
+    @classmethod
+    def from_env(cls) -> Optional['ConversionCache']:
+        """根据环境变量创建缓存，CONVERSION_CACHE_ENABLED为false时返回None"""
+        if not get_bool_env('CONVERSION_CACHE_ENABLED', True):
+            return None
+        return cls(
+            db_path=get_str_env('CONVERSION_CACHE_PATH', get_cache_path('conversion_cache.sqlite3')),
+            ttl=get_float_env('CONVERSION_CACHE_TTL', 7 * 24 * 3600),
+            max_entries=get_int_env('CONVERSION_CACHE_MAX_ENTRIES', 10000),
+            max_bytes=get_int_env('CONVERSION_CACHE_MAX_BYTES', 1024 * 1024 * 1024),
+        )
+
+    def make_key(self, content_hash: str, options: Optional[Dict[str, Any]] = None) -> str:
+        """
+        生成缓存键
+
+        Args:
+            content_hash: PDF内容的SHA-256
+            options: 影响转换结果的选项（marker配置、转换方式等）
+
+        Returns:
+            缓存键
+        """
+        fingerprint = json.dumps(
+            {
+                'content_hash': content_hash,
+                'marker_version': self.marker_version,
+                'options': options or {},
+            },
+            sort_keys=True,
+            ensure_ascii=False,
+            default=str,
+        )
+        return hashlib.sha256(fingerprint.encode('utf-8')).hexdigest()
+
+    def get(self, cache_key: str) -> Optional[Dict[str, Any]]:
+        """
+        查询缓存
+
+        Returns:
+            命中时返回包含markdown_text、file_url、files_dict的字典，否则返回None
+        """
+        now = time.time()
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT markdown_text, file_url, files_json, created_at FROM conversion_cache WHERE cache_key = ?",
+                (cache_key,),
+            ).fetchone()
+            if row is None or self._is_expired(row[3], now):
+                if row is not None:
+                    self._conn.execute("DELETE FROM conversion_cache WHERE cache_key = ?", (cache_key,))
+                    self._conn.commit()
+                self.misses += 1
+                return None
+            self._conn.execute(
+                "UPDATE conversion_cache SET last_access_at = ? WHERE cache_key = ?", (now, cache_key)
+            )
+            self._conn.commit()
+            self.hits += 1
+        markdown_text, file_url, files_json, _ = row
+        return {
+            'markdown_text': markdown_text,
+            'file_url': file_url,
+            'files_dict': json.loads(files_json),
+        }
+
+    def put(
+        self,
+        cache_key: str,
+        content_hash: str,
+        markdown_text: str,
+        file_url: str,
+        files_dict: Dict[str, str],
+    ) -> None:
+        """写入一条缓存，并执行过期清理和容量淘汰"""
+        now = time.time()
+        size_bytes = len(markdown_text.encode('utf-8'))
+        with self._lock:
+            self._conn.execute(
+                """
+                INSERT OR REPLACE INTO conversion_cache
+                    (cache_key, content_hash, markdown_text, file_url, files_json, size_bytes, created_at, last_access_at)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+                """,
+                (cache_key, content_hash, markdown_text, file_url,
+                 json.dumps(files_dict, ensure_ascii=False), size_bytes, now, now),
+            )
+            self._evict(now)
+            self._conn.commit()
+
+    def stats(self) -> Dict[str, Any]:
+        """返回缓存的命中统计和当前容量"""
+        with self._lock:
+            entries, total_bytes = self._conn.execute(
+                "SELECT COUNT(*), COALESCE(SUM(size_bytes), 0) FROM conversion_cache"
+            ).fetchone()
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'entries': entries,
+                'size_bytes': total_bytes,
+            }
+
+    def close(self) -> None:
+        with self._lock:
+            self._conn.close()
+
+    def _is_expired(self, created_at: float, now: float) -> bool:
+        return self.ttl > 0 and now - created_at > self.ttl
+
+    def _evict(self, now: float) -> None:
+        """删除过期条目，并按最近最少使用淘汰超出容量的条目（调用方需持有锁）"""
+        if self.ttl > 0:
+            self._conn.execute("DELETE FROM conversion_cache WHERE created_at < ?", (now - self.ttl,))
+        entries, total_bytes = self._conn.execute(
+            "SELECT COUNT(*), COALESCE(SUM(size_bytes), 0) FROM conversion_cache"
+        ).fetchone()
+        if entries <= self.max_entries and total_bytes <= self.max_bytes:
+            return
+        rows = self._conn.execute(
+            "SELECT cache_key, size_bytes FROM conversion_cache ORDER BY last_access_at ASC"
+        ).fetchall()
+        evicted = []
+        for cache_key, size_bytes in rows:
+            if entries <= self.max_entries and total_bytes <= self.max_bytes:
+                break
+            evicted.append((cache_key,))
+            entries -= 1
+            total_bytes -= size_bytes
+        self._conn.executemany("DELETE FROM conversion_cache WHERE cache_key = ?", evicted)
+        logger.info(f"转换缓存已淘汰{len(evicted)}个条目")
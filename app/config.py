@@ -0,0 +1,84 @@
+"""
+环境变量配置读取工具
+"""
+import json
+import logging
+import os
+from typing import Any, Dict, Optional
+
+logger = logging.getLogger(__name__)
+
+# 项目根目录：默认的缓存目录相对于它解析，而不是相对于启动服务时的工作目录
+PROJECT_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def get_str_env(name: str, default: Optional[str] = None) -> Optional[str]:
+    """读取字符串类型的环境变量，空字符串视为未配置"""
+    value = os.environ.get(name)
+    if value is None or not value.strip():
+        return default
+    return value.strip()
+
+
+def get_int_env(name: str, default: int) -> int:
+    """读取整数类型的环境变量，格式错误时使用默认值"""
+    value = get_str_env(name)
+    if value is None:
+        return default
+    try:
+        return int(value)
+    except ValueError:
+        logger.warning(f"环境变量{name}的值不是有效的整数: {value}，使用默认值{default}")
+        return default
+
+
+def get_float_env(name: str, default: float) -> float:
+    """读取浮点数类型的环境变量，格式错误时使用默认值"""
+    value = get_str_env(name)
+    if value is None:
+        return default
+    try:
+        return float(value)
+    except ValueError:
+        logger.warning(f"环境变量{name}的值不是有效的数字: {value}，使用默认值{default}")
+        return default
+
+
+def get_bool_env(name: str, default: bool) -> bool:
+    """读取布尔类型的环境变量，支持1/0、true/false、yes/no、on/off"""
+    value = get_str_env(name)
+    if value is None:
+        return default
+    return value.lower() in ('1', 'true', 'yes', 'on')
+
+
+def get_json_env(name: str, default: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+    """读取JSON对象类型的环境变量，格式错误时使用默认值"""
+    value = get_str_env(name)
+    if value is None:
+        return dict(default or {})
+    try:
+        parsed = json.loads(value)
+    except json.JSONDecodeError:
+        logger.warning(f"环境变量{name}的值不是有效的JSON: {value}")
+        return dict(default or {})
+    if not isinstance(parsed, dict):
+        logger.warning(f"环境变量{name}的值必须是JSON对象: {value}")
+        return dict(default or {})
+    return parsed
+
+
+def get_cache_path(*parts: str) -> str:
+    """
+    返回缓存根目录下的绝对路径，转换缓存、页面缓存、图片索引和PDF本地副本默认都存放在这里
+
+    缓存根目录由CACHE_DIR配置，相对路径按项目根目录解析，默认为项目根目录下的.cache
+
+    Args:
+        parts: 缓存根目录下的相对路径
+
+    Returns:
+        绝对路径
+    """
+    root = os.path.join(PROJECT_ROOT, get_str_env('CACHE_DIR', '.cache'))
+    return os.path.join(os.path.abspath(root), *parts)
@@ -1,11 +1,56 @@
+import logging
 import os
 import uuid
 import time
-from qcloud_cos import CosConfig
-from qcloud_cos import CosS3Client
-from typing import Optional, List, Dict
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
+from typing import Any, Optional, List, Dict, Tuple, Union
 from dotenv import load_dotenv
 
+from app import deadline, metrics
+from app.config import get_float_env, get_int_env, get_str_env
+from app.image_store import KnownObjectIndex, content_object_key
+from app.logs import submit_in_context
+
+logger = logging.getLogger(__name__)
+
+# 分块上传单个大文件时使用的并发线程数
+MULTIPART_THREADS = 4
+
+
+@dataclass
+class UploadReport:
+    """
+    批量上传的结果报告
+
+    Attributes:
+        urls: 相对路径到访问URL的映射（仅包含上传成功的文件）
+        failed: 相对路径到错误信息的映射
+        timings: 相对路径到上传耗时（秒）的映射
+        total_bytes: 上传成功的总字节数
+        elapsed: 整批上传的耗时（秒）
+        deduplicated: 因内容相同的对象已经存在而跳过上传的文件数
+        deduplicated_bytes: 跳过上传的字节数
+    """
+    urls: Dict[str, str] = field(default_factory=dict)
+    failed: Dict[str, str] = field(default_factory=dict)
+    timings: Dict[str, float] = field(default_factory=dict)
+    total_bytes: int = 0
+    elapsed: float = 0.0
+    deduplicated: int = 0
+    deduplicated_bytes: int = 0
+
+    def merge(self, other: 'UploadReport') -> None:
+        """合并另一批（并发执行的）上传结果"""
+        self.urls.update(other.urls)
+        self.failed.update(other.failed)
+        self.timings.update(other.timings)
+        self.total_bytes += other.total_bytes
+        self.elapsed = max(self.elapsed, other.elapsed)
+        self.deduplicated += other.deduplicated
+        self.deduplicated_bytes += other.deduplicated_bytes
+
 
 class COSService:
     """腾讯云对象存储服务"""
@@ -19,19 +64,40 @@ class COSService:
         self.region = os.environ.get('COS_REGION', 'ap-guangzhou')  # 默认区域
         self.bucket = os.environ.get('COS_BUCKET')
         self.domain = os.environ.get('COS_DOMAIN')  # 可选，自定义域名
+        # 并发上传的线程数、单个对象的重试次数和分块上传的分块大小（MB）
+        self.upload_workers = max(1, get_int_env('COS_UPLOAD_WORKERS', 8))
+        self.upload_retries = max(0, get_int_env('COS_UPLOAD_RETRIES', 3))
+        self.retry_backoff = get_float_env('COS_UPLOAD_RETRY_BACKOFF', 0.5)
+        self.part_size_mb = max(1, get_int_env('COS_UPLOAD_PART_SIZE_MB', 8))
+        self._executor: Optional[ThreadPoolExecutor] = None
+        self._executor_lock = threading.Lock()
+        # 按内容寻址的去重图片存储：COS_IMAGE_DEDUP=false时为None，图片仍上传到每次转换自己的目录
+        self.image_index = KnownObjectIndex.from_env()
+        self.image_prefix = get_str_env('COS_IMAGE_PREFIX', 'assets/sha256')
+        self._image_stats = {
+            'uploaded': 0, 'uploaded_bytes': 0,
+            'deduplicated_local': 0, 'deduplicated_remote': 0, 'deduplicated_bytes': 0,
+        }
+        self._image_stats_lock = threading.Lock()
 
         # 确保必要的配置信息存在
         if not self.secret_id or not self.secret_key or not self.bucket:
-            print("警告: 腾讯云COS配置不完整，上传功能将不可用")
+            logger.warning("腾讯云COS配置不完整，上传功能将不可用")
         else:
+            # COS SDK在创建客户端时才导入，导入本模块不需要加载它
+            from qcloud_cos import CosConfig, CosS3Client
+
             # 创建COS配置和客户端
+            # 所有上传线程共享同一个客户端，连接池大小与上传线程数匹配
             self.config = CosConfig(
                 Region=self.region,
                 SecretId=self.secret_id,
-                SecretKey=self.secret_key
+                SecretKey=self.secret_key,
+                PoolConnections=self.upload_workers,
+                PoolMaxSize=self.upload_workers
             )
             self.client = CosS3Client(self.config)
-            print(f"COS服务初始化完成，区域: {self.region}, 存储桶: {self.bucket}")
+            logger.info(f"COS服务初始化完成，区域: {self.region}, 存储桶: {self.bucket}")
 
     def upload_file(self, file_path: str, object_key: Optional[str] = None) -> Optional[str]:
         """
@@ -46,7 +112,7 @@ class COSService:
         """
         # 检查配置是否完整
         if not self.secret_id or not self.secret_key or not self.bucket:
-            print("错误: 腾讯云COS配置不完整，无法上传文件")
+            logger.error("腾讯云COS配置不完整，无法上传文件")
             return None
 
         # 如果未指定对象键名，生成随机UUID作为文件名
@@ -56,26 +122,12 @@ class COSService:
 
         try:
             # 上传文件
-            print(f"开始上传文件到COS: {file_path} -> {object_key}")
-            self.client.upload_file(
-                Bucket=self.bucket,
-                LocalFilePath=file_path,
-                Key=object_key,
-                EnableMD5=True
-            )
-            
-            # 构建文件访问URL
-            if self.domain:
-                # 使用自定义域名
-                url = f"{self.domain}/{object_key}"
-            else:
-                # 使用默认COS域名
-                url = f"https://{self.bucket}.cos.{self.region}.myqcloud.com/{object_key}"
-            
-            print(f"文件上传成功: {url}")
+            logger.debug(f"开始上传文件到COS: {file_path} -> {object_key}")
+            url = self._upload_object(file_path, object_key)
+            logger.debug(f"文件上传成功: {url}")
             return url
         except Exception as e:
-            print(f"文件上传失败: {str(e)}")
+            logger.warning(f"文件上传失败: {str(e)}")
             return None
 
     def upload_content(self, content: str, object_key: Optional[str] = None) -> Optional[str]:
@@ -91,7 +143,7 @@ class COSService:
         """
         # 检查配置是否完整
         if not self.secret_id or not self.secret_key or not self.bucket:
-            print("错误: 腾讯云COS配置不完整，无法上传内容")
+            logger.error("腾讯云COS配置不完整，无法上传内容")
             return None
 
         # 如果未指定对象键名，生成随机UUID作为文件名
@@ -99,27 +151,13 @@ class COSService:
             object_key = f"{uuid.uuid4()}.md"  # 默认使用.md扩展名
 
         try:
-            # 上传文本内容
-            print(f"开始上传文本内容到COS: {object_key}")
-            response = self.client.put_object(
-                Bucket=self.bucket,
-                Body=content.encode('utf-8'),
-                Key=object_key,
-                ContentType='text/markdown'
-            )
-            
-            # 构建文件访问URL
-            if self.domain:
-                # 使用自定义域名
-                url = f"{self.domain}/{object_key}"
-            else:
-                # 使用默认COS域名
-                url = f"https://{self.bucket}.cos.{self.region}.myqcloud.com/{object_key}"
-            
-            print(f"内容上传成功: {url}")
+            # 上传文本内容，失败时与文件上传一样重试
+            logger.debug(f"开始上传文本内容到COS: {object_key}")
+            url = self._upload_object(content.encode('utf-8'), object_key, content_type='text/markdown')
+            logger.debug(f"内容上传成功: {url}")
             return url
         except Exception as e:
-            print(f"内容上传失败: {str(e)}")
+            logger.warning(f"内容上传失败: {str(e)}")
             return None
             
     def upload_directory(self, local_dir: str, cos_base_path: str) -> Dict[str, str]:
@@ -135,11 +173,11 @@ class COSService:
         """
         # 检查配置是否完整
         if not self.secret_id or not self.secret_key or not self.bucket:
-            print("错误: 腾讯云COS配置不完整，无法上传目录")
+            logger.error("腾讯云COS配置不完整，无法上传目录")
             return {}
             
         if not os.path.isdir(local_dir):
-            print(f"错误: {local_dir} 不是有效的目录")
+            logger.error(f"{local_dir} 不是有效的目录")
             return {}
             
         # 确保COS路径末尾有斜杠，但不以斜杠开头
@@ -148,55 +186,268 @@ class COSService:
         if not cos_base_path.endswith('/') and cos_base_path:
             cos_base_path = f"{cos_base_path}/"
             
-        uploaded_files = {}
-        
+        logger.info(f"开始上传目录到COS: {local_dir} -> {cos_base_path}")
+        items = []
+        # 遍历目录中的所有文件
+        for root, dirs, files in os.walk(local_dir):
+            for file in files:
+                # 构建本地文件完整路径
+                local_file_path = os.path.join(root, file)
+                # 计算相对路径，将Windows路径分隔符替换为正斜杠
+                rel_path = os.path.relpath(local_file_path, local_dir).replace('\\', '/')
+                items.append((rel_path, local_file_path, f"{cos_base_path}{rel_path}"))
+
+        report = self.upload_many(items)
+        logger.info(f"目录上传完成，共上传 {len(report.urls)} 个文件，失败 {len(report.failed)} 个")
+        return report.urls
+
+    def upload_many(self, items: List[Tuple[str, Union[str, bytes], str]]) -> UploadReport:
+        """
+        通过有界线程池并发上传多个文件
+
+        每个文件按扩展名设置Content-Type，失败时按指数退避重试，
+        超过分块大小的本地文件使用分块上传，内存中的数据直接从缓冲区上传。
+
+        Args:
+            items: (相对路径, 本地文件路径或文件内容字节, COS对象键) 列表
+
+        Returns:
+            上传结果报告，包含每个文件的URL、错误信息和耗时
+        """
+        report = UploadReport()
+        if not items:
+            return report
+        if not self.secret_id or not self.secret_key or not self.bucket:
+            logger.error("腾讯云COS配置不完整，无法上传文件")
+            report.failed = {rel_path: "COS配置不完整" for rel_path, _, _ in items}
+            return report
+
+        started = time.perf_counter()
+        executor = self._get_executor()
+        futures = [
+            (rel_path, source, submit_in_context(executor, self._timed_upload, source, object_key))
+            for rel_path, source, object_key in items
+        ]
+        for rel_path, source, future in futures:
+            try:
+                url, elapsed = future.result()
+            except Exception as e:
+                report.failed[rel_path] = str(e)
+                logger.warning(f"文件上传失败: {rel_path}，错误: {str(e)}")
+                continue
+            report.urls[rel_path] = url
+            report.timings[rel_path] = elapsed
+            report.total_bytes += len(source) if isinstance(source, bytes) else os.path.getsize(source)
+        report.elapsed = time.perf_counter() - started
+        logger.info(
+            f"批量上传完成: 成功 {len(report.urls)} 个，失败 {len(report.failed)} 个，"
+            f"共 {report.total_bytes} 字节，耗时 {report.elapsed:.2f}秒"
+        )
+        return report
+
+    def upload_images(
+        self, items: List[Tuple[str, bytes]], filenames: Optional[Dict[str, str]] = None
+    ) -> UploadReport:
+        """
+        按内容寻址上传图片，相同内容的图片共享同一个对象
+
+        对象键为 COS_IMAGE_PREFIX/哈希前两位/哈希.扩展名。先查询本地已上传哈希索引，
+        本地没有记录的再并发发送HEAD请求确认，只有COS上确实不存在的对象才上传。
+
+        Args:
+            items: (相对路径, 图片内容字节) 列表
+            filenames: 可选，相对路径到确定扩展名所用文件名的映射（例如转码后扩展名改变的图片）
+
+        Returns:
+            上传结果报告，urls中每个相对路径映射到共享对象的URL
+        """
+        report = UploadReport()
+        if not items:
+            return report
+        if self.image_index is None:
+            raise RuntimeError("未启用去重图片存储（COS_IMAGE_DEDUP）")
+        if not self.secret_id or not self.secret_key or not self.bucket:
+            logger.error("腾讯云COS配置不完整，无法上传图片")
+            report.failed = {rel_path: "COS配置不完整" for rel_path, _ in items}
+            return report
+
+        started = time.perf_counter()
+        filenames = filenames or {}
+        object_keys = {
+            rel_path: content_object_key(self.image_prefix, filenames.get(rel_path, rel_path), data)
+            for rel_path, data in items
+        }
+        contents: Dict[str, bytes] = {}
+        for rel_path, data in items:
+            contents.setdefault(object_keys[rel_path], data)
+
+        # 先查本地索引，再对剩余的对象并发发送HEAD请求
+        known_local = set(self.image_index.find_known(contents))
+        unknown = [object_key for object_key in contents if object_key not in known_local]
+        executor = self._get_executor()
+        exists = [future.result() for future in [
+            submit_in_context(executor, self._object_exists, object_key) for object_key in unknown
+        ]]
+        known_remote = {object_key for object_key, found in zip(unknown, exists) if found}
+        self.image_index.add_many({object_key: len(contents[object_key]) for object_key in known_remote})
+
+        missing = [object_key for object_key in unknown if object_key not in known_remote]
+        upload_report = self.upload_many([(object_key, contents[object_key], object_key) for object_key in missing])
+        self.image_index.add_many({object_key: len(contents[object_key]) for object_key in upload_report.urls})
+
+        for rel_path, object_key in object_keys.items():
+            if object_key in upload_report.failed:
+                report.failed[rel_path] = upload_report.failed[object_key]
+                continue
+            report.urls[rel_path] = self.get_object_url(object_key)
+            if object_key in upload_report.timings:
+                report.timings[rel_path] = upload_report.timings[object_key]
+        report.total_bytes = upload_report.total_bytes
+        skipped = [object_key for object_key in contents if object_key in known_local or object_key in known_remote]
+        report.deduplicated = len(items) - len(missing)
+        report.deduplicated_bytes = sum(len(data) for _, data in items) - sum(len(contents[key]) for key in missing)
+        report.elapsed = time.perf_counter() - started
+
+        with self._image_stats_lock:
+            self._image_stats['uploaded'] += len(upload_report.urls)
+            self._image_stats['uploaded_bytes'] += upload_report.total_bytes
+            self._image_stats['deduplicated_local'] += len(known_local)
+            self._image_stats['deduplicated_remote'] += len(known_remote)
+            self._image_stats['deduplicated_bytes'] += report.deduplicated_bytes
+        logger.info(
+            f"去重图片上传完成: 共{len(items)}张，已存在{len(skipped)}个对象（本地索引{len(known_local)}，"
+            f"HEAD确认{len(known_remote)}），上传{len(upload_report.urls)}个，节省{report.deduplicated_bytes}字节"
+        )
+        return report
+
+    def image_stats(self) -> Optional[Dict[str, Any]]:
+        """返回去重图片存储的统计信息，未启用时返回None"""
+        if self.image_index is None:
+            return None
+        with self._image_stats_lock:
+            stats: Dict[str, Any] = dict(self._image_stats)
+        stats['known_objects'] = self.image_index.count()
+        return stats
+
+    def get_object_url(self, object_key: str) -> str:
+        """构建对象的访问URL"""
+        if self.domain:
+            # 使用自定义域名
+            return f"{self.domain}/{object_key}"
+        # 使用默认COS域名
+        return f"https://{self.bucket}.cos.{self.region}.myqcloud.com/{object_key}"
+
+    def shutdown(self) -> None:
+        """关闭上传线程池和已上传图片索引"""
+        with self._executor_lock:
+            if self._executor is not None:
+                self._executor.shutdown(wait=True)
+                self._executor = None
+        if self.image_index is not None:
+            self.image_index.close()
+
+    def _get_executor(self) -> ThreadPoolExecutor:
+        """获取所有上传共享的有界线程池"""
+        with self._executor_lock:
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(
+                    max_workers=self.upload_workers, thread_name_prefix='cos-upload'
+                )
+            return self._executor
+
+    def _object_exists(self, object_key: str) -> bool:
+        """发送HEAD请求检查对象是否存在，请求失败时按不存在处理（重新上传相同内容是安全的）"""
+        from qcloud_cos.cos_exception import CosServiceError
+
+        started = time.perf_counter()
+        status = 'error'
         try:
-            print(f"开始上传目录到COS: {local_dir} -> {cos_base_path}")
-            
-            # 遍历目录中的所有文件
-            for root, dirs, files in os.walk(local_dir):
-                for file in files:
-                    # 构建本地文件完整路径
-                    local_file_path = os.path.join(root, file)
-                    
-                    # 计算相对路径
-                    rel_path = os.path.relpath(local_file_path, local_dir)
-                    # 将Windows路径分隔符替换为正斜杠
-                    rel_path = rel_path.replace('\\', '/')
-                    
-                    # 构建COS对象键
-                    object_key = f"{cos_base_path}{rel_path}"
-                    
-                    # 获取文件MIME类型
-                    content_type = self._get_content_type(file)
-                    
-                    # 上传文件
-                    print(f"上传文件: {local_file_path} -> {object_key}")
+            self.client.head_object(Bucket=self.bucket, Key=object_key)
+            status = 'ok'
+            return True
+        except CosServiceError as e:
+            if e.get_status_code() == 404:
+                status = 'not_found'
+            else:
+                logger.warning(f"检查对象是否存在失败: {object_key}，错误: {e.get_error_msg()}")
+            return False
+        except Exception as e:
+            logger.warning(f"检查对象是否存在失败: {object_key}，错误: {str(e)}")
+            return False
+        finally:
+            metrics.COS_REQUESTS.inc(operation='head_object', status=status)
+            metrics.COS_REQUEST_SECONDS.observe(time.perf_counter() - started, operation='head_object')
+
+    def _timed_upload(self, source: Union[str, bytes], object_key: str) -> Tuple[str, float]:
+        """上传单个文件并返回 (URL, 耗时)"""
+        started = time.perf_counter()
+        url = self._upload_object(source, object_key)
+        return url, time.perf_counter() - started
+
+    def _upload_object(
+        self, source: Union[str, bytes], object_key: str, content_type: Optional[str] = None
+    ) -> str:
+        """
+        上传单个文件或内存中的数据，失败时按指数退避重试
+
+        本地文件不超过分块大小时使用简单上传，更大的文件由SDK分块并发上传；
+        内存中的数据直接作为请求体上传，不落盘。
+
+        Args:
+            source: 本地文件路径或文件内容字节
+            object_key: COS对象键
+            content_type: Content-Type，为None时根据扩展名判断
+
+        Returns:
+            文件的访问URL
+
+        Raises:
+            Exception: 重试次数用尽后的最后一次错误
+            DeadlineError: 请求已超时或已取消
+        """
+        content_type = content_type or self._get_content_type(
+            object_key if isinstance(source, bytes) else source
+        )
+        operation = 'put_object' if isinstance(source, bytes) else 'upload_file'
+        attempt = 0
+        while True:
+            # 请求已超时或已取消时不再发起新的上传（包括重试）
+            deadline.check('upload')
+            started = time.perf_counter()
+            try:
+                if isinstance(source, bytes):
+                    self.client.put_object(
+                        Bucket=self.bucket,
+                        Body=source,
+                        Key=object_key,
+                        EnableMD5=True,
+                        ContentType=content_type
+                    )
+                else:
                     self.client.upload_file(
                         Bucket=self.bucket,
-                        LocalFilePath=local_file_path,
+                        LocalFilePath=source,
                         Key=object_key,
+                        PartSize=self.part_size_mb,
+                        MAXThread=MULTIPART_THREADS,
                         EnableMD5=True,
                         ContentType=content_type
                     )
-                    
-                    # 构建文件访问URL
-                    if self.domain:
-                        # 使用自定义域名
-                        url = f"{self.domain}/{object_key}"
-                    else:
-                        # 使用默认COS域名
-                        url = f"https://{self.bucket}.cos.{self.region}.myqcloud.com/{object_key}"
-                        
-                    uploaded_files[rel_path] = url
-                    print(f"文件上传成功: {url}")
-            
-            print(f"目录上传完成，共上传 {len(uploaded_files)} 个文件")
-            return uploaded_files
-        except Exception as e:
-            print(f"上传目录时发生错误: {str(e)}")
-            return uploaded_files
-            
+            except Exception as e:
+                metrics.COS_REQUESTS.inc(operation=operation, status='error')
+                metrics.COS_REQUEST_SECONDS.observe(time.perf_counter() - started, operation=operation)
+                attempt += 1
+                if attempt > self.upload_retries:
+                    raise
+                delay = self.retry_backoff * (2 ** (attempt - 1))
+                logger.warning(f"上传失败，{delay:.1f}秒后第{attempt}次重试: {object_key}，错误: {str(e)}")
+                time.sleep(delay)
+                continue
+            metrics.COS_REQUESTS.inc(operation=operation, status='ok')
+            metrics.COS_REQUEST_SECONDS.observe(time.perf_counter() - started, operation=operation)
+            metrics.COS_UPLOADED_BYTES.inc(len(source) if isinstance(source, bytes) else os.path.getsize(source))
+            return self.get_object_url(object_key)
+
     def _get_content_type(self, filename: str) -> str:
         """根据文件扩展名获取MIME类型"""
         ext = os.path.splitext(filename)[1].lower()
@@ -211,6 +462,8 @@ class COSService:
             '.jpg': 'image/jpeg',
             '.jpeg': 'image/jpeg',
             '.gif': 'image/gif',
+            '.webp': 'image/webp',
+            '.bmp': 'image/bmp',
             '.svg': 'image/svg+xml',
             '.css': 'text/css',
             '.js': 'application/javascript',
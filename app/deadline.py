@@ -0,0 +1,173 @@
+"""
+请求截止时间与取消
+
+每个转换任务在提交时创建截止时间（服务端默认值或请求中的timeout），排队时间也计入其中。
+执行任务的线程通过contextvars绑定截止时间，下载、转换和上传各阶段在阻塞等待时检查它：
+超时或客户端断开连接后立即停止等待，终止正在执行的转换进程并抛出DeadlineExceeded或RequestCancelled。
+上传线程池通过app.logs.submit_in_context继承同一个截止时间。
+"""
+import contextvars
+import threading
+import time
+from concurrent.futures import Future, TimeoutError as FutureTimeoutError
+from contextlib import contextmanager
+from typing import Any, Callable, Iterator, Optional
+
+# 阻塞等待时检查取消状态的间隔（秒）
+POLL_INTERVAL = 0.2
+
+
+class DeadlineError(Exception):
+    """任务因超时或被取消而中止，携带建议返回给客户端的HTTP状态码"""
+
+    status_code = 500
+
+    def __init__(self, message: str, stage: Optional[str] = None):
+        super().__init__(message)
+        self.message = message
+        self.stage = stage
+
+
+class DeadlineExceeded(DeadlineError):
+    """超过请求的截止时间"""
+
+    status_code = 504
+
+
+class RequestCancelled(DeadlineError):
+    """客户端断开连接或主动取消了请求"""
+
+    # 与nginx的约定一致：客户端在响应之前关闭了连接
+    status_code = 499
+
+
+class Deadline:
+    """一个请求的截止时间和取消状态，可以在多个线程中共享"""
+
+    def __init__(self, timeout: Optional[float] = None, cancel_event: Optional[threading.Event] = None):
+        """
+        初始化截止时间
+
+        Args:
+            timeout: 从现在起允许的最长秒数，None或不大于0表示不限制
+            cancel_event: 可选，与其他截止时间共享的取消标志（例如同一批量请求中的所有文档）
+        """
+        self.timeout = timeout if timeout and timeout > 0 else None
+        self.expires_at = time.monotonic() + self.timeout if self.timeout else None
+        self._cancelled = cancel_event if cancel_event is not None else threading.Event()
+        self.cancel_reason: Optional[str] = None
+
+    def remaining(self) -> Optional[float]:
+        """返回剩余秒数（不小于0），不限制时返回None"""
+        if self.expires_at is None:
+            return None
+        return max(0.0, self.expires_at - time.monotonic())
+
+    @property
+    def expired(self) -> bool:
+        return self.expires_at is not None and time.monotonic() >= self.expires_at
+
+    @property
+    def cancelled(self) -> bool:
+        return self._cancelled.is_set()
+
+    @property
+    def aborted(self) -> bool:
+        """已超时或已取消"""
+        return self.cancelled or self.expired
+
+    def cancel(self, reason: str = "客户端已断开连接") -> None:
+        """取消请求，正在等待的阶段会在下一次检查时中止"""
+        if not self._cancelled.is_set():
+            self.cancel_reason = reason
+            self._cancelled.set()
+
+    def check(self, stage: Optional[str] = None) -> None:
+        """
+        已超时或已取消时抛出异常
+
+        Raises:
+            RequestCancelled: 请求已取消
+            DeadlineExceeded: 超过截止时间
+        """
+        if self.cancelled:
+            raise RequestCancelled(f"请求已取消: {self.cancel_reason or '客户端已断开连接'}", stage)
+        if self.expired:
+            where = f"（{stage}阶段）" if stage else ""
+            raise DeadlineExceeded(f"转换超时{where}: 超过{self.timeout:g}秒的截止时间", stage)
+
+    def clamp(self, timeout: Optional[float]) -> Optional[float]:
+        """把单次操作的超时限制在剩余时间以内（至少保留一个很小的正数，避免变成不限制）"""
+        remaining = self.remaining()
+        if remaining is None:
+            return timeout
+        remaining = max(remaining, 0.001)
+        return remaining if timeout is None else min(timeout, remaining)
+
+
+_current: contextvars.ContextVar[Optional[Deadline]] = contextvars.ContextVar('deadline', default=None)
+
+
+def current() -> Optional[Deadline]:
+    """返回当前上下文绑定的截止时间"""
+    return _current.get()
+
+
+@contextmanager
+def bind(deadline: Optional[Deadline]) -> Iterator[None]:
+    """在当前上下文绑定截止时间，退出时恢复"""
+    token = _current.set(deadline)
+    try:
+        yield
+    finally:
+        _current.reset(token)
+
+
+def check(stage: Optional[str] = None) -> None:
+    """检查当前上下文的截止时间，没有绑定时不做任何事"""
+    deadline = current()
+    if deadline is not None:
+        deadline.check(stage)
+
+
+def aborted() -> bool:
+    """当前上下文的请求是否已超时或已取消"""
+    deadline = current()
+    return deadline is not None and deadline.aborted
+
+
+def clamp(timeout: Optional[float]) -> Optional[float]:
+    """把单次操作的超时限制在当前截止时间的剩余时间以内"""
+    deadline = current()
+    return deadline.clamp(timeout) if deadline is not None else timeout
+
+
+def wait_for(future: Future, cancel: Optional[Callable[[Future], Any]] = None, stage: Optional[str] = None) -> Any:
+    """
+    等待Future完成，期间检查当前上下文的截止时间
+
+    Args:
+        future: 要等待的Future
+        cancel: 超时或取消时调用，用于终止正在执行的任务（例如终止工作进程）
+        stage: 阶段名称，写入异常信息
+
+    Returns:
+        Future的结果
+
+    Raises:
+        DeadlineExceeded: 超过截止时间
+        RequestCancelled: 请求已取消
+    """
+    deadline = current()
+    if deadline is None:
+        return future.result()
+    while True:
+        try:
+            return future.result(timeout=deadline.clamp(POLL_INTERVAL))
+        except FutureTimeoutError:
+            if deadline.aborted:
+                if cancel is not None:
+                    cancel(future)
+                else:
+                    future.cancel()
+                deadline.check(stage)
@@ -0,0 +1,413 @@
+"""
+流式、连接复用的PDF下载器
+"""
+import hashlib
+import logging
+import os
+import re
+import shutil
+import sqlite3
+import threading
+import time
+import urllib.parse
+from dataclasses import dataclass
+from typing import Dict, List, Optional, Tuple
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from app import deadline
+from app.config import get_bool_env, get_cache_path, get_float_env, get_int_env, get_str_env
+
+logger = logging.getLogger(__name__)
+
+# 默认允许的响应Content-Type，缺失Content-Type时同样放行
+DEFAULT_ALLOWED_CONTENT_TYPES = [
+    'application/pdf',
+    'application/x-pdf',
+    'application/octet-stream',
+    'binary/octet-stream',
+    'application/force-download',
+    'application/download',
+    'application/vnd.openxmlformats-officedocument.wordprocessingml.document',
+]
+
+# HTML的Content-Type：PDF地址返回的登录页、错误页也是HTML，因此只在URL以HTML扩展名结尾或显式开启时接受
+HTML_CONTENT_TYPES = ['text/html', 'application/xhtml+xml']
+
+# 表示URL指向HTML文档的扩展名
+HTML_URL_EXTENSIONS = ('.html', '.htm', '.xhtml')
+
+# 下载中断时可以通过Range续传的异常
+TRANSIENT_ERRORS = (
+    requests.exceptions.ConnectionError,
+    requests.exceptions.ChunkedEncodingError,
+    requests.exceptions.Timeout,
+)
+
+
+class DownloadError(Exception):
+    """下载失败（大小超限、类型不符、HTTP错误或重试耗尽）时抛出的异常"""
+
+
+@dataclass
+class DownloadResult:
+    """
+    下载结果
+
+    Attributes:
+        path: 下载到的本地文件路径
+        content_hash: 文件内容的SHA-256
+        size: 文件字节数
+        content_type: 响应的Content-Type
+        from_local_copy: 是否因远端未修改（304）而直接使用了本地副本
+    """
+    path: str
+    content_hash: str
+    size: int
+    content_type: Optional[str] = None
+    from_local_copy: bool = False
+
+
+class _LocalStore:
+    """
+    按URL记录ETag/Last-Modified及对应本地副本的存储
+
+    副本按内容哈希存放在objects目录下，同一内容只保存一份；总大小超过上限时按最近使用时间淘汰。
+    """
+
+    def __init__(self, store_dir: str, max_bytes: int):
+        self.store_dir = store_dir
+        self.objects_dir = os.path.join(store_dir, 'objects')
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        os.makedirs(self.objects_dir, exist_ok=True)
+        self._conn = sqlite3.connect(os.path.join(store_dir, 'index.sqlite3'), check_same_thread=False, timeout=30)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS download_validators (
+                url TEXT PRIMARY KEY,
+                etag TEXT,
+                last_modified TEXT,
+                content_hash TEXT NOT NULL,
+                size INTEGER NOT NULL,
+                content_type TEXT,
+                last_used_at REAL NOT NULL
+            )
+            """
+        )
+        self._conn.commit()
+
+    def object_path(self, content_hash: str) -> str:
+        return os.path.join(self.objects_dir, f"{content_hash}.bin")
+
+    def lookup(self, url: str) -> Optional[Dict[str, Optional[str]]]:
+        """查询URL上次下载时的校验信息，本地副本不存在时返回None"""
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT etag, last_modified, content_hash, size, content_type FROM download_validators WHERE url = ?",
+                (url,),
+            ).fetchone()
+        if row is None:
+            return None
+        etag, last_modified, content_hash, size, content_type = row
+        if not os.path.exists(self.object_path(content_hash)):
+            return None
+        return {
+            'etag': etag,
+            'last_modified': last_modified,
+            'content_hash': content_hash,
+            'size': size,
+            'content_type': content_type,
+        }
+
+    def touch(self, url: str) -> None:
+        with self._lock:
+            self._conn.execute("UPDATE download_validators SET last_used_at = ? WHERE url = ?", (time.time(), url))
+            self._conn.commit()
+
+    def save(self, url: str, file_path: str, etag: Optional[str], last_modified: Optional[str],
+             content_hash: str, size: int, content_type: Optional[str]) -> None:
+        """保存本地副本和校验信息"""
+        object_path = self.object_path(content_hash)
+        if not os.path.exists(object_path):
+            temp_path = f"{object_path}.{threading.get_ident()}.tmp"
+            _link_or_copy(file_path, temp_path)
+            os.replace(temp_path, object_path)
+        with self._lock:
+            self._conn.execute(
+                """
+                INSERT OR REPLACE INTO download_validators
+                    (url, etag, last_modified, content_hash, size, content_type, last_used_at)
+                VALUES (?, ?, ?, ?, ?, ?, ?)
+                """,
+                (url, etag, last_modified, content_hash, size, content_type, time.time()),
+            )
+            self._evict()
+            self._conn.commit()
+
+    def _evict(self) -> None:
+        """按最近使用时间淘汰超出容量的副本（调用方需持有锁）"""
+        rows = self._conn.execute(
+            "SELECT content_hash, MAX(size), MAX(last_used_at) AS used FROM download_validators "
+            "GROUP BY content_hash ORDER BY used ASC"
+        ).fetchall()
+        total_bytes = sum(row[1] for row in rows)
+        for content_hash, size, _ in rows:
+            if total_bytes <= self.max_bytes:
+                break
+            self._conn.execute("DELETE FROM download_validators WHERE content_hash = ?", (content_hash,))
+            try:
+                os.unlink(self.object_path(content_hash))
+            except FileNotFoundError:
+                pass
+            total_bytes -= size
+
+
+def _is_html_url(url: str) -> bool:
+    """URL的路径是否以HTML扩展名结尾"""
+    return urllib.parse.urlparse(url).path.lower().endswith(HTML_URL_EXTENSIONS)
+
+
+def _content_range_start(response: requests.Response) -> int:
+    """返回响应正文在文件中的起始偏移量：206响应按Content-Range解析，无法解析时返回-1；其他响应为整个文件"""
+    if response.status_code != 206:
+        return 0
+    match = re.match(r'bytes\s+(\d+)-', response.headers.get('Content-Range') or '')
+    return int(match.group(1)) if match else -1
+
+
+def _link_or_copy(src: str, dst: str) -> None:
+    """优先使用硬链接，跨文件系统时退回到复制"""
+    try:
+        os.link(src, dst)
+    except OSError:
+        shutil.copyfile(src, dst)
+
+
+class PDFDownloader:
+    """
+    PDF下载器
+
+    - 通过共享的requests.Session复用连接
+    - 按块流式写入磁盘，边下载边计算SHA-256，不在内存中缓冲整个文件
+    - 在读取正文之前检查Content-Type和Content-Length，下载过程中持续检查大小上限
+    - 网络中断时通过Range请求从已下载的位置续传
+    - 记录每个URL的ETag/Last-Modified，远端未修改时直接使用本地副本
+    """
+
+    def __init__(
+        self,
+        max_bytes: int = 200 * 1024 * 1024,
+        chunk_size: int = 1024 * 1024,
+        timeout: float = 30,
+        max_retries: int = 3,
+        pool_size: int = 16,
+        allowed_content_types: Optional[List[str]] = None,
+        store_dir: Optional[str] = None,
+        store_max_bytes: int = 2 * 1024 * 1024 * 1024,
+        allow_html: bool = False,
+    ):
+        """
+        初始化下载器
+
+        Args:
+            max_bytes: 允许下载的最大字节数
+            chunk_size: 每次写入磁盘的块大小
+            timeout: 连接和读取超时时间（秒）
+            max_retries: 网络中断时的最大续传次数
+            pool_size: 连接池大小
+            allowed_content_types: 允许的Content-Type列表
+            store_dir: 本地副本目录，为None时不保存副本、不发送条件请求
+            store_max_bytes: 本地副本最多占用的字节数
+            allow_html: 是否对任意URL接受HTML的Content-Type；为False时只有URL以.html/.htm/.xhtml结尾才接受
+        """
+        self.max_bytes = max_bytes
+        self.chunk_size = chunk_size
+        self.timeout = timeout
+        self.max_retries = max_retries
+        self.allowed_content_types = [
+            content_type.lower() for content_type in (allowed_content_types or DEFAULT_ALLOWED_CONTENT_TYPES)
+        ]
+        self.allow_html = allow_html
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+        self.store = _LocalStore(store_dir, store_max_bytes) if store_dir else None
+
+    @classmethod
+    def from_env(cls) -> 'PDFDownloader':
+        """根据环境变量创建下载器"""
+        allowed = get_str_env('PDF_ALLOWED_CONTENT_TYPES')
+        return cls(
+            max_bytes=get_int_env('PDF_MAX_DOWNLOAD_BYTES', 200 * 1024 * 1024),
+            chunk_size=get_int_env('PDF_DOWNLOAD_CHUNK_SIZE', 1024 * 1024),
+            timeout=get_float_env('PDF_DOWNLOAD_TIMEOUT', 30),
+            max_retries=get_int_env('PDF_DOWNLOAD_RETRIES', 3),
+            pool_size=get_int_env('PDF_DOWNLOAD_POOL_SIZE', 16),
+            allowed_content_types=[item.strip() for item in allowed.split(',')] if allowed else None,
+            store_dir=(
+                get_str_env('PDF_STORE_DIR', get_cache_path('pdf_store'))
+                if get_bool_env('PDF_STORE_ENABLED', True) else None
+            ),
+            store_max_bytes=get_int_env('PDF_STORE_MAX_BYTES', 2 * 1024 * 1024 * 1024),
+            allow_html=get_bool_env('PDF_ALLOW_HTML', False),
+        )
+
+    def download(self, url: str, dest_path: str) -> DownloadResult:
+        """
+        下载URL到指定路径
+
+        Args:
+            url: 文件URL
+            dest_path: 本地目标路径
+
+        Returns:
+            下载结果
+
+        Raises:
+            DownloadError: 下载失败
+        """
+        validators = self.store.lookup(url) if self.store else None
+        response = self._get(url, validators)
+        if response.status_code == 304 and validators:
+            response.close()
+            try:
+                _link_or_copy(self.store.object_path(validators['content_hash']), dest_path)
+            except FileNotFoundError:
+                # 查询后本地副本被其他进程淘汰或删除，不带校验信息重新下载
+                logger.warning(f"本地副本已不存在，重新下载: {url}")
+                response = self._get(url, None)
+            else:
+                self.store.touch(url)
+                logger.info(f"远端文件未修改，使用本地副本: {url}")
+                return DownloadResult(
+                    path=dest_path,
+                    content_hash=validators['content_hash'],
+                    size=validators['size'],
+                    content_type=validators['content_type'],
+                    from_local_copy=True,
+                )
+        try:
+            if response.status_code >= 400:
+                raise DownloadError(f"HTTP状态码错误: {response.status_code}")
+            content_type = self._check_headers(url, response)
+        except DownloadError:
+            response.close()
+            raise
+
+        etag = response.headers.get('ETag')
+        last_modified = response.headers.get('Last-Modified')
+        with open(dest_path, 'wb') as f:
+            written, content_hash = self._stream_body(url, response, f, etag or last_modified)
+
+        result = DownloadResult(path=dest_path, content_hash=content_hash, size=written,
+                                content_type=content_type)
+        if self.store and (etag or last_modified):
+            self.store.save(url, dest_path, etag, last_modified, result.content_hash, written, content_type)
+        logger.info(f"已下载文件: {dest_path}，大小: {written}字节")
+        return result
+
+    def _get(self, url: str, validators: Optional[Dict[str, Optional[str]]]) -> requests.Response:
+        """请求文件，有本地副本的校验信息时发送条件请求"""
+        headers = {}
+        if validators:
+            if validators['etag']:
+                headers['If-None-Match'] = validators['etag']
+            if validators['last_modified']:
+                headers['If-Modified-Since'] = validators['last_modified']
+        try:
+            return self.session.get(url, headers=headers, stream=True, timeout=deadline.clamp(self.timeout))
+        except requests.exceptions.RequestException as e:
+            raise DownloadError(f"请求失败: {e}") from e
+
+    def _check_headers(self, url: str, response: requests.Response) -> Optional[str]:
+        """在读取正文之前检查Content-Type和Content-Length"""
+        content_type = response.headers.get('Content-Type')
+        if content_type:
+            media_type = content_type.split(';')[0].strip().lower()
+            if media_type in HTML_CONTENT_TYPES and media_type not in self.allowed_content_types:
+                if not self.allow_html and not _is_html_url(url):
+                    raise DownloadError(f"URL返回了HTML页面（可能是登录页或错误页）: {content_type}")
+            elif media_type not in self.allowed_content_types:
+                raise DownloadError(f"不支持的Content-Type: {content_type}")
+        content_length = response.headers.get('Content-Length')
+        if content_length and content_length.isdigit() and int(content_length) > self.max_bytes:
+            raise DownloadError(f"文件大小{content_length}字节超过上限{self.max_bytes}字节")
+        return content_type
+
+    def _stream_body(self, url: str, response: requests.Response, f,
+                     validator: Optional[str]) -> Tuple[int, str]:
+        """
+        分块写入正文，网络中断时使用Range续传
+
+        Returns:
+            元组 (写入的总字节数, 内容的SHA-256)
+        """
+        digest = hashlib.sha256()
+        written = 0
+        attempt = 0
+        try:
+            while True:
+                try:
+                    if response is None:
+                        response = self._resume(url, written, validator)
+                        start = _content_range_start(response)
+                        if start not in (written, 0):
+                            # 返回的范围与请求的偏移量不一致，追加会损坏文件，从头重新请求
+                            response.close()
+                            response = self._resume(url, 0, None)
+                            start = _content_range_start(response)
+                            if start != 0:
+                                content_range = response.headers.get('Content-Range')
+                                raise DownloadError(f"续传时返回的Content-Range不正确: {content_range}")
+                        if start != written or response.status_code != 206:
+                            # 服务器不支持Range、文件已变化或返回的范围从头开始，从头重新下载
+                            self._check_headers(url, response)
+                            f.seek(0)
+                            f.truncate()
+                            digest = hashlib.sha256()
+                            written = 0
+                    content_length = response.headers.get('Content-Length')
+                    expected_size = (
+                        written + int(content_length)
+                        if content_length and content_length.isdigit() else None
+                    )
+                    for chunk in response.iter_content(chunk_size=self.chunk_size):
+                        # 每写入一块检查一次请求的截止时间，超时或取消时中止下载
+                        deadline.check('download')
+                        written += len(chunk)
+                        if written > self.max_bytes:
+                            raise DownloadError(f"文件大小超过上限{self.max_bytes}字节")
+                        f.write(chunk)
+                        digest.update(chunk)
+                    if expected_size is not None and written < expected_size:
+                        raise requests.exceptions.ChunkedEncodingError(
+                            f"连接提前关闭，已接收{written}/{expected_size}字节"
+                        )
+                    return written, digest.hexdigest()
+                except TRANSIENT_ERRORS as e:
+                    attempt += 1
+                    if attempt > self.max_retries:
+                        raise DownloadError(f"下载中断且重试次数已用尽: {e}") from e
+                    logger.warning(f"下载中断，第{attempt}次从{written}字节处续传: {e}")
+                    if response is not None:
+                        response.close()
+                        response = None
+                    time.sleep(min(0.5 * 2 ** (attempt - 1), 5))
+        finally:
+            if response is not None:
+                response.close()
+
+    def _resume(self, url: str, offset: int, validator: Optional[str]) -> requests.Response:
+        """从指定偏移量重新请求文件，网络异常原样抛出以便继续重试"""
+        headers = {'Range': f'bytes={offset}-'}
+        if validator:
+            headers['If-Range'] = validator
+        response = self.session.get(url, headers=headers, stream=True, timeout=deadline.clamp(self.timeout))
+        if response.status_code >= 400:
+            response.close()
+            raise DownloadError(f"续传时HTTP状态码错误: {response.status_code}")
+        return response
@@ -0,0 +1,163 @@
+"""
+按优先级和租户加权公平出队的队列
+
+两级步幅调度（stride scheduling）：先在有排队任务的优先级之间按权重选择，再在该优先级内的租户之间按权重轮转。
+每次出队后被选中的优先级（租户）的“通行值”增加1/权重，下一次选择通行值最小的一个，
+因此长期来看各优先级（租户）得到的出队次数与权重成正比，任何一方都不会被饿死。
+重新变为非空的队列从当前的虚拟时间开始计算，空闲期间不会积累额度。
+调度状态（各优先级和租户的通行值）可以导出和恢复，共享的任务代理据此在多个节点之间保持同样的公平性。
+"""
+from collections import deque
+from typing import Any, Callable, Deque, Dict, Generic, Optional, TypeVar
+
+T = TypeVar('T')
+
+
+class _StrideSet(Generic[T]):
+    """一组按权重轮转的子队列"""
+
+    def __init__(self, weight_of: Callable[[str], float]):
+        self.weight_of = weight_of
+        self.queues: Dict[str, T] = {}
+        self.passes: Dict[str, float] = {}
+        self.vtime = 0.0
+
+    def activate(self, key: str, create: Callable[[], T]) -> T:
+        """获取子队列，不存在时创建并从当前虚拟时间开始计算"""
+        if key not in self.queues:
+            self.queues[key] = create()
+            self.passes[key] = max(self.passes.get(key, 0.0), self.vtime)
+        return self.queues[key]
+
+    def ordered(self):
+        """按通行值从小到大（权重大的优先）返回子队列的键"""
+        return sorted(self.queues, key=lambda key: (self.passes[key], -self.weight_of(key)))
+
+    def advance(self, key: str) -> None:
+        """记录一次出队"""
+        self.vtime = self.passes[key]
+        self.passes[key] += 1.0 / self.weight_of(key)
+
+    def deactivate(self, key: str) -> None:
+        """删除已经为空的子队列（保留通行值，防止出队后立即重新入队获得额外的份额）"""
+        del self.queues[key]
+
+
+class FairQueue(Generic[T]):
+    """按优先级和租户加权公平出队的队列（非线程安全，调用方负责加锁）"""
+
+    def __init__(self, priority_weights: Dict[str, float], tenant_weights: Optional[Dict[str, float]] = None):
+        """
+        初始化队列
+
+        Args:
+            priority_weights: 优先级名称到权重的映射，权重越大出队越多
+            tenant_weights: 可选，租户到权重的映射，未配置的租户权重为1
+        """
+        self.priority_weights = dict(priority_weights)
+        self.tenant_weights = dict(tenant_weights or {})
+        self._priorities: _StrideSet[_StrideSet[Deque[T]]] = _StrideSet(lambda key: self.priority_weights[key])
+        # 当前没有排队任务的优先级内各租户的调度状态，重新入队时恢复
+        self._idle_tenants: Dict[str, Dict[str, Any]] = {}
+        self._size = 0
+
+    def __len__(self) -> int:
+        return self._size
+
+    def push(self, item: T, priority: str, tenant: str) -> None:
+        """
+        入队
+
+        Raises:
+            ValueError: 未知的优先级
+        """
+        if priority not in self.priority_weights:
+            raise ValueError(f"未知的优先级: {priority}")
+        tenants = self._priorities.activate(priority, lambda: self._tenant_set(priority))
+        tenants.activate(tenant, deque).append(item)
+        self._size += 1
+
+    def _tenant_set(self, priority: str) -> _StrideSet[Deque[T]]:
+        """创建某个优先级内的租户轮转集合，恢复之前的调度状态"""
+        tenants: _StrideSet[Deque[T]] = _StrideSet(lambda key: max(1e-6, float(self.tenant_weights.get(key, 1))))
+        state = self._idle_tenants.pop(priority, None)
+        if state:
+            tenants.vtime = state['vtime']
+            tenants.passes = dict(state['passes'])
+        return tenants
+
+    def pop(self, eligible: Optional[Callable[[str], bool]] = None) -> Optional[T]:
+        """
+        按权重选择下一个任务出队
+
+        Args:
+            eligible: 可选，判断租户当前能否执行新任务（例如并发配额已用完时返回False），不满足的租户本次跳过
+
+        Returns:
+            出队的任务，没有可以执行的任务时返回None
+        """
+        for priority in self._priorities.ordered():
+            tenants = self._priorities.queues[priority]
+            for tenant in tenants.ordered():
+                if eligible is not None and not eligible(tenant):
+                    continue
+                queue = tenants.queues[tenant]
+                item = queue.popleft()
+                self._size -= 1
+                tenants.advance(tenant)
+                self._priorities.advance(priority)
+                if not queue:
+                    tenants.deactivate(tenant)
+                if not tenants.queues:
+                    self._priorities.deactivate(priority)
+                    self._idle_tenants[priority] = {'vtime': tenants.vtime, 'passes': tenants.passes}
+                return item
+        return None
+
+    def remove(self, item: T, priority: str, tenant: str) -> bool:
+        """
+        从队列中删除一个还未出队的任务（例如被取消），不计入出队次数
+
+        Returns:
+            任务是否在队列中
+        """
+        tenants = self._priorities.queues.get(priority)
+        queue = tenants.queues.get(tenant) if tenants is not None else None
+        if queue is None or item not in queue:
+            return False
+        queue.remove(item)
+        self._size -= 1
+        if not queue:
+            tenants.deactivate(tenant)
+        if not tenants.queues:
+            self._priorities.deactivate(priority)
+            self._idle_tenants[priority] = {'vtime': tenants.vtime, 'passes': tenants.passes}
+        return True
+
+    def state(self) -> Dict[str, Any]:
+        """导出调度状态（不包含排队的任务），可以序列化为JSON"""
+        tenants = dict(self._idle_tenants)
+        for priority, active in self._priorities.queues.items():
+            tenants[priority] = {'vtime': active.vtime, 'passes': active.passes}
+        return {
+            'vtime': self._priorities.vtime,
+            'passes': dict(self._priorities.passes),
+            'tenants': {priority: {'vtime': value['vtime'], 'passes': dict(value['passes'])}
+                        for priority, value in tenants.items()},
+        }
+
+    def load_state(self, state: Dict[str, Any]) -> None:
+        """恢复state导出的调度状态，需要在入队之前调用"""
+        self._priorities.vtime = float(state.get('vtime', 0.0))
+        self._priorities.passes = {key: float(value) for key, value in state.get('passes', {}).items()}
+        self._idle_tenants = {
+            priority: {'vtime': float(value.get('vtime', 0.0)), 'passes': dict(value.get('passes', {}))}
+            for priority, value in state.get('tenants', {}).items()
+        }
+
+    def counts(self) -> Dict[str, int]:
+        """返回各优先级的排队数量"""
+        return {
+            priority: sum(len(queue) for queue in tenants.queues.values())
+            for priority, tenants in self._priorities.queues.items()
+        }
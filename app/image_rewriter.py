@@ -0,0 +1,131 @@
+"""
+Markdown图片引用改写器
+"""
+import os
+import re
+import urllib.parse
+from typing import Dict, Iterable, Iterator, Optional
+
+# 允许按文件名匹配的图片扩展名
+IMAGE_EXTENSIONS = {'.png', '.jpg', '.jpeg', '.gif', '.svg', '.webp', '.bmp'}
+
+# 同时匹配Markdown图片语法和HTML img标签，一次扫描完成替换
+# md_alt/md_path: ![alt](path/to/image.ext)
+# html_quote/html_src: <img ... src="path/to/image.ext" ...>
+IMAGE_PATTERN = re.compile(
+    r'!\[(?P<md_alt>[^]]*)\]\((?P<md_path>[^)]+)\)'
+    r'|<img\b[^>]*?\bsrc\s*=\s*(?P<html_quote>["\'])(?P<html_src>.*?)(?P=html_quote)[^>]*>',
+    re.IGNORECASE,
+)
+
+
+def _normalize_path(path: str) -> str:
+    """统一路径分隔符并去掉开头的./"""
+    path = path.replace('\\', '/')
+    while path.startswith('./'):
+        path = path[2:]
+    return path
+
+
+class ImageURLRewriter:
+    """
+    将Markdown中的本地图片引用替换为COS远程URL
+
+    构造时一次性建立完整路径索引和文件名索引，之后每个图片引用只需常数次字典查找；
+    Markdown图片语法和HTML img标签在同一次正则扫描中处理。
+    """
+
+    def __init__(self, files_dict: Dict[str, str]):
+        """
+        建立索引
+
+        Args:
+            files_dict: 文件相对路径到COS URL的映射
+        """
+        self.replace_count = 0
+        self._exact: Dict[str, str] = {}
+        self._by_basename: Dict[str, str] = {}
+        # 路径长的优先，同名文件按文件名匹配时取路径最长的一个
+        for local_path, remote_url in sorted(files_dict.items(), key=lambda x: len(x[0]), reverse=True):
+            normalized = _normalize_path(local_path)
+            self._exact.setdefault(local_path, remote_url)
+            self._exact.setdefault(normalized, remote_url)
+            basename = os.path.basename(normalized)
+            if os.path.splitext(basename)[1].lower() in IMAGE_EXTENSIONS:
+                self._by_basename.setdefault(basename, remote_url)
+
+    def resolve(self, image_path: str) -> Optional[str]:
+        """
+        查找图片引用对应的远程URL
+
+        Args:
+            image_path: Markdown或HTML中的图片路径
+
+        Returns:
+            远程URL，没有匹配项或已经是远程地址时返回None
+        """
+        # 去除可能的URL参数和锚点
+        image_path = image_path.strip().split('#')[0].split('?')[0]
+
+        # 如果已经是完整的HTTP/HTTPS URL或内嵌数据，不做替换
+        if image_path.startswith(('http://', 'https://', 'data:')):
+            return None
+
+        # 1. 完整路径匹配
+        for candidate in (image_path, _normalize_path(image_path), _normalize_path(urllib.parse.unquote(image_path))):
+            remote_url = self._exact.get(candidate)
+            if remote_url:
+                return remote_url
+
+        # 2. 图片引用可能使用相对路径，按文件名匹配
+        return self._by_basename.get(os.path.basename(_normalize_path(urllib.parse.unquote(image_path))))
+
+    def _replace(self, match: re.Match) -> str:
+        if match.group('md_path') is not None:
+            remote_url = self.resolve(match.group('md_path'))
+            if remote_url is None:
+                return match.group(0)
+            self.replace_count += 1
+            return f"![{match.group('md_alt')}]({remote_url})"
+
+        remote_url = self.resolve(match.group('html_src'))
+        if remote_url is None:
+            return match.group(0)
+        self.replace_count += 1
+        # 只替换src属性的值，保留标签的其他部分
+        tag = match.group(0)
+        start = match.start('html_src') - match.start()
+        end = match.end('html_src') - match.start()
+        return f"{tag[:start]}{remote_url}{tag[end:]}"
+
+    def rewrite(self, markdown_text: str) -> str:
+        """一次扫描替换文本中的所有图片引用"""
+        return IMAGE_PATTERN.sub(self._replace, markdown_text)
+
+    def rewrite_lines(self, lines: Iterable[str]) -> Iterator[str]:
+        """
+        逐行替换图片引用的流式转换器
+
+        marker输出的Markdown图片语法和img标签都不跨行，逐行处理与整体替换结果一致，
+        且不需要同时在内存中保存替换前后的整篇文档。
+        """
+        for line in lines:
+            yield IMAGE_PATTERN.sub(self._replace, line)
+
+    def rewrite_file(self, src_path: str, dst_path: Optional[str] = None) -> str:
+        """
+        流式改写Markdown文件
+
+        Args:
+            src_path: 源文件路径
+            dst_path: 目标文件路径，为None时原地改写
+
+        Returns:
+            目标文件路径
+        """
+        target_path = dst_path or src_path
+        temp_path = f"{target_path}.rewriting"
+        with open(src_path, 'r', encoding='utf-8') as src, open(temp_path, 'w', encoding='utf-8') as dst:
+            dst.writelines(self.rewrite_lines(src))
+        os.replace(temp_path, target_path)
+        return target_path
@@ -0,0 +1,106 @@
+"""
+按内容寻址的去重图片存储
+
+图片以内容哈希作为COS对象键，相同的图片（例如各文档重复出现的徽标、页眉和插图）只上传一次。
+上传前先查询本地记录的已上传哈希，本地没有记录时再向COS发送HEAD请求确认对象是否存在。
+"""
+import hashlib
+import os
+import sqlite3
+import threading
+import time
+from typing import Dict, Iterable, List, Optional
+
+from app.config import get_bool_env, get_cache_path, get_str_env
+
+
+def content_object_key(prefix: str, rel_path: str, data: bytes) -> str:
+    """
+    生成按内容寻址的对象键：前缀/哈希前两位/哈希.扩展名
+
+    Args:
+        prefix: 共享图片的COS前缀
+        rel_path: 图片的相对路径，只用于保留扩展名
+        data: 图片内容
+
+    Returns:
+        COS对象键
+    """
+    digest = hashlib.sha256(data).hexdigest()
+    extension = os.path.splitext(rel_path)[1].lower()
+    return f"{prefix.strip('/')}/{digest[:2]}/{digest}{extension}"
+
+
+class KnownObjectIndex:
+    """
+    已确认存在于COS上的共享对象键的本地索引（SQLite）
+
+    只记录上传成功或经HEAD确认存在的对象；共享前缀下的对象不应配置生命周期删除规则，
+    否则索引中记录的对象可能已经不存在。
+    """
+
+    def __init__(self, db_path: str):
+        """
+        初始化索引
+
+        Args:
+            db_path: SQLite数据库文件路径
+        """
+        self.db_path = db_path
+        self._lock = threading.Lock()
+        os.makedirs(os.path.dirname(os.path.abspath(db_path)), exist_ok=True)
+        self._conn = sqlite3.connect(db_path, check_same_thread=False, timeout=30)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS known_objects (
+                object_key TEXT PRIMARY KEY,
+                size INTEGER NOT NULL,
+                created_at REAL NOT NULL
+            )
+            """
+        )
+        self._conn.commit()
+
+    @classmethod
+    def from_env(cls) -> Optional['KnownObjectIndex']:
+        """根据环境变量创建索引，COS_IMAGE_DEDUP为false时返回None"""
+        if not get_bool_env('COS_IMAGE_DEDUP', False):
+            return None
+        return cls(get_str_env('COS_IMAGE_INDEX_PATH', get_cache_path('image_index.sqlite3')))
+
+    def find_known(self, object_keys: Iterable[str]) -> List[str]:
+        """返回其中已经记录为存在的对象键"""
+        unique_keys = list(dict.fromkeys(object_keys))
+        known: List[str] = []
+        with self._lock:
+            for start in range(0, len(unique_keys), 500):
+                batch = unique_keys[start:start + 500]
+                rows = self._conn.execute(
+                    f"SELECT object_key FROM known_objects WHERE object_key IN ({','.join('?' * len(batch))})",
+                    batch,
+                ).fetchall()
+                known.extend(row[0] for row in rows)
+        return known
+
+    def add_many(self, sizes: Dict[str, int]) -> None:
+        """记录已确认存在的对象键及其字节数"""
+        if not sizes:
+            return
+        now = time.time()
+        with self._lock:
+            self._conn.executemany(
+                "INSERT OR IGNORE INTO known_objects (object_key, size, created_at) VALUES (?, ?, ?)",
+                [(object_key, size, now) for object_key, size in sizes.items()],
+            )
+            self._conn.commit()
+
+    def count(self) -> int:
+        """返回记录的对象数量"""
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM known_objects").fetchone()[0]
+
+    def close(self) -> None:
+        """关闭数据库连接"""
+        with self._lock:
+            self._conn.close()
@@ -0,0 +1,227 @@
+"""
+上传前的图片转码和压缩
+
+marker输出的是原始分辨率的PNG/JPEG图片，直接上传会增加上传耗时以及客户端渲染Markdown时的下载量。
+转码阶段在进程池中把图片缩放到最大边长以内并重新编码为WebP或JPEG，图片的相对路径保持不变，
+只有上传到COS的对象键使用新的扩展名，因此replace_image_urls等按相对路径查找URL的逻辑不受影响。
+"""
+import io
+import logging
+import multiprocessing
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass, field
+from typing import Any, Dict, Optional
+
+from app.config import get_bool_env, get_int_env, get_str_env
+
+logger = logging.getLogger(__name__)
+
+# 参与转码的图片扩展名；GIF可能是动画、SVG是矢量图，保持原样
+TRANSCODABLE_EXTENSIONS = {'.png', '.jpg', '.jpeg', '.bmp', '.tif', '.tiff', '.webp'}
+
+# 输出格式对应的Pillow格式名和扩展名
+OUTPUT_FORMATS = {
+    'webp': ('WEBP', '.webp'),
+    'jpeg': ('JPEG', '.jpeg'),
+}
+
+
+def transcode_image(data: bytes, output_format: str, quality: int, max_dimension: int) -> Optional[bytes]:
+    """
+    缩放并重新编码一张图片（在子进程中执行）
+
+    Args:
+        data: 原始图片内容
+        output_format: 输出格式，webp或jpeg
+        quality: 编码质量（1-100）
+        max_dimension: 最大边长（像素），0表示不缩放
+
+    Returns:
+        转码后的图片内容；既没有缩放、结果也不比原图小时返回None，表示保留原图
+    """
+    from PIL import Image
+
+    pil_format, _ = OUTPUT_FORMATS[output_format]
+    with Image.open(io.BytesIO(data)) as image:
+        image.load()
+        resized = False
+        if max_dimension > 0 and max(image.size) > max_dimension:
+            image.thumbnail((max_dimension, max_dimension), Image.LANCZOS)
+            resized = True
+        if pil_format == 'JPEG' and image.mode not in ('RGB', 'L'):
+            # JPEG不支持透明通道，透明区域按白色背景合成
+            background = Image.new('RGB', image.size, (255, 255, 255))
+            rgba = image.convert('RGBA')
+            background.paste(rgba, mask=rgba.getchannel('A'))
+            image = background
+        elif image.mode not in ('RGB', 'RGBA', 'L', 'LA'):
+            image = image.convert('RGBA' if 'A' in image.getbands() or 'transparency' in image.info else 'RGB')
+        buffer = io.BytesIO()
+        image.save(buffer, pil_format, quality=quality, optimize=pil_format == 'JPEG')
+    output = buffer.getvalue()
+    if not resized and len(output) >= len(data):
+        return None
+    return output
+
+
+@dataclass
+class TranscodeResult:
+    """
+    一批图片的转码结果
+
+    Attributes:
+        images: 相对路径到（可能已转码的）图片内容的映射，相对路径与输入一致
+        filenames: 转码后的相对路径到对象文件名（扩展名改为输出格式）的映射，未转码的图片不在其中
+        original_bytes: 输入图片的总字节数
+        output_bytes: 输出图片的总字节数
+    """
+    images: Dict[str, bytes] = field(default_factory=dict)
+    filenames: Dict[str, str] = field(default_factory=dict)
+    original_bytes: int = 0
+    output_bytes: int = 0
+
+    def stats(self) -> Dict[str, Any]:
+        """返回本批转码的统计，用于任务结果"""
+        return {
+            'images': len(self.images),
+            'transcoded': len(self.filenames),
+            'original_bytes': self.original_bytes,
+            'output_bytes': self.output_bytes,
+            'saved_bytes': self.original_bytes - self.output_bytes,
+        }
+
+
+class ImageTranscoder:
+    """
+    在进程池中并行转码图片
+
+    图片编码是CPU密集的操作，放在独立的进程中执行，避免占用API进程的GIL；进程池在首次使用时创建。
+    """
+
+    def __init__(
+        self,
+        output_format: str = 'webp',
+        quality: int = 80,
+        max_dimension: int = 2048,
+        workers: int = 2,
+        min_bytes: int = 16 * 1024,
+    ):
+        """
+        初始化转码器
+
+        Args:
+            output_format: 输出格式，webp或jpeg
+            quality: 编码质量（1-100）
+            max_dimension: 最大边长（像素），0表示不缩放
+            workers: 转码进程数
+            min_bytes: 小于该字节数的图片不转码，避免进程间传输的开销超过收益
+
+        Raises:
+            ValueError: 不支持的输出格式
+        """
+        output_format = output_format.lower()
+        if output_format == 'jpg':
+            output_format = 'jpeg'
+        if output_format not in OUTPUT_FORMATS:
+            raise ValueError(f"不支持的图片转码格式: {output_format}")
+        self.output_format = output_format
+        self.quality = min(100, max(1, quality))
+        self.max_dimension = max(0, max_dimension)
+        self.workers = max(1, workers)
+        self.min_bytes = max(0, min_bytes)
+        self._executor: Optional[ProcessPoolExecutor] = None
+        self._lock = threading.Lock()
+        self._stats = {'jobs': 0, 'images': 0, 'transcoded': 0, 'failed': 0, 'original_bytes': 0, 'output_bytes': 0}
+
+    @classmethod
+    def from_env(cls) -> Optional['ImageTranscoder']:
+        """根据环境变量创建转码器，IMAGE_TRANSCODE_ENABLED为false时返回None"""
+        if not get_bool_env('IMAGE_TRANSCODE_ENABLED', False):
+            return None
+        return cls(
+            output_format=get_str_env('IMAGE_TRANSCODE_FORMAT', 'webp'),
+            quality=get_int_env('IMAGE_TRANSCODE_QUALITY', 80),
+            max_dimension=get_int_env('IMAGE_MAX_DIMENSION', 2048),
+            workers=get_int_env('IMAGE_TRANSCODE_WORKERS', min(4, os.cpu_count() or 1)),
+            min_bytes=get_int_env('IMAGE_TRANSCODE_MIN_BYTES', 16 * 1024),
+        )
+
+    def transcode(self, images: Dict[str, bytes]) -> TranscodeResult:
+        """
+        并行转码一批图片
+
+        转码失败或没有收益的图片保留原样。
+
+        Args:
+            images: 相对路径到图片内容的映射
+
+        Returns:
+            转码结果，images的键与输入相同
+        """
+        result = TranscodeResult(images=dict(images))
+        result.original_bytes = sum(len(data) for data in images.values())
+        candidates = [
+            rel_path for rel_path, data in images.items()
+            if os.path.splitext(rel_path)[1].lower() in TRANSCODABLE_EXTENSIONS and len(data) >= self.min_bytes
+        ]
+        failed = 0
+        if candidates:
+            executor = self._get_executor()
+            futures = [
+                (rel_path, executor.submit(
+                    transcode_image, images[rel_path], self.output_format, self.quality, self.max_dimension
+                ))
+                for rel_path in candidates
+            ]
+            extension = OUTPUT_FORMATS[self.output_format][1]
+            for rel_path, future in futures:
+                try:
+                    output = future.result()
+                except Exception as e:
+                    failed += 1
+                    logger.warning(f"图片转码失败，保留原图: {rel_path}，错误: {e}")
+                    continue
+                if output is None:
+                    continue
+                result.images[rel_path] = output
+                result.filenames[rel_path] = os.path.splitext(rel_path)[0] + extension
+        result.output_bytes = sum(len(data) for data in result.images.values())
+
+        with self._lock:
+            self._stats['jobs'] += 1
+            self._stats['images'] += len(images)
+            self._stats['transcoded'] += len(result.filenames)
+            self._stats['failed'] += failed
+            self._stats['original_bytes'] += result.original_bytes
+            self._stats['output_bytes'] += result.output_bytes
+        if result.filenames:
+            logger.info(f"图片转码完成: {len(result.filenames)}/{len(images)}张，"
+                        f"{result.original_bytes} -> {result.output_bytes} 字节")
+        return result
+
+    def stats(self) -> Dict[str, Any]:
+        """返回累计的转码统计"""
+        with self._lock:
+            stats: Dict[str, Any] = dict(self._stats)
+        stats['saved_bytes'] = stats['original_bytes'] - stats['output_bytes']
+        stats['format'] = self.output_format
+        return stats
+
+    def shutdown(self) -> None:
+        """关闭转码进程池"""
+        with self._lock:
+            executor, self._executor = self._executor, None
+        if executor is not None:
+            executor.shutdown(wait=True)
+
+    def _get_executor(self) -> ProcessPoolExecutor:
+        """获取（必要时创建）转码进程池，与工作进程池一样使用spawn启动"""
+        with self._lock:
+            if self._executor is None:
+                self._executor = ProcessPoolExecutor(
+                    max_workers=self.workers, mp_context=multiprocessing.get_context('spawn')
+                )
+            return self._executor
+
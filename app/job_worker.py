@@ -0,0 +1,49 @@
+"""
+只执行转换任务、不提供HTTP接口的工作节点
+
+与API节点配置同一个JOB_BROKER后启动：python -m app.job_worker
+收到SIGTERM或SIGINT后停止领取新任务并退出，未完成的任务在租约过期后由其他节点重新执行。
+"""
+import logging
+import signal
+import threading
+
+from dotenv import load_dotenv
+
+from app.logs import configure_logging
+
+load_dotenv()
+configure_logging()
+
+from app.jobs import JobScheduler  # noqa: E402
+from app.services import PDFConverterService  # noqa: E402
+from app.warmup import Warmup  # noqa: E402
+
+logger = logging.getLogger(__name__)
+
+
+def main() -> None:
+    """启动工作节点，直到收到退出信号"""
+    service = PDFConverterService()
+    scheduler = JobScheduler.from_env(service.run_conversion_job)
+    if scheduler.broker is None:
+        raise SystemExit("工作节点需要配置JOB_BROKER")
+    # 预热结束后再领取任务，避免第一个任务承担模型加载的耗时
+    warmup = Warmup.from_env(service.warm_up)
+    warmup.start()
+    warmup.wait()
+
+    stop = threading.Event()
+    signal.signal(signal.SIGTERM, lambda *_: stop.set())
+    signal.signal(signal.SIGINT, lambda *_: stop.set())
+
+    scheduler.start()
+    logger.info(f"工作节点已启动: {scheduler.node_id}，并发数: {scheduler.max_concurrent}")
+    stop.wait()
+    logger.info(f"工作节点正在退出: {scheduler.node_id}")
+    scheduler.shutdown()
+    service.shutdown()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,769 @@
+"""
+异步转换任务与并发受限的调度器
+"""
+import logging
+import math
+import os
+import socket
+import threading
+import time
+import uuid
+from concurrent.futures import Future
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from app import deadline, metrics
+from app.broker import JobBroker, JobRecord, create_broker
+from app.config import get_bool_env, get_float_env, get_int_env, get_json_env, get_str_env
+from app.fair_queue import FairQueue
+from app.logs import bind_context, get_request_id
+from app.progress import ProgressReporter, bind
+
+logger = logging.getLogger(__name__)
+
+# 优先级及其默认权重：交互式请求使用high，批量回填使用low
+DEFAULT_PRIORITY = "normal"
+DEFAULT_PRIORITY_WEIGHTS = {"high": 8, "normal": 4, "low": 1}
+# 请求没有携带API Key时归入的租户
+ANONYMOUS_TENANT = "anonymous"
+
+
+class JobStatus:
+    """任务状态常量"""
+    QUEUED = "queued"
+    RUNNING = "running"
+    SUCCEEDED = "succeeded"
+    FAILED = "failed"
+    TIMED_OUT = "timed_out"
+    CANCELLED = "cancelled"
+
+
+class QueueFullError(Exception):
+    """排队的任务过多或预计等待时间过长，拒绝接收新任务"""
+
+    status_code = 429
+
+    def __init__(self, message: str, retry_after: int):
+        super().__init__(message)
+        self.message = message
+        # 建议客户端重试前等待的秒数
+        self.retry_after = retry_after
+
+
+class JobFailedError(Exception):
+    """任务在其他节点上执行失败"""
+
+    def __init__(self, message: str, status_code: int = 500):
+        super().__init__(message)
+        self.message = message
+        self.status_code = status_code
+
+
+class ConversionJob:
+    """一个转换任务及其执行状态"""
+
+    def __init__(
+        self,
+        payload: Dict[str, Any],
+        partial_results: bool = False,
+        timeout: Optional[float] = None,
+        priority: str = DEFAULT_PRIORITY,
+        tenant: str = ANONYMOUS_TENANT,
+        pages: int = 1,
+    ):
+        """
+        初始化任务
+
+        Args:
+            payload: 任务参数，例如 {"pdf_url": "..."}
+            partial_results: 是否在进度事件中记录已完成页面的Markdown
+            timeout: 从提交起允许的最长秒数（包含排队时间），None表示不限制
+            priority: 优先级
+            tenant: 提交任务的租户（API Key）
+            pages: 估计的页数，用于计算排队的预计等待时间
+        """
+        self.job_id = uuid.uuid4().hex
+        self.payload = payload
+        self.priority = priority
+        self.tenant = tenant
+        self.pages = max(1, pages)
+        # 提交任务的请求ID，执行任务的线程据此关联日志
+        self.request_id = get_request_id()
+        self.status = JobStatus.QUEUED
+        self.created_at = time.time()
+        self.started_at: Optional[float] = None
+        self.finished_at: Optional[float] = None
+        self.result: Optional[Dict[str, Any]] = None
+        self.error: Optional[str] = None
+        # 供同步等待方（如/convert接口）获取结果
+        self.future: Future = Future()
+        # 阶段切换、页面进度等事件，供流式接口推送
+        self.progress = ProgressReporter(partial_results=partial_results)
+        # 截止时间从提交时开始计算，客户端断开连接时也通过它取消任务
+        self.deadline = deadline.Deadline(timeout)
+
+    @classmethod
+    def from_record(cls, record: JobRecord) -> 'ConversionJob':
+        """根据任务代理中的记录创建任务（尚未开始执行），截止时间按剩余时间计算"""
+        timeout = None
+        if record.deadline_at is not None:
+            # 已经超时的任务也需要一个正数，否则会被当作不限制
+            timeout = max(1e-3, record.deadline_at - time.time())
+        job = cls(record.payload, timeout=timeout, priority=record.priority, tenant=record.tenant, pages=record.pages)
+        job.job_id = record.job_id
+        job.request_id = record.request_id
+        job.created_at = record.created_at
+        if record.cancel_reason:
+            job.deadline.cancel(record.cancel_reason)
+        return job
+
+    @property
+    def finished(self) -> bool:
+        return self.status in (JobStatus.SUCCEEDED, JobStatus.FAILED, JobStatus.TIMED_OUT, JobStatus.CANCELLED)
+
+    def apply_record(self, record: JobRecord) -> None:
+        """用任务代理中的记录更新由其他节点执行的任务，任务结束时设置结果并结束进度事件"""
+        if self.finished:
+            return
+        if record.status == JobStatus.RUNNING and self.status == JobStatus.QUEUED:
+            self.status = JobStatus.RUNNING
+            self.started_at = record.started_at
+            self.future.set_running_or_notify_cancel()
+            self.progress.emit("stage", {"stage": "running"})
+        elif record.status in (JobStatus.SUCCEEDED, JobStatus.FAILED, JobStatus.TIMED_OUT, JobStatus.CANCELLED):
+            self.status = record.status
+            self.started_at = record.started_at
+            self.finished_at = record.finished_at
+            self.result = record.result
+            self.error = record.error
+            if record.status == JobStatus.SUCCEEDED:
+                result = record.result or {}
+                self.progress.emit("result", {"file_url": result.get("file_url"), "files": result.get("files_dict")})
+                self.progress.close()
+                self.future.set_result(result)
+                return
+            message = record.error or "任务执行失败"
+            if record.status == JobStatus.TIMED_OUT:
+                error: Exception = deadline.DeadlineExceeded(message)
+            elif record.status == JobStatus.CANCELLED:
+                error = deadline.RequestCancelled(message)
+            else:
+                error = JobFailedError(message, record.status_code or 500)
+            self.progress.emit("error", {"detail": message, "status_code": getattr(error, 'status_code', 500)})
+            self.progress.close()
+            self.future.set_exception(error)
+
+    def to_dict(self) -> Dict[str, Any]:
+        """转换为接口返回的字典"""
+        result = self.result or {}
+        return {
+            "job_id": self.job_id,
+            "status": self.status,
+            "priority": self.priority,
+            "created_at": self.created_at,
+            "started_at": self.started_at,
+            "finished_at": self.finished_at,
+            "file_url": result.get("file_url"),
+            "files": result.get("files_dict"),
+            "route": result.get("route"),
+            "page_cache": result.get("page_cache"),
+            "image_dedup": result.get("image_dedup"),
+            "image_transcode": result.get("image_transcode"),
+            "error": self.error,
+        }
+
+
+class JobScheduler:
+    """
+    转换任务调度器
+
+    任务按优先级和租户（API Key）排队，由固定数量的后台线程按权重公平地取出执行，从而限制同时进行的转换数量，
+    批量回填不会饿死交互式请求；每个租户同时执行的任务数可以设置配额。
+    排队的任务数或按排队页数估计的等待时间超过上限时拒绝新任务（QueueFullError，接口返回429）。
+    接口层只负责入队，不会因为长时间的转换而阻塞事件循环。
+
+    配置了任务代理（app.broker）时，队列由多个节点共享：任务写入代理后由任意节点以租约方式领取执行，
+    后台线程定期为正在执行的任务续约、把其他节点上的取消请求传递给本地的截止时间，
+    并把在其他节点上完成的任务结果交给本节点上等待的请求。
+    """
+
+    def __init__(
+        self,
+        handler: Callable[[Dict[str, Any]], Dict[str, Any]],
+        max_concurrent: int = 1,
+        result_ttl: float = 3600,
+        default_timeout: Optional[float] = None,
+        priority_weights: Optional[Dict[str, float]] = None,
+        tenant_weights: Optional[Dict[str, float]] = None,
+        tenant_max_concurrent: int = 0,
+        tenant_quotas: Optional[Dict[str, int]] = None,
+        max_queued: int = 0,
+        max_queue_wait: float = 0,
+        seconds_per_page: float = 2.0,
+        default_job_pages: int = 10,
+        broker: Optional[JobBroker] = None,
+        node_id: Optional[str] = None,
+        lease_seconds: float = 30,
+        poll_interval: float = 0.5,
+        execute: bool = True,
+    ):
+        """
+        初始化调度器（不会立即启动后台线程）
+
+        Args:
+            handler: 执行任务的函数，接收任务参数并返回结果字典，失败时抛出异常
+            max_concurrent: 最多同时执行的任务数量
+            result_ttl: 已结束任务的保留时间（秒）
+            default_timeout: 请求未指定timeout时的截止时间（秒），None或不大于0表示不限制
+            priority_weights: 优先级到权重的映射，默认high=8、normal=4、low=1
+            tenant_weights: 租户到权重的映射，同一优先级内按权重轮转，未配置的租户权重为1
+            tenant_max_concurrent: 每个租户同时执行的任务数上限，0表示不限制
+            tenant_quotas: 按租户单独设置的并发上限，覆盖tenant_max_concurrent
+            max_queued: 最多排队的任务数，0表示不限制
+            max_queue_wait: 新任务的预计等待时间（秒）上限，0表示不限制
+            seconds_per_page: 每页转换耗时的初始估计（秒），之后按已完成任务的实际耗时更新
+            default_job_pages: 无法预先得知页数的任务（例如URL）按此页数估计
+            broker: 可选，多个节点共享的任务代理，None表示只使用进程内的队列
+            node_id: 本节点的ID，用于领取任务，默认由主机名和进程号生成
+            lease_seconds: 领取任务的租约时长（秒），节点失联超过该时间后任务由其他节点重新执行
+            poll_interval: 空闲时检查代理中新任务、以及检查其他节点上任务结果的间隔（秒）
+            execute: 是否执行代理中的任意任务；为False时只执行必须在本节点执行的任务（例如上传的文件）
+        """
+        self.handler = handler
+        self.max_concurrent = max(1, max_concurrent)
+        self.result_ttl = result_ttl
+        self.default_timeout = default_timeout if default_timeout and default_timeout > 0 else None
+        self.priority_weights = {
+            name: float(weight) for name, weight in (priority_weights or DEFAULT_PRIORITY_WEIGHTS).items()
+            if float(weight) > 0
+        }
+        if DEFAULT_PRIORITY not in self.priority_weights:
+            self.priority_weights[DEFAULT_PRIORITY] = float(DEFAULT_PRIORITY_WEIGHTS[DEFAULT_PRIORITY])
+        self.tenant_max_concurrent = max(0, tenant_max_concurrent)
+        self.tenant_quotas = {tenant: int(limit) for tenant, limit in (tenant_quotas or {}).items()}
+        self.max_queued = max(0, max_queued)
+        self.max_queue_wait = max(0.0, max_queue_wait)
+        self.default_job_pages = max(1, default_job_pages)
+        self._seconds_per_page = max(0.0, seconds_per_page)
+        self.tenant_weights = dict(tenant_weights or {})
+        self.broker = broker
+        self.node_id = node_id or f"{socket.gethostname()}-{os.getpid()}-{uuid.uuid4().hex[:6]}"
+        self.lease_seconds = max(1.0, lease_seconds)
+        self.poll_interval = max(0.01, poll_interval)
+        self.execute = execute
+        self._queue: FairQueue[ConversionJob] = FairQueue(self.priority_weights, self.tenant_weights)
+        self._queued_pages: Dict[str, int] = {}
+        self._tenant_running: Dict[str, int] = {}
+        self._jobs: Dict[str, ConversionJob] = {}
+        # 本节点从代理领取、正在执行的任务
+        self._leased: Dict[str, ConversionJob] = {}
+        self._lock = threading.Lock()
+        self._condition = threading.Condition(self._lock)
+        self._closed = False
+        self._threads: List[threading.Thread] = []
+        self._running = 0
+
+    @classmethod
+    def from_env(cls, handler: Callable[[Dict[str, Any]], Dict[str, Any]]) -> 'JobScheduler':
+        """根据环境变量创建调度器，默认并发数与工作进程数量一致"""
+        default_concurrency = max(1, get_int_env('MARKER_WORKER_POOL_SIZE', 1))
+        return cls(
+            handler,
+            max_concurrent=get_int_env('MAX_CONCURRENT_CONVERSIONS', default_concurrency),
+            result_ttl=get_float_env('JOB_RESULT_TTL', 3600),
+            default_timeout=get_float_env('REQUEST_TIMEOUT_SECONDS', 600),
+            priority_weights=get_json_env('JOB_PRIORITY_WEIGHTS', DEFAULT_PRIORITY_WEIGHTS),
+            tenant_weights=get_json_env('TENANT_WEIGHTS'),
+            tenant_max_concurrent=get_int_env('TENANT_MAX_CONCURRENT', 0),
+            tenant_quotas=get_json_env('TENANT_QUOTAS'),
+            max_queued=get_int_env('MAX_QUEUED_JOBS', 1000),
+            max_queue_wait=get_float_env('MAX_QUEUE_WAIT_SECONDS', 0),
+            seconds_per_page=get_float_env('QUEUE_SECONDS_PER_PAGE', 2.0),
+            default_job_pages=get_int_env('QUEUE_DEFAULT_JOB_PAGES', 10),
+            broker=create_broker(get_str_env('JOB_BROKER'), max_attempts=get_int_env('JOB_MAX_ATTEMPTS', 3)),
+            node_id=get_str_env('JOB_NODE_ID'),
+            lease_seconds=get_float_env('JOB_LEASE_SECONDS', 30),
+            poll_interval=get_float_env('JOB_BROKER_POLL_INTERVAL', 0.5),
+            execute=get_bool_env('JOB_BROKER_EXECUTE', True),
+        )
+
+    def start(self) -> None:
+        """启动执行任务的后台线程"""
+        with self._lock:
+            if self._threads:
+                return
+            self._closed = False
+            for index in range(self.max_concurrent):
+                thread = threading.Thread(
+                    target=self._worker_loop, name=f'conversion-job-{index}', daemon=True
+                )
+                thread.start()
+                self._threads.append(thread)
+            if self.broker is not None:
+                thread = threading.Thread(target=self._broker_loop, name='conversion-job-broker', daemon=True)
+                thread.start()
+                self._threads.append(thread)
+
+    def submit(
+        self,
+        payload: Dict[str, Any],
+        partial_results: bool = False,
+        timeout: Optional[float] = None,
+        priority: Optional[str] = None,
+        tenant: Optional[str] = None,
+        pages: Optional[int] = None,
+        local_only: bool = False,
+    ) -> ConversionJob:
+        """
+        提交任务，立即返回
+
+        Args:
+            payload: 任务参数
+            partial_results: 是否在进度事件中记录已完成页面的Markdown
+            timeout: 任务的截止时间（秒），未指定时使用default_timeout
+            priority: 优先级，未指定时为normal
+            tenant: 租户（API Key），未指定时为anonymous
+            pages: 文档页数，未知时按default_job_pages估计
+            local_only: 任务只能在本节点执行（例如依赖本地的上传文件或需要推送部分结果），只在配置了任务代理时有影响
+
+        Returns:
+            新创建的任务
+
+        Raises:
+            ValueError: 未知的优先级
+            QueueFullError: 排队的任务数或预计等待时间超过上限
+        """
+        priority = self._resolve_priority(priority)
+        self.start()
+        job = ConversionJob(
+            payload, partial_results=partial_results,
+            timeout=timeout if timeout is not None else self.default_timeout,
+            priority=priority, tenant=tenant or ANONYMOUS_TENANT, pages=pages or self.default_job_pages,
+        )
+        if self.broker is not None:
+            queued = self._submit_to_broker(job, local_only)
+        else:
+            with self._condition:
+                self._prune_expired()
+                self._admit(job, len(self._queue), self._queued_pages)
+                self._jobs[job.job_id] = job
+                self._queue.push(job, job.priority, job.tenant)
+                self._queued_pages[job.priority] = self._queued_pages.get(job.priority, 0) + job.pages
+                queued = len(self._queue)
+                self._condition.notify()
+        logger.info(f"任务已入队: {job.job_id}，优先级: {job.priority}，当前排队数: {queued}")
+        return job
+
+    def check_admission(self, priority: Optional[str] = None, tenant: Optional[str] = None) -> None:
+        """
+        按当前的排队情况检查是否会接受一个新任务，不入队
+
+        批量请求的文档在下载完成后才逐个提交，开始前据此整体返回429，而不是在流式响应中逐个被拒绝。
+
+        Args:
+            priority: 优先级，未指定时为normal
+            tenant: 租户（API Key），未指定时为anonymous
+
+        Raises:
+            ValueError: 未知的优先级
+            QueueFullError: 排队的任务数或预计等待时间超过上限
+        """
+        probe = ConversionJob(
+            {}, priority=self._resolve_priority(priority), tenant=tenant or ANONYMOUS_TENANT,
+            pages=self.default_job_pages,
+        )
+        if self.broker is not None:
+            stats = self.broker.stats()
+            with self._lock:
+                self._admit(probe, stats["queued"], stats["queued_pages"])
+        else:
+            with self._lock:
+                self._admit(probe, len(self._queue), self._queued_pages)
+
+    def _resolve_priority(self, priority: Optional[str]) -> str:
+        """返回任务的优先级，未指定时为normal"""
+        priority = priority or DEFAULT_PRIORITY
+        if priority not in self.priority_weights:
+            raise ValueError(f"未知的优先级: {priority}，可选: {', '.join(self.priority_weights)}")
+        return priority
+
+    def _submit_to_broker(self, job: ConversionJob, local_only: bool) -> int:
+        """把任务写入代理（准入控制按代理中所有节点的排队情况计算），返回写入前的排队数"""
+        stats = self.broker.stats()
+        with self._condition:
+            self._prune_expired()
+            self._admit(job, stats["queued"], stats["queued_pages"])
+            self._jobs[job.job_id] = job
+        timeout = job.deadline.timeout
+        try:
+            self.broker.enqueue(JobRecord(
+                job_id=job.job_id,
+                payload=job.payload,
+                priority=job.priority,
+                tenant=job.tenant,
+                pages=job.pages,
+                created_at=job.created_at,
+                deadline_at=job.created_at + timeout if timeout else None,
+                affinity=self.node_id if local_only else None,
+                request_id=job.request_id,
+            ))
+        except Exception:
+            with self._lock:
+                self._jobs.pop(job.job_id, None)
+            raise
+        with self._condition:
+            self._condition.notify()
+        return stats["queued"] + 1
+
+    def get(self, job_id: str) -> Optional[ConversionJob]:
+        """
+        根据任务ID获取任务，不存在或已过期时返回None
+
+        配置了任务代理时也可以查询其他节点提交的任务，返回的是当前状态的快照
+        """
+        with self._lock:
+            self._prune_expired()
+            job = self._jobs.get(job_id) or self._leased.get(job_id)
+        if job is not None or self.broker is None:
+            return job
+        record = self.broker.get(job_id)
+        if record is None:
+            return None
+        job = ConversionJob.from_record(record)
+        job.apply_record(record)
+        # 快照不会再更新，进度事件只在执行任务的节点上推送
+        job.progress.close()
+        return job
+
+    def cancel(self, job_id: str, reason: str = "客户端已断开连接") -> Optional[ConversionJob]:
+        """
+        取消任务：排队中的任务不再执行，正在执行的任务在下一次检查截止时间时中止并终止转换进程
+
+        Args:
+            job_id: 任务ID
+            reason: 取消原因，写入任务的错误信息
+
+        Returns:
+            被取消的任务，不存在时返回None
+        """
+        job = self.get(job_id)
+        if job is None or job.finished:
+            return job
+        logger.info(f"取消任务: {job_id}，原因: {reason}")
+        job.deadline.cancel(reason)
+        if self.broker is None:
+            # 排队中的任务立即移出队列并结束，不再占用排队配额
+            with self._lock:
+                removed = self._queue.remove(job, job.priority, job.tenant)
+                if removed:
+                    self._queued_pages[job.priority] -= job.pages
+            if removed:
+                self._finish_cancelled(job)
+        else:
+            # 排队中的任务在代理中直接结束，其他节点上正在执行的任务在下一次续约时中止
+            record = self.broker.cancel(job_id, reason)
+            with self._lock:
+                local = job_id in self._jobs or job_id in self._leased
+            if record is not None and not local:
+                job = ConversionJob.from_record(record)
+                job.apply_record(record)
+                job.progress.close()
+        return job
+
+    def _finish_cancelled(self, job: ConversionJob) -> None:
+        """结束还未开始执行就被取消的任务"""
+        error = deadline.RequestCancelled(f"请求已取消: {job.deadline.cancel_reason}", 'queue')
+        job.status = JobStatus.CANCELLED
+        job.error = str(error)
+        job.finished_at = time.time()
+        job.progress.emit("error", {"detail": job.error, "status_code": error.status_code})
+        job.progress.close()
+        job.future.set_exception(error)
+
+    def stats(self) -> Dict[str, Any]:
+        """返回调度器当前的排队和执行数量"""
+        if self.broker is not None:
+            broker_stats = self.broker.stats()
+            queued, queued_by_priority, queued_pages = (
+                broker_stats["queued"], broker_stats["queued_by_priority"], broker_stats["queued_pages"]
+            )
+        with self._lock:
+            if self.broker is None:
+                queued, queued_by_priority, queued_pages = len(self._queue), self._queue.counts(), self._queued_pages
+            stats = {
+                "queued": queued,
+                "running": self._running,
+                "max_concurrent": self.max_concurrent,
+                "queued_by_priority": queued_by_priority,
+                "queued_pages": sum(queued_pages.values()),
+                "seconds_per_page": round(self._seconds_per_page, 3),
+                "estimated_wait": round(self._estimate_wait(min(self.priority_weights.values()), queued_pages), 3),
+            }
+        if self.broker is not None:
+            stats["broker"] = {"node_id": self.node_id, "running": broker_stats["running"]}
+        return stats
+
+    def shutdown(self) -> None:
+        """停止后台线程，已入队但未开始的任务不再执行"""
+        with self._condition:
+            self._closed = True
+            threads = list(self._threads)
+            self._threads.clear()
+            self._condition.notify_all()
+        for thread in threads:
+            thread.join(timeout=1)
+
+    def _admit(self, job: ConversionJob, queued: int, queued_pages: Dict[str, int]) -> None:
+        """
+        准入控制（调用方需持有锁）
+
+        Args:
+            job: 新任务
+            queued: 当前排队的任务数
+            queued_pages: 各优先级排队的页数
+
+        Raises:
+            QueueFullError: 排队的任务数或预计等待时间超过上限
+        """
+        if self.max_queued and queued >= self.max_queued:
+            # 大约一个排队任务完成所需的时间
+            retry_after = sum(queued_pages.values()) / queued * self._seconds_per_page / self.max_concurrent
+            self._reject(job, "queue_depth", f"排队的任务过多（{queued}个），请稍后重试", retry_after)
+        if self.max_queue_wait:
+            wait = self._estimate_wait(self.priority_weights[job.priority], queued_pages)
+            if wait > self.max_queue_wait:
+                self._reject(
+                    job, "queue_wait", f"预计排队等待{wait:.0f}秒，超过上限{self.max_queue_wait:g}秒，请稍后重试",
+                    wait - self.max_queue_wait,
+                )
+
+    def _reject(self, job: ConversionJob, reason: str, message: str, retry_after: float) -> None:
+        """记录并抛出拒绝新任务的异常"""
+        metrics.JOBS_REJECTED.inc(reason=reason)
+        logger.warning(f"拒绝新任务: {message}，租户: {job.tenant}，优先级: {job.priority}")
+        raise QueueFullError(message, retry_after=max(1, math.ceil(retry_after)))
+
+    def _estimate_wait(self, weight: float, queued_pages: Dict[str, int]) -> float:
+        """
+        估计新任务的排队等待时间（调用方需持有锁）
+
+        只计算权重不低于该任务优先级的排队页数：低优先级的任务不会挡在它前面
+        """
+        pages = sum(
+            count for priority, count in queued_pages.items() if self.priority_weights.get(priority, 0) >= weight
+        )
+        return pages * self._seconds_per_page / self.max_concurrent
+
+    def _tenant_limit(self, tenant: str) -> int:
+        """返回租户的并发上限，0表示不限制"""
+        return self.tenant_quotas.get(tenant, self.tenant_max_concurrent)
+
+    def _has_capacity(self, tenant: str) -> bool:
+        """租户是否还能开始新任务（调用方需持有锁）"""
+        limit = self._tenant_limit(tenant)
+        return limit <= 0 or self._tenant_running.get(tenant, 0) < limit
+
+    def _next_job(self) -> Optional[ConversionJob]:
+        """等待并取出下一个可以执行的任务，调度器关闭时返回None"""
+        if self.broker is not None:
+            return self._next_leased_job()
+        with self._condition:
+            while True:
+                if self._closed:
+                    return None
+                job = self._queue.pop(self._has_capacity)
+                if job is not None:
+                    self._queued_pages[job.priority] -= job.pages
+                    self._mark_running(job)
+                    return job
+                self._condition.wait()
+
+    def _next_leased_job(self) -> Optional[ConversionJob]:
+        """从代理领取下一个任务，调度器关闭时返回None"""
+        while True:
+            with self._condition:
+                if self._closed:
+                    return None
+            job = self._lease_job()
+            if job is not None:
+                return job
+            with self._condition:
+                if self._closed:
+                    return None
+                # 其他节点提交的任务不会唤醒本节点，需要定期检查
+                self._condition.wait(self.poll_interval)
+
+    def _mark_running(self, job: ConversionJob) -> None:
+        """把任务计入执行数量和租户的并发配额（调用方需持有锁）"""
+        self._tenant_running[job.tenant] = self._tenant_running.get(job.tenant, 0) + 1
+        self._running += 1
+
+    def _lease_job(self) -> Optional[ConversionJob]:
+        """
+        从代理领取下一个任务，租户的并发配额按所有节点上正在执行的任务计算
+
+        领取可能需要等待数据库的写锁，因此在调度器的锁之外进行，领取成功后再持有锁登记任务，
+        等待期间提交、查询任务不受影响。
+        """
+        try:
+            record = self.broker.lease(
+                self.node_id,
+                self.lease_seconds,
+                FairQueue(self.priority_weights, self.tenant_weights),
+                self._tenant_limit,
+                affinity_only=not self.execute,
+            )
+        except Exception as e:
+            logger.error(f"从任务代理领取任务失败: {e}")
+            return None
+        if record is None:
+            return None
+        with self._lock:
+            # 本节点提交的任务直接使用原来的对象，等待结果的请求和进度订阅者不受影响
+            job = self._jobs.get(record.job_id) or ConversionJob.from_record(record)
+            self._leased[job.job_id] = job
+            self._mark_running(job)
+        if record.attempts > 1:
+            logger.info(f"重新执行节点失联时中断的任务: {job.job_id}，第{record.attempts}次")
+        return job
+
+    def _record_pages(self, job: ConversionJob, result: Dict[str, Any]) -> None:
+        """按已完成任务的实际耗时更新每页耗时的估计（指数移动平均）"""
+        pages = result.get("pages")
+        if not pages or job.started_at is None or job.finished_at is None:
+            return
+        observed = (job.finished_at - job.started_at) / pages
+        with self._lock:
+            self._seconds_per_page = 0.8 * self._seconds_per_page + 0.2 * observed
+
+    def _prune_expired(self) -> None:
+        """清理超过保留时间的已结束任务（调用方需持有锁）"""
+        now = time.time()
+        expired = [
+            job_id for job_id, job in self._jobs.items()
+            if job.finished and job.finished_at and now - job.finished_at > self.result_ttl
+        ]
+        for job_id in expired:
+            del self._jobs[job_id]
+
+    def _worker_loop(self) -> None:
+        """后台线程：按优先级和租户公平地取出任务并执行"""
+        while True:
+            job = self._next_job()
+            if job is None:
+                break
+            # 任务执行期间的日志带有提交任务的请求ID和任务ID
+            with bind_context(request_id=job.request_id, job_id=job.job_id):
+                self._run_job(job)
+
+    def _run_job(self, job: ConversionJob) -> None:
+        """执行单个任务并记录结果（调用方已计入执行数量）"""
+        job.status = JobStatus.RUNNING
+        job.started_at = time.time()
+        metrics.JOB_QUEUE_SECONDS.observe(job.started_at - job.created_at, priority=job.priority)
+        job.future.set_running_or_notify_cancel()
+        job.progress.emit("stage", {"stage": "running"})
+        status_code = None
+        try:
+            # 排队期间已经超时或被取消的任务直接结束
+            job.deadline.check('queue')
+            with bind(job.progress), deadline.bind(job.deadline):
+                result = self.handler(job.payload)
+        except Exception as e:
+            job.error = str(e)
+            if isinstance(e, deadline.DeadlineExceeded):
+                job.status = JobStatus.TIMED_OUT
+            elif isinstance(e, deadline.RequestCancelled):
+                job.status = JobStatus.CANCELLED
+            else:
+                job.status = JobStatus.FAILED
+            job.finished_at = time.time()
+            status_code = getattr(e, 'status_code', 500)
+            job.progress.emit("error", {"detail": str(e), "status_code": status_code})
+            job.progress.close()
+            job.future.set_exception(e)
+            metrics.JOB_SECONDS.observe(job.finished_at - job.started_at, status=job.status)
+            logger.warning(f"任务执行失败: {job.job_id}，状态: {job.status}，错误: {e}")
+        else:
+            job.result = result
+            job.status = JobStatus.SUCCEEDED
+            job.finished_at = time.time()
+            job.progress.emit("result", {"file_url": result.get("file_url"), "files": result.get("files_dict")})
+            job.progress.close()
+            job.future.set_result(result)
+            metrics.JOB_SECONDS.observe(job.finished_at - job.started_at, status=JobStatus.SUCCEEDED)
+            self._record_pages(job, result)
+            logger.info(f"任务执行完成: {job.job_id}，耗时: {job.finished_at - job.started_at:.2f}秒")
+        finally:
+            if self.broker is not None:
+                self._complete_in_broker(job, status_code)
+            with self._condition:
+                self._running -= 1
+                self._tenant_running[job.tenant] -= 1
+                if not self._tenant_running[job.tenant]:
+                    del self._tenant_running[job.tenant]
+                # 租户释放了并发配额，之前被跳过的任务可能可以执行了
+                self._condition.notify_all()
+
+    def _complete_in_broker(self, job: ConversionJob, status_code: Optional[int]) -> None:
+        """把任务结果写入代理，供其他节点上等待的请求和查询使用"""
+        try:
+            if not self.broker.complete(job.job_id, self.node_id, job.status, job.result, job.error, status_code):
+                logger.warning(f"任务的租约已失效，结果未写入任务代理: {job.job_id}")
+        except Exception as e:
+            logger.error(f"写入任务结果失败: {job.job_id}，错误: {e}")
+        finally:
+            with self._lock:
+                self._leased.pop(job.job_id, None)
+
+    def _broker_loop(self) -> None:
+        """后台线程：为正在执行的任务续约，同步其他节点上的取消请求和任务结果"""
+        last_heartbeat = 0.0
+        while True:
+            with self._condition:
+                if self._closed:
+                    return
+            try:
+                if time.monotonic() - last_heartbeat >= self.lease_seconds / 3:
+                    last_heartbeat = time.monotonic()
+                    self._heartbeat()
+                    self.broker.prune(self.result_ttl)
+                self._sync_remote_jobs()
+            except Exception as e:
+                logger.error(f"与任务代理同步失败: {e}")
+            with self._condition:
+                if self._closed:
+                    return
+                self._condition.wait(self.poll_interval)
+
+    def _heartbeat(self) -> None:
+        """续约本节点的存活状态和正在执行的任务，其他节点发出的取消请求在这里生效"""
+        with self._lock:
+            leased = dict(self._leased)
+        # 没有正在执行的任务时也续约节点的存活状态，指定由本节点执行的排队任务才不会被当作失联节点的任务
+        held = self.broker.heartbeat(self.node_id, leased, self.lease_seconds)
+        for job_id, job in leased.items():
+            if job.finished:
+                continue
+            if job_id not in held:
+                # 续约失败（例如本节点长时间无响应），任务可能已经由其他节点重新执行
+                logger.warning(f"任务的租约已失效，停止执行: {job_id}")
+                job.deadline.cancel("任务的租约已失效")
+            elif held[job_id] and not job.deadline.cancelled:
+                logger.info(f"收到其他节点的取消请求: {job_id}，原因: {held[job_id]}")
+                job.deadline.cancel(held[job_id])
+
+    def _sync_remote_jobs(self) -> None:
+        """本节点提交、由其他节点执行的任务：同步状态，结束时设置结果"""
+        with self._lock:
+            pending: List[Tuple[str, ConversionJob]] = [
+                (job_id, job) for job_id, job in self._jobs.items()
+                if not job.finished and job_id not in self._leased
+            ]
+        if not pending:
+            return
+        records = self.broker.get_many(job_id for job_id, _ in pending)
+        for job_id, job in pending:
+            record = records.get(job_id)
+            if record is None or record.owner == self.node_id and record.status == JobStatus.RUNNING:
+                continue
+            job.apply_record(record)
@@ -0,0 +1,112 @@
+"""
+结构化日志与请求ID关联
+
+每个HTTP请求在中间件中分配请求ID（或沿用客户端传入的X-Request-ID），保存在contextvars中；
+任务和流水线在提交时记录请求ID，在后台线程中执行时重新绑定，因此同一个请求在各线程中输出的日志
+都带有相同的request_id和job_id。LOG_FORMAT=json时每行输出一个JSON对象，便于日志系统按字段检索。
+"""
+import contextvars
+import json
+import logging
+import sys
+import time
+from concurrent.futures import Executor, Future
+from contextlib import contextmanager
+from typing import Any, Callable, Iterator, Optional
+
+from app.config import get_str_env
+
+_request_id: contextvars.ContextVar[Optional[str]] = contextvars.ContextVar('request_id', default=None)
+_job_id: contextvars.ContextVar[Optional[str]] = contextvars.ContextVar('job_id', default=None)
+
+# LogRecord自带的属性，其余属性视为通过extra传入的结构化字段
+_RECORD_ATTRIBUTES = set(vars(logging.LogRecord('', 0, '', 0, '', (), None))) | {'message', 'asctime'}
+
+
+def get_request_id() -> Optional[str]:
+    """返回当前上下文的请求ID"""
+    return _request_id.get()
+
+
+def get_job_id() -> Optional[str]:
+    """返回当前上下文的任务ID"""
+    return _job_id.get()
+
+
+@contextmanager
+def bind_context(request_id: Optional[str] = None, job_id: Optional[str] = None) -> Iterator[None]:
+    """
+    在当前上下文绑定请求ID和任务ID，退出时恢复
+
+    Args:
+        request_id: 请求ID，为None时保持不变
+        job_id: 任务ID，为None时保持不变
+    """
+    tokens = []
+    if request_id is not None:
+        tokens.append((_request_id, _request_id.set(request_id)))
+    if job_id is not None:
+        tokens.append((_job_id, _job_id.set(job_id)))
+    try:
+        yield
+    finally:
+        for variable, token in reversed(tokens):
+            variable.reset(token)
+
+
+def submit_in_context(executor: Executor, fn: Callable[..., Any], *args: Any) -> Future:
+    """把任务提交到线程池，并在当前上下文（请求ID、任务ID）的副本中执行"""
+    return executor.submit(contextvars.copy_context().run, fn, *args)
+
+
+class ContextFilter(logging.Filter):
+    """把当前上下文的请求ID和任务ID写入日志记录"""
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        record.request_id = _request_id.get()
+        record.job_id = _job_id.get()
+        return True
+
+
+class JsonFormatter(logging.Formatter):
+    """每条日志输出为一行JSON，包含时间、级别、模块、请求ID、任务ID以及通过extra传入的字段"""
+
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            'ts': time.strftime('%Y-%m-%dT%H:%M:%S', time.localtime(record.created)) + f'.{int(record.msecs):03d}',
+            'level': record.levelname,
+            'logger': record.name,
+            'message': record.getMessage(),
+            'request_id': getattr(record, 'request_id', None),
+            'job_id': getattr(record, 'job_id', None),
+        }
+        for name, value in vars(record).items():
+            if name not in _RECORD_ATTRIBUTES and name not in entry:
+                entry[name] = value
+        if record.exc_info:
+            entry['exc_info'] = self.formatException(record.exc_info)
+        return json.dumps(entry, ensure_ascii=False, default=str)
+
+
+def configure_logging() -> None:
+    """
+    根据环境变量配置app包的日志输出（重复调用时只配置一次）
+
+    LOG_FORMAT为json（默认）或text，LOG_LEVEL为日志级别（默认INFO）。
+    """
+    app_logger = logging.getLogger('app')
+    if any(isinstance(handler_filter, ContextFilter) for handler in app_logger.handlers
+           for handler_filter in handler.filters):
+        return
+    handler = logging.StreamHandler(sys.stdout)
+    handler.addFilter(ContextFilter())
+    if get_str_env('LOG_FORMAT', 'json').lower() == 'text':
+        handler.setFormatter(logging.Formatter(
+            '%(asctime)s %(levelname)s [%(request_id)s %(job_id)s] %(name)s: %(message)s'
+        ))
+    else:
+        handler.setFormatter(JsonFormatter())
+    app_logger.addHandler(handler)
+    app_logger.setLevel(get_str_env('LOG_LEVEL', 'INFO').upper())
+    # 不再传递给根logger，避免与uvicorn的日志配置重复输出
+    app_logger.propagate = False
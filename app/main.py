@@ -1,13 +1,38 @@
-from fastapi import FastAPI
+import uuid
+from contextlib import asynccontextmanager
+
+from dotenv import load_dotenv
+from fastapi import FastAPI, Request
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import Response
+
+from app.logs import bind_context, configure_logging
+
+# 先加载.env，各模块导入时读取的配置（包括日志格式）都以它为准；再配置日志，初始化阶段的日志也使用统一的格式
+load_dotenv()
+configure_logging()
+
+from app import api, metrics  # noqa: E402
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """
+    应用生命周期：启动时创建任务调度器（配置了任务代理时立即开始领取其他节点提交的任务），
+    并在后台预热转换服务；退出时停止任务调度并关闭常驻的marker工作进程
+    """
+    api.get_job_scheduler().start()
+    api.warmup.start()
+    yield
+    api.shutdown()
 
-from app.api import router as api_router
 
 # 创建FastAPI应用
 app = FastAPI(
     title="PDF to Markdown API",
     description="使用marker库将PDF转换为Markdown的API服务",
-    version="0.1.0"
+    version="0.1.0",
+    lifespan=lifespan
 )
 
 # 添加CORS中间件
@@ -17,10 +42,22 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["X-Request-ID"],
 )
 
+
+@app.middleware("http")
+async def request_id_middleware(request: Request, call_next):
+    """为每个请求分配请求ID（沿用客户端传入的X-Request-ID），用于关联该请求在各线程中的日志"""
+    request_id = request.headers.get("x-request-id") or uuid.uuid4().hex
+    with bind_context(request_id=request_id):
+        response = await call_next(request)
+    response.headers["X-Request-ID"] = request_id
+    return response
+
+
 # 注册路由
-app.include_router(api_router)
+app.include_router(api.router)
 
 
 @app.get("/", tags=["root"])
@@ -30,4 +67,10 @@ async def root():
         "message": "欢迎使用PDF转Markdown API",
         "docs_url": "/docs",
         "redoc_url": "/redoc"
-    } 
\ No newline at end of file
+    }
+
+
+@app.get("/metrics", include_in_schema=False)
+async def get_metrics():
+    """Prometheus格式的运行指标"""
+    return Response(content=metrics.REGISTRY.render(), media_type=metrics.CONTENT_TYPE)
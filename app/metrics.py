@@ -0,0 +1,280 @@
+"""
+Prometheus格式的运行指标
+
+服务只需要计数器、仪表和直方图三种指标以及文本格式的输出，这里直接实现，不引入prometheus_client依赖。
+各阶段的耗时通过stage_timer()记录到同一个按stage标签区分的直方图中，阶段抛出异常时同时累加失败次数。
+"""
+import logging
+import math
+import threading
+import time
+from contextlib import contextmanager
+from typing import Callable, Dict, Iterator, List, Optional, Sequence, Tuple
+
+logger = logging.getLogger(__name__)
+
+# /metrics接口返回的Content-Type
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+# 默认的耗时分桶（秒），覆盖从毫秒级的缓存查询到数分钟的大文档转换
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600)
+
+
+def _format_value(value: float) -> str:
+    """按Prometheus文本格式输出数值"""
+    if math.isinf(value):
+        return "+Inf" if value > 0 else "-Inf"
+    if value == int(value) and abs(value) < 1e15:
+        return str(int(value))
+    return repr(float(value))
+
+
+def _format_labels(labels: Sequence[Tuple[str, str]]) -> str:
+    """输出标签部分，例如 {stage="convert"}"""
+    if not labels:
+        return ""
+    escaped = []
+    for name, value in labels:
+        value = str(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+        escaped.append(f'{name}="{value}"')
+    return "{" + ",".join(escaped) + "}"
+
+
+class _Metric:
+    """指标的公共部分：名称、说明、标签名以及按标签值保存的样本"""
+
+    kind = ""
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+
+    def _key(self, labels: Dict[str, str]) -> Tuple[str, ...]:
+        """把标签参数转换为按标签名排序的取值元组"""
+        if set(labels) != set(self.labelnames):
+            raise ValueError(f"指标{self.name}的标签必须为: {', '.join(self.labelnames)}")
+        return tuple(str(labels[name]) for name in self.labelnames)
+
+    def render(self) -> List[str]:
+        """输出该指标的文本格式行"""
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+        lines.extend(self._samples())
+        return lines
+
+    def _samples(self) -> List[str]:
+        raise NotImplementedError
+
+
+class Counter(_Metric):
+    """只增不减的计数器"""
+
+    kind = "counter"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        super().__init__(name, documentation, labelnames)
+        self._values: Dict[Tuple[str, ...], float] = {}
+
+    def inc(self, amount: float = 1, **labels: str) -> None:
+        """累加计数，amount不能为负数"""
+        if amount < 0:
+            raise ValueError("计数器只能增加")
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.0) + amount
+
+    def value(self, **labels: str) -> float:
+        """返回当前计数"""
+        with self._lock:
+            return self._values.get(self._key(labels), 0.0)
+
+    def _samples(self) -> List[str]:
+        with self._lock:
+            values = sorted(self._values.items())
+        return [
+            f"{self.name}{_format_labels(list(zip(self.labelnames, key)))} {_format_value(value)}"
+            for key, value in values
+        ]
+
+
+class Gauge(_Metric):
+    """可增可减的仪表，也可以在输出时通过回调函数读取当前值（例如队列长度）"""
+
+    kind = "gauge"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        super().__init__(name, documentation, labelnames)
+        self._values: Dict[Tuple[str, ...], float] = {}
+        self._function: Optional[Callable[[], float]] = None
+
+    def set(self, value: float, **labels: str) -> None:
+        """设置当前值"""
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = value
+
+    def inc(self, amount: float = 1, **labels: str) -> None:
+        """增加（amount为负数时减少）当前值"""
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.0) + amount
+
+    def set_function(self, function: Callable[[], float]) -> None:
+        """输出时调用function读取当前值，只适用于没有标签的仪表"""
+        if self.labelnames:
+            raise ValueError(f"带标签的指标{self.name}不能使用回调函数")
+        self._function = function
+
+    def value(self, **labels: str) -> float:
+        """返回当前值"""
+        if self._function is not None:
+            return float(self._function())
+        with self._lock:
+            return self._values.get(self._key(labels), 0.0)
+
+    def _samples(self) -> List[str]:
+        if self._function is not None:
+            try:
+                return [f"{self.name} {_format_value(float(self._function()))}"]
+            except Exception as e:
+                logger.warning(f"读取指标{self.name}失败: {e}")
+                return []
+        with self._lock:
+            values = sorted(self._values.items())
+        return [
+            f"{self.name}{_format_labels(list(zip(self.labelnames, key)))} {_format_value(value)}"
+            for key, value in values
+        ]
+
+
+class Histogram(_Metric):
+    """按分桶累计观测值的直方图，用于记录耗时分布"""
+
+    kind = "histogram"
+
+    def __init__(
+        self, name: str, documentation: str, labelnames: Sequence[str] = (), buckets: Sequence[float] = DEFAULT_BUCKETS
+    ):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+        # 每组标签对应 (各分桶的计数, 总和, 总数)
+        self._values: Dict[Tuple[str, ...], Tuple[List[int], float, int]] = {}
+
+    def observe(self, value: float, **labels: str) -> None:
+        """记录一个观测值"""
+        key = self._key(labels)
+        with self._lock:
+            counts, total, count = self._values.get(key) or ([0] * len(self.buckets), 0.0, 0)
+            for index, bound in enumerate(self.buckets):
+                if value <= bound:
+                    counts[index] += 1
+                    break
+            self._values[key] = (counts, total + value, count + 1)
+
+    def count(self, **labels: str) -> int:
+        """返回观测次数"""
+        with self._lock:
+            entry = self._values.get(self._key(labels))
+        return entry[2] if entry else 0
+
+    def _samples(self) -> List[str]:
+        with self._lock:
+            values = sorted((key, (list(counts), total, count)) for key, (counts, total, count) in self._values.items())
+        lines = []
+        for key, (counts, total, count) in values:
+            labels = list(zip(self.labelnames, key))
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets, counts):
+                cumulative += bucket_count
+                bucket_labels = _format_labels(labels + [("le", _format_value(bound))])
+                lines.append(f"{self.name}_bucket{bucket_labels} {cumulative}")
+            lines.append(f"{self.name}_bucket{_format_labels(labels + [('le', '+Inf')])} {count}")
+            lines.append(f"{self.name}_sum{_format_labels(labels)} {_format_value(total)}")
+            lines.append(f"{self.name}_count{_format_labels(labels)} {count}")
+        return lines
+
+
+class Registry:
+    """指标注册表，按注册顺序输出所有指标"""
+
+    def __init__(self):
+        self._metrics: Dict[str, _Metric] = {}
+        self._lock = threading.Lock()
+
+    def register(self, metric: _Metric) -> _Metric:
+        """注册指标，同名指标只能注册一次"""
+        with self._lock:
+            if metric.name in self._metrics:
+                raise ValueError(f"指标已注册: {metric.name}")
+            self._metrics[metric.name] = metric
+        return metric
+
+    def render(self) -> str:
+        """输出Prometheus文本格式"""
+        with self._lock:
+            metrics = list(self._metrics.values())
+        lines: List[str] = []
+        for metric in metrics:
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = Registry()
+
+STAGE_SECONDS = REGISTRY.register(Histogram(
+    "pdf2md_stage_duration_seconds", "各转换阶段的耗时（秒）", ["stage"]
+))
+STAGE_FAILURES = REGISTRY.register(Counter(
+    "pdf2md_stage_failures_total", "各转换阶段的失败次数", ["stage"]
+))
+JOB_SECONDS = REGISTRY.register(Histogram(
+    "pdf2md_job_duration_seconds", "转换任务从开始执行到结束的耗时（秒）", ["status"]
+))
+JOB_QUEUE_SECONDS = REGISTRY.register(Histogram(
+    "pdf2md_job_queue_seconds", "转换任务在队列中等待的时间（秒）", ["priority"]
+))
+JOBS_QUEUED = REGISTRY.register(Gauge("pdf2md_jobs_queued", "排队等待执行的转换任务数"))
+JOBS_RUNNING = REGISTRY.register(Gauge("pdf2md_jobs_running", "正在执行的转换任务数"))
+WORKER_RECYCLES = REGISTRY.register(Counter(
+    "pdf2md_worker_recycles_total", "marker工作进程的回收和重启次数", ["reason"]
+))
+WORKER_JOB_RETRIES = REGISTRY.register(Counter(
+    "pdf2md_worker_job_retries_total", "工作进程意外退出后在新进程上重试的任务数"
+))
+WORKER_MAX_RSS = REGISTRY.register(Gauge(
+    "pdf2md_worker_max_rss_bytes", "看门狗最近一次检查时工作进程（含子进程）RSS的最大值"
+))
+JOBS_REJECTED = REGISTRY.register(Counter(
+    "pdf2md_jobs_rejected_total", "因排队过多或预计等待过长而拒绝的任务数", ["reason"]
+))
+DOWNLOADED_BYTES = REGISTRY.register(Counter("pdf2md_downloaded_bytes_total", "下载的文档字节数"))
+PAGES_CONVERTED = REGISTRY.register(Counter("pdf2md_pages_converted_total", "转换的页数", ["route"]))
+IMAGES_UPLOADED = REGISTRY.register(Counter("pdf2md_images_uploaded_total", "上传到COS的图片数（不含去重跳过的图片）"))
+COS_REQUESTS = REGISTRY.register(Counter(
+    "pdf2md_cos_requests_total", "COS请求次数（每次重试单独计数）", ["operation", "status"]
+))
+COS_REQUEST_SECONDS = REGISTRY.register(Histogram(
+    "pdf2md_cos_request_duration_seconds", "单次COS请求的耗时（秒）", ["operation"]
+))
+COS_UPLOADED_BYTES = REGISTRY.register(Counter("pdf2md_cos_uploaded_bytes_total", "上传到COS的字节数"))
+
+
+@contextmanager
+def stage_timer(stage: str) -> Iterator[None]:
+    """
+    记录一个阶段的耗时，阶段抛出异常时累加该阶段的失败次数
+
+    Args:
+        stage: 阶段名称，作为stage标签
+    """
+    started = time.perf_counter()
+    try:
+        yield
+    except BaseException:
+        STAGE_FAILURES.inc(stage=stage)
+        raise
+    finally:
+        elapsed = time.perf_counter() - started
+        STAGE_SECONDS.observe(elapsed, stage=stage)
+        logger.debug(f"阶段{stage}耗时{elapsed:.3f}秒", extra={'stage': stage, 'duration': round(elapsed, 6)})
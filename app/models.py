@@ -1,17 +1,76 @@
-from typing import Dict, Optional
-from pydantic import BaseModel, HttpUrl
+from typing import Any, Dict, List, Literal, Optional
+from pydantic import BaseModel, Field, HttpUrl
 
 
-class ConversionRequest(BaseModel):
+class ConversionOptions(BaseModel):
+    """
+    转换选项，均为可选项，未指定时使用服务端配置
+    """
+    shard_pages: Optional[int] = Field(
+        default=None,
+        ge=0,
+        description="按页拆分大文档并行转换时每个分片的页数，0表示不拆分，未指定时使用PDF_SHARD_PAGES"
+    )
+
+    route: Optional[Literal["auto", "marker", "text"]] = Field(
+        default=None,
+        description="转换路径：auto按文本层自动选择，marker强制使用marker模型，text强制使用文本层快速路径；未指定时使用CONVERSION_ROUTE"
+    )
+
+    timeout: Optional[float] = Field(
+        default=None,
+        gt=0,
+        description="本次请求的截止时间（秒，包含排队、下载、转换和上传），超时返回504；未指定时使用REQUEST_TIMEOUT_SECONDS"
+    )
+
+    priority: Optional[Literal["high", "normal", "low"]] = Field(
+        default=None,
+        description="调度优先级：交互式请求使用high，批量回填使用low；未指定时为normal"
+    )
+
+    def cache_fingerprint(self) -> Dict[str, Any]:
+        """返回会影响转换结果的选项，作为缓存键和请求合并键的一部分"""
+        fingerprint: Dict[str, Any] = {}
+        if self.route is not None:
+            fingerprint["route"] = self.route
+        return fingerprint
+
+
+class ConversionRequest(ConversionOptions):
     """
     PDF转Markdown的请求模型
     """
     pdf_url: HttpUrl
+
+    def to_options(self) -> ConversionOptions:
+        """提取请求中的转换选项"""
+        return ConversionOptions(**self.model_dump(exclude={"pdf_url"}))
     
     class Config:
         json_schema_extra = {
             "example": {
-                "pdf_url": "https://example.com/sample.pdf"
+                "pdf_url": "https://example.com/sample.pdf",
+                "shard_pages": 50,
+                "route": "auto"
+            }
+        }
+
+
+class BatchConversionRequest(ConversionOptions):
+    """
+    批量转换的请求模型，转换选项应用到每个文档
+    """
+    pdf_urls: List[HttpUrl] = Field(min_length=1)
+
+    def to_options(self) -> ConversionOptions:
+        """提取请求中的转换选项"""
+        return ConversionOptions(**self.model_dump(exclude={"pdf_urls"}))
+
+    class Config:
+        json_schema_extra = {
+            "example": {
+                "pdf_urls": ["https://example.com/a.pdf", "https://example.com/b.pdf"],
+                "route": "auto"
             }
         }
 
@@ -21,10 +80,83 @@ class ConversionResponse(BaseModel):
     PDF转Markdown的响应模型
     """
     file_url: str
+    route: Optional[str] = Field(
+        default=None,
+        description="本次使用的转换路径：marker、text（文本层快速路径）、docx/html快速路径，命中转换缓存时为cache"
+    )
     
     class Config:
         json_schema_extra = {
             "example": {
-                "file_url": "https://example-bucket-1250000000.cos.ap-guangzhou.myqcloud.com/tmp/example_12345678/example.md"
+                "file_url": "https://example-bucket-1250000000.cos.ap-guangzhou.myqcloud.com/tmp/example_12345678/example.md",
+                "route": "marker"
             }
-        } 
\ No newline at end of file
+        } 
+
+
+class JobCreatedResponse(BaseModel):
+    """
+    创建异步转换任务的响应模型
+    """
+    job_id: str
+    status: str
+
+    class Config:
+        json_schema_extra = {
+            "example": {
+                "job_id": "3f2b6c0e9a7d4e1f8b5c2a9d6e3f0a1b",
+                "status": "queued"
+            }
+        }
+
+
+class JobStatusResponse(BaseModel):
+    """
+    异步转换任务状态的响应模型
+    """
+    job_id: str
+    status: str
+    priority: Optional[str] = None
+    created_at: float
+    started_at: Optional[float] = None
+    finished_at: Optional[float] = None
+    file_url: Optional[str] = None
+    files: Optional[Dict[str, str]] = None
+    route: Optional[str] = Field(
+        default=None,
+        description="本次使用的转换路径：marker、text（文本层快速路径）、docx/html快速路径，命中转换缓存时为cache"
+    )
+    page_cache: Optional[Dict[str, Any]] = Field(
+        default=None,
+        description="本次转换的页面缓存命中情况：pages、hits、misses、hit_rate，未使用页面缓存时为空"
+    )
+    image_dedup: Optional[Dict[str, Any]] = Field(
+        default=None,
+        description="本次转换的图片去重情况：images、deduplicated、deduplicated_bytes，未启用去重图片存储时为空"
+    )
+    image_transcode: Optional[Dict[str, Any]] = Field(
+        default=None,
+        description="本次转换的图片转码情况：images、transcoded、original_bytes、output_bytes、saved_bytes，未启用转码时为空"
+    )
+    error: Optional[str] = None
+
+    class Config:
+        json_schema_extra = {
+            "example": {
+                "job_id": "3f2b6c0e9a7d4e1f8b5c2a9d6e3f0a1b",
+                "status": "succeeded",
+                "created_at": 1628123456.0,
+                "started_at": 1628123456.1,
+                "finished_at": 1628123470.5,
+                "file_url": "https://example-bucket-1250000000.cos.ap-guangzhou.myqcloud.com/tmp/example_12345678/example.md",
+                "files": {
+                    "example.md": "https://example-bucket-1250000000.cos.ap-guangzhou.myqcloud.com/tmp/example_12345678/example.md"
+                },
+                "route": "marker",
+                "page_cache": {"pages": 300, "hits": 299, "misses": 1, "hit_rate": 0.9967},
+                "image_dedup": {"images": 12, "deduplicated": 10, "deduplicated_bytes": 482133},
+                "image_transcode": {"images": 12, "transcoded": 9, "original_bytes": 5242880,
+                                    "output_bytes": 917504, "saved_bytes": 4325376},
+                "error": None
+            }
+        }
@@ -0,0 +1,357 @@
+"""
+DOCX和HTML文档的快速转换路径
+
+结构化的办公文档不需要版面分析和OCR模型：DOCX通过mammoth直接转换为Markdown，
+HTML通过标准库的HTML解析器转换。内嵌图片提取到转换结果中，与PDF转换一样上传到COS并改写引用。
+"""
+import base64
+import binascii
+import logging
+import mimetypes
+import re
+import zipfile
+from html.parser import HTMLParser
+from typing import Dict, List, Optional, Tuple
+
+from app.worker_pool import ConvertedDocument
+
+logger = logging.getLogger(__name__)
+
+# 可以走快速路径的文档类型
+OFFICE_DOCUMENT_TYPES = ('docx', 'html')
+
+# 按扩展名识别文档类型，文件头无法判断时使用
+EXTENSION_TYPES = {
+    '.pdf': 'pdf',
+    '.docx': 'docx',
+    '.html': 'html',
+    '.htm': 'html',
+}
+
+# 图片MIME类型对应的扩展名，mimetypes给出的扩展名不常用时在这里覆盖
+IMAGE_EXTENSION_OVERRIDES = {
+    'image/jpeg': '.jpeg',
+    'image/x-emf': '.emf',
+    'image/x-wmf': '.wmf',
+}
+
+# 转换为Markdown时丢弃内容的HTML标签
+SKIPPED_HTML_TAGS = {'script', 'style', 'head', 'title', 'noscript', 'template', 'svg'}
+
+# 块级HTML标签，开始和结束时都另起一段
+BLOCK_HTML_TAGS = {
+    'p', 'div', 'section', 'article', 'header', 'footer', 'main', 'aside', 'nav',
+    'figure', 'figcaption', 'table', 'ul', 'ol', 'dl', 'dt', 'dd', 'form',
+}
+
+
+def detect_document_type(path: str) -> str:
+    """
+    根据文件头识别文档类型
+
+    Args:
+        path: 本地文件路径
+
+    Returns:
+        'pdf'、'docx'或'html'；无法识别时按扩展名判断，仍无法判断时视为'pdf'
+    """
+    with open(path, 'rb') as f:
+        head = f.read(1024)
+
+    if head.startswith(b'%PDF') or b'%PDF-' in head:
+        return 'pdf'
+    if head.startswith(b'PK\x03\x04'):
+        try:
+            with zipfile.ZipFile(path) as archive:
+                if 'word/document.xml' in archive.namelist():
+                    return 'docx'
+        except zipfile.BadZipFile:
+            pass
+    text = head.lstrip(b'\xef\xbb\xbf \t\r\n').lower()
+    if text.startswith((b'<!doctype html', b'<html', b'<head', b'<body')):
+        return 'html'
+
+    extension = re.search(r'\.[^./\\]+$', path)
+    return EXTENSION_TYPES.get(extension.group(0).lower() if extension else '', 'pdf')
+
+
+def _image_extension(content_type: str) -> str:
+    """返回图片MIME类型对应的文件扩展名"""
+    content_type = content_type.split(';')[0].strip().lower()
+    if content_type in IMAGE_EXTENSION_OVERRIDES:
+        return IMAGE_EXTENSION_OVERRIDES[content_type]
+    return mimetypes.guess_extension(content_type) or '.bin'
+
+
+def convert_docx(path: str) -> ConvertedDocument:
+    """
+    使用mammoth将DOCX转换为Markdown，提取内嵌图片
+
+    Args:
+        path: DOCX文件路径
+
+    Returns:
+        转换结果，图片以相对路径 image_序号.扩展名 引用
+    """
+    import mammoth
+
+    images: Dict[str, bytes] = {}
+
+    def convert_image(image):
+        rel_path = f"image_{len(images) + 1}{_image_extension(image.content_type or '')}"
+        with image.open() as image_bytes:
+            images[rel_path] = image_bytes.read()
+        return {"src": rel_path, "alt": image.alt_text or ""}
+
+    with open(path, 'rb') as docx_file:
+        result = mammoth.convert_to_markdown(docx_file, convert_image=mammoth.images.img_element(convert_image))
+
+    # mammoth会转义Markdown链接地址中的标点，还原为原始相对路径以便后续按路径改写为COS URL
+    markdown = result.value
+    for rel_path in images:
+        escaped = re.sub(r'([\\`*_{}\[\]()#+\-.!])', r'\\\1', rel_path)
+        markdown = markdown.replace(f"]({escaped})", f"]({rel_path})")
+
+    warnings = [message.message for message in result.messages]
+    if warnings:
+        logger.warning(f"DOCX转换警告（共{len(warnings)}条）: {warnings[:5]}")
+    return ConvertedDocument(
+        markdown=markdown.strip('\n') + '\n',
+        images=images,
+        metadata={'route': 'docx', 'warnings': warnings},
+    )
+
+
+def _escape_markdown(text: str) -> str:
+    """转义正文中会被解析为Markdown语法的字符"""
+    return re.sub(r'([\\`*_\[\]])', r'\\\1', text)
+
+
+class _MarkdownHTMLParser(HTMLParser):
+    """把HTML转换为Markdown的解析器，只处理常见的正文标签"""
+
+    def __init__(self):
+        super().__init__(convert_charrefs=True)
+        self.blocks: List[str] = []
+        self.images: Dict[str, bytes] = {}
+        self._inline: List[str] = []
+        self._skip_depth = 0
+        self._pre_depth = 0
+        self._list_stack: List[List] = []
+        self._links: List[Optional[str]] = []
+        self._block_prefix = ''
+        self._table: Optional[List[List[str]]] = None
+        self._cell: Optional[List[str]] = None
+
+    def _flush(self) -> None:
+        """把当前累积的行内文本作为一个段落输出，预格式文本在</pre>时整体输出"""
+        if self._pre_depth:
+            return
+        text = ''.join(self._inline)
+        self._inline = []
+        text = re.sub(r'[ \t\r\n]+', ' ', text).strip()
+        if text:
+            self.blocks.append(self._block_prefix + text)
+            self._block_prefix = ''
+
+    def _break(self) -> None:
+        """块级标签的边界：预格式文本中换行，表格单元格中以空格分隔，其余情况结束当前段落"""
+        if self._pre_depth:
+            self._emit('\n')
+        elif self._cell is not None:
+            self._cell.append(' ')
+        else:
+            self._flush()
+
+    def _emit(self, text: str) -> None:
+        """输出行内文本，表格单元格中的内容写入单元格"""
+        if self._cell is not None:
+            self._cell.append(text)
+        else:
+            self._inline.append(text)
+
+    def _extract_image(self, src: str) -> str:
+        """把data URI内嵌图片提取为图片文件，返回图片引用路径"""
+        match = re.match(r'data:([^;,]+)?(;base64)?,(.*)', src, re.DOTALL)
+        if not match or not match.group(2):
+            return src
+        try:
+            data = base64.b64decode(match.group(3), validate=False)
+        except (binascii.Error, ValueError):
+            return src
+        rel_path = f"image_{len(self.images) + 1}{_image_extension(match.group(1) or '')}"
+        self.images[rel_path] = data
+        return rel_path
+
+    def handle_starttag(self, tag: str, attrs: List[Tuple[str, Optional[str]]]) -> None:
+        attributes = dict(attrs)
+        if tag in SKIPPED_HTML_TAGS:
+            self._skip_depth += 1
+            return
+        if self._skip_depth:
+            return
+
+        if tag in BLOCK_HTML_TAGS or re.fullmatch(r'h[1-6]', tag) or tag in ('blockquote', 'hr', 'li', 'pre'):
+            self._break()
+        if re.fullmatch(r'h[1-6]', tag):
+            self._block_prefix = '#' * int(tag[1]) + ' '
+        elif tag == 'blockquote':
+            self._block_prefix = '> '
+        elif tag == 'hr':
+            self.blocks.append('---')
+        elif tag in ('ul', 'ol'):
+            self._list_stack.append([tag, 0])
+        elif tag == 'li':
+            indent = '  ' * max(len(self._list_stack) - 1, 0)
+            if self._list_stack and self._list_stack[-1][0] == 'ol':
+                self._list_stack[-1][1] += 1
+                self._block_prefix = f"{indent}{self._list_stack[-1][1]}. "
+            else:
+                self._block_prefix = f"{indent}- "
+        elif tag == 'pre':
+            self._pre_depth += 1
+        elif tag == 'br':
+            self._emit('\n' if self._pre_depth else '  \n')
+        elif tag in ('strong', 'b'):
+            self._emit('**')
+        elif tag in ('em', 'i'):
+            self._emit('*')
+        elif tag == 'code' and not self._pre_depth:
+            self._emit('`')
+        elif tag == 'a':
+            self._links.append(attributes.get('href'))
+            self._emit('[')
+        elif tag == 'img' and attributes.get('src'):
+            src = self._extract_image(attributes['src'])
+            self._emit(f"![{_escape_markdown(attributes.get('alt') or '')}]({src})")
+        elif tag == 'table':
+            self._table = []
+        elif tag == 'tr' and self._table is not None:
+            self._table.append([])
+        elif tag in ('td', 'th') and self._table is not None:
+            self._cell = []
+
+    def handle_endtag(self, tag: str) -> None:
+        if tag in SKIPPED_HTML_TAGS:
+            self._skip_depth = max(self._skip_depth - 1, 0)
+            return
+        if self._skip_depth:
+            return
+
+        if tag in ('strong', 'b'):
+            self._emit('**')
+        elif tag in ('em', 'i'):
+            self._emit('*')
+        elif tag == 'code' and not self._pre_depth:
+            self._emit('`')
+        elif tag == 'a':
+            href = self._links.pop() if self._links else None
+            self._emit(f"]({href})" if href else ']')
+        elif tag == 'pre' and self._pre_depth:
+            self._pre_depth -= 1
+            if not self._pre_depth:
+                code = ''.join(self._inline).strip('\n')
+                self._inline = []
+                self.blocks.append(f"```\n{code}\n```")
+            return
+        elif tag in ('td', 'th') and self._cell is not None:
+            if self._table:
+                cell = re.sub(r'\s+', ' ', ''.join(self._cell)).strip().replace('|', '\\|')
+                self._table[-1].append(cell)
+            self._cell = None
+            return
+        elif tag == 'table' and self._table is not None:
+            self._flush_table()
+            return
+        elif tag in ('ul', 'ol') and self._list_stack:
+            self._flush()
+            self._list_stack.pop()
+            return
+
+        if tag in BLOCK_HTML_TAGS or re.fullmatch(r'h[1-6]', tag) or tag in ('blockquote', 'li'):
+            self._break()
+            if not self._pre_depth and self._cell is None:
+                self._block_prefix = ''
+
+    def _flush_table(self) -> None:
+        """输出Markdown表格，第一行作为表头"""
+        rows = [row for row in self._table if row]
+        self._table = None
+        if not rows:
+            return
+        width = max(len(row) for row in rows)
+        rows = [row + [''] * (width - len(row)) for row in rows]
+        lines = [
+            '| ' + ' | '.join(rows[0]) + ' |',
+            '| ' + ' | '.join(['---'] * width) + ' |',
+        ]
+        lines.extend('| ' + ' | '.join(row) + ' |' for row in rows[1:])
+        self.blocks.append('\n'.join(lines))
+
+    def handle_data(self, data: str) -> None:
+        if self._skip_depth:
+            return
+        self._emit(data if self._pre_depth else _escape_markdown(data))
+
+    def close(self) -> None:
+        super().close()
+        self._flush()
+
+
+def html_to_markdown(html: str) -> ConvertedDocument:
+    """
+    将HTML转换为Markdown
+
+    Args:
+        html: HTML文本
+
+    Returns:
+        转换结果，data URI内嵌图片提取为图片文件；远程图片和相对路径图片保持原样
+    """
+    parser = _MarkdownHTMLParser()
+    parser.feed(html)
+    parser.close()
+    return ConvertedDocument(
+        markdown='\n\n'.join(parser.blocks) + '\n',
+        images=parser.images,
+        metadata={'route': 'html'},
+    )
+
+
+def convert_html(path: str) -> ConvertedDocument:
+    """
+    将HTML文件转换为Markdown
+
+    Args:
+        path: HTML文件路径
+
+    Returns:
+        转换结果
+    """
+    with open(path, 'rb') as f:
+        raw = f.read()
+    charset = re.search(rb'<meta[^>]+charset=["\']?([\w-]+)', raw[:4096], re.IGNORECASE)
+    encoding = charset.group(1).decode('ascii') if charset else 'utf-8'
+    try:
+        html = raw.decode(encoding, errors='replace')
+    except LookupError:
+        html = raw.decode('utf-8', errors='replace')
+    return html_to_markdown(html)
+
+
+def convert_office_document(path: str, document_type: str) -> ConvertedDocument:
+    """
+    按文档类型选择转换器
+
+    Args:
+        path: 文档路径
+        document_type: 'docx'或'html'
+
+    Returns:
+        转换结果
+    """
+    if document_type == 'docx':
+        return convert_docx(path)
+    if document_type == 'html':
+        return convert_html(path)
+    raise ValueError(f"不支持的文档类型: {document_type}")
@@ -0,0 +1,365 @@
+"""
+按页内容哈希的增量转换缓存
+
+同一份长文档的修订版本通常只改动了少数几页。每页按其内容（文本、字体、图片数据、
+图形路径和位置）计算哈希，未变化的页面直接复用之前转换并改写好图片URL的Markdown，
+只有变化的页面需要重新交给marker转换。
+"""
+import ctypes
+import hashlib
+import json
+import logging
+import os
+import re
+import sqlite3
+import struct
+import threading
+import time
+from dataclasses import dataclass
+from typing import Any, Dict, Iterable, List, Optional
+
+from app.cache import get_marker_version
+from app.config import get_bool_env, get_cache_path, get_float_env, get_int_env, get_str_env
+from app.image_rewriter import IMAGE_PATTERN, ImageURLRewriter
+
+logger = logging.getLogger(__name__)
+
+# marker开启paginate_output后在每页开头输出的分隔行：{页码}------...
+PAGE_SEPARATOR_PATTERN = re.compile(r'(?:^|\n\n)\{(\d+)\}-{48}\n\n')
+
+
+def _hash_text_object(digest, obj, textpage) -> None:
+    """把文本对象的文字、字体和字号加入哈希"""
+    import pypdfium2.raw as pdfium_c
+
+    length = pdfium_c.FPDFTextObj_GetText(obj.raw, textpage.raw, None, 0)
+    if length > 0:
+        buffer = ctypes.create_string_buffer(length)
+        pdfium_c.FPDFTextObj_GetText(
+            obj.raw, textpage.raw, ctypes.cast(buffer, ctypes.POINTER(pdfium_c.FPDF_WCHAR)), length
+        )
+        digest.update(buffer.raw)
+    font = pdfium_c.FPDFTextObj_GetFont(obj.raw)
+    if font:
+        length = pdfium_c.FPDFFont_GetBaseFontName(font, None, 0)
+        if length > 0:
+            buffer = ctypes.create_string_buffer(length)
+            pdfium_c.FPDFFont_GetBaseFontName(font, buffer, length)
+            digest.update(buffer.raw)
+    size = ctypes.c_float()
+    if pdfium_c.FPDFTextObj_GetFontSize(obj.raw, ctypes.byref(size)):
+        digest.update(struct.pack('<f', size.value))
+
+
+def _hash_path_object(digest, obj) -> None:
+    """把图形路径的各个线段端点加入哈希"""
+    import pypdfium2.raw as pdfium_c
+
+    x, y = ctypes.c_float(), ctypes.c_float()
+    for index in range(pdfium_c.FPDFPath_CountSegments(obj.raw)):
+        segment = pdfium_c.FPDFPath_GetPathSegment(obj.raw, index)
+        pdfium_c.FPDFPathSegment_GetPoint(segment, ctypes.byref(x), ctypes.byref(y))
+        digest.update(struct.pack(
+            '<iff', pdfium_c.FPDFPathSegment_GetType(segment), round(x.value, 2), round(y.value, 2)
+        ))
+
+
+def hash_pages(pdf_path: str) -> List[str]:
+    """
+    计算PDF每一页内容的哈希
+
+    哈希覆盖页面尺寸、每个页面对象的类型和位置，以及文本对象的文字和字体、
+    图片对象的原始数据和图形路径的线段，只取决于页面内容本身，与页面在文档中的位置和文档元数据无关。
+
+    Args:
+        pdf_path: PDF文件路径
+
+    Returns:
+        按页序排列的SHA-256列表
+    """
+    import pypdfium2
+    import pypdfium2.raw as pdfium_c
+
+    pdf = pypdfium2.PdfDocument(pdf_path)
+    hashes = []
+    try:
+        for index in range(len(pdf)):
+            page = pdf[index]
+            textpage = page.get_textpage()
+            try:
+                digest = hashlib.sha256()
+                width, height = page.get_size()
+                digest.update(struct.pack('<ffi', width, height, page.get_rotation()))
+                bounds = [ctypes.c_float() for _ in range(4)]
+                for obj in page.get_objects(max_depth=15):
+                    object_type = pdfium_c.FPDFPageObj_GetType(obj.raw)
+                    pdfium_c.FPDFPageObj_GetBounds(obj.raw, *(ctypes.byref(value) for value in bounds))
+                    digest.update(struct.pack('<i4f', object_type, *(round(value.value, 2) for value in bounds)))
+                    if object_type == pdfium_c.FPDF_PAGEOBJ_TEXT:
+                        _hash_text_object(digest, obj, textpage)
+                    elif object_type == pdfium_c.FPDF_PAGEOBJ_IMAGE:
+                        digest.update(bytes(obj.get_data(decode_simple=False)))
+                    elif object_type == pdfium_c.FPDF_PAGEOBJ_PATH:
+                        _hash_path_object(digest, obj)
+                hashes.append(digest.hexdigest())
+            finally:
+                textpage.close()
+                page.close()
+    finally:
+        pdf.close()
+    return hashes
+
+
+def split_pages(markdown: str) -> Optional[Dict[int, str]]:
+    """
+    按marker的分页分隔行拆分Markdown
+
+    Args:
+        markdown: 开启paginate_output后得到的Markdown
+
+    Returns:
+        页码（从0开始）到该页Markdown的映射；没有分页分隔行时返回None
+    """
+    matches = list(PAGE_SEPARATOR_PATTERN.finditer(markdown))
+    if not matches:
+        return None
+    pages = {}
+    for index, match in enumerate(matches):
+        end = matches[index + 1].start() if index + 1 < len(matches) else len(markdown)
+        pages[int(match.group(1))] = markdown[match.end():end].strip('\n')
+    return pages
+
+
+def page_image_refs(markdown: str) -> List[str]:
+    """返回一页Markdown中引用的所有图片路径"""
+    refs = []
+    for match in IMAGE_PATTERN.finditer(markdown):
+        path = match.group('md_path') if match.group('md_path') is not None else match.group('html_src')
+        refs.append(path.strip().split('#')[0].split('?')[0])
+    return refs
+
+
+@dataclass
+class PagePlan:
+    """
+    一次增量转换的页面计划
+
+    Attributes:
+        page_keys: 按页序排列的页面缓存键
+        cached: 命中缓存的页码到缓存条目的映射
+        missing: 需要重新转换的页码
+    """
+    page_keys: List[str]
+    cached: Dict[int, Dict[str, Any]]
+    missing: List[int]
+
+    def stats(self) -> Dict[str, Any]:
+        """返回本次转换的页面缓存命中情况"""
+        pages = len(self.page_keys)
+        return {
+            'pages': pages,
+            'hits': len(self.cached),
+            'misses': len(self.missing),
+            'hit_rate': len(self.cached) / pages if pages else 0.0,
+        }
+
+    def cached_files(self) -> Dict[str, str]:
+        """返回命中缓存的页面引用的资源文件URL"""
+        files: Dict[str, str] = {}
+        for entry in self.cached.values():
+            files.update(entry['files_dict'])
+        return files
+
+    def assemble(self, converted_pages: Dict[int, str], pages: Optional[Iterable[int]] = None) -> str:
+        """按页序拼接缓存的页面和重新转换的页面，pages指定时只拼接这些页面"""
+        parts = []
+        for index in pages if pages is not None else range(len(self.page_keys)):
+            entry = self.cached.get(index)
+            markdown = entry['markdown_text'] if entry else converted_pages.get(index, '')
+            if markdown:
+                parts.append(markdown)
+        return '\n\n'.join(parts) + '\n'
+
+    def build_entries(self, converted_pages: Dict[int, str], files_dict: Dict[str, str]) -> Dict[str, Dict[str, Any]]:
+        """
+        生成重新转换的页面的缓存条目
+
+        每页的图片引用按上传结果改写为COS URL；有图片未能上传的页面不写入缓存。
+
+        Args:
+            converted_pages: 页码到重新转换得到的Markdown的映射
+            files_dict: 本次上传的资源文件URL
+
+        Returns:
+            页面缓存键到缓存条目的映射
+        """
+        rewriter = ImageURLRewriter(files_dict)
+        entries = {}
+        for index, markdown in converted_pages.items():
+            if index >= len(self.page_keys) or index in self.cached:
+                continue
+            page_files = {}
+            complete = True
+            for ref in page_image_refs(markdown):
+                remote_url = rewriter.resolve(ref)
+                if remote_url:
+                    page_files[ref] = remote_url
+                elif not ref.startswith(('http://', 'https://', 'data:')):
+                    complete = False
+                    break
+            if complete:
+                entries[self.page_keys[index]] = {
+                    'markdown_text': rewriter.rewrite(markdown),
+                    'files_dict': page_files,
+                }
+        return entries
+
+
+class PageCache:
+    """
+    页面级转换缓存
+
+    以 "页面内容哈希 + marker版本 + 转换选项" 为键，记录该页图片URL改写完成后的Markdown
+    以及该页引用的资源文件URL。索引保存在本地SQLite中，按TTL过期，条目数超过上限时按最近最少使用淘汰。
+    """
+
+    def __init__(self, db_path: str, ttl: float = 30 * 24 * 3600, max_entries: int = 200000):
+        """
+        初始化缓存
+
+        Args:
+            db_path: SQLite数据库文件路径
+            ttl: 缓存条目的有效期（秒），小于等于0表示不过期
+            max_entries: 最多保留的页面条目数
+        """
+        self.db_path = db_path
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.marker_version = get_marker_version()
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+
+        os.makedirs(os.path.dirname(os.path.abspath(db_path)), exist_ok=True)
+        self._conn = sqlite3.connect(db_path, check_same_thread=False, timeout=30)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS page_cache (
+                page_key TEXT PRIMARY KEY,
+                markdown_text TEXT NOT NULL,
+                files_json TEXT NOT NULL,
+                created_at REAL NOT NULL,
+                last_access_at REAL NOT NULL
+            )
+            """
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_page_cache_access ON page_cache (last_access_at)")
+        self._conn.commit()
+
+    @classmethod
+    def from_env(cls) -> Optional['PageCache']:
+        """根据环境变量创建缓存，PAGE_CACHE_ENABLED为false时返回None"""
+        if not get_bool_env('PAGE_CACHE_ENABLED', True):
+            return None
+        return cls(
+            db_path=get_str_env('PAGE_CACHE_PATH', get_cache_path('page_cache.sqlite3')),
+            ttl=get_float_env('PAGE_CACHE_TTL', 30 * 24 * 3600),
+            max_entries=get_int_env('PAGE_CACHE_MAX_ENTRIES', 200000),
+        )
+
+    def make_key(self, page_hash: str, options: Optional[Dict[str, Any]] = None) -> str:
+        """生成页面缓存键"""
+        fingerprint = json.dumps(
+            {'page_hash': page_hash, 'marker_version': self.marker_version, 'options': options or {}},
+            sort_keys=True,
+            ensure_ascii=False,
+            default=str,
+        )
+        return hashlib.sha256(fingerprint.encode('utf-8')).hexdigest()
+
+    def get_many(self, page_keys: List[str]) -> Dict[str, Dict[str, Any]]:
+        """
+        批量查询页面缓存
+
+        Returns:
+            命中的页面缓存键到 {"markdown_text", "files_dict"} 的映射
+        """
+        now = time.time()
+        found: Dict[str, Dict[str, Any]] = {}
+        unique_keys = list(dict.fromkeys(page_keys))
+        with self._lock:
+            for start in range(0, len(unique_keys), 500):
+                batch = unique_keys[start:start + 500]
+                rows = self._conn.execute(
+                    f"SELECT page_key, markdown_text, files_json, created_at FROM page_cache "
+                    f"WHERE page_key IN ({','.join('?' * len(batch))})",
+                    batch,
+                ).fetchall()
+                for page_key, markdown_text, files_json, created_at in rows:
+                    if self.ttl > 0 and now - created_at > self.ttl:
+                        continue
+                    found[page_key] = {'markdown_text': markdown_text, 'files_dict': json.loads(files_json)}
+            self._conn.executemany(
+                "UPDATE page_cache SET last_access_at = ? WHERE page_key = ?",
+                [(now, page_key) for page_key in found],
+            )
+            self._conn.commit()
+            hits = sum(1 for page_key in page_keys if page_key in found)
+            self.hits += hits
+            self.misses += len(page_keys) - hits
+        return found
+
+    def put_many(self, entries: Dict[str, Dict[str, Any]]) -> None:
+        """
+        批量写入页面缓存，并执行过期清理和容量淘汰
+
+        Args:
+            entries: 页面缓存键到 {"markdown_text", "files_dict"} 的映射
+        """
+        if not entries:
+            return
+        now = time.time()
+        with self._lock:
+            self._conn.executemany(
+                """
+                INSERT OR REPLACE INTO page_cache (page_key, markdown_text, files_json, created_at, last_access_at)
+                VALUES (?, ?, ?, ?, ?)
+                """,
+                [
+                    (page_key, entry['markdown_text'], json.dumps(entry['files_dict'], ensure_ascii=False), now, now)
+                    for page_key, entry in entries.items()
+                ],
+            )
+            self._evict(now)
+            self._conn.commit()
+
+    def stats(self) -> Dict[str, Any]:
+        """返回页面缓存的累计命中统计和当前条目数"""
+        with self._lock:
+            entries = self._conn.execute("SELECT COUNT(*) FROM page_cache").fetchone()[0]
+            total = self.hits + self.misses
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': self.hits / total if total else 0.0,
+                'entries': entries,
+            }
+
+    def close(self) -> None:
+        with self._lock:
+            self._conn.close()
+
+    def _evict(self, now: float) -> None:
+        """删除过期条目，并按最近最少使用淘汰超出上限的条目（调用方需持有锁）"""
+        if self.ttl > 0:
+            self._conn.execute("DELETE FROM page_cache WHERE created_at < ?", (now - self.ttl,))
+        entries = self._conn.execute("SELECT COUNT(*) FROM page_cache").fetchone()[0]
+        if entries <= self.max_entries:
+            return
+        self._conn.execute(
+            "DELETE FROM page_cache WHERE page_key IN "
+            "(SELECT page_key FROM page_cache ORDER BY last_access_at ASC LIMIT ?)",
+            (entries - self.max_entries,),
+        )
+        logger.info(f"页面缓存已淘汰{entries - self.max_entries}个条目")
@@ -0,0 +1,347 @@
+"""
+批量转换的流水线
+
+下载、转换和上传分为三个阶段，各自使用独立的线程池：下载阶段提前预取后续的文档，
+转换阶段的并发数与工作进程数一致，上传阶段与下一个文档的转换重叠，
+从而使整批的耗时接近只受转换速度限制的下限。
+
+指定任务调度器时（API服务中总是如此），下载完成的文档的转换作为只在本节点执行的任务提交给调度器，
+与交互式请求一起按优先级和租户公平排队，并受租户配额和准入控制的限制；上传仍在流水线的上传阶段进行。
+"""
+import contextvars
+import logging
+import threading
+import time
+import uuid
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Any, Dict, List, Optional
+
+from app import deadline
+from app.config import get_float_env, get_int_env
+from app.deadline import Deadline, DeadlineError, DeadlineExceeded, RequestCancelled
+from app.downloader import DownloadError
+from app.logs import submit_in_context
+from app.models import ConversionOptions
+
+logger = logging.getLogger(__name__)
+
+
+class _BatchItem:
+    """批量请求中的一个文档及其在各阶段的耗时"""
+
+    def __init__(
+        self,
+        index: int,
+        pdf_url: str,
+        options: ConversionOptions,
+        slots: threading.Semaphore,
+        cancel_event: Optional[threading.Event] = None,
+        tenant: Optional[str] = None,
+    ):
+        self.index = index
+        self.pdf_url = pdf_url
+        self.options = options
+        self.tenant = tenant
+        self.future: Future = Future()
+        self.timings: Dict[str, float] = {}
+        self.content_hash: Optional[str] = None
+        self.cache_key: Optional[str] = None
+        self.path: Optional[str] = None
+        self.converted = None
+        self.pages: Optional[int] = None
+        # 截止时间在开始下载时创建，同一批次的文档共享取消标志
+        self.cancel_event = cancel_event
+        self.deadline: Optional[Deadline] = None
+        # 预取名额：下载开始时占用，转换结束后释放
+        self._slots = slots
+        self._holding_slot = True
+
+    def release_slot(self) -> None:
+        """释放预取名额（只释放一次）"""
+        if self._holding_slot:
+            self._holding_slot = False
+            self._slots.release()
+
+
+class BatchPipeline:
+    """
+    下载、转换、上传三阶段流水线
+
+    同时处于“已下载或正在下载、尚未转换完成”状态的文档数量不超过转换并发数加预取数量，
+    避免一次提交上千个URL时把所有文件都下载到磁盘。
+    """
+
+    def __init__(
+        self,
+        service,
+        convert_workers: int = 1,
+        download_workers: int = 4,
+        upload_workers: int = 2,
+        prefetch: int = 4,
+        document_timeout: Optional[float] = None,
+        scheduler=None,
+    ):
+        """
+        初始化流水线（线程池在首次提交时创建）
+
+        Args:
+            service: PDFConverterService实例
+            convert_workers: 同时转换的文档数量，通常与工作进程数一致
+            download_workers: 下载线程数
+            upload_workers: 同时上传的文档数量（每个文档内部的资源文件仍由COS上传线程池并发上传）
+            prefetch: 在转换阶段之外最多提前下载的文档数量
+            document_timeout: 请求未指定timeout时每个文档的截止时间（秒，从开始下载时计算），None表示不限制
+            scheduler: 可选，JobScheduler实例；指定时下载完成的文档的转换提交给调度器（调度器的任务处理函数
+                需要把batch_item任务交给run_scheduled），同时进行的转换数量由调度器控制，
+                convert_workers只限制同时排队或执行的文档数量
+        """
+        self.service = service
+        self.convert_workers = max(1, convert_workers)
+        self.download_workers = max(1, download_workers)
+        self.upload_workers = max(1, upload_workers)
+        self.prefetch = max(0, prefetch)
+        self.document_timeout = document_timeout if document_timeout and document_timeout > 0 else None
+        self.scheduler = scheduler
+        self._executors: Dict[str, ThreadPoolExecutor] = {}
+        # 已提交给调度器、等待转换的文档
+        self._scheduled: Dict[str, _BatchItem] = {}
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_env(cls, service, scheduler=None) -> 'BatchPipeline':
+        """根据环境变量创建流水线，默认转换并发数与工作进程数一致"""
+        return cls(
+            service,
+            convert_workers=get_int_env('BATCH_CONVERT_WORKERS', max(1, get_int_env('MARKER_WORKER_POOL_SIZE', 1))),
+            download_workers=get_int_env('BATCH_DOWNLOAD_WORKERS', 4),
+            upload_workers=get_int_env('BATCH_UPLOAD_WORKERS', 2),
+            prefetch=get_int_env('BATCH_PREFETCH', 4),
+            document_timeout=get_float_env('REQUEST_TIMEOUT_SECONDS', 600),
+            scheduler=scheduler,
+        )
+
+    def submit(
+        self,
+        pdf_urls: List[str],
+        options: Optional[ConversionOptions] = None,
+        cancel_event: Optional[threading.Event] = None,
+        tenant: Optional[str] = None,
+    ) -> List[Future]:
+        """
+        提交一批URL，立即返回
+
+        Args:
+            pdf_urls: 文档URL列表
+            options: 应用到每个文档的转换选项，其中的timeout是每个文档的截止时间
+            cancel_event: 可选，设置后尚未完成的文档立即中止（例如客户端断开连接）
+            tenant: 提交批量请求的租户（API Key），提交给调度器的任务按该租户排队和计算配额
+
+        Returns:
+            与pdf_urls顺序一致的Future列表，结果为单个文档的结果字典（失败时status为failed，Future本身不会抛出异常）
+        """
+        options = options or ConversionOptions()
+        slots = threading.Semaphore(self.convert_workers + self.prefetch)
+        items = [
+            _BatchItem(index, url, options, slots, cancel_event, tenant) for index, url in enumerate(pdf_urls)
+        ]
+        # 按顺序占用预取名额后再提交下载，由单独的线程完成，避免阻塞调用方
+        # 各阶段在提交请求的上下文副本中执行，日志带有相同的请求ID
+        threading.Thread(
+            target=contextvars.copy_context().run, args=(self._feed, items, slots),
+            name='batch-pipeline-feeder', daemon=True,
+        ).start()
+        return [item.future for item in items]
+
+    def shutdown(self) -> None:
+        """关闭流水线的线程池"""
+        with self._lock:
+            executors = list(self._executors.values())
+            self._executors.clear()
+        for executor in executors:
+            executor.shutdown(wait=False)
+
+    def _executor(self, stage: str) -> ThreadPoolExecutor:
+        """获取某个阶段共享的线程池"""
+        sizes = {'download': self.download_workers, 'convert': self.convert_workers, 'upload': self.upload_workers}
+        with self._lock:
+            if stage not in self._executors:
+                self._executors[stage] = ThreadPoolExecutor(
+                    max_workers=sizes[stage], thread_name_prefix=f'batch-{stage}'
+                )
+            return self._executors[stage]
+
+    def _feed(self, items: List[_BatchItem], slots: threading.Semaphore) -> None:
+        """按顺序把文档送入下载阶段，预取名额用完时等待前面的文档转换完成"""
+        for item in items:
+            slots.acquire()
+            submit_in_context(self._executor('download'), self._download, item)
+
+    def _download(self, item: _BatchItem) -> None:
+        """下载阶段：下载文档并查询转换缓存"""
+        timeout = item.options.timeout if item.options.timeout is not None else self.document_timeout
+        item.deadline = Deadline(timeout, cancel_event=item.cancel_event)
+        started = time.perf_counter()
+        try:
+            with deadline.bind(item.deadline):
+                item.deadline.check('download')
+                download = self.service.fetch_pdf(item.pdf_url)
+        except DeadlineError as e:
+            self._abort(item, e)
+            return
+        except DownloadError as e:
+            self._fail(item, f"无法下载PDF文件: {e}")
+            return
+        except Exception as e:
+            self._fail(item, f"执行命令时发生错误: {str(e)}")
+            return
+        item.timings['download'] = time.perf_counter() - started
+        item.path = download.path
+        item.content_hash = download.content_hash
+
+        try:
+            item.cache_key = self.service.make_cache_key(download.content_hash, item.options)
+            cached = self.service.get_cached_result(item.cache_key)
+        except Exception as e:
+            logger.warning(f"查询转换缓存失败: {e}")
+            cached = None
+        if cached:
+            logger.info(f"命中转换缓存，PDF哈希: {download.content_hash}，Markdown URL: {cached[1]}")
+            self._cleanup(item)
+            self._finish(item, cached, cached=True)
+            return
+        submit_in_context(self._executor('convert'), self._convert, item)
+
+    def _convert(self, item: _BatchItem) -> None:
+        """转换阶段：在内存中得到转换结果后立即释放本地文件和预取名额，上传交给上传阶段"""
+        from app.jobs import JobFailedError, QueueFullError
+        from app.services import ConversionError
+
+        started = time.perf_counter()
+        try:
+            with deadline.bind(item.deadline):
+                if self.scheduler is not None:
+                    self._convert_scheduled(item)
+                else:
+                    item.converted = self.service.convert_file(item.path, item.options)
+        except DeadlineError as e:
+            self._abort(item, e)
+            return
+        except QueueFullError as e:
+            self._fail(item, e.message, status="rejected")
+            return
+        except (ConversionError, JobFailedError) as e:
+            self._fail(item, e.message)
+            return
+        except Exception as e:
+            self._fail(item, f"执行命令时发生错误: {str(e)}")
+            return
+        finally:
+            self._cleanup(item)
+        item.timings['convert'] = time.perf_counter() - started
+        submit_in_context(self._executor('upload'), self._upload, item)
+
+    def _convert_scheduled(self, item: _BatchItem) -> None:
+        """作为只在本节点执行的任务提交给调度器，等待run_scheduled把转换结果写入item"""
+        item.deadline.check('queue')
+        item.pages = self.service._count_pages(item.path)
+        token = uuid.uuid4().hex
+        with self._lock:
+            self._scheduled[token] = item
+        try:
+            remaining = item.deadline.remaining()
+            job = self.scheduler.submit(
+                {"batch_item": token},
+                timeout=remaining if remaining is not None else 0,
+                priority=item.options.priority,
+                tenant=item.tenant,
+                pages=item.pages,
+                local_only=True,
+            )
+            deadline.wait_for(
+                job.future, cancel=lambda _: self.scheduler.cancel(job.job_id, "批量请求已取消"), stage='convert'
+            )
+        finally:
+            with self._lock:
+                self._scheduled.pop(token, None)
+
+    def run_scheduled(self, payload: Dict[str, Any]) -> Dict[str, Any]:
+        """
+        执行_convert_scheduled提交给调度器的任务，由调度器的任务处理函数调用
+
+        只执行转换，结果留在内存中，上传在流水线的上传阶段进行，调度器的并发名额在转换结束时即可释放。
+
+        Args:
+            payload: 任务参数，batch_item为提交时登记的文档标识
+
+        Returns:
+            结果字典，包含文档页数pages（用于估计排队等待时间）
+
+        Raises:
+            RequestCancelled: 批量请求已不再等待这个文档
+            ConversionError: 转换失败
+        """
+        with self._lock:
+            item = self._scheduled.get(payload["batch_item"])
+        if item is None:
+            raise RequestCancelled("批量请求已不再等待该文档", 'convert')
+        item.converted = self.service.convert_file(item.path, item.options)
+        return {"pages": item.pages}
+
+    def _upload(self, item: _BatchItem) -> None:
+        """上传阶段：与后续文档的转换重叠执行"""
+        started = time.perf_counter()
+        try:
+            with deadline.bind(item.deadline):
+                result = self.service.publish_converted(item.converted, item.content_hash, item.cache_key)
+        except DeadlineError as e:
+            self._abort(item, e)
+            return
+        except Exception as e:
+            self._fail(item, f"执行命令时发生错误: {str(e)}")
+            return
+        finally:
+            item.converted = None
+        item.timings['upload'] = time.perf_counter() - started
+        self._finish(item, result)
+
+    def _cleanup(self, item: _BatchItem) -> None:
+        """删除下载的临时文件并释放预取名额"""
+        if item.path:
+            self.service._remove_temp_file(item.path)
+            item.path = None
+        item.release_slot()
+
+    def _finish(self, item: _BatchItem, result, cached: bool = False) -> None:
+        """记录单个文档的结果"""
+        markdown_text, file_url, files_dict, error = result
+        if not markdown_text:
+            self._fail(item, error or "未知错误")
+            return
+        if not file_url:
+            self._fail(item, "无法获取转换后的Markdown文件URL")
+            return
+        item.future.set_result({
+            "index": item.index,
+            "pdf_url": item.pdf_url,
+            "status": "succeeded",
+            "file_url": file_url,
+            "files": files_dict,
+            "cached": cached,
+            "timings": item.timings,
+        })
+
+    def _abort(self, item: _BatchItem, error: DeadlineError) -> None:
+        """记录单个文档因超时或取消而中止"""
+        self._fail(item, error.message, status="timed_out" if isinstance(error, DeadlineExceeded) else "cancelled")
+
+    def _fail(self, item: _BatchItem, error: str, status: str = "failed") -> None:
+        """记录单个文档的失败"""
+        self._cleanup(item)
+        logger.warning(f"批量转换中的文档失败: {item.pdf_url}，错误: {error}")
+        item.future.set_result({
+            "index": item.index,
+            "pdf_url": item.pdf_url,
+            "status": status,
+            "error": error,
+            "timings": item.timings,
+        })
@@ -0,0 +1,150 @@
+"""
+转换进度事件
+
+每个任务持有一个事件记录器，执行任务的线程通过contextvars绑定记录器（与截止时间、日志上下文一致，
+通过app.logs.submit_in_context提交到线程池的工作也能继承），
+服务在各阶段调用report()记录阶段切换、页面进度和已完成页面的Markdown，
+流式接口从记录器中按顺序读取事件推送给客户端。
+"""
+import contextvars
+import threading
+from contextlib import contextmanager
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+
+class ProgressReporter:
+    """
+    一个任务的进度事件记录器
+
+    事件只追加不修改，读取方按游标增量读取，因此多个客户端可以同时订阅同一个任务，
+    任务结束后订阅也能从头回放。
+    """
+
+    def __init__(self, partial_results: bool = False):
+        """
+        初始化记录器
+
+        Args:
+            partial_results: 是否记录已完成页面的Markdown；开启后大文档按页分块转换，每块完成时即可推送
+        """
+        self.partial_results = partial_results
+        # 是否已经按页记录过进度，转换结束时据此决定是否还需要记录整篇文档
+        self.pages_reported = False
+        self._events: List[Dict[str, Any]] = []
+        self._closed = False
+        self._condition = threading.Condition()
+
+    def emit(self, event: str, data: Dict[str, Any]) -> None:
+        """追加一个事件"""
+        with self._condition:
+            if self._closed:
+                return
+            self._events.append({"event": event, "data": data})
+            self._condition.notify_all()
+
+    def close(self) -> None:
+        """任务结束，不再追加事件"""
+        with self._condition:
+            self._closed = True
+            self._condition.notify_all()
+
+    @property
+    def closed(self) -> bool:
+        return self._closed
+
+    def wait(self, cursor: int, timeout: Optional[float] = None) -> Tuple[List[Dict[str, Any]], bool]:
+        """
+        等待游标之后的新事件
+
+        Args:
+            cursor: 已经读取的事件数量
+            timeout: 最长等待秒数，超时返回空列表
+
+        Returns:
+            元组 (新事件列表, 记录器是否已关闭)
+        """
+        with self._condition:
+            self._condition.wait_for(lambda: len(self._events) > cursor or self._closed, timeout)
+            return list(self._events[cursor:]), self._closed
+
+
+class ProgressFanout(ProgressReporter):
+    """
+    合并执行的进度记录器
+
+    合并到同一次执行的每个请求都订阅这个记录器，事件转发给所有订阅者的记录器，
+    后加入的订阅者先回放已经记录的事件，因此所有请求看到相同的事件序列。
+    """
+
+    def __init__(self, partial_results: bool = False):
+        super().__init__(partial_results)
+        self._subscribers: List[ProgressReporter] = []
+
+    def emit(self, event: str, data: Dict[str, Any]) -> None:
+        """追加一个事件并转发给所有订阅者"""
+        with self._condition:
+            if self._closed:
+                return
+            self._events.append({"event": event, "data": data})
+            # 在锁内转发，保证每个订阅者收到的事件顺序与记录顺序一致
+            for subscriber in self._subscribers:
+                subscriber.emit(event, data)
+            self._condition.notify_all()
+
+    def subscribe(self, reporter: ProgressReporter) -> None:
+        """回放已经记录的事件，之后的事件转发给该记录器"""
+        with self._condition:
+            for item in self._events:
+                reporter.emit(item["event"], item["data"])
+            self._subscribers.append(reporter)
+
+    def unsubscribe(self, reporter: ProgressReporter) -> None:
+        """不再转发事件给该记录器"""
+        with self._condition:
+            if reporter in self._subscribers:
+                self._subscribers.remove(reporter)
+
+
+_current: contextvars.ContextVar[Optional[ProgressReporter]] = contextvars.ContextVar('progress', default=None)
+
+
+def current() -> Optional[ProgressReporter]:
+    """返回当前上下文绑定的记录器"""
+    return _current.get()
+
+
+@contextmanager
+def bind(reporter: Optional[ProgressReporter]) -> Iterator[None]:
+    """在当前上下文绑定记录器，退出时恢复"""
+    token = _current.set(reporter)
+    try:
+        yield
+    finally:
+        _current.reset(token)
+
+
+def report(event: str, **data: Any) -> None:
+    """向当前上下文绑定的记录器追加事件，没有绑定时忽略"""
+    reporter = current()
+    if reporter is not None:
+        reporter.emit(event, data)
+
+
+def report_markdown(pages: List[int], markdown: str, total_pages: Optional[int] = None) -> None:
+    """
+    记录一段已完成页面的Markdown
+
+    只有订阅方要求部分结果时才记录Markdown正文，其余情况只记录页面进度。
+
+    Args:
+        pages: 这段Markdown包含的页码（从0开始）
+        markdown: 图片引用为相对路径的Markdown，完整文件上传后才改写为COS URL
+        total_pages: 文档总页数
+    """
+    reporter = current()
+    if reporter is None:
+        return
+    reporter.pages_reported = True
+    if reporter.partial_results:
+        reporter.emit("markdown", {"pages": [pages[0], pages[-1]] if pages else [], "markdown": markdown})
+    reporter.emit("progress", {"pages_done": pages[-1] + 1 if pages else total_pages, "total_pages": total_pages})
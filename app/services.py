@@ -1,16 +1,72 @@
+import logging
 import os
 import tempfile
 import subprocess
 import shutil
+import signal
 import time
 import random
 import string
+import threading
 import urllib.parse
 import re
-from typing import Optional, Tuple, Dict
-import requests
+import json
+from concurrent.futures import TimeoutError as FutureTimeoutError
+from dataclasses import dataclass, field
+from typing import Any, Callable, List, Optional, Tuple, Dict
 
+from app import deadline, metrics, progress
+from app.batching import PageBatcher
+from app.cache import ConversionCache
+from app.config import get_float_env, get_int_env, get_json_env, get_str_env
 from app.cos_service import COSService
+from app.downloader import DownloadError, DownloadResult, PDFDownloader
+from app.image_rewriter import ImageURLRewriter
+from app.image_transcoder import ImageTranscoder
+from app.models import ConversionOptions
+from app.office_converter import EXTENSION_TYPES, OFFICE_DOCUMENT_TYPES, convert_office_document, detect_document_type
+from app.page_cache import PageCache, PagePlan, hash_pages, split_pages
+from app.sharding import convert_shards, get_page_count, plan_shards
+from app.singleflight import SingleFlight
+from app.text_fast_path import classify_pdf, extract_markdown
+from app.warmup import synthetic_pdf
+from app.worker_pool import (
+    ConvertedDocument,
+    MarkerWorkerPool,
+    WorkerPoolError,
+    encode_metadata,
+    read_document,
+)
+
+logger = logging.getLogger(__name__)
+
+
+class ConversionError(Exception):
+    """转换任务失败时抛出的异常，携带建议返回给客户端的HTTP状态码"""
+
+    def __init__(self, message: str, status_code: int = 400):
+        super().__init__(message)
+        self.message = message
+        self.status_code = status_code
+
+
+@dataclass
+class ConvertedFile:
+    """
+    一个文档在内存中的转换结果，等待上传到COS
+
+    Attributes:
+        document: 转换结果
+        pdf_name: 文档名称（不含扩展名）
+        route: 使用的转换路径
+        page_plan: 页面缓存的查询结果，未使用页面缓存时为None
+        converted_pages: 重新转换的页码到该页Markdown的映射，上传后写入页面缓存
+    """
+    document: ConvertedDocument
+    pdf_name: str
+    route: str
+    page_plan: Optional[PagePlan] = None
+    converted_pages: Dict[int, str] = field(default_factory=dict)
 
 
 class PDFConverterService:
@@ -20,7 +76,210 @@ class PDFConverterService:
         """初始化服务"""
         # 初始化腾讯云COS服务
         self.cos_service = COSService()
+        # 流式、连接复用的PDF下载器
+        self.downloader = PDFDownloader.from_env()
+        # 常驻模型的工作进程池，首次转换时才启动；进程数为0时退回到marker_single命令行
+        self.use_worker_pool = get_int_env('MARKER_WORKER_POOL_SIZE', 1) > 0
+        self._worker_pool: Optional[MarkerWorkerPool] = None
+        self._worker_pool_lock = threading.Lock()
+        # 跨请求合并小文档页面的批处理器，随工作进程池一起创建，MARKER_BATCH_ENABLED=false时为None
+        self._page_batcher: Optional[PageBatcher] = None
+        # 以PDF内容哈希为键的转换结果缓存，CONVERSION_CACHE_ENABLED=false时为None
+        self.conversion_cache = ConversionCache.from_env()
+        # 以页面内容哈希为键的增量缓存，修订后重新提交的文档只转换变化的页面
+        self.page_cache = PageCache.from_env() if self.use_worker_pool else None
+        self.page_cache_min_pages = get_int_env('PAGE_CACHE_MIN_PAGES', 10)
+        # 当前线程正在执行的任务的统计信息，例如页面缓存命中率
+        self._job_context = threading.local()
+        # 大文档按页拆分并行转换的默认分片页数，0表示不拆分
+        self.default_shard_pages = get_int_env('PDF_SHARD_PAGES', 0)
+        # 流式返回部分结果时按多少页一块转换，每块完成后即推送该块的Markdown
+        self.stream_chunk_pages = get_int_env('STREAM_CHUNK_PAGES', 10)
+        # 转换路径：默认始终使用marker；auto时预先检查文本层，文本型PDF走快速路径跳过版面/OCR模型
+        # （快速路径不识别标题、表格和图片，因此需要显式开启，且默认只接受没有图片的文档）
+        self.default_route = get_str_env('CONVERSION_ROUTE', 'marker')
+        self.fast_path_min_chars = get_int_env('FAST_PATH_MIN_CHARS_PER_PAGE', 100)
+        self.fast_path_min_coverage = get_float_env('FAST_PATH_MIN_TEXT_COVERAGE', 0.9)
+        self.fast_path_max_image_ratio = get_float_env('FAST_PATH_MAX_IMAGE_PAGE_RATIO', 0.0)
+        self._route_stats: Dict[str, Dict[str, float]] = {}
+        self._route_stats_lock = threading.Lock()
+        # 上传前在进程池中缩放并重新编码图片，IMAGE_TRANSCODE_ENABLED=false时为None
+        self.image_transcoder = ImageTranscoder.from_env()
+        # 直接上传的文件大小上限，以及接收时在内存中缓存的最大字节数
+        self.upload_max_bytes = get_int_env('UPLOAD_MAX_BYTES', self.downloader.max_bytes)
+        self.upload_spool_bytes = get_int_env('UPLOAD_SPOOL_BYTES', 8 * 1024 * 1024)
+        # 合并并发的相同请求：先按URL合并，下载后再按内容哈希合并
+        self._url_flight = SingleFlight()
+        self._content_flight = SingleFlight()
+        # 影响转换结果的选项，作为缓存键的一部分
+        self.conversion_options = {
+            'backend': 'worker_pool' if self.use_worker_pool else 'marker_single',
+            'marker_config': get_json_env('MARKER_CONFIG'),
+            'route': self.default_route,
+            'image_transcode': (
+                [self.image_transcoder.output_format, self.image_transcoder.quality, self.image_transcoder.max_dimension]
+                if self.image_transcoder else None
+            ),
+        }
+
+    def get_worker_pool(self) -> MarkerWorkerPool:
+        """获取（必要时创建并启动）常驻模型的工作进程池"""
+        with self._worker_pool_lock:
+            if self._worker_pool is None:
+                self._worker_pool = MarkerWorkerPool.from_env()
+                self._worker_pool.start()
+                self._page_batcher = PageBatcher.from_env(self._worker_pool)
+            return self._worker_pool
+
+    def warm_up(self, timeout: Optional[float] = None) -> None:
+        """
+        预热：启动工作进程池（各进程加载一次模型），并在每个工作进程上转换一个单页的合成PDF，
+        同时加载文本层检查使用的PDF库，使首个请求不承担这些初始化开销
+
+        Args:
+            timeout: 等待预热完成的最长秒数，None表示不限制
+
+        Raises:
+            WorkerPoolError: 工作进程加载模型或转换失败
+            TimeoutError: 超过timeout仍未完成
+        """
+        started = time.monotonic()
+        temp_dir = tempfile.mkdtemp()
+        try:
+            pdf_path = os.path.join(temp_dir, 'warmup.pdf')
+            with open(pdf_path, 'wb') as f:
+                f.write(synthetic_pdf())
+            classify_pdf(pdf_path)
+            if not self.use_worker_pool:
+                # marker_single每次转换都启动新进程，没有可以常驻的模型
+                logger.info("未启用工作进程池，跳过模型预热")
+                return
+            pool = self.get_worker_pool()
+            if not pool.wait_ready(timeout):
+                raise TimeoutError(f"工作进程加载模型超过{timeout:g}秒仍未完成")
+            # 所有进程都空闲时各领取一个任务，全部完成即每个进程都完成过一次推理
+            futures = [pool.submit(pdf_path) for _ in range(pool.size)]
+            for future in futures:
+                remaining = None if timeout is None else max(0.0, timeout - (time.monotonic() - started))
+                try:
+                    future.result(timeout=remaining)
+                except FutureTimeoutError:
+                    for pending in futures:
+                        pool.cancel(pending)
+                    raise TimeoutError(f"预热超过{timeout:g}秒仍未完成")
+            logger.info(f"工作进程已预热，进程数: {pool.size}，耗时: {time.monotonic() - started:.2f}秒")
+        finally:
+            shutil.rmtree(temp_dir, ignore_errors=True)
+
+    def _convert_on_pool(self, pdf_path: str, options: Optional[Dict[str, Any]] = None) -> ConvertedDocument:
+        """在工作进程池中转换单个文档，启用批处理时小文档与其他请求的页面合并转换"""
+        pool = self.get_worker_pool()
+        if deadline.current() is None:
+            if self._page_batcher is not None:
+                return self._page_batcher.convert(pdf_path, options)
+            return pool.convert(pdf_path, options=options)
+        if self._page_batcher is not None:
+            # 合并批次中的任务与其他请求共享工作进程，超时时只取消尚未开始的任务
+            return deadline.wait_for(self._page_batcher.submit(pdf_path, options), stage='convert')
+        return deadline.wait_for(pool.submit(pdf_path, options=options), cancel=pool.cancel, stage='convert')
+
+    def shutdown(self) -> None:
+        """释放服务持有的后台资源"""
+        with self._worker_pool_lock:
+            if self._page_batcher is not None:
+                self._page_batcher.shutdown()
+                self._page_batcher = None
+            if self._worker_pool is not None:
+                self._worker_pool.shutdown()
+                self._worker_pool = None
+        self.cos_service.shutdown()
+        if self.image_transcoder:
+            self.image_transcoder.shutdown()
+        if self.conversion_cache:
+            self.conversion_cache.close()
+        if self.page_cache:
+            self.page_cache.close()
     
+    def get_stats(self) -> Dict[str, Any]:
+        """返回服务运行统计：请求合并次数、缓存命中情况、页面批处理、工作进程和各转换路径的使用情况"""
+        return {
+            "coalesced_requests": {
+                "by_url": self._url_flight.stats(),
+                "by_content": self._content_flight.stats(),
+            },
+            "conversion_cache": self.conversion_cache.stats() if self.conversion_cache else None,
+            "page_cache": self.page_cache.stats() if self.page_cache else None,
+            "batching": self._page_batcher.stats() if self._page_batcher else None,
+            "worker_pool": self._worker_pool.stats() if self._worker_pool else None,
+            "image_store": self.cos_service.image_stats(),
+            "image_transcode": self.image_transcoder.stats() if self.image_transcoder else None,
+            "routes": self._get_route_stats(),
+        }
+
+    def _get_route_stats(self) -> Dict[str, Dict[str, float]]:
+        """返回各转换路径的使用次数和平均耗时"""
+        with self._route_stats_lock:
+            return {
+                route: {
+                    "count": stats["count"],
+                    "avg_seconds": stats["total_seconds"] / stats["count"] if stats["count"] else 0.0,
+                }
+                for route, stats in self._route_stats.items()
+            }
+
+    def fetch_pdf(self, url: str) -> DownloadResult:
+        """
+        从URL流式下载PDF文件到新建的临时目录
+
+        Args:
+            url: PDF文件的URL
+
+        Returns:
+            下载结果，包含临时文件路径和内容哈希
+
+        Raises:
+            DownloadError: 下载失败
+        """
+        # 从URL获取原始文件名
+        parsed_url = urllib.parse.urlparse(url)
+        original_filename = os.path.basename(parsed_url.path)
+
+        # 创建临时文件夹
+        temp_dir = tempfile.mkdtemp()
+        temp_file_path = os.path.join(temp_dir, self.make_temp_filename(original_filename))
+
+        try:
+            with metrics.stage_timer('download'):
+                result = self.downloader.download(url, temp_file_path)
+        except Exception:
+            shutil.rmtree(temp_dir, ignore_errors=True)
+            raise
+        if not result.from_local_copy:
+            metrics.DOWNLOADED_BYTES.inc(result.size)
+        return result
+
+    def make_temp_filename(self, original_filename: str) -> str:
+        """
+        生成临时文件名：原始文件名_8位随机字符串.扩展名
+
+        Args:
+            original_filename: URL或上传表单中的原始文件名
+
+        Returns:
+            临时文件名；原始文件名为空或不是支持的文档类型时以document.pdf为基础
+        """
+        # 如果没有文件名或不是支持的文档类型，使用默认名称（实际类型在转换前按文件头识别）
+        if not original_filename or os.path.splitext(original_filename)[1].lower() not in EXTENSION_TYPES:
+            original_filename = "document.pdf"
+
+        # 生成8位随机字符串
+        random_suffix = ''.join(random.choices(string.ascii_letters + string.digits, k=8))
+
+        # 分离文件名和扩展名，特殊符号替换为-，避免出现在命令行和COS路径中
+        base_name, extension = os.path.splitext(original_filename)
+        base_name = re.sub(r'[^\w\-.]', '-', base_name)
+        return f"{base_name}_{random_suffix}{extension}"
+
     def download_pdf(self, url: str) -> Optional[str]:
         """
         从URL下载PDF文件
@@ -32,44 +291,20 @@ class PDFConverterService:
             临时文件路径，如果下载失败则返回None
         """
         try:
-            response = requests.get(url, timeout=30)
-            response.raise_for_status()
-            
-            # 从URL获取原始文件名
-            parsed_url = urllib.parse.urlparse(url)
-            original_filename = os.path.basename(parsed_url.path)
-            
-            # 如果URL中没有文件名或不是PDF，使用默认名称
-            if not original_filename or not original_filename.lower().endswith('.pdf'):
-                original_filename = "document.pdf"
-            
-            # 生成8位随机字符串
-            random_suffix = ''.join(random.choices(string.ascii_letters + string.digits, k=8))
-            
-            # 分离文件名和扩展名
-            base_name, extension = os.path.splitext(original_filename)
-            
-            # 创建临时文件夹
-            temp_dir = tempfile.mkdtemp()
-            
-            # 构建新的文件名: 原始文件名_随机字符串.pdf
-            new_filename = f"{base_name}_{random_suffix}{extension}"
-            temp_file_path = os.path.join(temp_dir, new_filename)
-            
-            # 写入文件内容
-            with open(temp_file_path, 'wb') as temp_file:
-                temp_file.write(response.content)
-            
-            print(f"已下载PDF文件: {temp_file_path}")
-            return temp_file_path
+            result = self.fetch_pdf(url)
+            logger.info(f"已下载PDF文件: {result.path}")
+            return result.path
         except Exception as e:
-            print(f"下载PDF文件失败: {e}")
+            logger.warning(f"下载PDF文件失败: {e}")
             return None
     
     def replace_image_urls(self, markdown_text: str, files_dict: Dict[str, str]) -> str:
         """
         替换Markdown文本中的图片URL为COS远程URL
-        
+
+        同时处理Markdown图片语法 ![alt](path) 和HTML的 <img src="path"> 标签，
+        先按完整路径匹配，再按图片文件名匹配，已经是HTTP/HTTPS URL的引用保持不变。
+
         Args:
             markdown_text: 原始Markdown文本
             files_dict: 文件路径和COS URL的映射字典
@@ -79,215 +314,683 @@ class PDFConverterService:
         """
         if not files_dict:
             return markdown_text
-            
-        # 创建一个按路径长度降序排序的文件字典（先匹配长路径，避免子路径误匹配）
-        sorted_files = sorted(files_dict.items(), key=lambda x: len(x[0]), reverse=True)
-        
-        # 图片URL替换计数
-        replace_count = 0
-        
-        # 查找Markdown中的图片引用格式: ![alt](path/to/image.ext)
-        # 正则表达式解释:
-        # !\[ - 开始，必须以![ 开头
-        # [^]]* - 捕获组1，图片alt文本，除了]以外的任何字符
-        # \]\( - 中间的](分隔符
-        # ([^)]+) - 捕获组2，图片URL，除了)以外的任何字符
-        # \) - 结束，必须以)结尾
-        pattern = r'!\[([^]]*)\]\(([^)]+)\)'
-        
-        def replace_url(match):
-            nonlocal replace_count
-            alt_text = match.group(1)
-            image_path = match.group(2)
-            
-            # 去除可能的URL参数和锚点
-            image_path = image_path.split('#')[0].split('?')[0]
-            
-            # 如果已经是完整的HTTP/HTTPS URL，不做替换
-            if image_path.startswith(('http://', 'https://')):
-                return match.group(0)
-                
-            # 尝试找到对应的远程URL
-            replaced = False
-            for local_path, remote_url in sorted_files:
-                # 检查本地路径是否匹配
-                # 1. 完全匹配
-                if local_path == image_path:
-                    replaced = True
-                    replace_count += 1
-                    return f'![{alt_text}]({remote_url})'
-                
-                # 2. 图片引用可能使用相对路径，尝试匹配文件名部分
-                image_filename = os.path.basename(image_path)
-                if os.path.basename(local_path) == image_filename:
-                    # 确保这是图片文件
-                    ext = os.path.splitext(image_filename)[1].lower()
-                    if ext in ['.png', '.jpg', '.jpeg', '.gif', '.svg', '.webp', '.bmp']:
-                        replaced = True
-                        replace_count += 1
-                        return f'![{alt_text}]({remote_url})'
-            
-            # 如果没有找到匹配项，返回原始引用
-            return match.group(0)
-        
-        # 执行替换
-        new_markdown = re.sub(pattern, replace_url, markdown_text)
+
+        rewriter = ImageURLRewriter(files_dict)
+        new_markdown = rewriter.rewrite(markdown_text)
         
-        print(f"图片URL替换完成，共替换了{replace_count}个图片引用")
+        logger.info(f"图片URL替换完成，共替换了{rewriter.replace_count}个图片引用")
         return new_markdown
 
-    def convert_using_command(self, pdf_url: str) -> Tuple[Optional[str], Optional[str], Optional[Dict[str, str]], Optional[str]]:
+    def convert_using_command(
+        self, pdf_url: str, options: Optional[ConversionOptions] = None
+    ) -> Tuple[Optional[str], Optional[str], Optional[Dict[str, str]], Optional[str]]:
         """
-        使用marker_single命令行工具从URL获取PDF并转换为Markdown，并上传到COS
+        从URL获取PDF并使用marker转换为Markdown，并上传到COS
+
+        转换优先交给常驻模型的工作进程池执行；当MARKER_WORKER_POOL_SIZE为0时，
+        退回到每次执行marker_single命令行工具。并发的相同URL请求（以及下载后内容相同的请求）
+        会合并到同一次转换，共享其结果；每个请求按自己的截止时间等待，所有请求都离开后转换才被取消。
 
         Args:
             pdf_url: PDF文件的URL
+            options: 转换选项，未指定时使用服务端配置
 
         Returns:
             元组 (转换后的Markdown文本, 主文件URL, 所有文件URL字典, 错误信息)
             如果处理成功，错误信息为None；如果处理失败，Markdown文本为None
+
+        Raises:
+            DeadlineError: 当前请求已超时或已取消
+        """
+        options = options or ConversionOptions()
+        flight_key = json.dumps([pdf_url, options.cache_fingerprint()], sort_keys=True)
+        result, shared = self._do_shared(self._url_flight, flight_key, lambda: self._convert_url(pdf_url, options))
+        if shared:
+            logger.info(f"已合并到进行中的相同URL转换: {pdf_url}")
+        return self._copy_result(result)
+
+    def _do_shared(self, flight: SingleFlight, key: str, fn: Callable[[], Any]) -> Tuple[Any, bool]:
+        """
+        合并执行相同的转换
+
+        转换在单独的线程中执行，其中记录的任务统计信息交回发起转换的请求，被合并的请求只沿用转换路径。
+        是否需要部分结果决定了是否按块转换，因此需要和不需要部分结果的请求不会合并。
         """
+        reporter = progress.current()
+        key = json.dumps([key, reporter is not None and reporter.partial_results])
+
+        def run():
+            self._job_context.stats = {}
+            return fn(), self._job_context.stats
+
+        (result, stats), shared = flight.do(key, run)
+        for name, value in stats.items():
+            if not shared or name == 'route':
+                self._set_job_stat(name, value)
+        return result, shared
+
+    def _copy_result(
+        self, result: Tuple[Optional[str], Optional[str], Optional[Dict[str, str]], Optional[str]]
+    ) -> Tuple[Optional[str], Optional[str], Optional[Dict[str, str]], Optional[str]]:
+        """复制转换结果中的文件URL字典，避免被合并的多个请求共享同一个可变对象"""
+        markdown_text, file_url, files_dict, error_message = result
+        return markdown_text, file_url, dict(files_dict) if files_dict is not None else None, error_message
+
+    def _convert_url(
+        self, pdf_url: str, options: ConversionOptions
+    ) -> Tuple[Optional[str], Optional[str], Optional[Dict[str, str]], Optional[str]]:
+        """下载PDF并查询缓存，未命中时按内容哈希合并后执行转换"""
         pdf_path = None
-        output_dir = None
-        markdown_text = None
-        file_url = None
-        files_dict = None
-        error_message = None
-        pdf_dir_name = None
 
         try:
-            # 步骤1: 下载PDF文件
-            pdf_path = self.download_pdf(pdf_url)
-            if not pdf_path:
-                return None, None, None, "无法下载PDF文件"
+            # 步骤1: 流式下载PDF文件，同时计算内容哈希
+            progress.report("stage", stage="downloading")
+            try:
+                download = self.fetch_pdf(pdf_url)
+            except DownloadError as e:
+                logger.warning(f"下载PDF文件失败: {e}")
+                return None, None, None, f"无法下载PDF文件: {e}"
+            pdf_path = download.path
 
-            # 获取pdf文件名,去除.pdf后缀
-            pdf_basename = os.path.basename(pdf_path)
-            pdf_name = os.path.splitext(pdf_basename)[0]
+            # 步骤1.5: 按PDF内容哈希查询转换缓存，未命中时执行转换
+            return self._convert_local_file(pdf_path, download.content_hash, options)
+        except deadline.DeadlineError:
+            # 超时和取消不能变成普通的错误结果，合并等待的请求据此重新发起转换
+            raise
+        except Exception as e:
+            return None, None, None, f"执行命令时发生错误: {str(e)}"
+        finally:
+            # 清理下载的临时PDF文件及其目录
+            self._remove_temp_file(pdf_path)
 
-            # 步骤2: 创建临时输出目录
-            output_dir = tempfile.mkdtemp()
-            
-            # marker生成的文件夹名称 (pdf文件名)
-            pdf_dir_name = pdf_name
-            output_pdf_dir = os.path.join(output_dir, pdf_dir_name)
-            output_file_path = os.path.join(output_pdf_dir, f"{pdf_name}.md")
+    def convert_uploaded_file(
+        self, file_path: str, content_hash: str, options: Optional[ConversionOptions] = None
+    ) -> Tuple[Optional[str], Optional[str], Optional[Dict[str, str]], Optional[str]]:
+        """
+        转换客户端直接上传的文件，不需要再下载
+
+        Args:
+            file_path: 上传文件的本地路径，转换结束后连同所在的临时目录一起删除
+            content_hash: 文件内容的SHA-256（接收上传时已经计算）
+            options: 转换选项，未指定时使用服务端配置
+
+        Returns:
+            元组 (转换后的Markdown文本, 主文件URL, 所有文件URL字典, 错误信息)
+
+        Raises:
+            DeadlineError: 当前请求已超时或已取消
+        """
+        try:
+            return self._convert_local_file(file_path, content_hash, options or ConversionOptions())
+        except deadline.DeadlineError:
+            raise
+        except Exception as e:
+            return None, None, None, f"执行命令时发生错误: {str(e)}"
+        finally:
+            self._remove_temp_file(file_path)
+
+    def _convert_local_file(
+        self, pdf_path: str, content_hash: str, options: ConversionOptions
+    ) -> Tuple[Optional[str], Optional[str], Optional[Dict[str, str]], Optional[str]]:
+        """查询转换缓存，未命中时按内容哈希合并后执行转换"""
+        # 按PDF内容哈希查询转换缓存，命中时直接返回之前的结果
+        cache_key = self.make_cache_key(content_hash, options)
+        cached = self.get_cached_result(cache_key)
+        if cached:
+            logger.info(f"命中转换缓存，PDF哈希: {content_hash}，Markdown URL: {cached[1]}")
+            progress.report("stage", stage="cached")
+            self._set_job_stat('route', 'cache')
+            return cached
+
+        # 内容相同的PDF（即使来自不同URL）只执行一次转换
+        content_key = cache_key or json.dumps([content_hash, options.cache_fingerprint()], sort_keys=True)
+        result, shared = self._do_shared(
+            self._content_flight, content_key,
+            lambda: self._convert_pdf_file(pdf_path, content_hash, cache_key, options),
+        )
+        if shared:
+            logger.info(f"已合并到进行中的相同内容转换，PDF哈希: {content_hash}")
+        return self._copy_result(result)
+
+    def make_cache_key(self, content_hash: str, options: ConversionOptions) -> Optional[str]:
+        """生成转换缓存键，未启用缓存时返回None"""
+        if not self.conversion_cache:
+            return None
+        return self.conversion_cache.make_key(
+            content_hash, {**self.conversion_options, **options.cache_fingerprint()}
+        )
+
+    def get_cached_result(
+        self, cache_key: Optional[str]
+    ) -> Optional[Tuple[Optional[str], Optional[str], Optional[Dict[str, str]], Optional[str]]]:
+        """
+        查询转换缓存
+
+        Returns:
+            命中时返回元组 (Markdown文本, 主文件URL, 所有文件URL字典, None)，未命中或未启用缓存时返回None
+        """
+        if not cache_key:
+            return None
+        with metrics.stage_timer('cache_lookup'):
+            cached = self.conversion_cache.get(cache_key)
+        if not cached:
+            return None
+        return cached['markdown_text'], cached['file_url'], cached['files_dict'], None
+
+    def _remove_temp_file(self, file_path: Optional[str]) -> None:
+        """删除临时文件及其所在的临时目录"""
+        try:
+            if file_path and os.path.exists(file_path):
+                os.unlink(file_path)
+                temp_dir = os.path.dirname(file_path)
+                if temp_dir and os.path.exists(temp_dir):
+                    shutil.rmtree(temp_dir, ignore_errors=True)
+                logger.debug(f"已删除临时文件和目录: {file_path}")
+        except Exception as cleanup_error:
+            logger.warning(f"清理临时文件时发生错误: {cleanup_error}")
+
+    def _convert_pdf_file(
+        self, pdf_path: str, content_hash: str, cache_key: Optional[str], options: ConversionOptions
+    ) -> Tuple[Optional[str], Optional[str], Optional[Dict[str, str]], Optional[str]]:
+        """
+        转换本地PDF文件，上传资源文件和Markdown到COS，并写入转换缓存
+
+        常驻的转换器直接在内存中返回Markdown和编码后的图片，图片从内存缓冲区上传，
+        Markdown改写后通过upload_content上传，整个过程不写临时文件。
+
+        Args:
+            pdf_path: 本地PDF文件路径
+            content_hash: PDF内容的SHA-256
+            cache_key: 转换缓存键，未启用缓存时为None
+            options: 转换选项
+
+        Returns:
+            元组 (转换后的Markdown文本, 主文件URL, 所有文件URL字典, 错误信息)
+
+        Raises:
+            DeadlineError: 转换已超时或已取消
+        """
+        try:
+            converted = self.convert_file(pdf_path, options)
+            return self.publish_converted(converted, content_hash, cache_key)
+        except ConversionError as e:
+            return None, None, None, e.message
+        except deadline.DeadlineError:
+            raise
+        except Exception as e:
+            return None, None, None, f"执行命令时发生错误: {str(e)}"
+
+    def convert_file(self, pdf_path: str, options: ConversionOptions) -> ConvertedFile:
+        """
+        选择转换路径并把本地文件转换为内存中的结果，不上传
+
+        Args:
+            pdf_path: 本地PDF文件路径
+            options: 转换选项
+
+        Returns:
+            内存中的转换结果
+
+        Raises:
+            ConversionError: 转换失败
+        """
+        # 获取pdf文件名,去除.pdf后缀
+        pdf_name = os.path.splitext(os.path.basename(pdf_path))[0]
+
+        # 步骤2: 预分类选择转换路径并执行转换，得到内存中的转换结果
+        deadline.check('convert')
+        with metrics.stage_timer('classify'):
+            route = self._choose_route(pdf_path, options)
+        progress.report("stage", stage="converting", route=route)
+        self._set_job_stat('route', route)
+        conversion_started = time.perf_counter()
+        page_plan = None
+        if route == 'marker' and self.page_cache:
+            with metrics.stage_timer('page_plan'):
+                page_plan = self._plan_pages(pdf_path)
+        converted_pages: Dict[int, str] = {}
+        with metrics.stage_timer('convert'):
+            if page_plan is not None:
+                document, converted_pages = self._convert_pages(pdf_path, pdf_name, page_plan, options)
+            else:
+                document = self._convert_document(pdf_path, pdf_name, route, options)
+                if route == 'text' and not document.markdown.strip():
+                    # 指定了文本层路径但PDF没有文本层（扫描件、纯图片），退回到marker而不是返回空文档
+                    logger.warning(f"PDF没有文本层，改用marker转换: {pdf_path}")
+                    route = 'marker'
+                    self._set_job_stat('route', route)
+                    progress.report("stage", stage="converting", route=route)
+                    document = self._convert_document(pdf_path, pdf_name, route, options)
+        self._record_route(route, time.perf_counter() - conversion_started)
+        logger.info(
+            f"转换完成，Markdown长度: {len(document.markdown)}，图片数量: {len(document.images)}",
+            extra={'route': route, 'duration': round(time.perf_counter() - conversion_started, 6)},
+        )
+        total_pages = self._count_pages(pdf_path) if route not in OFFICE_DOCUMENT_TYPES else None
+        if total_pages:
+            metrics.PAGES_CONVERTED.inc(total_pages, route=route)
+            # 任务调度器据此更新每页耗时的估计
+            self._set_job_stat('pages', total_pages)
+        reporter = progress.current()
+        if reporter is not None and not reporter.pages_reported:
+            # 没有按块推送过的转换（快速路径、整篇转换）在完成时一次推送整篇文档
+            progress.report_markdown(list(range(total_pages or 0)), document.markdown, total_pages)
+        return ConvertedFile(document, pdf_name, route, page_plan, converted_pages)
+
+    def publish_converted(
+        self, converted: ConvertedFile, content_hash: str, cache_key: Optional[str]
+    ) -> Tuple[Optional[str], Optional[str], Optional[Dict[str, str]], Optional[str]]:
+        """
+        上传内存中的转换结果到COS，并写入转换缓存和页面缓存
+
+        Args:
+            converted: 内存中的转换结果
+            content_hash: PDF内容的SHA-256
+            cache_key: 转换缓存键，未启用缓存时为None
+
+        Returns:
+            元组 (转换后的Markdown文本, 主文件URL, 所有文件URL字典, 错误信息)
+        """
+        page_plan = converted.page_plan
+        # 步骤3: 上传资源文件和Markdown到COS
+        deadline.check('upload')
+        progress.report("stage", stage="uploading")
+        result = self._publish_document(
+            converted.document, converted.pdf_name, content_hash, cache_key,
+            extra_files=page_plan.cached_files() if page_plan else None,
+        )
+
+        # 步骤4: 把重新转换的页面写入页面缓存
+        if page_plan is not None and converted.converted_pages and result[1]:
+            self.page_cache.put_many(page_plan.build_entries(converted.converted_pages, result[2]))
+        return result
+
+    def _convert_document(
+        self, pdf_path: str, pdf_name: str, route: str, options: ConversionOptions
+    ) -> ConvertedDocument:
+        """
+        按选定的路径执行转换
+
+        Raises:
+            ConversionError: 转换失败
+        """
+        if route in OFFICE_DOCUMENT_TYPES:
+            logger.info(f"使用{route.upper()}快速路径转换: {pdf_path}")
+            return convert_office_document(pdf_path, route)
+        if route == 'text':
+            logger.info(f"使用文本层快速路径转换: {pdf_path}")
+            return extract_markdown(pdf_path)
+        if not self.use_worker_pool:
+            return self._convert_with_command(pdf_path, pdf_name)
+
+        # 优先使用常驻模型的工作进程池，阻塞等待完成
+        try:
+            shards = self._plan_shards(pdf_path, options)
+            reporter = progress.current()
+            if not shards and reporter is not None and reporter.partial_results:
+                # 需要推送部分结果时按块转换，每块完成即可推送
+                shards = plan_shards(get_page_count(pdf_path), self.stream_chunk_pages)
+            if shards:
+                # 大文档按页范围拆分，各分片在多个工作进程中并行转换后按顺序拼接
+                logger.info(f"按页拆分为{len(shards)}个分片并行转换: {pdf_path}")
+                total_pages = shards[-1][-1] + 1
+                document = convert_shards(
+                    self.get_worker_pool(), pdf_path, shards,
+                    on_shard=lambda pages, shard: progress.report_markdown(pages, shard.markdown, total_pages),
+                )
+            else:
+                logger.info(f"提交转换任务到marker工作进程池: {pdf_path}")
+                document = self._convert_on_pool(pdf_path)
+        except WorkerPoolError as e:
+            raise ConversionError(f"转换失败: {e}")
+        logger.info("marker工作进程转换完成")
+        return document
+
+    def _plan_pages(self, pdf_path: str) -> Optional[PagePlan]:
+        """计算每页内容哈希并查询页面缓存，页数太少或无法解析时返回None"""
+        try:
+            page_hashes = hash_pages(pdf_path)
+        except Exception as e:
+            logger.warning(f"计算页面哈希失败，跳过页面缓存: {e}")
+            return None
+        if len(page_hashes) < self.page_cache_min_pages:
+            return None
+        fingerprint = {'marker_config': self.conversion_options['marker_config']}
+        page_keys = [self.page_cache.make_key(page_hash, fingerprint) for page_hash in page_hashes]
+        found = self.page_cache.get_many(page_keys)
+        plan = PagePlan(
+            page_keys=page_keys,
+            cached={index: found[key] for index, key in enumerate(page_keys) if key in found},
+            missing=[index for index, key in enumerate(page_keys) if key not in found],
+        )
+        stats = plan.stats()
+        logger.info(f"页面缓存: 共{stats['pages']}页，命中{stats['hits']}页，需要转换{stats['misses']}页")
+        self._set_job_stat('page_cache', stats)
+        return plan
+
+    def _convert_pages(
+        self, pdf_path: str, pdf_name: str, plan: PagePlan, options: ConversionOptions
+    ) -> Tuple[ConvertedDocument, Dict[int, str]]:
+        """
+        只把页面缓存未命中的页面交给marker转换，再与缓存的页面按页序拼接
+
+        Returns:
+            元组 (拼接后的转换结果, 重新转换的页码到该页Markdown的映射)
+
+        Raises:
+            ConversionError: 转换失败
+        """
+        if not plan.missing:
+            logger.info("所有页面均命中页面缓存，跳过marker转换")
+            return ConvertedDocument(markdown=plan.assemble({}), metadata={'page_cache': plan.stats()}), {}
+
+        # 缺失的页面按分片大小拆分，开启分页输出以便按页拆分结果
+        pool = self.get_worker_pool()
+        shard_pages = options.shard_pages if options.shard_pages is not None else self.default_shard_pages
+        reporter = progress.current()
+        if not shard_pages and reporter is not None and reporter.partial_results:
+            # 需要推送部分结果时按块转换，每块完成即可推送
+            shard_pages = self.stream_chunk_pages
+        shards = [[plan.missing[index] for index in shard] for shard in plan_shards(len(plan.missing), shard_pages)]
+        try:
+            if shards:
+                logger.info(f"按页拆分为{len(shards)}个分片并行转换{len(plan.missing)}个未命中的页面: {pdf_path}")
+                document = convert_shards(
+                    pool, pdf_path, shards, options={'paginate_output': True},
+                    on_shard=self._page_chunk_reporter(plan),
+                )
+            else:
+                logger.info(f"提交{len(plan.missing)}个未命中的页面到marker工作进程池: {pdf_path}")
+                document = self._convert_on_pool(
+                    pdf_path, options={'page_range': plan.missing, 'paginate_output': True}
+                )
+        except WorkerPoolError as e:
+            raise ConversionError(f"转换失败: {e}")
+
+        converted_pages = split_pages(document.markdown)
+        if converted_pages is None:
+            if plan.cached:
+                # 转换器没有输出分页分隔行，无法与缓存的页面拼接，退回到整篇转换
+                logger.info("转换结果中没有分页分隔行，退回到整篇转换")
+                return self._convert_document(pdf_path, pdf_name, 'marker', options), {}
+            return document, {}
+        document = ConvertedDocument(
+            markdown=plan.assemble(converted_pages),
+            images=document.images,
+            metadata={**document.metadata, 'page_cache': plan.stats()},
+        )
+        return document, converted_pages
+
+    def _page_chunk_reporter(self, plan: PagePlan) -> Callable[[List[int], ConvertedDocument], None]:
+        """
+        返回页面缓存路径的分片回调：每完成一个分片，按页序推送到该分片最后一页为止尚未推送的页面
+
+        推送的内容包含其间命中缓存的页面，最后一个分片连同之后的缓存页面一起推送。
+        """
+        total_pages = len(plan.page_keys)
+        reported = [0]
+
+        def on_shard(pages: List[int], shard: ConvertedDocument) -> None:
+            converted = split_pages(shard.markdown)
+            if converted is None:
+                # 没有分页分隔行时无法按页拼接，转换结束后再推送整篇文档
+                return
+            end = total_pages if pages[-1] == plan.missing[-1] else pages[-1] + 1
+            chunk = list(range(reported[0], end))
+            reported[0] = end
+            progress.report_markdown(chunk, plan.assemble(converted, chunk), total_pages)
+
+        return on_shard
+
+    def _get_job_stat(self, name: str) -> Any:
+        """读取当前线程正在执行的任务的统计信息"""
+        return (getattr(self._job_context, 'stats', None) or {}).get(name)
+
+    def _set_job_stat(self, name: str, value: Any) -> None:
+        """记录当前线程正在执行的任务的统计信息"""
+        stats = getattr(self._job_context, 'stats', None)
+        if stats is not None:
+            stats[name] = value
+
+    def _convert_with_command(self, pdf_path: str, pdf_name: str) -> ConvertedDocument:
+        """
+        执行marker_single命令行工具转换，并把输出目录读入内存
+
+        Raises:
+            ConversionError: 命令执行失败或未找到输出文件
+            DeadlineError: 请求已超时或已取消，命令进程已被终止
+        """
+        output_dir = tempfile.mkdtemp()
+        try:
             # 获取当前文件执行的绝对路径
             current_dir = os.path.dirname(os.path.abspath(__file__))
-
-            # 步骤3: 执行marker_single命令 - 使用阻塞方式等待完成
             activate_command = f"source {current_dir}/../.venv/bin/activate"
             program = f"marker_single {pdf_path} --output_dir {output_dir}"
 
             cmd = ["bash", "-c", f'{activate_command} && {program}']
-            print(f"开始执行命令: {' '.join(cmd)}")
-            process = subprocess.run(
+            logger.info(f"开始执行命令: {' '.join(cmd)}")
+            # 在新的进程组中执行，超时或取消时连同marker的子进程一起终止
+            process = subprocess.Popen(
                 cmd,
-                capture_output=True,
+                stdout=subprocess.PIPE,
+                stderr=subprocess.PIPE,
                 text=True,
-                check=False
+                start_new_session=True,
             )
+            while True:
+                try:
+                    _, stderr = process.communicate(timeout=deadline.clamp(deadline.POLL_INTERVAL))
+                    break
+                except subprocess.TimeoutExpired:
+                    if deadline.aborted():
+                        logger.warning(f"终止超时或已取消的marker_single进程，PID: {process.pid}")
+                        try:
+                            os.killpg(process.pid, signal.SIGKILL)
+                        except ProcessLookupError:
+                            pass
+                        process.communicate()
+                        deadline.check('convert')
 
-            # 步骤4: 检查命令执行结果
-            print(f"命令执行完成，返回码: {process.returncode}")
+            # 检查命令执行结果，进程退出时输出文件已经全部写完
+            logger.info(f"命令执行完成，返回码: {process.returncode}")
             if process.returncode != 0:
-                error_message = f"命令执行失败: {process.stderr}"
-                return None, None, None, error_message
-
-            # 步骤5: 等待短暂时间确保文件写入完成
-            time.sleep(1)
+                raise ConversionError(f"命令执行失败: {stderr}")
 
-            # 步骤6: 检查输出目录是否存在
-            if not os.path.exists(output_pdf_dir):
-                # 尝试列出输出目录中的内容
+            # marker生成的文件夹名称 (pdf文件名)
+            output_pdf_dir = os.path.join(output_dir, pdf_name)
+            output_file_path = os.path.join(output_pdf_dir, f"{pdf_name}.md")
+            if not os.path.exists(output_file_path):
+                # 列出输出目录中的所有文件
                 available_files = []
                 for root, dirs, files in os.walk(output_dir):
                     for file in files:
                         available_files.append(os.path.join(root, file))
-                error_message = f"转换后的目录不存在: {output_pdf_dir}。可用文件: {available_files}"
-                return None, None, None, error_message
-
-            # 步骤7: 读取生成的Markdown文件
-            if os.path.exists(output_file_path):
-                with open(output_file_path, 'r', encoding='utf-8') as f:
-                    markdown_text = f.read()
-                print(f"成功读取Markdown文件，长度: {len(markdown_text)}")
-                
-                # 步骤8: 上传整个目录到COS (除了主Markdown文件)
-                # 生成COS上的基础路径：pdf文件名_时间戳
-                timestamp = int(time.time())
-                # 如果pdf_name以document开头，说明这个文件没有文件名，需要使用markdown内容中去提取文件名
-                if pdf_name.startswith("document"):
-                    # 提取markdown内容中的标题，第一个以#开头的行
-                    pdf_name = re.search(r'^# (.*)', markdown_text, re.MULTILINE).group(1)
-                    # 特殊符号处理，空格等全部替换为-
-                    pdf_name = re.sub(r'[^\w\-]', '-', pdf_name)
-                cos_base_path = f"tmp/{pdf_name}_{timestamp}"
-                
-                # 上传资源文件（图片等）
-                print(f"开始上传资源文件到COS: {output_pdf_dir} -> {cos_base_path}")
-                # 先上传除主Markdown文件外的所有文件
-                files_dict = {}
-                for root, dirs, files in os.walk(output_pdf_dir):
-                    for file in files:
-                        file_path = os.path.join(root, file)
-                        # 跳过主Markdown文件，我们将在替换URL后再上传它
-                        if file_path == output_file_path:
-                            continue
-                        
-                        # 计算相对路径
-                        rel_path = os.path.relpath(file_path, output_pdf_dir)
-                        # 上传文件并获取URL
-                        file_url = self.cos_service.upload_file(file_path, f"{cos_base_path}/{rel_path}")
-                        if file_url:
-                            files_dict[rel_path] = file_url
-                            
-                # 步骤9: 替换Markdown中的图片引用为COS URL
-                if files_dict:
-                    markdown_text = self.replace_image_urls(markdown_text, files_dict)
-                    print("已完成Markdown中图片引用的替换")
-                    
-                    # 将替换后的内容写回原文件
-                    with open(output_file_path, 'w', encoding='utf-8') as f:
-                        f.write(markdown_text)
-                    print("已将替换后的内容写入原Markdown文件")
-                
-                # 步骤10: 上传替换后的Markdown文件
-                main_md_rel_path = f"{pdf_name}.md"
-                file_url = self.cos_service.upload_file(output_file_path, f"{cos_base_path}/{main_md_rel_path}")
-                if file_url:
-                    print(f"已上传替换后的Markdown文件: {file_url}")
-                    files_dict[main_md_rel_path] = file_url
-                else:
-                    print("警告: 上传替换后的Markdown文件失败")
-            else:
-                available_files = []
-                # 列出输出目录下的所有文件
-                for root, dirs, files in os.walk(output_pdf_dir):
-                    for file in files:
-                        available_files.append(os.path.join(root, file))
+                raise ConversionError(f"命令执行成功但未找到Markdown文件: {output_file_path}。可用文件: {available_files}")
+            return read_document(output_dir, pdf_name)
+        finally:
+            # 清理临时输出目录（下载的PDF由调用方清理）
+            shutil.rmtree(output_dir, ignore_errors=True)
+            logger.debug(f"已删除临时输出目录: {output_dir}")
+
+    def _publish_document(
+        self,
+        document: ConvertedDocument,
+        pdf_name: str,
+        content_hash: str,
+        cache_key: Optional[str],
+        extra_files: Optional[Dict[str, str]] = None,
+    ) -> Tuple[Optional[str], Optional[str], Optional[Dict[str, str]], Optional[str]]:
+        """
+        从内存上传转换结果中的资源文件，改写图片引用后上传Markdown，并写入转换缓存
+
+        Args:
+            document: 转换结果
+            pdf_name: 文档名称
+            content_hash: PDF内容的SHA-256
+            cache_key: 转换缓存键，未启用缓存时为None
+            extra_files: 已经上传过的资源文件URL（例如命中页面缓存的页面引用的图片），合并到返回的文件URL字典中
+
+        Returns:
+            元组 (转换后的Markdown文本, 主文件URL, 所有文件URL字典, 错误信息)
+        """
+        markdown_text = document.markdown
+        # 可选的图片转码：相对路径保持不变，只有上传的文件名使用新的扩展名
+        images = document.images
+        filenames: Dict[str, str] = {}
+        if self.image_transcoder is not None and images:
+            with metrics.stage_timer('transcode'):
+                transcoded = self.image_transcoder.transcode(images)
+            images, filenames = transcoded.images, transcoded.filenames
+            self._set_job_stat('image_transcode', transcoded.stats())
+        # 与marker_single的输出目录一致，元数据作为资源文件一起上传
+        assets = dict(images)
+        assets[f"{pdf_name}_meta.json"] = encode_metadata(document.metadata)
 
-                error_message = f"命令执行成功但未找到Markdown文件: {output_file_path}。可用文件: {available_files}"
+        # 生成COS上的基础路径：pdf文件名_时间戳
+        timestamp = int(time.time())
+        # 如果pdf_name以document开头，说明这个文件没有文件名，需要使用markdown内容中去提取文件名
+        if pdf_name.startswith("document"):
+            # 提取markdown内容中的标题，第一个以#开头的行；没有标题时保留原名称
+            title_match = re.search(r'^# (.*)', markdown_text, re.MULTILINE)
+            if title_match:
+                # 特殊符号处理，空格等全部替换为-
+                pdf_name = re.sub(r'[^\w\-]', '-', title_match.group(1))
+        cos_base_path = f"tmp/{pdf_name}_{timestamp}"
 
+        # 步骤4: 从内存缓冲区并发上传资源文件（图片等）
+        # 启用去重图片存储时图片按内容哈希上传到共享前缀，相同的图片只上传一次
+        shared_images = images if self.cos_service.image_index is not None else {}
+        logger.info(f"开始上传资源文件到COS: {len(assets)}个 -> {cos_base_path}")
+        upload_items = [
+            (rel_path, data, f"{cos_base_path}/{filenames.get(rel_path, rel_path)}")
+            for rel_path, data in assets.items() if rel_path not in shared_images
+        ]
+        with metrics.stage_timer('upload_assets'):
+            upload_report = self.cos_service.upload_many(upload_items)
+            uploaded_images = sum(1 for rel_path in images if rel_path in upload_report.urls)
+            if shared_images:
+                image_report = self.cos_service.upload_images(list(shared_images.items()), filenames)
+                uploaded_images = len(shared_images) - image_report.deduplicated - len(image_report.failed)
+                upload_report.merge(image_report)
+                self._set_job_stat('image_dedup', {
+                    'images': len(shared_images),
+                    'deduplicated': image_report.deduplicated,
+                    'deduplicated_bytes': image_report.deduplicated_bytes,
+                })
+        metrics.IMAGES_UPLOADED.inc(max(0, uploaded_images))
+        files_dict = {**(extra_files or {}), **upload_report.urls}
+        failed_uploads = len(upload_report.failed)
+        if failed_uploads:
+            metrics.STAGE_FAILURES.inc(stage='upload_assets')
+        if upload_report.timings:
+            slowest = max(upload_report.timings, key=upload_report.timings.get)
+            logger.info(f"资源文件上传耗时: {upload_report.elapsed:.2f}秒，"
+                        f"最慢的文件: {slowest} ({upload_report.timings[slowest]:.2f}秒)")
+
+        # 步骤5: 替换Markdown中的图片引用为COS URL
+        if upload_report.urls:
+            with metrics.stage_timer('rewrite'):
+                markdown_text = self.replace_image_urls(markdown_text, upload_report.urls)
+            logger.info("已完成Markdown中图片引用的替换")
+
+        # 步骤6: 直接上传替换后的Markdown内容
+        deadline.check('upload')
+        main_md_rel_path = f"{pdf_name}.md"
+        with metrics.stage_timer('upload_markdown'):
+            file_url = self.cos_service.upload_content(markdown_text, f"{cos_base_path}/{main_md_rel_path}")
+        if file_url:
+            logger.info(f"已上传替换后的Markdown文件: {file_url}")
+            files_dict[main_md_rel_path] = file_url
+            # 只缓存所有资源文件都上传成功的结果
+            if cache_key and failed_uploads == 0:
+                self.conversion_cache.put(cache_key, content_hash, markdown_text, file_url, files_dict)
+        else:
+            metrics.STAGE_FAILURES.inc(stage='upload_markdown')
+            logger.warning("上传替换后的Markdown文件失败")
+        return markdown_text, file_url, files_dict, None
+
+    def _choose_route(self, pdf_path: str, options: ConversionOptions) -> str:
+        """
+        选择转换路径
+
+        Returns:
+            'docx'/'html' 表示使用对应的文档转换器，'text' 表示走文本层快速路径，'marker' 表示使用marker模型
+        """
+        # DOCX和HTML不需要marker模型，按文件头识别后直接转换
+        document_type = detect_document_type(pdf_path)
+        if document_type in OFFICE_DOCUMENT_TYPES:
+            return document_type
+
+        route = options.route or self.default_route
+        if route != 'auto':
+            return route
+        started = time.perf_counter()
+        try:
+            classification = classify_pdf(
+                pdf_path,
+                min_chars_per_page=self.fast_path_min_chars,
+                min_text_coverage=self.fast_path_min_coverage,
+                max_image_page_ratio=self.fast_path_max_image_ratio,
+            )
         except Exception as e:
-            error_message = f"执行命令时发生错误: {str(e)}"
-        finally:
-            # 步骤11: 清理临时文件 - 确保串行处理完成后再清理
-            try:
-                if pdf_path and os.path.exists(pdf_path):
-                    # 删除PDF文件
-                    os.unlink(pdf_path)
-                    # 删除包含PDF的临时目录
-                    pdf_temp_dir = os.path.dirname(pdf_path)
-                    if pdf_temp_dir and os.path.exists(pdf_temp_dir) and pdf_temp_dir != output_dir:
-                        shutil.rmtree(pdf_temp_dir, ignore_errors=True)
-                    print(f"已删除临时PDF文件和目录: {pdf_path}")
-
-                if output_dir and os.path.exists(output_dir):
-                    shutil.rmtree(output_dir, ignore_errors=True)
-                    print(f"已删除临时输出目录: {output_dir}")
-            except Exception as cleanup_error:
-                print(f"清理临时文件时发生错误: {cleanup_error}")
-
-        # 所有处理完成后再返回结果
-        return markdown_text, file_url, files_dict, error_message
\ No newline at end of file
+            logger.warning(f"PDF预分类失败，使用marker转换: {e}")
+            return 'marker'
+        route = 'text' if classification.is_text_native else 'marker'
+        logger.info(
+            f"PDF预分类完成，耗时{time.perf_counter() - started:.3f}秒: 共{classification.page_count}页，"
+            f"文本页{classification.text_pages}，含图片页{classification.image_pages}，"
+            f"仅图片页{classification.image_only_pages}，选择路径: {route}"
+        )
+        return route
+
+    def _record_route(self, route: str, elapsed: float) -> None:
+        """记录各转换路径的使用次数和耗时"""
+        with self._route_stats_lock:
+            stats = self._route_stats.setdefault(route, {"count": 0, "total_seconds": 0.0})
+            stats["count"] += 1
+            stats["total_seconds"] += elapsed
+
+    def _count_pages(self, pdf_path: str) -> Optional[int]:
+        """读取PDF的页数，无法解析时返回None"""
+        try:
+            return get_page_count(pdf_path)
+        except Exception:
+            return None
+
+    def _plan_shards(self, pdf_path: str, options: ConversionOptions) -> List[List[int]]:
+        """根据请求或服务端配置的分片大小规划页范围分片，不需要拆分时返回空列表"""
+        shard_pages = options.shard_pages if options.shard_pages is not None else self.default_shard_pages
+        if shard_pages <= 0:
+            return []
+        return plan_shards(get_page_count(pdf_path), shard_pages)
+
+    def run_conversion_job(self, payload: Dict[str, Any]) -> Dict[str, Any]:
+        """
+        执行一个转换任务，供任务调度器调用
+
+        Args:
+            payload: 任务参数，包含pdf_url（或直接上传的upload_path和content_hash）和可选的options
+
+        Returns:
+            结果字典，包含file_url、files_dict和使用的转换路径route（命中转换缓存时为cache）
+
+        Raises:
+            ConversionError: 转换失败或未能获取Markdown文件URL
+            DeadlineError: 任务已超时或已取消
+        """
+        options = ConversionOptions(**payload.get("options", {}))
+        self._job_context.stats = {}
+        if payload.get("upload_path"):
+            markdown_text, file_url, files_dict, error = self.convert_uploaded_file(
+                payload["upload_path"], payload["content_hash"], options
+            )
+        else:
+            markdown_text, file_url, files_dict, error = self.convert_using_command(payload["pdf_url"], options)
+        if not markdown_text or not file_url:
+            # 各阶段把超时转换成了错误信息，这里恢复为独立的超时错误
+            deadline.check()
+        if not markdown_text:
+            raise ConversionError(error if error else "未知错误")
+        if not file_url:
+            raise ConversionError("无法获取转换后的Markdown文件URL", status_code=500)
+        return {"file_url": file_url, "files_dict": files_dict, **self._job_context.stats}
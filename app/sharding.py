@@ -0,0 +1,137 @@
+"""
+按页范围拆分大文档并行转换
+"""
+import logging
+import os
+from concurrent.futures import Future
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from app import deadline
+from app.image_rewriter import ImageURLRewriter
+from app.worker_pool import ConvertedDocument, MarkerWorkerPool
+
+logger = logging.getLogger(__name__)
+
+
+def get_page_count(pdf_path: str) -> int:
+    """读取PDF的页数"""
+    import pypdfium2
+
+    pdf = pypdfium2.PdfDocument(pdf_path)
+    try:
+        return len(pdf)
+    finally:
+        pdf.close()
+
+
+def plan_shards(page_count: int, shard_pages: int) -> List[List[int]]:
+    """
+    将页码划分为连续的分片
+
+    Args:
+        page_count: 文档总页数
+        shard_pages: 每个分片的页数
+
+    Returns:
+        每个分片包含的页码（从0开始）列表；不需要拆分时返回空列表
+    """
+    if shard_pages <= 0 or page_count <= shard_pages:
+        return []
+    return [
+        list(range(start, min(start + shard_pages, page_count)))
+        for start in range(0, page_count, shard_pages)
+    ]
+
+
+def rename_shard_images(index: int, document: ConvertedDocument) -> ConvertedDocument:
+    """
+    给分片的图片文件名加上分片序号前缀，并同步改写该分片Markdown中的图片引用
+
+    Args:
+        index: 分片序号
+        document: 分片的转换结果
+
+    Returns:
+        改名后的分片转换结果
+    """
+    renamed = {}
+    images: Dict[str, bytes] = {}
+    for rel_path, data in document.images.items():
+        directory, filename = os.path.split(rel_path)
+        new_rel_path = os.path.join(directory, f"shard{index:03d}_{filename}")
+        renamed[rel_path] = new_rel_path
+        images[new_rel_path] = data
+    markdown = document.markdown
+    if renamed:
+        markdown = ImageURLRewriter(renamed).rewrite(markdown)
+    return ConvertedDocument(markdown=markdown, images=images, metadata=document.metadata)
+
+
+def stitch_documents(documents: List[ConvertedDocument]) -> ConvertedDocument:
+    """
+    按顺序拼接各分片的转换结果
+
+    每个分片的图片文件名加上分片序号前缀以避免冲突，并同步改写该分片Markdown中的图片引用。
+
+    Args:
+        documents: 按页序排列的分片转换结果
+
+    Returns:
+        拼接后的转换结果
+    """
+    markdown_parts = []
+    images: Dict[str, bytes] = {}
+    shard_metadata: List[Dict[str, Any]] = []
+    for index, document in enumerate(documents):
+        document = rename_shard_images(index, document)
+        images.update(document.images)
+        markdown_parts.append(document.markdown.strip('\n'))
+        shard_metadata.append(document.metadata)
+    return ConvertedDocument(
+        markdown="\n\n".join(part for part in markdown_parts if part) + "\n",
+        images=images,
+        metadata={"shards": shard_metadata},
+    )
+
+
+def convert_shards(
+    pool: MarkerWorkerPool,
+    pdf_path: str,
+    shards: List[List[int]],
+    options: Optional[Dict[str, Any]] = None,
+    on_shard: Optional[Callable[[List[int], ConvertedDocument], None]] = None,
+) -> ConvertedDocument:
+    """
+    将各分片提交到工作进程池并行转换，再按顺序拼接
+
+    Args:
+        pool: 工作进程池
+        pdf_path: PDF文件路径
+        shards: 每个分片包含的页码
+        options: 其他marker配置
+        on_shard: 可选，按页序每完成一个分片时调用，参数为分片页码和图片已按拼接规则改名的分片结果
+
+    Returns:
+        拼接后的转换结果
+    """
+    futures: List[Tuple[List[int], Future]] = [
+        (pages, pool.submit(pdf_path, options={**(options or {}), "page_range": pages}))
+        for pages in shards
+    ]
+    documents = []
+    try:
+        for index, (pages, future) in enumerate(futures):
+            documents.append(deadline.wait_for(future, cancel=pool.cancel, stage='convert'))
+            logger.info(f"分片转换完成: 第{pages[0] + 1}-{pages[-1] + 1}页")
+            if on_shard is not None:
+                on_shard(pages, rename_shard_images(index, documents[-1]))
+    except Exception:
+        # 任一分片失败时取消尚未开始的分片；超时或请求取消时连同正在执行的分片一起终止
+        abort = deadline.aborted()
+        for _, future in futures:
+            if abort:
+                pool.cancel(future)
+            else:
+                future.cancel()
+        raise
+    return stitch_documents(documents)
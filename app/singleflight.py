@@ -0,0 +1,127 @@
+"""
+合并并发的相同请求（single-flight）
+"""
+import contextvars
+import threading
+from concurrent.futures import Future
+from typing import Any, Callable, Dict, Tuple
+
+from app import deadline, progress
+
+
+class _Call:
+    """一次进行中的执行：结果、共享的取消状态、共享的进度记录器和仍在等待的调用方数量"""
+
+    def __init__(self, partial_results: bool = False):
+        self.future: Future = Future()
+        # 执行不受任何单个调用方的截止时间限制，所有调用方都离开后才取消
+        self.deadline = deadline.Deadline()
+        # 执行中记录的进度事件转发给每个等待的调用方
+        self.progress = progress.ProgressFanout(partial_results)
+        self.waiters = 0
+
+
+class SingleFlight:
+    """
+    对同一个键的并发调用只执行一次
+
+    第一个调用方在单独的线程中启动执行（继承其上下文），所有调用方（包括第一个）按各自的截止时间等待并共享结果（或异常）。
+    某个调用方超时或被取消时只是离开，执行继续为其他调用方进行；所有调用方都离开后执行才被取消。
+    执行因此被取消时，仍在等待的调用方重新发起执行，而不是收到取消的错误。
+    执行期间记录的进度事件转发给每个调用方上下文中绑定的进度记录器，后加入的调用方先回放之前的事件。
+    执行结束后键被移除，之后的调用会重新执行。
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._calls: Dict[str, _Call] = {}
+        self.executions = 0
+        self.coalesced = 0
+
+    def do(self, key: str, fn: Callable[[], Any]) -> Tuple[Any, bool]:
+        """
+        执行函数，或者等待进行中的相同键的调用
+
+        Args:
+            key: 合并请求使用的键
+            fn: 实际执行的函数，在单独的线程中执行，期间绑定的截止时间只在所有调用方都离开后取消，
+                绑定的进度记录器按第一个调用方是否需要部分结果记录Markdown
+
+        Returns:
+            元组 (函数结果, 是否复用了其他调用方发起的执行)
+
+        Raises:
+            DeadlineError: 当前调用方的截止时间已到或已被取消
+        """
+        reporter = progress.current()
+        while True:
+            with self._lock:
+                call = self._calls.get(key)
+                shared = call is not None
+                if shared:
+                    self.coalesced += 1
+                else:
+                    call = _Call(partial_results=reporter is not None and reporter.partial_results)
+                    self._calls[key] = call
+                    self.executions += 1
+                call.waiters += 1
+            if reporter is not None:
+                call.progress.subscribe(reporter)
+            if not shared:
+                self._start(key, call, fn)
+
+            try:
+                # 离开时不取消执行，是否取消由_leave按剩余的调用方决定
+                result = deadline.wait_for(call.future, cancel=lambda future: None, stage='coalesce')
+            except deadline.DeadlineError:
+                if call.deadline.cancelled and not deadline.aborted():
+                    # 其他调用方都已离开导致执行被取消，当前调用方仍然有效，重新发起执行
+                    continue
+                raise
+            finally:
+                if reporter is not None:
+                    call.progress.unsubscribe(reporter)
+                self._leave(key, call)
+            return result, shared
+
+    def _start(self, key: str, call: _Call, fn: Callable[[], Any]) -> None:
+        """在新线程中执行函数，复制发起方的上下文（日志上下文），截止时间和进度记录器换成共享的"""
+        context = contextvars.copy_context()
+
+        def run() -> None:
+            try:
+                with deadline.bind(call.deadline), progress.bind(call.progress):
+                    result = fn()
+            except BaseException as e:
+                self._finish(key, call)
+                call.future.set_exception(e)
+            else:
+                self._finish(key, call)
+                call.future.set_result(result)
+
+        threading.Thread(target=context.run, args=(run,), name='singleflight', daemon=True).start()
+
+    def _finish(self, key: str, call: _Call) -> None:
+        """执行结束，先移除键再设置结果，调用方拿到结果时键已经被释放"""
+        with self._lock:
+            if self._calls.get(key) is call:
+                del self._calls[key]
+
+    def _leave(self, key: str, call: _Call) -> None:
+        """调用方不再等待；没有调用方等待时取消执行，之后到达的相同键的调用重新执行"""
+        with self._lock:
+            call.waiters -= 1
+            if call.waiters or call.future.done():
+                return
+            if self._calls.get(key) is call:
+                del self._calls[key]
+        call.deadline.cancel("所有等待结果的请求均已中止")
+
+    def stats(self) -> Dict[str, int]:
+        """返回实际执行次数、被合并的请求数和当前进行中的键数量"""
+        with self._lock:
+            return {
+                "executions": self.executions,
+                "coalesced": self.coalesced,
+                "in_flight": len(self._calls),
+            }
@@ -0,0 +1,157 @@
+import shutil
+import tempfile
+import unittest
+from concurrent.futures import Future
+
+from app.batching import PageBatcher, demultiplex
+from app.page_cache import split_pages
+from app.test_page_cache import paginate, write_pdf
+from app.worker_pool import ConvertedDocument
+
+
+def read_page_texts(pdf_path, pages=None):
+    """读取PDF每页的文本"""
+    import pypdfium2
+
+    pdf = pypdfium2.PdfDocument(pdf_path)
+    try:
+        pages = pages if pages is not None else range(len(pdf))
+        texts = []
+        for index in pages:
+            textpage = pdf[index].get_textpage()
+            texts.append(textpage.get_text_range().strip())
+        return texts
+    finally:
+        pdf.close()
+
+
+class FakeBatchPool:
+    """测试用工作进程池：把每页文本作为Markdown输出，每页附带一张图片"""
+
+    def __init__(self, fail_paths=()):
+        self.calls = []
+        self.fail_paths = fail_paths
+
+    def submit(self, pdf_path, output_dir=None, options=None):
+        options = options or {}
+        self.calls.append((pdf_path, options))
+        future = Future()
+        if any(path in pdf_path for path in self.fail_paths) or (
+            'marker_batch_' in pdf_path and any('bad' in text for text in read_page_texts(pdf_path))
+        ):
+            future.set_exception(RuntimeError("转换失败"))
+            return future
+        pages = options.get('page_range')
+        texts = read_page_texts(pdf_path, pages)
+        indexes = pages if pages is not None else range(len(texts))
+        page_markdown = [
+            (index, f"{text}\n\n![](_page_{index}_Picture_0.jpeg)") for index, text in zip(indexes, texts)
+        ]
+        if options.get('paginate_output'):
+            markdown = paginate(page_markdown)
+        else:
+            markdown = "\n\n".join(text for _, text in page_markdown)
+        future.set_result(ConvertedDocument(
+            markdown=markdown,
+            images={f"_page_{index}_Picture_0.jpeg": f"img-{text}".encode() for index, text in zip(indexes, texts)},
+        ))
+        return future
+
+    def cancel(self, future):
+        return future.cancel()
+
+    def convert(self, pdf_path, output_dir=None, options=None, timeout=None):
+        return self.submit(pdf_path, output_dir, options).result(timeout=timeout)
+
+
+class TestPageBatcher(unittest.TestCase):
+    """测试跨请求的页面批处理"""
+
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.temp_dir, ignore_errors=True)
+
+    def make_pdf(self, name, pages):
+        path = f"{self.temp_dir}/{name}.pdf"
+        write_pdf(path, [[text] for text in pages])
+        return path
+
+    def test_demultiplex(self):
+        """测试把合并结果按页拆回各任务并还原图片页码"""
+        merged = ConvertedDocument(
+            markdown=paginate([(0, "a0 ![](_page_0_Picture_0.jpeg)"), (1, "b5"), (2, "b7 ![](_page_2_Picture_0.jpeg)")]),
+            images={"_page_0_Picture_0.jpeg": b"a", "_page_2_Picture_0.jpeg": b"b"},
+        )
+        first, second = demultiplex(merged, [[0], [5, 7]], [False, True])
+        self.assertEqual(first.markdown, "a0 ![](_page_0_Picture_0.jpeg)\n")
+        self.assertEqual(first.images, {"_page_0_Picture_0.jpeg": b"a"})
+        self.assertEqual(split_pages(second.markdown), {5: "b5", 7: "b7 ![](_page_7_Picture_0.jpeg)"})
+        self.assertEqual(second.images, {"_page_7_Picture_0.jpeg": b"b"})
+        self.assertEqual(second.metadata['batch'], {'jobs': 2, 'pages': 3})
+
+    def test_concurrent_jobs_share_one_batch(self):
+        """测试等待窗口内的多个小文档合并为一次转换"""
+        pool = FakeBatchPool()
+        batcher = PageBatcher(pool, max_batch_pages=16, max_wait=0.2)
+        paths = [self.make_pdf(f"doc{n}", [f"doc{n} page{p}" for p in range(n + 1)]) for n in range(3)]
+        futures = [batcher.submit(path) for path in paths]
+        documents = [future.result(timeout=10) for future in futures]
+        batcher.shutdown()
+
+        self.assertEqual(len(pool.calls), 1)
+        self.assertEqual(pool.calls[0][1], {'paginate_output': True})
+        self.assertIn("doc2 page2", documents[2].markdown)
+        self.assertNotIn("doc1", documents[2].markdown)
+        self.assertEqual(documents[2].images["_page_2_Picture_0.jpeg"], b"img-doc2 page2")
+        self.assertEqual(batcher.stats()['batched_jobs'], 3)
+
+    def test_batch_respects_page_range_and_size(self):
+        """测试按页范围参与批处理，超过批次页数上限时切分为多个批次"""
+        pool = FakeBatchPool()
+        batcher = PageBatcher(pool, max_batch_pages=3, max_wait=0.2)
+        first = self.make_pdf("first", ["f0", "f1", "f2"])
+        second = self.make_pdf("second", ["s0", "s1"])
+        third = self.make_pdf("third", ["t0"])
+        futures = [
+            batcher.submit(first, {'page_range': [0, 2], 'paginate_output': True}),
+            batcher.submit(second),
+            batcher.submit(third),
+        ]
+        documents = [future.result(timeout=10) for future in futures]
+        batcher.shutdown()
+
+        self.assertEqual(split_pages(documents[0].markdown)[2].split("\n")[0], "f2")
+        self.assertEqual(set(split_pages(documents[0].markdown)), {0, 2})
+        self.assertIn("s1", documents[1].markdown)
+        self.assertIn("t0", documents[2].markdown)
+        self.assertEqual(len(pool.calls), 2)
+
+    def test_failed_batch_falls_back_to_single_jobs(self):
+        """测试合并转换失败时逐个转换，只有出错的任务失败"""
+        pool = FakeBatchPool(fail_paths=("/bad.pdf",))
+        batcher = PageBatcher(pool, max_batch_pages=16, max_wait=0.2)
+        good = self.make_pdf("good", ["fine"])
+        bad = self.make_pdf("bad", ["bad"])
+        good_future, bad_future = batcher.submit(good), batcher.submit(bad)
+        self.assertIn("fine", good_future.result(timeout=10).markdown)
+        with self.assertRaises(RuntimeError):
+            bad_future.result(timeout=10)
+        batcher.shutdown()
+        self.assertEqual(batcher.stats()['fallbacks'], 1)
+
+    def test_large_document_bypasses_batch(self):
+        """测试页数超过上限的文档直接提交给工作进程池"""
+        pool = FakeBatchPool()
+        batcher = PageBatcher(pool, max_document_pages=2, max_wait=5)
+        path = self.make_pdf("large", ["a", "b", "c"])
+        document = batcher.convert(path)
+        batcher.shutdown()
+        self.assertEqual(pool.calls, [(path, {})])
+        self.assertIn("c", document.markdown)
+        self.assertEqual(batcher.stats()['direct_jobs'], 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,74 @@
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import unittest
+
+from qcloud_cos.cos_exception import CosServiceError
+
+from app.bench_service import FakeConverter, LocalCOSClient, percentile, write_synthetic_pdf
+from app.page_cache import split_pages
+
+
+class TestBenchComponents(unittest.TestCase):
+    """测试基准测试使用的合成文档、假转换器和本地COS"""
+
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.temp_dir, ignore_errors=True)
+
+    def test_fake_converter(self):
+        """测试假转换器读取文本层、生成图片引用并支持page_range和分页输出"""
+        path = os.path.join(self.temp_dir, 'doc.pdf')
+        write_synthetic_pdf(path, pages=3, images_per_page=2, seed=7, image_size=32)
+        converter = FakeConverter({'seconds_per_page': 0, 'images_per_page': 2, 'image_size': 32})
+
+        document = converter(path, {'page_range': [0, 2], 'paginate_output': True})
+        pages = split_pages(document.markdown)
+        self.assertEqual(sorted(pages), [0, 2])
+        self.assertIn('Document 7 page 3 line 1', pages[2])
+        self.assertIn('![](_page_2_Picture_1.jpeg)', pages[2])
+        self.assertEqual(len(document.images), 4)
+        # 相同参数的转换结果完全一致
+        self.assertEqual(converter(path, {'page_range': [0, 2]}).images, document.images)
+
+    def test_local_cos_client(self):
+        """测试本地COS写入文件，HEAD不存在的对象时返回404"""
+        client = LocalCOSClient(self.temp_dir)
+        with self.assertRaises(CosServiceError):
+            client.head_object(Bucket='bucket', Key='tmp/doc/a.md')
+        client.put_object(Bucket='bucket', Body=b'# A', Key='tmp/doc/a.md')
+        self.assertEqual(client.head_object(Bucket='bucket', Key='tmp/doc/a.md')['Content-Length'], '3')
+        self.assertEqual((client.requests, client.uploaded_bytes), (3, 3))
+
+    def test_percentile(self):
+        """测试线性插值的百分位数"""
+        values = [float(value) for value in range(1, 101)]
+        self.assertAlmostEqual(percentile(values, 50), 50.5)
+        self.assertAlmostEqual(percentile(values, 99), 99.01)
+        self.assertEqual(percentile([], 95), 0.0)
+
+
+class TestBenchRun(unittest.TestCase):
+    """在独立进程中运行一次小规模基准测试，确保整个流程可用"""
+
+    def test_smoke(self):
+        output = subprocess.run(
+            [sys.executable, '-m', 'app.bench_service', '--requests', '4', '--concurrency', '2',
+             '--pages', '2', '--images', '1', '--workers', '1', '--seconds-per-page', '0', '--json'],
+            capture_output=True, text=True, timeout=120, check=True,
+            cwd=os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+        ).stdout
+        result = json.loads(output[output.index('{'):])
+        self.assertEqual((result['succeeded'], result['failed']), (4, 0))
+        self.assertEqual(result['stages']['convert']['count'], 4)
+        # 每个文档上传2张图片、元数据和Markdown
+        self.assertEqual(result['cos']['requests'], 16)
+
+
+if __name__ == "__main__":
+    unittest.main()
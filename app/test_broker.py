@@ -0,0 +1,228 @@
+import os
+import shutil
+import sqlite3
+import tempfile
+import threading
+import time
+import unittest
+
+from app.broker import JobBroker, JobRecord, SQLiteJobBroker
+from app.deadline import RequestCancelled, check
+from app.fair_queue import FairQueue
+from app.jobs import DEFAULT_PRIORITY_WEIGHTS, JobFailedError, JobScheduler, JobStatus
+
+
+def _record(job_id, priority="normal", tenant="anonymous", affinity=None):
+    return JobRecord(job_id=job_id, payload={"pdf_url": job_id}, priority=priority, tenant=tenant, pages=1,
+                     affinity=affinity)
+
+
+class TestSQLiteJobBroker(unittest.TestCase):
+    """测试基于SQLite的任务代理"""
+
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp()
+        self.broker = SQLiteJobBroker(os.path.join(self.temp_dir, 'jobs.sqlite3'), max_attempts=2)
+
+    def tearDown(self):
+        self.broker.close()
+        shutil.rmtree(self.temp_dir, ignore_errors=True)
+
+    def _lease(self, owner="node-a", lease_seconds=30, affinity_only=False, tenant_limit=lambda tenant: 0):
+        return self.broker.lease(owner, lease_seconds, FairQueue(DEFAULT_PRIORITY_WEIGHTS), tenant_limit,
+                                 affinity_only=affinity_only)
+
+    def test_priority_order_matches_fair_queue(self):
+        """测试调度状态在多次领取之间保留，领取顺序与进程内的公平队列一致"""
+        queue = FairQueue(DEFAULT_PRIORITY_WEIGHTS)
+        for i in range(12):
+            for priority, tenant in (("low", "a"), ("high", "a"), ("high", "b")):
+                job_id = f"{priority}-{tenant}-{i}"
+                self.broker.enqueue(_record(job_id, priority=priority, tenant=tenant))
+                queue.push(job_id, priority, tenant)
+        expected = [queue.pop() for _ in range(20)]
+        self.assertEqual([self._lease().job_id for _ in range(20)], expected)
+        self.assertEqual(sum(job_id.startswith("low") for job_id in expected), 3)
+
+    def test_expired_lease_is_requeued(self):
+        """测试租约过期的任务回到队列，重试次数用完后失败"""
+        self.broker.enqueue(_record("doc"))
+        self.assertEqual(self._lease(lease_seconds=0.01).attempts, 1)
+        time.sleep(0.05)
+        record = self._lease(owner="node-b", lease_seconds=0.01)
+        self.assertEqual((record.job_id, record.owner, record.attempts), ("doc", "node-b", 2))
+        self.assertFalse(self.broker.complete("doc", "node-a", JobStatus.SUCCEEDED, {}))
+        time.sleep(0.05)
+        self.assertIsNone(self._lease())
+        self.assertEqual(self.broker.get("doc").status, JobStatus.FAILED)
+
+    def test_jobs_pinned_to_dead_node_fail(self):
+        """测试指定由已失联节点执行的任务（排队中或执行中）以失败结束，不计入排队数量"""
+        self.broker.enqueue(_record("running", affinity="node-old"))
+        self.assertEqual(self._lease(owner="node-old", lease_seconds=0.01, affinity_only=True).job_id, "running")
+        self.broker.enqueue(_record("queued", affinity="node-old"))
+        time.sleep(0.05)
+        self.assertEqual(self.broker.stats()["queued"], 0)
+        self.assertIsNone(self._lease(owner="node-new"))
+        for job_id in ("running", "queued"):
+            record = self.broker.get(job_id)
+            self.assertEqual((record.status, record.status_code), (JobStatus.FAILED, 503))
+
+    def test_queued_job_past_deadline_times_out(self):
+        """测试排队期间超过截止时间的任务以超时结束，不计入排队数量"""
+        record = _record("late")
+        record.deadline_at = time.time() - 1
+        self.broker.enqueue(record)
+        self.assertEqual(self.broker.stats()["queued"], 0)
+        self.assertIsNone(self._lease())
+        self.assertEqual(self.broker.get("late").status, JobStatus.TIMED_OUT)
+
+    def test_affinity_and_tenant_limit(self):
+        """测试指定节点的任务只由该节点领取，租户并发配额按所有节点计算"""
+        self.broker.enqueue(_record("pinned", affinity="node-b"))
+        self.broker.enqueue(_record("t1", tenant="t"))
+        self.broker.enqueue(_record("t2", tenant="t"))
+        self.assertEqual(self._lease(affinity_only=True, owner="node-b").job_id, "pinned")
+        limit = lambda tenant: 1  # noqa: E731
+        self.assertEqual(self._lease(tenant_limit=limit).job_id, "t1")
+        self.assertIsNone(self._lease(owner="node-b", tenant_limit=limit))
+
+    def test_cancel(self):
+        """测试取消排队中的任务直接结束，执行中的任务在续约时返回取消原因"""
+        self.broker.enqueue(_record("queued"))
+        self.broker.enqueue(_record("running"))
+        self.broker.cancel("queued", "任务已被取消")
+        self.assertEqual(self.broker.get("queued").status, JobStatus.CANCELLED)
+        self.assertEqual(self._lease().job_id, "running")
+        self.broker.cancel("running", "任务已被取消")
+        self.assertEqual(self.broker.heartbeat("node-a", ["running"], 30), {"running": "任务已被取消"})
+
+    def test_get_many(self):
+        """测试一次查询多个任务，不存在的任务不在结果中"""
+        for job_id in ("a", "b"):
+            self.broker.enqueue(_record(job_id))
+        records = self.broker.get_many(["a", "b", "missing"])
+        self.assertEqual(sorted(records), ["a", "b"])
+        self.assertEqual(records["a"].status, JobStatus.QUEUED)
+
+
+class TestJobBrokerInterface(unittest.TestCase):
+    """测试任务代理接口"""
+
+    def test_incomplete_broker_fails_at_construction(self):
+        """测试缺少方法的代理实现在创建时就报错，而不是在执行任务时"""
+        class IncompleteBroker(JobBroker):
+            def enqueue(self, record):
+                pass
+
+        with self.assertRaises(TypeError):
+            IncompleteBroker()
+
+
+class TestSharedScheduler(unittest.TestCase):
+    """测试多个调度器（节点）通过同一个任务代理协作"""
+
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp()
+        self.path = os.path.join(self.temp_dir, 'jobs.sqlite3')
+        self.schedulers = []
+
+    def tearDown(self):
+        for scheduler in self.schedulers:
+            scheduler.shutdown()
+            scheduler.broker.close()
+        shutil.rmtree(self.temp_dir, ignore_errors=True)
+
+    def _scheduler(self, handler, node_id, **kwargs):
+        scheduler = JobScheduler(handler, broker=SQLiteJobBroker(self.path), node_id=node_id,
+                                 poll_interval=0.05, **kwargs)
+        scheduler.start()
+        self.schedulers.append(scheduler)
+        return scheduler
+
+    def test_remote_execution(self):
+        """测试不执行任务的API节点提交的任务由工作节点执行，结果交给API节点上等待的请求"""
+        api = self._scheduler(lambda payload: self.fail("API节点不应执行任务"), "api", execute=False)
+        self._scheduler(lambda payload: {"file_url": f"https://cos/{payload['pdf_url']}.md"}, "worker")
+        job = api.submit({"pdf_url": "doc"})
+        self.assertEqual(job.future.result(timeout=5)["file_url"], "https://cos/doc.md")
+        self.assertEqual(job.status, JobStatus.SUCCEEDED)
+        self.assertEqual(api.get(job.job_id).to_dict()["file_url"], "https://cos/doc.md")
+
+    def test_local_only_job_stays_on_node(self):
+        """测试指定只在本节点执行的任务不会被其他节点领取"""
+        nodes = []
+        api = self._scheduler(lambda payload: nodes.append("api") or {}, "api", execute=False)
+        self._scheduler(lambda payload: nodes.append("worker") or {}, "worker")
+        api.submit({"pdf_url": "upload"}, local_only=True).future.result(timeout=5)
+        self.assertEqual(nodes, ["api"])
+
+    def test_remote_failure(self):
+        """测试在其他节点上失败的任务把错误和状态码交给提交任务的节点"""
+        def handler(payload):
+            error = ValueError("无法下载PDF文件")
+            error.status_code = 400
+            raise error
+
+        api = self._scheduler(handler, "api", execute=False)
+        self._scheduler(handler, "worker")
+        job = api.submit({"pdf_url": "doc"})
+        with self.assertRaises(JobFailedError) as context:
+            job.future.result(timeout=5)
+        self.assertEqual(context.exception.status_code, 400)
+        self.assertEqual(job.status, JobStatus.FAILED)
+
+    def test_cancel_propagates_to_worker(self):
+        """测试在API节点取消任务时，正在其他节点上执行的任务随之中止"""
+        started = threading.Event()
+
+        def handler(payload):
+            started.set()
+            for _ in range(100):
+                check('convert')
+                time.sleep(0.05)
+            return {}
+
+        api = self._scheduler(handler, "api", execute=False)
+        worker = self._scheduler(handler, "worker", lease_seconds=1)
+        job = api.submit({"pdf_url": "doc"})
+        self.assertTrue(started.wait(5))
+        api.cancel(job.job_id, reason="任务已被取消")
+        with self.assertRaises(RequestCancelled):
+            job.future.result(timeout=5)
+        self.assertEqual(worker.get(job.job_id).status, JobStatus.CANCELLED)
+
+    def test_restarted_node_does_not_block_admission(self):
+        """测试节点重启（节点ID改变）后，指定由旧节点执行的任务结束，不会一直占用排队配额"""
+        broker = SQLiteJobBroker(self.path)
+        broker.heartbeat("api-old", [], 0.05)
+        broker.enqueue(_record("upload", affinity="api-old"))
+        broker.close()
+        time.sleep(0.1)
+
+        api = self._scheduler(lambda payload: {}, "api-new", max_queued=1)
+        job = api.submit({"pdf_url": "doc"}, local_only=True)
+        self.assertEqual(job.future.result(timeout=5), {})
+        self.assertEqual(api.get("upload").status, JobStatus.FAILED)
+        self.assertEqual(api.stats()["queued"], 0)
+
+    def test_waiting_for_lease_does_not_block_queries(self):
+        """测试领取任务等待数据库写锁时，查询调度器状态和任务不会被阻塞"""
+        scheduler = self._scheduler(lambda payload: {}, "worker")
+        time.sleep(0.1)
+        other = sqlite3.connect(self.path, isolation_level=None)
+        other.execute("BEGIN IMMEDIATE")
+        try:
+            # 等待后台线程进入领取并阻塞在写锁上
+            time.sleep(0.2)
+            started = time.monotonic()
+            self.assertEqual(scheduler.stats()["queued"], 0)
+            self.assertIsNone(scheduler.get("missing"))
+            self.assertLess(time.monotonic() - started, 1)
+        finally:
+            other.execute("ROLLBACK")
+            other.close()
+
+
+if __name__ == "__main__":
+    unittest.main()
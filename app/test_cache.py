@@ -0,0 +1,82 @@
+import os
+import shutil
+import tempfile
+import time
+import unittest
+
+from app.cache import ConversionCache, hash_file
+
+
+class TestConversionCache(unittest.TestCase):
+    """测试以PDF内容哈希为键的转换缓存"""
+
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp()
+        self.db_path = os.path.join(self.temp_dir, 'cache.sqlite3')
+
+    def tearDown(self):
+        shutil.rmtree(self.temp_dir, ignore_errors=True)
+
+    def _put(self, cache, key, markdown='# doc'):
+        cache.put(key, 'hash', markdown, f'https://cos/{key}.md', {'a.png': 'https://cos/a.png'})
+
+    def test_hit_and_miss(self):
+        """测试缓存命中和未命中"""
+        cache = ConversionCache(self.db_path)
+        key = cache.make_key('abc', {'backend': 'worker_pool'})
+        self.assertIsNone(cache.get(key))
+        self._put(cache, key)
+        cached = cache.get(key)
+        self.assertEqual(cached['markdown_text'], '# doc')
+        self.assertEqual(cached['files_dict'], {'a.png': 'https://cos/a.png'})
+        self.assertEqual(cache.stats()['hits'], 1)
+        self.assertEqual(cache.stats()['misses'], 1)
+        cache.close()
+
+    def test_key_depends_on_options(self):
+        """测试不同的转换选项生成不同的缓存键"""
+        cache = ConversionCache(self.db_path)
+        self.assertNotEqual(cache.make_key('abc', {'backend': 'worker_pool'}),
+                            cache.make_key('abc', {'backend': 'marker_single'}))
+        self.assertEqual(cache.make_key('abc', {'a': 1, 'b': 2}), cache.make_key('abc', {'b': 2, 'a': 1}))
+        cache.close()
+
+    def test_ttl_expiry(self):
+        """测试过期条目不再命中"""
+        cache = ConversionCache(self.db_path, ttl=0.01)
+        self._put(cache, 'k')
+        time.sleep(0.05)
+        self.assertIsNone(cache.get('k'))
+        cache.close()
+
+    def test_lru_eviction_by_entries_and_bytes(self):
+        """测试超过条目数或字节数上限时淘汰最久未使用的条目"""
+        cache = ConversionCache(self.db_path, max_entries=2)
+        self._put(cache, 'k1')
+        self._put(cache, 'k2')
+        cache.get('k1')
+        self._put(cache, 'k3')
+        self.assertIsNotNone(cache.get('k1'))
+        self.assertIsNone(cache.get('k2'))
+        cache.close()
+
+        cache = ConversionCache(os.path.join(self.temp_dir, 'bytes.sqlite3'), max_bytes=10)
+        self._put(cache, 'k1', markdown='x' * 6)
+        self._put(cache, 'k2', markdown='y' * 6)
+        self.assertIsNone(cache.get('k1'))
+        self.assertIsNotNone(cache.get('k2'))
+        cache.close()
+
+    def test_hash_file(self):
+        """测试文件哈希只取决于内容"""
+        paths = []
+        for name in ('a.pdf', 'b.pdf'):
+            path = os.path.join(self.temp_dir, name)
+            with open(path, 'wb') as f:
+                f.write(b'%PDF-1.4 same content')
+            paths.append(path)
+        self.assertEqual(hash_file(paths[0]), hash_file(paths[1]))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,33 @@
+import os
+import tempfile
+import unittest
+from unittest import mock
+
+from app.config import PROJECT_ROOT, get_cache_path
+
+
+class TestCachePath(unittest.TestCase):
+    """测试缓存根目录的解析"""
+
+    def test_default_is_anchored_to_project_root(self):
+        """测试默认缓存目录在项目根目录下，与工作目录无关"""
+        with mock.patch.dict(os.environ, {'CACHE_DIR': ''}), tempfile.TemporaryDirectory() as cwd:
+            previous = os.getcwd()
+            os.chdir(cwd)
+            try:
+                path = get_cache_path('page_cache.sqlite3')
+            finally:
+                os.chdir(previous)
+        self.assertEqual(path, os.path.join(PROJECT_ROOT, '.cache', 'page_cache.sqlite3'))
+
+    def test_configured_root(self):
+        """测试CACHE_DIR为绝对路径时直接使用，为相对路径时按项目根目录解析"""
+        with tempfile.TemporaryDirectory() as root:
+            with mock.patch.dict(os.environ, {'CACHE_DIR': root}):
+                self.assertEqual(get_cache_path('pdf_store'), os.path.join(root, 'pdf_store'))
+        with mock.patch.dict(os.environ, {'CACHE_DIR': 'var/cache'}):
+            self.assertEqual(get_cache_path(), os.path.join(PROJECT_ROOT, 'var', 'cache'))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,191 @@
+import os
+import shutil
+import tempfile
+import threading
+import time
+import unittest
+from unittest import mock
+
+from qcloud_cos.cos_exception import CosServiceError
+
+from app.cos_service import COSService
+
+
+class FakeCosClient:
+    """测试用COS客户端：记录上传调用，可让指定对象先失败若干次"""
+
+    def __init__(self, failures=None, existing=()):
+        self.failures = dict(failures or {})
+        self.existing = set(existing)
+        self.heads = []
+        self.calls = []
+        self.lock = threading.Lock()
+        self.active = 0
+        self.peak = 0
+
+    def head_object(self, Bucket, Key, **kwargs):
+        with self.lock:
+            self.heads.append(Key)
+            if Key not in self.existing:
+                raise CosServiceError('HEAD', 'NoSuchResource', 404)
+        return {}
+
+    def put_object(self, Bucket, Body, Key, **kwargs):
+        self.upload_file(Bucket, None, Key, Body=Body, **kwargs)
+
+    def upload_file(self, Bucket, LocalFilePath, Key, **kwargs):
+        with self.lock:
+            self.calls.append((Key, kwargs))
+            self.active += 1
+            self.peak = max(self.peak, self.active)
+        try:
+            time.sleep(0.02)
+            with self.lock:
+                if self.failures.get(Key, 0) > 0:
+                    self.failures[Key] -= 1
+                    raise IOError(f"上传失败: {Key}")
+                self.existing.add(Key)
+        finally:
+            with self.lock:
+                self.active -= 1
+
+
+class TestCOSUploadEngine(unittest.TestCase):
+    """测试并发上传引擎"""
+
+    def setUp(self):
+        env = {
+            'COS_SECRET_ID': 'id',
+            'COS_SECRET_KEY': 'key',
+            'COS_BUCKET': 'bucket-1250000000',
+            'COS_REGION': 'ap-guangzhou',
+            'COS_UPLOAD_WORKERS': '4',
+            'COS_UPLOAD_RETRY_BACKOFF': '0',
+        }
+        with mock.patch.dict(os.environ, env):
+            self.service = COSService()
+        self.temp_dir = tempfile.mkdtemp()
+        self.items = []
+        for index in range(12):
+            rel_path = f"images/figure_{index}.png" if index % 2 else f"figure_{index}.jpeg"
+            path = os.path.join(self.temp_dir, rel_path)
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            with open(path, 'wb') as f:
+                f.write(b'x' * 10)
+            self.items.append((rel_path, path, f"tmp/doc/{rel_path}"))
+
+    def tearDown(self):
+        self.service.shutdown()
+        shutil.rmtree(self.temp_dir, ignore_errors=True)
+
+    def test_parallel_upload_with_content_types(self):
+        """测试并发上传并按扩展名设置Content-Type"""
+        self.service.client = FakeCosClient()
+        report = self.service.upload_many(self.items)
+        self.assertEqual(len(report.urls), 12)
+        self.assertEqual(report.total_bytes, 120)
+        self.assertEqual(set(report.timings), set(report.urls))
+        self.assertEqual(
+            report.urls['figure_0.jpeg'],
+            'https://bucket-1250000000.cos.ap-guangzhou.myqcloud.com/tmp/doc/figure_0.jpeg'
+        )
+        self.assertGreater(self.service.client.peak, 1)
+        self.assertLessEqual(self.service.client.peak, 4)
+        content_types = {key: kwargs['ContentType'] for key, kwargs in self.service.client.calls}
+        self.assertEqual(content_types['tmp/doc/figure_0.jpeg'], 'image/jpeg')
+        self.assertEqual(content_types['tmp/doc/images/figure_1.png'], 'image/png')
+
+    def test_retry_and_failure_reporting(self):
+        """测试失败后重试，重试耗尽时记录在失败列表中"""
+        self.service.client = FakeCosClient(failures={
+            'tmp/doc/figure_0.jpeg': 2,
+            'tmp/doc/images/figure_1.png': 10,
+        })
+        report = self.service.upload_many(self.items)
+        self.assertIn('figure_0.jpeg', report.urls)
+        self.assertEqual(list(report.failed), ['images/figure_1.png'])
+
+    def test_upload_from_memory(self):
+        """测试直接从内存缓冲区上传，并通过upload_content上传Markdown"""
+        self.service.client = FakeCosClient(failures={'tmp/doc/figure.png': 1})
+        report = self.service.upload_many([('figure.png', b'\x89PNG' * 4, 'tmp/doc/figure.png')])
+        self.assertEqual(list(report.urls), ['figure.png'])
+        self.assertEqual(report.total_bytes, 16)
+        url = self.service.upload_content('# doc', 'tmp/doc/doc.md')
+        self.assertTrue(url.endswith('/tmp/doc/doc.md'))
+        calls = {key: kwargs for key, kwargs in self.service.client.calls}
+        self.assertEqual(calls['tmp/doc/figure.png']['Body'], b'\x89PNG' * 4)
+        self.assertEqual(calls['tmp/doc/figure.png']['ContentType'], 'image/png')
+        self.assertEqual(calls['tmp/doc/doc.md']['Body'], '# doc'.encode('utf-8'))
+        self.assertEqual(calls['tmp/doc/doc.md']['ContentType'], 'text/markdown')
+
+    def test_upload_directory_uses_engine(self):
+        """测试上传目录复用并发上传引擎"""
+        self.service.client = FakeCosClient()
+        urls = self.service.upload_directory(self.temp_dir, '/tmp/doc')
+        self.assertEqual(len(urls), 12)
+        self.assertIn('images/figure_1.png', urls)
+
+
+class TestImageDedup(unittest.TestCase):
+    """测试按内容寻址的去重图片存储"""
+
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp()
+        self.env = {
+            'COS_SECRET_ID': 'id',
+            'COS_SECRET_KEY': 'key',
+            'COS_BUCKET': 'bucket-1250000000',
+            'COS_UPLOAD_RETRY_BACKOFF': '0',
+            'COS_IMAGE_DEDUP': 'true',
+            'COS_IMAGE_PREFIX': 'assets/sha256',
+            'COS_IMAGE_INDEX_PATH': os.path.join(self.temp_dir, 'images.sqlite3'),
+        }
+
+    def tearDown(self):
+        shutil.rmtree(self.temp_dir, ignore_errors=True)
+
+    def make_service(self, client, index_name='images.sqlite3'):
+        env = {**self.env, 'COS_IMAGE_INDEX_PATH': os.path.join(self.temp_dir, index_name)}
+        with mock.patch.dict(os.environ, env):
+            service = COSService()
+        service.client = client
+        return service
+
+    def test_identical_images_share_one_object(self):
+        """测试相同内容的图片只上传一次，之后通过本地索引跳过上传"""
+        client = FakeCosClient()
+        service = self.make_service(client)
+        logo = b'\x89PNG logo'
+        report = service.upload_images([('logo.png', logo), ('page_2_logo.png', logo), ('figure.jpeg', b'jpeg')])
+        self.assertEqual(report.urls['logo.png'], report.urls['page_2_logo.png'])
+        self.assertIn('/assets/sha256/', report.urls['logo.png'])
+        self.assertTrue(report.urls['figure.jpeg'].endswith('.jpeg'))
+        self.assertEqual(len(client.calls), 2)
+        self.assertEqual(report.deduplicated, 1)
+
+        report = service.upload_images([('other_logo.png', logo)])
+        self.assertEqual(len(client.calls), 2)
+        self.assertEqual(report.deduplicated_bytes, len(logo))
+        self.assertEqual(len(client.heads), 2)
+        self.assertEqual(service.image_stats()['deduplicated_local'], 1)
+        service.shutdown()
+
+    def test_head_fallback(self):
+        """测试本地索引没有记录时通过HEAD请求确认对象已存在"""
+        client = FakeCosClient()
+        first = self.make_service(client, 'first.sqlite3')
+        first.upload_images([('logo.png', b'logo')])
+        first.shutdown()
+
+        second = self.make_service(client, 'second.sqlite3')
+        report = second.upload_images([('logo.png', b'logo')])
+        self.assertEqual(len(client.calls), 1)
+        self.assertEqual(report.deduplicated, 1)
+        self.assertEqual(second.image_stats()['deduplicated_remote'], 1)
+        self.assertEqual(second.image_stats()['known_objects'], 1)
+        second.shutdown()
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,108 @@
+import threading
+import time
+import unittest
+from concurrent.futures import Future
+
+from app import deadline
+from app.deadline import Deadline, DeadlineExceeded, RequestCancelled
+from app.jobs import JobScheduler, JobStatus
+
+
+class TestDeadline(unittest.TestCase):
+    """测试截止时间的检查和阻塞等待"""
+
+    def test_wait_for_timeout_cancels_task(self):
+        """测试等待超时后调用取消函数并抛出DeadlineExceeded"""
+        cancelled = []
+        with deadline.bind(Deadline(0.3)):
+            started = time.monotonic()
+            with self.assertRaises(DeadlineExceeded) as context:
+                deadline.wait_for(Future(), cancel=cancelled.append, stage='convert')
+        self.assertLess(time.monotonic() - started, 2)
+        self.assertEqual(len(cancelled), 1)
+        self.assertEqual(context.exception.status_code, 504)
+        self.assertEqual(context.exception.stage, 'convert')
+
+    def test_cancel_from_other_thread(self):
+        """测试其他线程取消请求后等待立即中止"""
+        current = Deadline()
+        future = Future()
+        threading.Timer(0.1, current.cancel).start()
+        with deadline.bind(current), self.assertRaises(RequestCancelled):
+            deadline.wait_for(future)
+        self.assertTrue(future.cancelled())
+
+    def test_clamp(self):
+        """测试单次操作的超时被限制在剩余时间以内"""
+        self.assertEqual(deadline.clamp(30), 30)
+        with deadline.bind(Deadline(5)):
+            self.assertLessEqual(deadline.clamp(30), 5)
+            self.assertLessEqual(deadline.clamp(None), 5)
+        with deadline.bind(Deadline(None)):
+            self.assertIsNone(deadline.clamp(None))
+
+    def test_shared_cancel_event(self):
+        """测试共享取消标志的截止时间一起取消"""
+        event = threading.Event()
+        first, second = Deadline(cancel_event=event), Deadline(cancel_event=event)
+        first.cancel()
+        with self.assertRaises(RequestCancelled):
+            second.check()
+
+
+class TestJobDeadline(unittest.TestCase):
+    """测试任务调度器按截止时间中止任务"""
+
+    def test_running_job_times_out(self):
+        """测试执行中的任务超时后状态为timed_out"""
+        def handler(payload):
+            return deadline.wait_for(Future(), stage='convert')
+
+        scheduler = JobScheduler(handler, max_concurrent=1, default_timeout=0.3)
+        job = scheduler.submit({"pdf_url": "doc"})
+        with self.assertRaises(DeadlineExceeded):
+            job.future.result(timeout=5)
+        self.assertEqual(job.status, JobStatus.TIMED_OUT)
+        self.assertTrue(job.finished)
+        scheduler.shutdown()
+
+    def test_queued_job_expires_without_running(self):
+        """测试排队期间超时的任务不再执行，请求中的timeout覆盖默认值"""
+        release = threading.Event()
+        calls = []
+
+        def handler(payload):
+            calls.append(payload["pdf_url"])
+            release.wait(5)
+            return {"file_url": "https://cos/doc.md", "files_dict": {}}
+
+        scheduler = JobScheduler(handler, max_concurrent=1, default_timeout=60)
+        first = scheduler.submit({"pdf_url": "first"})
+        second = scheduler.submit({"pdf_url": "second"}, timeout=0.1)
+        time.sleep(0.3)
+        release.set()
+        first.future.result(timeout=5)
+        with self.assertRaises(DeadlineExceeded):
+            second.future.result(timeout=5)
+        self.assertEqual(calls, ["first"])
+        self.assertEqual(second.status, JobStatus.TIMED_OUT)
+        scheduler.shutdown()
+
+    def test_cancel_job(self):
+        """测试取消正在执行的任务"""
+        def handler(payload):
+            return deadline.wait_for(Future(), stage='convert')
+
+        scheduler = JobScheduler(handler, max_concurrent=1)
+        job = scheduler.submit({"pdf_url": "doc"})
+        time.sleep(0.1)
+        self.assertIs(scheduler.cancel(job.job_id), job)
+        with self.assertRaises(RequestCancelled):
+            job.future.result(timeout=5)
+        self.assertEqual(job.status, JobStatus.CANCELLED)
+        self.assertIsNone(scheduler.cancel("missing"))
+        scheduler.shutdown()
+
+
+if __name__ == "__main__":
+    unittest.main()
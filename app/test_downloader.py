@@ -0,0 +1,173 @@
+import hashlib
+import os
+import shutil
+import tempfile
+import threading
+import unittest
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from app.downloader import DownloadError, PDFDownloader
+
+PDF_BYTES = b'%PDF-1.4\n' + bytes(range(256)) * 200
+ETAG = '"v1"'
+
+
+class _Handler(BaseHTTPRequestHandler):
+    """测试用HTTP服务：支持ETag、Range，并可模拟连接中断"""
+
+    state = {'requests': [], 'drop_once': False, 'wrong_range': False}
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_GET(self):
+        self.state['requests'].append((self.path, dict(self.headers)))
+        if self.path == '/image.png':
+            body = b'\x89PNG\r\n\x1a\n'
+            self.send_response(200)
+            self.send_header('Content-Type', 'image/png')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+            return
+        if self.path in ('/article.html', '/login'):
+            body = b'<html><body><p>Sign in</p></body></html>'
+            self.send_response(200)
+            self.send_header('Content-Type', 'text/html; charset=utf-8')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+            return
+        if self.headers.get('If-None-Match') == ETAG:
+            self.send_response(304)
+            self.end_headers()
+            return
+
+        start = 0
+        range_header = self.headers.get('Range')
+        if range_header:
+            start = int(range_header.split('=')[1].rstrip('-'))
+            if self.state['wrong_range']:
+                # 忽略请求的偏移量，返回另一段范围
+                start //= 2
+            self.send_response(206)
+            self.send_header('Content-Range', f'bytes {start}-{len(PDF_BYTES) - 1}/{len(PDF_BYTES)}')
+        else:
+            self.send_response(200)
+        body = PDF_BYTES[start:]
+        self.send_header('Content-Type', 'application/pdf')
+        self.send_header('Content-Length', str(len(body)))
+        self.send_header('ETag', ETAG)
+        self.end_headers()
+        if self.state['drop_once'] and not range_header:
+            # 只发送一半正文后断开连接
+            self.state['drop_once'] = False
+            self.wfile.write(body[:len(body) // 2])
+            self.wfile.flush()
+            self.close_connection = True
+            return
+        self.wfile.write(body)
+
+
+class TestPDFDownloader(unittest.TestCase):
+    """测试流式PDF下载器"""
+
+    @classmethod
+    def setUpClass(cls):
+        cls.server = ThreadingHTTPServer(('127.0.0.1', 0), _Handler)
+        cls.thread = threading.Thread(target=cls.server.serve_forever, daemon=True)
+        cls.thread.start()
+        cls.base_url = f'http://127.0.0.1:{cls.server.server_address[1]}'
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.server.shutdown()
+        cls.server.server_close()
+
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp()
+        _Handler.state['requests'] = []
+        _Handler.state['drop_once'] = False
+        _Handler.state['wrong_range'] = False
+
+    def tearDown(self):
+        shutil.rmtree(self.temp_dir, ignore_errors=True)
+
+    def _downloader(self, **kwargs):
+        kwargs.setdefault('store_dir', os.path.join(self.temp_dir, 'store'))
+        return PDFDownloader(chunk_size=1024, **kwargs)
+
+    def _dest(self, name='doc.pdf'):
+        return os.path.join(self.temp_dir, name)
+
+    def test_stream_download_and_hash(self):
+        """测试流式下载并计算内容哈希"""
+        result = self._downloader().download(f'{self.base_url}/doc.pdf', self._dest())
+        with open(result.path, 'rb') as f:
+            self.assertEqual(f.read(), PDF_BYTES)
+        self.assertEqual(result.content_hash, hashlib.sha256(PDF_BYTES).hexdigest())
+        self.assertFalse(result.from_local_copy)
+
+    def test_conditional_refetch_uses_local_copy(self):
+        """测试远端未修改时使用本地副本"""
+        downloader = self._downloader()
+        downloader.download(f'{self.base_url}/doc.pdf', self._dest('first.pdf'))
+        result = downloader.download(f'{self.base_url}/doc.pdf', self._dest('second.pdf'))
+        self.assertTrue(result.from_local_copy)
+        self.assertEqual(_Handler.state['requests'][-1][1].get('If-None-Match'), ETAG)
+        with open(result.path, 'rb') as f:
+            self.assertEqual(f.read(), PDF_BYTES)
+
+    def test_resume_with_range_after_interruption(self):
+        """测试连接中断后通过Range续传"""
+        _Handler.state['drop_once'] = True
+        result = self._downloader(store_dir=None).download(f'{self.base_url}/doc.pdf', self._dest())
+        self.assertEqual(result.content_hash, hashlib.sha256(PDF_BYTES).hexdigest())
+        self.assertIn('Range', _Handler.state['requests'][-1][1])
+
+    def test_resume_with_wrong_range_restarts(self):
+        """测试续传时返回的Content-Range与偏移量不一致时从头重新下载，而不是追加到文件末尾"""
+        _Handler.state['drop_once'] = True
+        _Handler.state['wrong_range'] = True
+        result = self._downloader(store_dir=None).download(f'{self.base_url}/doc.pdf', self._dest())
+        self.assertEqual(result.content_hash, hashlib.sha256(PDF_BYTES).hexdigest())
+        self.assertEqual(_Handler.state['requests'][-1][1].get('Range'), 'bytes=0-')
+
+    def test_local_copy_removed_after_lookup(self):
+        """测试发送条件请求后本地副本被删除时，不带校验信息重新下载"""
+        downloader = self._downloader()
+        downloader.download(f'{self.base_url}/doc.pdf', self._dest('first.pdf'))
+        lookup = downloader.store.lookup
+
+        def lookup_then_evict(url):
+            validators = lookup(url)
+            os.unlink(downloader.store.object_path(validators['content_hash']))
+            return validators
+
+        downloader.store.lookup = lookup_then_evict
+        result = downloader.download(f'{self.base_url}/doc.pdf', self._dest('second.pdf'))
+        self.assertFalse(result.from_local_copy)
+        self.assertEqual(result.content_hash, hashlib.sha256(PDF_BYTES).hexdigest())
+        self.assertNotIn('If-None-Match', _Handler.state['requests'][-1][1])
+
+    def test_size_limit(self):
+        """测试超过大小上限时拒绝下载"""
+        with self.assertRaises(DownloadError):
+            self._downloader(max_bytes=1000).download(f'{self.base_url}/doc.pdf', self._dest())
+
+    def test_content_type_check(self):
+        """测试拒绝不支持的文档类型的Content-Type"""
+        with self.assertRaises(DownloadError):
+            self._downloader().download(f'{self.base_url}/image.png', self._dest())
+
+    def test_html_only_for_html_urls(self):
+        """测试URL不是HTML文档时拒绝HTML响应（例如登录页），HTML文档的URL或显式开启时接受"""
+        with self.assertRaises(DownloadError):
+            self._downloader().download(f'{self.base_url}/login', self._dest())
+        result = self._downloader().download(f'{self.base_url}/article.html', self._dest('article.html'))
+        self.assertTrue(result.content_type.startswith('text/html'))
+        self._downloader(allow_html=True).download(f'{self.base_url}/login', self._dest('login'))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,70 @@
+import unittest
+from collections import Counter
+
+from app.fair_queue import FairQueue
+
+
+class TestFairQueue(unittest.TestCase):
+    """测试按优先级和租户加权公平出队"""
+
+    def test_priority_weights(self):
+        """测试各优先级的出队次数与权重成正比，低优先级不会被饿死"""
+        queue = FairQueue({"high": 4, "low": 1})
+        for index in range(100):
+            queue.push(("high", index), "high", "a")
+            queue.push(("low", index), "low", "b")
+        first = [queue.pop()[0] for _ in range(50)]
+        self.assertEqual(Counter(first), {"high": 40, "low": 10})
+        self.assertEqual(len(queue), 150)
+
+    def test_tenants_round_robin(self):
+        """测试同一优先级内按租户轮转，大量提交的租户不会挡住其他租户"""
+        queue = FairQueue({"normal": 1})
+        for index in range(10):
+            queue.push(("bulk", index), "normal", "bulk")
+        queue.push(("alice", 0), "normal", "alice")
+        order = [queue.pop() for _ in range(3)]
+        self.assertIn(("alice", 0), order[:2])
+        # 同一租户内保持提交顺序
+        self.assertEqual([item for item in order if item[0] == "bulk"], [("bulk", 0), ("bulk", 1)])
+
+    def test_idle_flow_does_not_accumulate_credit(self):
+        """测试空闲后重新入队的优先级不会一次性补回空闲期间的份额"""
+        queue = FairQueue({"high": 1, "low": 1})
+        for index in range(20):
+            queue.push(index, "low", "a")
+        for _ in range(10):
+            queue.pop()
+        queue.push("h1", "high", "a")
+        queue.push("h2", "high", "a")
+        popped = [queue.pop() for _ in range(4)]
+        self.assertLessEqual(sum(1 for item in popped if isinstance(item, str)), 2)
+        self.assertTrue(any(isinstance(item, int) for item in popped[:2]))
+
+    def test_ineligible_tenants_are_skipped(self):
+        """测试并发配额已满的租户被跳过，没有可执行的任务时返回None"""
+        queue = FairQueue({"normal": 1})
+        queue.push("a1", "normal", "a")
+        queue.push("b1", "normal", "b")
+        self.assertEqual(queue.pop(lambda tenant: tenant != "a"), "b1")
+        self.assertIsNone(queue.pop(lambda tenant: tenant != "a"))
+        self.assertEqual(queue.pop(), "a1")
+        self.assertIsNone(queue.pop())
+
+    def test_remove(self):
+        """测试删除排队中的任务，删除后空的优先级不再被选中"""
+        queue = FairQueue({"high": 4, "low": 1})
+        queue.push("h1", "high", "a")
+        queue.push("l1", "low", "a")
+        self.assertTrue(queue.remove("h1", "high", "a"))
+        self.assertFalse(queue.remove("h1", "high", "a"))
+        self.assertEqual((len(queue), queue.counts()), (1, {"low": 1}))
+        self.assertEqual(queue.pop(), "l1")
+
+    def test_unknown_priority(self):
+        with self.assertRaises(ValueError):
+            FairQueue({"normal": 1}).push("x", "urgent", "a")
+
+
+if __name__ == "__main__":
+    unittest.main()
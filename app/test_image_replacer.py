@@ -1,4 +1,7 @@
+import os
+import tempfile
 import unittest
+from app.image_rewriter import ImageURLRewriter
 from app.services import PDFConverterService
 
 class TestImageURLReplacement(unittest.TestCase):
@@ -92,5 +95,50 @@ class TestImageURLReplacement(unittest.TestCase):
         result = self.service.replace_image_urls(markdown, self.files_dict)
         self.assertEqual(result, expected)
 
+    def test_html_img_tags(self):
+        """测试替换HTML img标签的src属性，保留其他属性"""
+        markdown = """<p><img src="images/image2.png" alt="图2" width="50%"></p>
+<img alt='外部' src='https://external-site.com/image.jpg'/>
+<IMG SRC="image1.jpg">
+"""
+        expected = """<p><img src="https://example-bucket.cos.ap-guangzhou.myqcloud.com/tmp/doc_12345/images/image2.png" alt="图2" width="50%"></p>
+<img alt='外部' src='https://external-site.com/image.jpg'/>
+<IMG SRC="https://example-bucket.cos.ap-guangzhou.myqcloud.com/tmp/doc_12345/image1.jpg">
+"""
+        result = self.service.replace_image_urls(markdown, self.files_dict)
+        self.assertEqual(result, expected)
+
+    def test_exact_path_takes_precedence_over_filename(self):
+        """测试完整路径匹配优先于文件名匹配"""
+        files_dict = {
+            "a.png": "https://cos/a.png",
+            "nested/deeper/a.png": "https://cos/nested/deeper/a.png",
+        }
+        markdown = "![](a.png) ![](./nested/deeper/a.png) ![](other/a.png?x=1)"
+        expected = "![](https://cos/a.png) ![](https://cos/nested/deeper/a.png) ![](https://cos/nested/deeper/a.png)"
+        self.assertEqual(self.service.replace_image_urls(markdown, files_dict), expected)
+
+    def test_non_image_files_only_match_exact_path(self):
+        """测试非图片文件不会按文件名匹配"""
+        markdown = "![](doc.md) ![](other/doc.md)"
+        expected = "![](https://example-bucket.cos.ap-guangzhou.myqcloud.com/tmp/doc_12345/doc.md) ![](other/doc.md)"
+        self.assertEqual(self.service.replace_image_urls(markdown, self.files_dict), expected)
+
+    def test_streaming_rewrite_matches_full_rewrite(self):
+        """测试逐行流式改写与整体改写结果一致"""
+        markdown = "# 标题\n\n![图1](image1.jpg)\n<img src=\"image3.jpeg\">\n正文\n"
+        rewriter = ImageURLRewriter(self.files_dict)
+        streamed = "".join(rewriter.rewrite_lines(markdown.splitlines(keepends=True)))
+        self.assertEqual(streamed, ImageURLRewriter(self.files_dict).rewrite(markdown))
+        self.assertEqual(rewriter.replace_count, 2)
+
+        with tempfile.TemporaryDirectory() as temp_dir:
+            path = os.path.join(temp_dir, "doc.md")
+            with open(path, "w", encoding="utf-8") as f:
+                f.write(markdown)
+            ImageURLRewriter(self.files_dict).rewrite_file(path)
+            with open(path, "r", encoding="utf-8") as f:
+                self.assertEqual(f.read(), streamed)
+
 if __name__ == "__main__":
     unittest.main() 
\ No newline at end of file
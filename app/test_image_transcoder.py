@@ -0,0 +1,76 @@
+import io
+import unittest
+
+from app.image_transcoder import ImageTranscoder, transcode_image
+
+
+def make_png(width, height, mode='RGB'):
+    """生成带渐变的PNG图片"""
+    from PIL import Image
+
+    image = Image.new(mode, (width, height))
+    pixels = image.load()
+    for x in range(width):
+        for y in range(height):
+            value = (x * 7 + y * 3) % 256
+            pixels[x, y] = (value, 255 - value, (x * y) % 256) if mode == 'RGB' else (value, 0, 0, value)
+    buffer = io.BytesIO()
+    image.save(buffer, 'PNG')
+    return buffer.getvalue()
+
+
+def image_size(data):
+    from PIL import Image
+
+    with Image.open(io.BytesIO(data)) as image:
+        return image.size, image.format
+
+
+class TestImageTranscoder(unittest.TestCase):
+    """测试上传前的图片转码"""
+
+    @classmethod
+    def setUpClass(cls):
+        cls.transcoder = ImageTranscoder(output_format='webp', quality=75, max_dimension=256, workers=2, min_bytes=1024)
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.transcoder.shutdown()
+
+    def test_transcode_keeps_rel_paths(self):
+        """测试大图缩放并转为WebP，相对路径不变，只有上传文件名使用新扩展名"""
+        images = {
+            '_page_0_Picture_1.png': make_png(800, 400),
+            'images/_page_1_Figure_2.jpeg': make_png(300, 300),
+            'icon.png': make_png(8, 8),
+            'chart.svg': b'<svg/>' * 500,
+        }
+        result = self.transcoder.transcode(images)
+
+        self.assertEqual(set(result.images), set(images))
+        self.assertEqual(image_size(result.images['_page_0_Picture_1.png']), ((256, 128), 'WEBP'))
+        self.assertEqual(result.filenames['_page_0_Picture_1.png'], '_page_0_Picture_1.webp')
+        self.assertEqual(result.filenames['images/_page_1_Figure_2.jpeg'], 'images/_page_1_Figure_2.webp')
+        # 太小的图片和矢量图保持原样
+        self.assertEqual(result.images['icon.png'], images['icon.png'])
+        self.assertEqual(result.images['chart.svg'], images['chart.svg'])
+        stats = result.stats()
+        self.assertEqual(stats['transcoded'], 2)
+        self.assertGreater(stats['saved_bytes'], 0)
+        self.assertEqual(self.transcoder.stats()['transcoded'], 2)
+
+    def test_invalid_image_is_kept(self):
+        """测试无法解码的图片保留原样"""
+        images = {'broken.png': b'not a png' * 200}
+        result = self.transcoder.transcode(images)
+        self.assertEqual(result.images, images)
+        self.assertEqual(result.filenames, {})
+
+    def test_jpeg_drops_alpha(self):
+        """测试转为JPEG时透明通道按白色背景合成"""
+        output = transcode_image(make_png(64, 64, mode='RGBA'), 'jpeg', 80, 32)
+        self.assertEqual(image_size(output), ((32, 32), 'JPEG'))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,196 @@
+import threading
+import time
+import unittest
+
+from app.deadline import RequestCancelled
+from app.jobs import JobScheduler, JobStatus, QueueFullError
+
+
+class TestJobScheduler(unittest.TestCase):
+    """测试异步任务调度器"""
+
+    def test_job_lifecycle(self):
+        """测试任务从排队到成功的状态变化"""
+        release = threading.Event()
+
+        def handler(payload):
+            release.wait(5)
+            return {"file_url": f"https://cos/{payload['pdf_url']}.md", "files_dict": {}}
+
+        scheduler = JobScheduler(handler, max_concurrent=1)
+        job = scheduler.submit({"pdf_url": "doc"})
+        self.assertIs(scheduler.get(job.job_id), job)
+        release.set()
+        self.assertEqual(job.future.result(timeout=5)["file_url"], "https://cos/doc.md")
+        self.assertEqual(job.status, JobStatus.SUCCEEDED)
+        self.assertEqual(job.to_dict()["file_url"], "https://cos/doc.md")
+        scheduler.shutdown()
+
+    def test_failed_job(self):
+        """测试任务失败时记录错误信息"""
+        def handler(payload):
+            raise ValueError("无法下载PDF文件")
+
+        scheduler = JobScheduler(handler, max_concurrent=1)
+        job = scheduler.submit({"pdf_url": "doc"})
+        with self.assertRaises(ValueError):
+            job.future.result(timeout=5)
+        self.assertEqual(job.status, JobStatus.FAILED)
+        self.assertEqual(job.error, "无法下载PDF文件")
+        scheduler.shutdown()
+
+    def test_concurrency_is_bounded(self):
+        """测试同时执行的任务数量不超过上限"""
+        lock = threading.Lock()
+        state = {"running": 0, "peak": 0}
+
+        def handler(payload):
+            with lock:
+                state["running"] += 1
+                state["peak"] = max(state["peak"], state["running"])
+            time.sleep(0.05)
+            with lock:
+                state["running"] -= 1
+            return {}
+
+        scheduler = JobScheduler(handler, max_concurrent=2)
+        jobs = [scheduler.submit({"pdf_url": str(i)}) for i in range(6)]
+        for job in jobs:
+            job.future.result(timeout=5)
+        self.assertEqual(state["peak"], 2)
+        scheduler.shutdown()
+
+    def test_expired_jobs_are_pruned(self):
+        """测试超过保留时间的已结束任务会被清理"""
+        scheduler = JobScheduler(lambda payload: {}, max_concurrent=1, result_ttl=0)
+        job = scheduler.submit({"pdf_url": "doc"})
+        job.future.result(timeout=5)
+        time.sleep(0.01)
+        self.assertIsNone(scheduler.get(job.job_id))
+        scheduler.shutdown()
+
+
+class TestAdmissionControl(unittest.TestCase):
+    """测试优先级、租户配额和准入控制"""
+
+    def _blocked_scheduler(self, **kwargs):
+        """创建一个任务阻塞到release被设置的调度器，返回 (调度器, release, 执行顺序)"""
+        release = threading.Event()
+        order = []
+
+        def handler(payload):
+            order.append(payload["pdf_url"])
+            release.wait(5)
+            return {"file_url": "https://cos/doc.md", "files_dict": {}, "pages": 1}
+
+        return JobScheduler(handler, **kwargs), release, order
+
+    def test_high_priority_runs_first(self):
+        """测试排队中的高优先级任务先于先提交的低优先级任务执行"""
+        scheduler, release, order = self._blocked_scheduler(max_concurrent=1)
+        blocker = scheduler.submit({"pdf_url": "blocker"})
+        time.sleep(0.1)
+        low = [scheduler.submit({"pdf_url": f"low{i}"}, priority="low") for i in range(3)]
+        high = scheduler.submit({"pdf_url": "high"}, priority="high")
+        self.assertEqual(scheduler.stats()["queued_by_priority"], {"low": 3, "high": 1})
+        release.set()
+        for job in [blocker, high, *low]:
+            job.future.result(timeout=5)
+        self.assertEqual(order[:2], ["blocker", "high"])
+        self.assertEqual(high.to_dict()["priority"], "high")
+        scheduler.shutdown()
+
+    def test_tenant_quota(self):
+        """测试租户达到并发配额后，其他租户的任务可以先执行"""
+        scheduler, release, order = self._blocked_scheduler(max_concurrent=2, tenant_max_concurrent=1)
+        jobs = [scheduler.submit({"pdf_url": f"bulk{i}"}, tenant="bulk") for i in range(3)]
+        jobs.append(scheduler.submit({"pdf_url": "alice"}, tenant="alice"))
+        time.sleep(0.2)
+        self.assertEqual(sorted(order), ["alice", "bulk0"])
+        release.set()
+        for job in jobs:
+            job.future.result(timeout=5)
+        scheduler.shutdown()
+
+    def test_reject_when_queue_is_full(self):
+        """测试排队数超过上限时拒绝新任务并给出重试等待时间"""
+        scheduler, release, _ = self._blocked_scheduler(max_concurrent=1, max_queued=2, seconds_per_page=3)
+        jobs = [scheduler.submit({"pdf_url": "running"}, pages=1)]
+        time.sleep(0.1)
+        jobs += [scheduler.submit({"pdf_url": f"queued{i}"}, pages=4) for i in range(2)]
+        with self.assertRaises(QueueFullError) as context:
+            scheduler.submit({"pdf_url": "rejected"})
+        self.assertEqual(context.exception.status_code, 429)
+        self.assertEqual(context.exception.retry_after, 12)
+        release.set()
+        for job in jobs:
+            job.future.result(timeout=5)
+        scheduler.shutdown()
+
+    def test_check_admission_does_not_enqueue(self):
+        """测试准入检查与提交时的拒绝条件一致，且不会入队"""
+        scheduler, release, _ = self._blocked_scheduler(max_concurrent=1, max_queued=1)
+        jobs = [scheduler.submit({"pdf_url": "running"})]
+        time.sleep(0.1)
+        scheduler.check_admission(priority="low", tenant="bulk")
+        self.assertEqual(scheduler.stats()["queued"], 0)
+        jobs.append(scheduler.submit({"pdf_url": "queued"}))
+        with self.assertRaises(QueueFullError):
+            scheduler.check_admission(priority="low", tenant="bulk")
+        with self.assertRaises(ValueError):
+            scheduler.check_admission(priority="urgent")
+        release.set()
+        for job in jobs:
+            job.future.result(timeout=5)
+        scheduler.shutdown()
+
+    def test_cancelled_queued_job_leaves_queue(self):
+        """测试取消排队中的任务后立即结束并移出队列，不再占用排队配额"""
+        scheduler, release, order = self._blocked_scheduler(max_concurrent=1, max_queued=1)
+        running = scheduler.submit({"pdf_url": "running"})
+        time.sleep(0.1)
+        queued = scheduler.submit({"pdf_url": "queued"})
+        scheduler.cancel(queued.job_id, reason="任务已被取消")
+        self.assertEqual(queued.status, JobStatus.CANCELLED)
+        with self.assertRaises(RequestCancelled):
+            queued.future.result(timeout=1)
+        self.assertEqual((scheduler.stats()["queued"], scheduler.stats()["queued_pages"]), (0, 0))
+        accepted = scheduler.submit({"pdf_url": "accepted"})
+        release.set()
+        for job in (running, accepted):
+            job.future.result(timeout=5)
+        self.assertEqual(order, ["running", "accepted"])
+        scheduler.shutdown()
+
+    def test_reject_by_estimated_wait(self):
+        """测试按排队页数估计的等待时间超过上限时拒绝，低优先级的排队页数不影响高优先级"""
+        scheduler, release, _ = self._blocked_scheduler(
+            max_concurrent=1, max_queue_wait=30, seconds_per_page=2
+        )
+        jobs = [scheduler.submit({"pdf_url": "running"})]
+        time.sleep(0.1)
+        jobs.append(scheduler.submit({"pdf_url": "backfill"}, priority="low", pages=20))
+        with self.assertRaises(QueueFullError) as context:
+            scheduler.submit({"pdf_url": "more"}, priority="low", pages=1)
+        self.assertEqual(context.exception.retry_after, 10)
+        jobs.append(scheduler.submit({"pdf_url": "interactive"}, priority="high", pages=1))
+        with self.assertRaises(ValueError):
+            scheduler.submit({"pdf_url": "doc"}, priority="urgent")
+        release.set()
+        for job in jobs:
+            job.future.result(timeout=5)
+        scheduler.shutdown()
+
+    def test_seconds_per_page_follows_observed_durations(self):
+        """测试按已完成任务的实际耗时更新每页耗时的估计"""
+        scheduler = JobScheduler(
+            lambda payload: {"file_url": "https://cos/doc.md", "files_dict": {}, "pages": 100},
+            max_concurrent=1, seconds_per_page=10,
+        )
+        scheduler.submit({"pdf_url": "doc"}).future.result(timeout=5)
+        self.assertLess(scheduler.stats()["seconds_per_page"], 10)
+        scheduler.shutdown()
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,102 @@
+import io
+import json
+import logging
+import unittest
+
+from app import metrics
+from app.jobs import JobScheduler
+from app.logs import ContextFilter, JsonFormatter, bind_context, get_job_id, get_request_id
+from app.metrics import Counter, Gauge, Histogram, Registry
+
+
+class TestMetrics(unittest.TestCase):
+    """测试指标的记录和Prometheus文本格式输出"""
+
+    def test_render(self):
+        """测试计数器、仪表和直方图的文本格式"""
+        registry = Registry()
+        requests = registry.register(Counter("test_requests_total", "请求次数", ["operation", "status"]))
+        depth = registry.register(Gauge("test_queue_depth", "队列长度"))
+        latency = registry.register(Histogram("test_latency_seconds", "耗时", ["stage"], buckets=(0.1, 1)))
+
+        requests.inc(operation="put_object", status="ok")
+        requests.inc(2, operation="put_object", status="ok")
+        depth.set_function(lambda: 3)
+        latency.observe(0.05, stage="convert")
+        latency.observe(0.5, stage="convert")
+        latency.observe(5, stage="convert")
+
+        lines = registry.render().splitlines()
+        self.assertIn("# TYPE test_requests_total counter", lines)
+        self.assertIn('test_requests_total{operation="put_object",status="ok"} 3', lines)
+        self.assertIn("test_queue_depth 3", lines)
+        self.assertIn('test_latency_seconds_bucket{stage="convert",le="0.1"} 1', lines)
+        self.assertIn('test_latency_seconds_bucket{stage="convert",le="1"} 2', lines)
+        self.assertIn('test_latency_seconds_bucket{stage="convert",le="+Inf"} 3', lines)
+        self.assertIn('test_latency_seconds_count{stage="convert"} 3', lines)
+        self.assertIn('test_latency_seconds_sum{stage="convert"} 5.55', lines)
+
+    def test_label_validation(self):
+        """测试标签名不匹配时抛出异常"""
+        counter = Counter("test_labels_total", "计数", ["stage"])
+        with self.assertRaises(ValueError):
+            counter.inc(route="text")
+
+    def test_stage_timer_counts_failures(self):
+        """测试阶段抛出异常时同时记录耗时和失败次数"""
+        failures = metrics.STAGE_FAILURES.value(stage="test_stage")
+        observed = metrics.STAGE_SECONDS.count(stage="test_stage")
+        with metrics.stage_timer("test_stage"):
+            pass
+        with self.assertRaises(RuntimeError):
+            with metrics.stage_timer("test_stage"):
+                raise RuntimeError("失败")
+        self.assertEqual(metrics.STAGE_SECONDS.count(stage="test_stage"), observed + 2)
+        self.assertEqual(metrics.STAGE_FAILURES.value(stage="test_stage"), failures + 1)
+
+
+class TestRequestContext(unittest.TestCase):
+    """测试请求ID在任务线程中的传递和结构化日志输出"""
+
+    def test_job_inherits_request_id(self):
+        """测试任务在后台线程中执行时带有提交时的请求ID和自己的任务ID"""
+        seen = {}
+
+        def handler(payload):
+            seen["request_id"] = get_request_id()
+            seen["job_id"] = get_job_id()
+            return {"file_url": "https://cos/doc.md", "files_dict": {}}
+
+        scheduler = JobScheduler(handler, max_concurrent=1)
+        with bind_context(request_id="req-1"):
+            job = scheduler.submit({"pdf_url": "doc"})
+        job.future.result(timeout=5)
+        scheduler.shutdown()
+        self.assertEqual(seen, {"request_id": "req-1", "job_id": job.job_id})
+        self.assertIsNone(get_request_id())
+
+    def test_json_formatter(self):
+        """测试JSON日志包含请求ID、任务ID和extra字段"""
+        stream = io.StringIO()
+        handler = logging.StreamHandler(stream)
+        handler.addFilter(ContextFilter())
+        handler.setFormatter(JsonFormatter())
+        test_logger = logging.getLogger("app.test_metrics.json")
+        test_logger.addHandler(handler)
+        test_logger.setLevel(logging.INFO)
+        test_logger.propagate = False
+        try:
+            with bind_context(request_id="req-2", job_id="job-2"):
+                test_logger.info("阶段完成", extra={"stage": "convert", "duration": 1.5})
+        finally:
+            test_logger.removeHandler(handler)
+
+        entry = json.loads(stream.getvalue())
+        self.assertEqual(entry["message"], "阶段完成")
+        self.assertEqual(entry["level"], "INFO")
+        self.assertEqual((entry["request_id"], entry["job_id"]), ("req-2", "job-2"))
+        self.assertEqual((entry["stage"], entry["duration"]), ("convert", 1.5))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,121 @@
+import os
+import shutil
+import tempfile
+import unittest
+import zipfile
+
+from app.office_converter import convert_docx, detect_document_type, html_to_markdown
+
+PNG_BYTES = b'\x89PNG\r\n\x1a\n' + b'\x00' * 16
+
+CONTENT_TYPES_XML = """<?xml version="1.0" encoding="UTF-8"?>
+<Types xmlns="http://schemas.openxmlformats.org/package/2006/content-types">
+<Default Extension="rels" ContentType="application/vnd.openxmlformats-package.relationships+xml"/>
+<Default Extension="xml" ContentType="application/xml"/>
+<Default Extension="png" ContentType="image/png"/>
+<Override PartName="/word/document.xml"
+ ContentType="application/vnd.openxmlformats-officedocument.wordprocessingml.document.main+xml"/>
+</Types>"""
+
+RELS_XML = """<?xml version="1.0" encoding="UTF-8"?>
+<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">
+<Relationship Id="rId1" Target="word/document.xml"
+ Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/officeDocument"/>
+</Relationships>"""
+
+DOCUMENT_RELS_XML = """<?xml version="1.0" encoding="UTF-8"?>
+<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">
+<Relationship Id="rIdImg" Target="media/image1.png"
+ Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/image"/>
+</Relationships>"""
+
+DOCUMENT_XML = """<?xml version="1.0" encoding="UTF-8"?>
+<w:document xmlns:w="http://schemas.openxmlformats.org/wordprocessingml/2006/main"
+ xmlns:r="http://schemas.openxmlformats.org/officeDocument/2006/relationships"
+ xmlns:wp="http://schemas.openxmlformats.org/drawingml/2006/wordprocessingDrawing"
+ xmlns:a="http://schemas.openxmlformats.org/drawingml/2006/main"
+ xmlns:pic="http://schemas.openxmlformats.org/drawingml/2006/picture">
+<w:body>
+<w:p><w:pPr><w:pStyle w:val="Heading1"/></w:pPr><w:r><w:t>Report</w:t></w:r></w:p>
+<w:p><w:r><w:t>Hello world</w:t></w:r></w:p>
+<w:p><w:r><w:drawing><wp:inline><wp:docPr id="1" name="Picture 1" descr="chart"/>
+<a:graphic><a:graphicData uri="http://schemas.openxmlformats.org/drawingml/2006/picture"><pic:pic>
+<pic:blipFill><a:blip r:embed="rIdImg"/></pic:blipFill>
+</pic:pic></a:graphicData></a:graphic></wp:inline></w:drawing></w:r></w:p>
+</w:body>
+</w:document>"""
+
+
+class TestOfficeConverter(unittest.TestCase):
+    """测试DOCX和HTML的快速转换路径"""
+
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.temp_dir, ignore_errors=True)
+
+    def _write_docx(self, name='report.docx'):
+        path = os.path.join(self.temp_dir, name)
+        with zipfile.ZipFile(path, 'w') as archive:
+            archive.writestr('[Content_Types].xml', CONTENT_TYPES_XML)
+            archive.writestr('_rels/.rels', RELS_XML)
+            archive.writestr('word/document.xml', DOCUMENT_XML)
+            archive.writestr('word/_rels/document.xml.rels', DOCUMENT_RELS_XML)
+            archive.writestr('word/media/image1.png', PNG_BYTES)
+        return path
+
+    def test_detect_document_type(self):
+        """测试按文件头识别文档类型，扩展名不可信"""
+        docx_path = self._write_docx('document.pdf')
+        html_path = os.path.join(self.temp_dir, 'document_1.pdf')
+        with open(html_path, 'w', encoding='utf-8') as f:
+            f.write('<!DOCTYPE html><html><body>hi</body></html>')
+        pdf_path = os.path.join(self.temp_dir, 'paper.pdf')
+        with open(pdf_path, 'wb') as f:
+            f.write(b'%PDF-1.4\n')
+
+        self.assertEqual(detect_document_type(docx_path), 'docx')
+        self.assertEqual(detect_document_type(html_path), 'html')
+        self.assertEqual(detect_document_type(pdf_path), 'pdf')
+
+    def test_convert_docx_extracts_images(self):
+        """测试DOCX转换为Markdown并提取内嵌图片"""
+        document = convert_docx(self._write_docx())
+        self.assertIn('# Report', document.markdown)
+        self.assertIn('Hello world', document.markdown)
+        self.assertEqual(document.images, {'image_1.png': PNG_BYTES})
+        self.assertIn('](image_1.png)', document.markdown)
+
+    def test_html_to_markdown(self):
+        """测试HTML转换为Markdown，提取data URI图片并丢弃脚本"""
+        html = (
+            '<html><head><title>t</title><script>alert(1)</script></head><body>'
+            '<h2>Title</h2><p>Some <b>bold</b> and <a href="https://example.com">link</a>.</p>'
+            '<ul><li>one</li><li>two</li></ul>'
+            '<table><tr><th>A</th><th>B</th></tr><tr><td>1</td><td>2</td></tr></table>'
+            '<img src="data:image/png;base64,iVBORw0KGgo=" alt="logo"><img src="https://cdn/x.png">'
+            '</body></html>'
+        )
+        document = html_to_markdown(html)
+        self.assertEqual(
+            document.markdown,
+            "## Title\n\nSome **bold** and [link](https://example.com).\n\n- one\n\n- two\n\n"
+            "| A | B |\n| --- | --- |\n| 1 | 2 |\n\n![logo](image_1.png)![](https://cdn/x.png)\n",
+        )
+        self.assertEqual(document.images, {'image_1.png': b'\x89PNG\r\n\x1a\n'})
+
+    def test_block_tags_inside_pre_and_cells(self):
+        """测试预格式文本中的块级标签不会丢失代码，表格单元格中的段落以空格分隔"""
+        self.assertEqual(
+            html_to_markdown('<pre>line1\nline2<div>x</div>line3</pre><p>after</p>').markdown,
+            "```\nline1\nline2\nx\nline3\n```\n\nafter\n",
+        )
+        self.assertEqual(
+            html_to_markdown('<table><tr><th>A</th></tr><tr><td>a<p>b</p>c</td></tr></table>').markdown,
+            "| A |\n| --- |\n| a b c |\n",
+        )
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,155 @@
+import ctypes
+import os
+import shutil
+import tempfile
+import unittest
+from unittest import mock
+
+from app.models import ConversionOptions
+from app.page_cache import PageCache, PagePlan, hash_pages, split_pages
+from app.services import PDFConverterService
+from app.test_cos_service import FakeCosClient
+from app.worker_pool import ConvertedDocument
+
+
+def write_pdf(path, pages):
+    """生成每页包含指定文本行的PDF"""
+    import pypdfium2
+    import pypdfium2.raw as pdfium_c
+
+    pdf = pypdfium2.PdfDocument.new()
+    font = pdfium_c.FPDFText_LoadStandardFont(pdf.raw, b"Helvetica")
+    for lines in pages:
+        page = pdf.new_page(612, 792)
+        for index, line in enumerate(lines):
+            obj = pdfium_c.FPDFPageObj_CreateTextObj(pdf.raw, font, 11.0)
+            text = (line + "\0").encode("utf-16-le")
+            pdfium_c.FPDFText_SetText(obj, ctypes.cast(ctypes.c_char_p(text), ctypes.POINTER(pdfium_c.FPDF_WCHAR)))
+            pdfium_c.FPDFPageObj_Transform(obj, 1, 0, 0, 1, 72, 720 - index * 14)
+            pdfium_c.FPDFPage_InsertObject(page.raw, obj)
+        pdfium_c.FPDFPage_GenerateContent(page.raw)
+        page.close()
+    pdf.save(path)
+    pdf.close()
+
+
+def paginate(pages):
+    """按marker的分页输出格式拼接页面"""
+    return "".join(f"\n\n{{{index}}}{'-' * 48}\n\n{markdown}" for index, markdown in pages)
+
+
+class FakePagePool:
+    """测试用工作进程池：按page_range只转换指定页面，并输出分页分隔行"""
+
+    def __init__(self, page_texts):
+        self.page_texts = page_texts
+        self.page_ranges = []
+
+    def convert(self, pdf_path, output_dir=None, options=None, timeout=None):
+        pages = options['page_range']
+        self.page_ranges.append(pages)
+        return ConvertedDocument(
+            markdown=paginate((index, f"{self.page_texts[index]}\n\n![](_page_{index}_Picture_0.jpeg)") for index in pages),
+            images={f"_page_{index}_Picture_0.jpeg": f"img{index}".encode() for index in pages},
+        )
+
+
+class TestPageCache(unittest.TestCase):
+    """测试按页内容哈希的增量缓存"""
+
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.temp_dir, ignore_errors=True)
+
+    def test_split_pages(self):
+        """测试按分页分隔行拆分Markdown"""
+        markdown = paginate([(3, "# A\n\ntext"), (4, ""), (7, "last")])
+        self.assertEqual(split_pages(markdown), {3: "# A\n\ntext", 4: "", 7: "last"})
+        self.assertIsNone(split_pages("# no pages"))
+
+    def test_hash_pages_detects_changed_page(self):
+        """测试页面哈希只在页面内容变化时改变"""
+        first = os.path.join(self.temp_dir, 'v1.pdf')
+        second = os.path.join(self.temp_dir, 'v2.pdf')
+        write_pdf(first, [["page one"], ["page two"], ["page three"]])
+        write_pdf(second, [["page one"], ["page two, fixed typo"], ["page three"]])
+        v1, v2 = hash_pages(first), hash_pages(second)
+        self.assertEqual(v1, hash_pages(first))
+        self.assertEqual([a == b for a, b in zip(v1, v2)], [True, False, True])
+
+    def test_store_and_lookup(self):
+        """测试批量写入、查询和命中统计"""
+        cache = PageCache(os.path.join(self.temp_dir, 'pages.sqlite3'))
+        plan = PagePlan(page_keys=['k0', 'k1'], cached={}, missing=[0, 1])
+        entries = plan.build_entries(
+            {0: "text ![](a.png)", 1: "![](missing.png)"},
+            {"a.png": "https://cos/a.png"},
+        )
+        # 图片没有上传成功的页面不写入缓存
+        self.assertEqual(list(entries), ['k0'])
+        cache.put_many(entries)
+        found = cache.get_many(['k0', 'k1'])
+        self.assertEqual(found, {'k0': {'markdown_text': "text ![](https://cos/a.png)",
+                                        'files_dict': {'a.png': 'https://cos/a.png'}}})
+        self.assertEqual(cache.stats()['hits'], 1)
+        self.assertEqual(cache.stats()['misses'], 1)
+        cache.close()
+
+
+class TestIncrementalConversion(unittest.TestCase):
+    """测试修订后的文档只转换变化的页面"""
+
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp()
+        env = {
+            'COS_SECRET_ID': 'id',
+            'COS_SECRET_KEY': 'key',
+            'COS_BUCKET': 'bucket-1250000000',
+            'CONVERSION_CACHE_ENABLED': 'false',
+            'CONVERSION_ROUTE': 'marker',
+            'PDF_STORE_ENABLED': 'false',
+            'PAGE_CACHE_PATH': os.path.join(self.temp_dir, 'pages.sqlite3'),
+            'PAGE_CACHE_MIN_PAGES': '1',
+        }
+        with mock.patch.dict(os.environ, env):
+            self.service = PDFConverterService()
+        self.service.cos_service.client = FakeCosClient()
+
+    def tearDown(self):
+        self.service.shutdown()
+        shutil.rmtree(self.temp_dir, ignore_errors=True)
+
+    def _convert(self, name, page_texts):
+        path = os.path.join(self.temp_dir, f"{name}.pdf")
+        write_pdf(path, [[text] for text in page_texts])
+        pool = FakePagePool(page_texts)
+        self.service.get_worker_pool = lambda: pool
+        self.service._job_context.stats = {}
+        result = self.service._convert_pdf_file(path, name, None, ConversionOptions())
+        return result, pool, self.service._job_context.stats['page_cache']
+
+    def test_only_changed_pages_are_converted(self):
+        """测试第二次提交时只转换修改过的页面，并复用其余页面的Markdown和图片URL"""
+        (markdown_v1, _, _, error), pool, stats = self._convert('v1', ["one", "two", "three"])
+        self.assertIsNone(error)
+        self.assertEqual(pool.page_ranges, [[0, 1, 2]])
+        self.assertEqual(stats['hits'], 0)
+
+        (markdown_v2, _, files_dict, error), pool, stats = self._convert('v2', ["one", "TWO", "three"])
+        self.assertIsNone(error)
+        self.assertEqual(pool.page_ranges, [[1]])
+        self.assertEqual((stats['hits'], stats['misses']), (2, 1))
+        v1_pages = markdown_v1.split("\n\n")
+        v2_pages = markdown_v2.split("\n\n")
+        # 未变化的页面（包括已上传的图片URL）原样复用，变化的页面使用新上传的图片
+        self.assertEqual(v2_pages[:2], v1_pages[:2])
+        self.assertEqual(v2_pages[4:], v1_pages[4:])
+        self.assertEqual(v2_pages[2], "TWO")
+        self.assertIn('/v2_', v2_pages[3])
+        self.assertIn('_page_0_Picture_0.jpeg', files_dict)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,209 @@
+import os
+import shutil
+import tempfile
+import threading
+import time
+import unittest
+
+from app.downloader import DownloadError, DownloadResult
+from app.jobs import JobScheduler
+from app.pipeline import BatchPipeline
+from app.models import ConversionOptions
+from app.services import ConversionError
+
+
+class FakeService:
+    """测试用转换服务：每个阶段固定耗时，并记录各阶段的执行区间"""
+
+    def __init__(self, temp_dir, stage_seconds=0.1):
+        self.temp_dir = temp_dir
+        self.stage_seconds = stage_seconds
+        self.events = []
+        self.cached = {}
+        self.downloaded = 0
+        self.max_downloaded = 0
+        self._lock = threading.Lock()
+
+    def _record(self, stage, url, started):
+        with self._lock:
+            self.events.append((stage, url, started, time.perf_counter()))
+
+    def fetch_pdf(self, url):
+        started = time.perf_counter()
+        if "missing" in url:
+            raise DownloadError("远端返回404")
+        time.sleep(self.stage_seconds / 2)
+        path = os.path.join(tempfile.mkdtemp(dir=self.temp_dir), os.path.basename(url))
+        with open(path, 'wb') as f:
+            f.write(url.encode())
+        with self._lock:
+            self.downloaded += 1
+            self.max_downloaded = max(self.max_downloaded, self.downloaded)
+        self._record('download', url, started)
+        return DownloadResult(path=path, content_hash=url, size=len(url))
+
+    def make_cache_key(self, content_hash, options):
+        return content_hash
+
+    def get_cached_result(self, cache_key):
+        return self.cached.get(cache_key)
+
+    def convert_file(self, pdf_path, options):
+        started = time.perf_counter()
+        time.sleep(self.stage_seconds)
+        if pdf_path.endswith("broken.pdf"):
+            raise ConversionError("转换失败: 文件损坏")
+        self._record('convert', pdf_path, started)
+        return os.path.basename(pdf_path)
+
+    def publish_converted(self, converted, content_hash, cache_key):
+        started = time.perf_counter()
+        time.sleep(self.stage_seconds)
+        self._record('upload', converted, started)
+        return f"# {converted}", f"https://cos.example.com/{converted}.md", {}, None
+
+    def _count_pages(self, path):
+        return 1
+
+    def _remove_temp_file(self, path):
+        with self._lock:
+            self.downloaded -= 1
+        shutil.rmtree(os.path.dirname(path), ignore_errors=True)
+
+
+class TestBatchPipeline(unittest.TestCase):
+    """测试下载、转换、上传三阶段流水线"""
+
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp()
+        self.service = FakeService(self.temp_dir)
+
+    def tearDown(self):
+        shutil.rmtree(self.temp_dir, ignore_errors=True)
+
+    def run_batch(self, urls, **kwargs):
+        pipeline = BatchPipeline(self.service, **kwargs)
+        try:
+            return [future.result(timeout=10) for future in pipeline.submit(urls)]
+        finally:
+            pipeline.shutdown()
+
+    def test_stages_overlap(self):
+        """测试上传与下一个文档的转换重叠，整批耗时接近只受转换限制的下限"""
+        urls = [f"https://example.com/doc{n}.pdf" for n in range(4)]
+        started = time.perf_counter()
+        results = self.run_batch(urls, convert_workers=1, prefetch=1)
+        elapsed = time.perf_counter() - started
+
+        self.assertEqual([result["status"] for result in results], ["succeeded"] * 4)
+        self.assertEqual(results[2]["file_url"], "https://cos.example.com/doc2.pdf.md")
+        self.assertEqual(set(results[0]["timings"]), {"download", "convert", "upload"})
+        # 串行执行需要 4 * 0.25 秒
+        self.assertLess(elapsed, 0.8)
+        uploads = [event for event in self.service.events if event[0] == 'upload']
+        converts = [event for event in self.service.events if event[0] == 'convert']
+        self.assertTrue(any(
+            upload[2] < convert[3] and convert[2] < upload[3] for upload in uploads for convert in converts
+        ))
+
+    def test_prefetch_is_bounded(self):
+        """测试已下载但尚未转换的文档数量不超过转换并发数加预取数量"""
+        urls = [f"https://example.com/doc{n}.pdf" for n in range(8)]
+        self.service.stage_seconds = 0.05
+        self.run_batch(urls, convert_workers=1, download_workers=4, prefetch=1)
+        self.assertLessEqual(self.service.max_downloaded, 2)
+        self.assertEqual(os.listdir(self.temp_dir), [])
+
+    def test_failures_and_cache_hits(self):
+        """测试单个文档失败不影响其他文档，命中缓存的文档跳过转换"""
+        self.service.cached["https://example.com/cached.pdf"] = ("# cached", "https://cos.example.com/cached.md", {}, None)
+        results = self.run_batch([
+            "https://example.com/missing.pdf",
+            "https://example.com/broken.pdf",
+            "https://example.com/cached.pdf",
+            "https://example.com/ok.pdf",
+        ])
+        self.assertEqual([result["index"] for result in results], [0, 1, 2, 3])
+        self.assertIn("无法下载PDF文件", results[0]["error"])
+        self.assertEqual(results[1]["error"], "转换失败: 文件损坏")
+        self.assertTrue(results[2]["cached"])
+        self.assertEqual(results[3]["status"], "succeeded")
+        self.assertEqual(os.listdir(self.temp_dir), [])
+
+
+class TestScheduledBatchPipeline(unittest.TestCase):
+    """测试指定调度器时，批量转换的文档与交互式请求一起按优先级和租户排队"""
+
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp()
+        self.service = FakeService(self.temp_dir, stage_seconds=0.02)
+        self.release = threading.Event()
+        self.order = []
+
+        def handler(payload):
+            self.order.append("batch" if "batch_item" in payload else payload["pdf_url"])
+            self.release.wait(5)
+            if "batch_item" in payload:
+                return self.pipeline.run_scheduled(payload)
+            return {"file_url": "https://cos.example.com/doc.md", "files_dict": {}}
+
+        self.scheduler = JobScheduler(handler, max_concurrent=1)
+        self.pipeline = BatchPipeline(self.service, convert_workers=3, scheduler=self.scheduler)
+
+    def tearDown(self):
+        self.release.set()
+        self.pipeline.shutdown()
+        self.scheduler.shutdown()
+        shutil.rmtree(self.temp_dir, ignore_errors=True)
+
+    def _wait_queued(self, expected):
+        for _ in range(100):
+            if self.scheduler.stats()["queued_by_priority"] == expected:
+                return
+            time.sleep(0.02)
+        self.fail(f"排队情况不符合预期: {self.scheduler.stats()['queued_by_priority']}")
+
+    def test_interactive_job_overtakes_batch(self):
+        """测试批量文档以指定的优先级排队，之后提交的高优先级任务先于排队中的批量文档执行"""
+        blocker = self.scheduler.submit({"pdf_url": "blocker"})
+        urls = [f"https://example.com/doc{n}.pdf" for n in range(3)]
+        options = ConversionOptions(priority="low")
+        futures = self.pipeline.submit(urls, options, tenant="bulk")
+        self._wait_queued({"low": 3})
+        high = self.scheduler.submit({"pdf_url": "high"}, priority="high")
+        self.release.set()
+        results = [future.result(timeout=5) for future in futures]
+        blocker.future.result(timeout=5)
+        high.future.result(timeout=5)
+
+        self.assertEqual(self.order, ["blocker", "high", "batch", "batch", "batch"])
+        self.assertEqual([result["status"] for result in results], ["succeeded"] * 3)
+        self.assertEqual(results[1]["file_url"], "https://cos.example.com/doc1.pdf.md")
+        self.assertEqual(set(results[1]["timings"]), {"download", "convert", "upload"})
+        self.assertEqual(os.listdir(self.temp_dir), [])
+
+    def test_upload_overlaps_scheduled_conversion(self):
+        """测试调度器只执行转换，上传在流水线中与下一个文档的转换重叠执行"""
+        self.release.set()
+        self.service.stage_seconds = 0.1
+        futures = self.pipeline.submit([f"https://example.com/doc{n}.pdf" for n in range(3)])
+        self.assertEqual([future.result(timeout=5)["status"] for future in futures], ["succeeded"] * 3)
+        uploads = [event for event in self.service.events if event[0] == 'upload']
+        converts = [event for event in self.service.events if event[0] == 'convert']
+        self.assertTrue(any(
+            upload[2] < convert[3] and convert[2] < upload[3] for upload in uploads for convert in converts
+        ))
+
+    def test_rejected_when_queue_is_full(self):
+        """测试调度器拒绝的文档以rejected结束，并删除下载的文件"""
+        self.scheduler.max_queued = 1
+        self.scheduler.submit({"pdf_url": "blocker"})
+        time.sleep(0.1)
+        self.scheduler.submit({"pdf_url": "queued"})
+        results = [future.result(timeout=5) for future in self.pipeline.submit(["https://example.com/doc.pdf"])]
+        self.assertEqual(results[0]["status"], "rejected")
+        self.assertEqual(os.listdir(self.temp_dir), [])
+
+
+if __name__ == '__main__':
+    unittest.main()
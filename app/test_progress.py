@@ -0,0 +1,199 @@
+import os
+import shutil
+import tempfile
+import threading
+import time
+import unittest
+from concurrent.futures import ThreadPoolExecutor
+from unittest import mock
+
+from app import progress
+from app.jobs import JobScheduler
+from app.logs import submit_in_context
+from app.models import ConversionOptions
+from app.progress import ProgressReporter
+from app.services import PDFConverterService
+from app.test_batching import FakeBatchPool
+from app.test_cos_service import FakeCosClient
+from app.test_page_cache import write_pdf
+
+
+class TestProgressReporter(unittest.TestCase):
+    """测试进度事件的记录和回放"""
+
+    def test_job_events(self):
+        """测试任务执行线程绑定记录器，结束时记录结果并关闭"""
+        def handler(payload):
+            progress.report("stage", stage="downloading")
+            return {"file_url": "https://cos/doc.md", "files_dict": {}}
+
+        scheduler = JobScheduler(handler, max_concurrent=1)
+        job = scheduler.submit({"pdf_url": "doc"})
+        job.future.result(timeout=5)
+        events, closed = job.progress.wait(0, timeout=1)
+        scheduler.shutdown()
+
+        self.assertTrue(closed)
+        self.assertEqual([event["event"] for event in events], ["stage", "stage", "result"])
+        self.assertEqual(events[1]["data"], {"stage": "downloading"})
+        self.assertEqual(events[2]["data"]["file_url"], "https://cos/doc.md")
+        # 没有绑定记录器的线程中调用report不产生任何效果
+        progress.report("stage", stage="ignored")
+
+    def test_reporter_follows_thread_pool_context(self):
+        """测试通过submit_in_context提交到线程池的工作继承绑定的记录器"""
+        reporter = ProgressReporter()
+        with ThreadPoolExecutor(max_workers=1) as executor, progress.bind(reporter):
+            submit_in_context(executor, lambda: progress.report("stage", stage="uploading")).result(timeout=5)
+            # 未复制上下文的工作不会写入该记录器
+            executor.submit(lambda: progress.report("stage", stage="ignored")).result(timeout=5)
+        events, _ = reporter.wait(0, timeout=0)
+        self.assertEqual(events, [{"event": "stage", "data": {"stage": "uploading"}}])
+        self.assertIsNone(progress.current())
+
+    def test_failed_job_event(self):
+        """测试任务失败时记录错误事件"""
+        def handler(payload):
+            raise ValueError("无法下载PDF文件")
+
+        scheduler = JobScheduler(handler, max_concurrent=1)
+        job = scheduler.submit({"pdf_url": "doc"})
+        with self.assertRaises(ValueError):
+            job.future.result(timeout=5)
+        events, closed = job.progress.wait(0, timeout=1)
+        scheduler.shutdown()
+        self.assertTrue(closed)
+        self.assertEqual(events[-1], {"event": "error", "data": {"detail": "无法下载PDF文件", "status_code": 500}})
+
+
+class TestPartialResults(unittest.TestCase):
+    """测试按块转换并推送已完成页面的Markdown"""
+
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp()
+        self.service = self._create_service(page_cache=False)
+        self.pool = FakeBatchPool()
+        self.service.get_worker_pool = lambda: self.pool
+
+    def tearDown(self):
+        self.service.shutdown()
+        shutil.rmtree(self.temp_dir, ignore_errors=True)
+
+    def _create_service(self, page_cache):
+        env = {
+            'COS_SECRET_ID': 'id',
+            'COS_SECRET_KEY': 'key',
+            'COS_BUCKET': 'bucket-1250000000',
+            'CONVERSION_CACHE_ENABLED': 'false',
+            'PAGE_CACHE_ENABLED': 'true' if page_cache else 'false',
+            'PAGE_CACHE_PATH': os.path.join(self.temp_dir, 'pages.sqlite3'),
+            'CONVERSION_ROUTE': 'marker',
+            'PDF_STORE_ENABLED': 'false',
+            'STREAM_CHUNK_PAGES': '2',
+        }
+        with mock.patch.dict(os.environ, env):
+            service = PDFConverterService()
+        service.cos_service.client = FakeCosClient()
+        return service
+
+    def _convert(self, reporter, texts=None):
+        path = os.path.join(self.temp_dir, 'report.pdf')
+        write_pdf(path, [[text] for text in texts or [f"page {index}" for index in range(5)]])
+        with progress.bind(reporter):
+            result = self.service._convert_pdf_file(path, 'hash', None, ConversionOptions())
+        events, _ = reporter.wait(0, timeout=0)
+        return result, events
+
+    def test_chunks_are_streamed_in_order(self):
+        """测试每块完成后按页序推送Markdown和页面进度"""
+        (markdown_text, file_url, _, error), events = self._convert(ProgressReporter(partial_results=True))
+        self.assertIsNone(error)
+        self.assertEqual([options['page_range'] for _, options in self.pool.calls], [[0, 1], [2, 3], [4]])
+
+        chunks = [event["data"] for event in events if event["event"] == "markdown"]
+        self.assertEqual([chunk["pages"] for chunk in chunks], [[0, 1], [2, 3], [4, 4]])
+        self.assertIn("page 2", chunks[1]["markdown"])
+        # 推送的图片引用与最终文件中的资源文件名一致
+        self.assertIn("shard001__page_2_Picture_0.jpeg", chunks[1]["markdown"])
+        pages_done = [event["data"]["pages_done"] for event in events if event["event"] == "progress"]
+        self.assertEqual(pages_done, [2, 4, 5])
+        stages = [event["data"]["stage"] for event in events if event["event"] == "stage"]
+        self.assertEqual(stages, ["converting", "uploading"])
+        self.assertIn("page 4", markdown_text)
+
+    def test_chunks_are_streamed_with_page_cache(self):
+        """测试大文档走页面缓存时也按块推送，推送内容包含其间命中缓存的页面"""
+        self.service.shutdown()
+        self.service = self._create_service(page_cache=True)
+        self.service.get_worker_pool = lambda: self.pool
+        texts = [f"page {index}" for index in range(12)]
+        (_, _, _, error), events = self._convert(ProgressReporter(partial_results=True), texts)
+        self.assertIsNone(error)
+        chunks = [event["data"]["pages"] for event in events if event["event"] == "markdown"]
+        self.assertEqual(chunks, [[index, index + 1] for index in range(0, 12, 2)])
+
+        # 修订后只重新转换变化的页面，每块连同之前命中缓存的页面一起推送
+        self.pool.calls.clear()
+        texts[4], texts[9], texts[10] = "revised 4", "revised 9", "revised 10"
+        (markdown_text, _, _, error), events = self._convert(ProgressReporter(partial_results=True), texts)
+        self.assertIsNone(error)
+        self.assertEqual([options['page_range'] for _, options in self.pool.calls], [[4, 9], [10]])
+        chunks = [event["data"] for event in events if event["event"] == "markdown"]
+        self.assertEqual([chunk["pages"] for chunk in chunks], [[0, 9], [10, 11]])
+        self.assertIn("page 3", chunks[0]["markdown"])
+        self.assertIn("revised 9", chunks[0]["markdown"])
+        self.assertIn("page 11", chunks[1]["markdown"])
+        pages_done = [event["data"]["pages_done"] for event in events if event["event"] == "progress"]
+        self.assertEqual(pages_done, [10, 12])
+        self.assertIn("revised 10", markdown_text)
+
+    def test_progress_without_partial_results(self):
+        """测试不需要部分结果时整篇转换，完成时只记录页面进度"""
+        (_, _, _, error), events = self._convert(ProgressReporter())
+        self.assertIsNone(error)
+        self.assertEqual([options for _, options in self.pool.calls], [{}])
+        self.assertNotIn("markdown", [event["event"] for event in events])
+        self.assertIn({"event": "progress", "data": {"pages_done": 5, "total_pages": 5}}, events)
+
+    def test_coalesced_stream_subscribers_receive_chunks(self):
+        """测试合并到同一次转换的多个流式请求都收到按块推送的事件，不需要部分结果的请求不会抑制按块转换"""
+        release = threading.Event()
+        submit = self.pool.submit
+
+        def blocked_submit(*args, **kwargs):
+            release.wait(5)
+            return submit(*args, **kwargs)
+
+        self.pool.submit = blocked_submit
+        path = os.path.join(self.temp_dir, 'report.pdf')
+        write_pdf(path, [[f"page {index}"] for index in range(5)])
+        reporters = [ProgressReporter(), ProgressReporter(partial_results=True), ProgressReporter(partial_results=True)]
+
+        def convert(reporter):
+            with progress.bind(reporter):
+                return self.service._convert_local_file(path, 'hash', ConversionOptions())
+
+        with ThreadPoolExecutor(max_workers=3) as executor:
+            futures = []
+            for reporter in reporters:
+                futures.append(submit_in_context(executor, convert, reporter))
+                time.sleep(0.1)
+            for _ in range(100):
+                if self.service._content_flight.stats()["coalesced"]:
+                    break
+                time.sleep(0.02)
+            release.set()
+            results = [future.result(timeout=5) for future in futures]
+
+        self.assertEqual([error for _, _, _, error in results], [None] * 3)
+        self.assertEqual(self.service._content_flight.stats()["executions"], 2)
+        for reporter in reporters[1:]:
+            events, _ = reporter.wait(0, timeout=0)
+            chunks = [event["data"]["pages"] for event in events if event["event"] == "markdown"]
+            self.assertEqual(chunks, [[0, 1], [2, 3], [4, 4]])
+            stages = [event["data"]["stage"] for event in events if event["event"] == "stage"]
+            self.assertEqual(stages, ["converting", "uploading"])
+
+
+if __name__ == "__main__":
+    unittest.main()
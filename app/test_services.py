@@ -0,0 +1,117 @@
+import os
+import unittest
+from unittest import mock
+
+from app.image_transcoder import TranscodeResult
+from app.models import ConversionOptions
+from app.services import PDFConverterService
+from app.test_cos_service import FakeCosClient
+from app.worker_pool import ConvertedDocument
+
+
+class FakePool:
+    """测试用工作进程池：直接在内存中返回转换结果"""
+
+    def __init__(self):
+        self.calls = []
+
+    def convert(self, pdf_path, output_dir=None, options=None, timeout=None):
+        self.calls.append((pdf_path, output_dir))
+        return ConvertedDocument(
+            markdown='# Title\n\n![](_page_0_Picture_1.jpeg)\n',
+            images={'_page_0_Picture_1.jpeg': b'jpeg-bytes'},
+            metadata={'pages': 1},
+        )
+
+
+class TestInMemoryPipeline(unittest.TestCase):
+    """测试转换结果在内存中完成上传和改写"""
+
+    def setUp(self):
+        env = {
+            'COS_SECRET_ID': 'id',
+            'COS_SECRET_KEY': 'key',
+            'COS_BUCKET': 'bucket-1250000000',
+            'CONVERSION_CACHE_ENABLED': 'false',
+            'CONVERSION_ROUTE': 'marker',
+            'PDF_STORE_ENABLED': 'false',
+        }
+        with mock.patch.dict(os.environ, env):
+            self.service = PDFConverterService()
+        self.service.cos_service.client = FakeCosClient()
+        self.pool = FakePool()
+        self.service.get_worker_pool = lambda: self.pool
+
+    def tearDown(self):
+        self.service.shutdown()
+
+    def test_convert_without_temp_files(self):
+        """测试热路径不创建临时目录、不写文件，Markdown通过upload_content上传"""
+        with mock.patch('app.services.detect_document_type', return_value='pdf'), \
+                mock.patch('tempfile.mkdtemp', side_effect=AssertionError("不应创建临时目录")):
+            markdown_text, file_url, files_dict, error = self.service._convert_pdf_file(
+                '/data/paper_abc12345.pdf', 'hash', None, ConversionOptions()
+            )
+
+        self.assertIsNone(error)
+        self.assertEqual(self.pool.calls, [('/data/paper_abc12345.pdf', None)])
+        image_url = files_dict['_page_0_Picture_1.jpeg']
+        self.assertEqual(markdown_text, f'# Title\n\n![]({image_url})\n')
+        self.assertIn('paper_abc12345_meta.json', files_dict)
+        self.assertEqual(files_dict['paper_abc12345.md'], file_url)
+        uploads = {key: kwargs['Body'] for key, kwargs in self.service.cos_service.client.calls}
+        self.assertEqual(uploads[file_url.split('.myqcloud.com/')[1]], markdown_text.encode('utf-8'))
+
+    def test_default_route_is_marker_and_reported(self):
+        """测试默认不走文本层快速路径，使用的转换路径记录在任务结果中"""
+        env = {'CONVERSION_CACHE_ENABLED': 'false', 'PAGE_CACHE_ENABLED': 'false', 'PDF_STORE_ENABLED': 'false'}
+        with mock.patch.dict(os.environ, env):
+            os.environ.pop('CONVERSION_ROUTE', None)
+            service = PDFConverterService()
+        self.assertEqual(service.default_route, 'marker')
+        service.shutdown()
+
+        self.service._job_context.stats = {}
+        with mock.patch('app.services.detect_document_type', return_value='pdf'), \
+                mock.patch('app.services.classify_pdf', side_effect=AssertionError("不应检查文本层")):
+            self.service._convert_pdf_file('/data/paper_abc12345.pdf', 'hash', None, ConversionOptions())
+        self.assertEqual(self.service._job_context.stats['route'], 'marker')
+
+    def test_text_route_without_text_layer_falls_back_to_marker(self):
+        """测试指定文本层路径的PDF没有文本层时改用marker转换，而不是返回空文档"""
+        self.service._job_context.stats = {}
+        with mock.patch('app.services.detect_document_type', return_value='pdf'), \
+                mock.patch('app.services.extract_markdown', return_value=ConvertedDocument(markdown='\n\n')):
+            markdown_text, _, _, error = self.service._convert_pdf_file(
+                '/data/scan_abc12345.pdf', 'hash', None, ConversionOptions(route='text')
+            )
+        self.assertIsNone(error)
+        self.assertTrue(markdown_text.startswith('# Title'))
+        self.assertEqual(len(self.pool.calls), 1)
+        self.assertEqual(self.service._job_context.stats['route'], 'marker')
+
+    def test_transcoded_images_keep_rel_paths(self):
+        """测试转码后的图片以新扩展名上传，Markdown中的相对路径仍能替换为URL"""
+        transcoder = mock.Mock()
+        transcoder.transcode.return_value = TranscodeResult(
+            images={'_page_0_Picture_1.jpeg': b'webp-bytes'},
+            filenames={'_page_0_Picture_1.jpeg': '_page_0_Picture_1.webp'},
+            original_bytes=10,
+            output_bytes=10,
+        )
+        self.service.image_transcoder = transcoder
+        with mock.patch('app.services.detect_document_type', return_value='pdf'):
+            markdown_text, _, files_dict, error = self.service._convert_pdf_file(
+                '/data/paper_abc12345.pdf', 'hash', None, ConversionOptions()
+            )
+
+        self.assertIsNone(error)
+        image_url = files_dict['_page_0_Picture_1.jpeg']
+        self.assertTrue(image_url.endswith('/_page_0_Picture_1.webp'))
+        self.assertIn(f'![]({image_url})', markdown_text)
+        calls = {key: kwargs for key, kwargs in self.service.cos_service.client.calls}
+        self.assertEqual(calls[image_url.split('.myqcloud.com/')[1]]['ContentType'], 'image/webp')
+
+
+if __name__ == "__main__":
+    unittest.main()
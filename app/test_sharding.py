@@ -0,0 +1,52 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+from app.sharding import convert_shards, plan_shards, stitch_documents
+from app.worker_pool import ConvertedDocument, MarkerWorkerPool
+
+
+class TestSharding(unittest.TestCase):
+    """测试按页范围拆分和拼接"""
+
+    def test_plan_shards(self):
+        """测试页码分片规划"""
+        self.assertEqual(plan_shards(10, 0), [])
+        self.assertEqual(plan_shards(10, 10), [])
+        self.assertEqual(plan_shards(7, 3), [[0, 1, 2], [3, 4, 5], [6]])
+
+    def test_stitch_renames_colliding_images(self):
+        """测试拼接时图片重命名且引用同步改写"""
+        documents = [
+            ConvertedDocument(markdown="# 第一部分\n\n![](figure.png)\n", images={"figure.png": b"a"}),
+            ConvertedDocument(markdown="第二部分\n\n<img src=\"figure.png\">\n", images={"figure.png": b"b"}),
+        ]
+        stitched = stitch_documents(documents)
+        self.assertEqual(stitched.images, {"shard000_figure.png": b"a", "shard001_figure.png": b"b"})
+        self.assertEqual(
+            stitched.markdown,
+            "# 第一部分\n\n![](shard000_figure.png)\n\n第二部分\n\n<img src=\"shard001_figure.png\">\n"
+        )
+
+    def test_convert_shards_in_parallel_and_in_order(self):
+        """测试各分片并行转换后按页序拼接"""
+        temp_dir = tempfile.mkdtemp()
+        pool = MarkerWorkerPool(size=2, factory_path='app.test_worker_pool:create_fake_converter')
+        try:
+            pdf_path = os.path.join(temp_dir, 'doc.pdf')
+            with open(pdf_path, 'w', encoding='utf-8') as f:
+                f.write('doc')
+            document = convert_shards(pool, pdf_path, [[0, 1], [2, 3], [4]])
+            self.assertEqual(len(document.images), 3)
+            self.assertEqual([meta['options']['page_range'] for meta in document.metadata['shards']],
+                             [[0, 1], [2, 3], [4]])
+            self.assertEqual(document.markdown.count('# doc'), 3)
+            self.assertIn('![图](shard002__page_0_Picture_1.png)', document.markdown)
+        finally:
+            pool.shutdown()
+            shutil.rmtree(temp_dir, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,214 @@
+import os
+import shutil
+import tempfile
+import threading
+import time
+import unittest
+from concurrent.futures import ThreadPoolExecutor
+from unittest import mock
+
+from app import deadline
+from app.downloader import DownloadResult
+from app.services import PDFConverterService
+from app.singleflight import SingleFlight
+
+
+class TestSingleFlight(unittest.TestCase):
+    """测试并发相同请求的合并"""
+
+    def test_concurrent_calls_share_result(self):
+        """测试并发的相同键只执行一次"""
+        flight = SingleFlight()
+        calls = []
+        started = threading.Event()
+
+        def work():
+            calls.append(1)
+            started.set()
+            time.sleep(0.1)
+            return 'result'
+
+        with ThreadPoolExecutor(max_workers=4) as executor:
+            leader = executor.submit(flight.do, 'k', work)
+            started.wait(5)
+            followers = [executor.submit(flight.do, 'k', work) for _ in range(3)]
+            results = [leader.result()] + [future.result() for future in followers]
+
+        self.assertEqual(len(calls), 1)
+        self.assertEqual([result for result, _ in results], ['result'] * 4)
+        self.assertEqual(sum(shared for _, shared in results), 3)
+        self.assertEqual(flight.stats(), {'executions': 1, 'coalesced': 3, 'in_flight': 0})
+
+    def test_exception_is_shared_and_key_released(self):
+        """测试异常会传递给所有等待方，且执行结束后键被释放"""
+        flight = SingleFlight()
+
+        def fail():
+            raise ValueError('boom')
+
+        with self.assertRaises(ValueError):
+            flight.do('k', fail)
+        self.assertEqual(flight.do('k', lambda: 1), (1, False))
+
+    def _wait_until_cancelled(self, release, timeout=5):
+        """执行函数：等待release或共享的截止时间被取消"""
+        for _ in range(int(timeout / 0.01)):
+            deadline.check('convert')
+            if release.is_set():
+                return 'result'
+            time.sleep(0.01)
+        raise AssertionError("执行没有结束")
+
+    def test_leader_cancel_does_not_fail_followers(self):
+        """测试发起执行的调用方被取消后，执行继续，没有截止时间的等待方拿到结果"""
+        flight = SingleFlight()
+        release = threading.Event()
+        calls = []
+        leader_deadline = deadline.Deadline()
+
+        def work():
+            calls.append(1)
+            return self._wait_until_cancelled(release)
+
+        def leader():
+            with deadline.bind(leader_deadline):
+                return flight.do('k', work)
+
+        with ThreadPoolExecutor(max_workers=2) as executor:
+            first = executor.submit(leader)
+            time.sleep(0.05)
+            follower = executor.submit(flight.do, 'k', work)
+            time.sleep(0.05)
+            leader_deadline.cancel("client gone")
+            with self.assertRaises(deadline.RequestCancelled):
+                first.result(timeout=5)
+            release.set()
+            self.assertEqual(follower.result(timeout=5), ('result', True))
+        self.assertEqual(len(calls), 1)
+
+    def test_follower_waits_with_own_deadline(self):
+        """测试等待方按自己的截止时间离开，执行继续为其他调用方进行"""
+        flight = SingleFlight()
+        release = threading.Event()
+
+        def follower():
+            with deadline.bind(deadline.Deadline(0.1)):
+                return flight.do('k', lambda: self._wait_until_cancelled(release))
+
+        with ThreadPoolExecutor(max_workers=2) as executor:
+            first = executor.submit(flight.do, 'k', lambda: self._wait_until_cancelled(release))
+            time.sleep(0.05)
+            with self.assertRaises(deadline.DeadlineExceeded):
+                executor.submit(follower).result(timeout=5)
+            release.set()
+            self.assertEqual(first.result(timeout=5), ('result', False))
+
+    def test_run_cancelled_when_every_caller_left(self):
+        """测试所有调用方都离开后执行被取消，之后的相同调用重新执行"""
+        flight = SingleFlight()
+        outcome = []
+        finished = threading.Event()
+
+        def work():
+            try:
+                return self._wait_until_cancelled(threading.Event())
+            except deadline.RequestCancelled as e:
+                outcome.append(e.message)
+                raise
+            finally:
+                finished.set()
+
+        with deadline.bind(deadline.Deadline(0.1)):
+            with self.assertRaises(deadline.DeadlineExceeded):
+                flight.do('k', work)
+        self.assertTrue(finished.wait(5))
+        self.assertEqual(outcome, ["请求已取消: 所有等待结果的请求均已中止"])
+        self.assertEqual(flight.do('k', lambda: 1), (1, False))
+
+
+class TestServiceCoalescing(unittest.TestCase):
+    """测试转换服务对相同URL和相同内容的请求合并"""
+
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp()
+        # 缓存和PDF存储都写到临时目录（或关闭），测试不会在工作目录下生成.cache
+        env = {
+            'CONVERSION_CACHE_ENABLED': 'false',
+            'CONVERSION_CACHE_PATH': os.path.join(self.temp_dir, 'cache.sqlite3'),
+            'PAGE_CACHE_ENABLED': 'false',
+            'PAGE_CACHE_PATH': os.path.join(self.temp_dir, 'pages.sqlite3'),
+            'PDF_STORE_ENABLED': 'false',
+            'PDF_STORE_DIR': os.path.join(self.temp_dir, 'pdf_store'),
+            'COS_IMAGE_INDEX_PATH': os.path.join(self.temp_dir, 'images.sqlite3'),
+        }
+        with mock.patch.dict(os.environ, env):
+            self.service = PDFConverterService()
+        self.conversions = []
+
+        def fetch_pdf(url):
+            time.sleep(0.05)
+            temp_dir = tempfile.mkdtemp()
+            path = os.path.join(temp_dir, 'doc.pdf')
+            with open(path, 'wb') as f:
+                f.write(b'%PDF same bytes')
+            return DownloadResult(path=path, content_hash='same-hash', size=15)
+
+        def convert_pdf_file(pdf_path, content_hash, cache_key, options):
+            self.conversions.append(content_hash)
+            time.sleep(0.3)
+            return '# doc', 'https://cos/doc.md', {'doc.md': 'https://cos/doc.md'}, None
+
+        self.service.fetch_pdf = fetch_pdf
+        self.service._convert_pdf_file = convert_pdf_file
+
+    def tearDown(self):
+        self.service.shutdown()
+        shutil.rmtree(self.temp_dir, ignore_errors=True)
+
+    def test_same_url_and_same_content_are_coalesced(self):
+        """测试相同URL以及内容相同的不同URL只转换一次"""
+        urls = ['https://a.com/doc.pdf'] * 3 + ['https://b.com/copy.pdf']
+        with ThreadPoolExecutor(max_workers=4) as executor:
+            results = list(executor.map(self.service.convert_using_command, urls))
+
+        self.assertEqual(len(self.conversions), 1)
+        self.assertTrue(all(result[1] == 'https://cos/doc.md' for result in results))
+        # 每个请求拿到独立的文件URL字典
+        self.assertEqual(len({id(result[2]) for result in results}), 4)
+        stats = self.service.get_stats()['coalesced_requests']
+        self.assertEqual(stats['by_url']['coalesced'], 2)
+        self.assertEqual(stats['by_content']['coalesced'], 1)
+
+    def test_cancelled_leader_does_not_fail_followers(self):
+        """测试发起转换的请求被取消后，合并等待的请求仍然拿到转换结果而不是取消错误"""
+        def convert_pdf_file(pdf_path, content_hash, cache_key, options):
+            self.conversions.append(content_hash)
+            for _ in range(30):
+                deadline.check('convert')
+                time.sleep(0.01)
+            return '# doc', 'https://cos/doc.md', {'doc.md': 'https://cos/doc.md'}, None
+
+        self.service._convert_pdf_file = convert_pdf_file
+        leader_deadline = deadline.Deadline()
+
+        def leader():
+            with deadline.bind(leader_deadline):
+                return self.service.convert_using_command('https://a.com/doc.pdf')
+
+        with ThreadPoolExecutor(max_workers=2) as executor:
+            first = executor.submit(leader)
+            time.sleep(0.1)
+            follower = executor.submit(self.service.convert_using_command, 'https://a.com/doc.pdf')
+            time.sleep(0.05)
+            leader_deadline.cancel("client gone")
+            with self.assertRaises(deadline.RequestCancelled):
+                first.result(timeout=5)
+            result = follower.result(timeout=5)
+
+        self.assertEqual(result[1], 'https://cos/doc.md')
+        self.assertIsNone(result[3])
+        self.assertEqual(len(self.conversions), 1)
+
+
+if __name__ == "__main__":
+    unittest.main()
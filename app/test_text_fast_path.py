@@ -0,0 +1,38 @@
+import unittest
+
+from app.text_fast_path import text_to_markdown
+
+
+class TestTextToMarkdown(unittest.TestCase):
+    """测试文本层转Markdown段落"""
+
+    def test_merge_layout_line_breaks(self):
+        """测试合并排版换行，空行和句末短行作为段落分隔"""
+        text = (
+            "This is a fairly long line of body text that wraps\n"
+            "onto the next line of the same paragraph and keeps\n"
+            "going until it ends.\n"
+            "\n"
+            "A second paragraph starts here and it is also long\n"
+            "enough to wrap around."
+        )
+        self.assertEqual(
+            text_to_markdown(text),
+            "This is a fairly long line of body text that wraps onto the next line of the same paragraph "
+            "and keeps going until it ends.\n\n"
+            "A second paragraph starts here and it is also long enough to wrap around.",
+        )
+
+    def test_hyphenation_and_cjk(self):
+        """测试合并英文断词连字符，中文换行不插入空格"""
+        self.assertEqual(text_to_markdown("conver-\nsion of docu-\nments"), "conversion of documents")
+        self.assertEqual(text_to_markdown("这是第一行中文内容\n紧接着第二行"), "这是第一行中文内容紧接着第二行")
+
+    def test_escape_markdown_markers(self):
+        """测试正文开头的#不会被解析为标题"""
+        self.assertEqual(text_to_markdown("# not a heading"), "\\# not a heading")
+        self.assertEqual(text_to_markdown("\n\n"), "")
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,92 @@
+import hashlib
+import os
+import shutil
+import tempfile
+import unittest
+
+from fastapi import FastAPI, HTTPException, Request
+from fastapi.testclient import TestClient
+
+from app.uploads import UploadError, UploadTooLargeError, receive_upload
+
+PDF_BYTES = b'%PDF-1.4\n' + bytes(range(256)) * 40
+
+
+class TestReceiveUpload(unittest.TestCase):
+    """测试流式接收multipart上传"""
+
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp()
+        app = FastAPI()
+
+        @app.post("/upload")
+        async def upload(request: Request):
+            try:
+                received = await receive_upload(
+                    request,
+                    self.temp_dir,
+                    lambda filename: f"saved_{filename}",
+                    max_bytes=int(request.query_params.get('max_bytes', 1024 * 1024)),
+                    spool_bytes=1024,
+                )
+            except UploadTooLargeError as e:
+                raise HTTPException(status_code=413, detail=str(e))
+            except UploadError as e:
+                raise HTTPException(status_code=400, detail=str(e))
+            return {
+                "path": received.path,
+                "filename": received.filename,
+                "content_hash": received.content_hash,
+                "size": received.size,
+                "spooled_to_disk": received.spooled_to_disk,
+                "fields": received.fields,
+            }
+
+        self.client = TestClient(app)
+
+    def tearDown(self):
+        shutil.rmtree(self.temp_dir, ignore_errors=True)
+
+    def test_small_upload_with_fields(self):
+        """测试小文件在内存中接收，并解析其他表单字段"""
+        response = self.client.post(
+            "/upload",
+            files={"file": ("paper.pdf", b'%PDF-1.4\nsmall', "application/pdf")},
+            data={"shard_pages": "10"},
+        )
+        self.assertEqual(response.status_code, 200)
+        result = response.json()
+        self.assertFalse(result["spooled_to_disk"])
+        self.assertEqual(result["filename"], "paper.pdf")
+        self.assertEqual(result["fields"], {"shard_pages": "10"})
+        with open(result["path"], 'rb') as f:
+            self.assertEqual(f.read(), b'%PDF-1.4\nsmall')
+
+    def test_large_upload_spools_to_disk(self):
+        """测试超过内存阈值的文件转存到磁盘，内容和哈希正确"""
+        response = self.client.post("/upload", files={"file": ("../big.pdf", PDF_BYTES, "application/pdf")})
+        self.assertEqual(response.status_code, 200)
+        result = response.json()
+        self.assertTrue(result["spooled_to_disk"])
+        self.assertEqual(result["path"], os.path.join(self.temp_dir, "saved_big.pdf"))
+        self.assertEqual(result["content_hash"], hashlib.sha256(PDF_BYTES).hexdigest())
+        self.assertEqual(result["size"], len(PDF_BYTES))
+
+    def test_size_limit_removes_partial_file(self):
+        """测试超过大小上限时返回413并删除已写入的部分文件"""
+        response = self.client.post(
+            "/upload",
+            params={"max_bytes": 4096},
+            files={"file": ("big.pdf", PDF_BYTES, "application/pdf")},
+        )
+        self.assertEqual(response.status_code, 413)
+        self.assertEqual(os.listdir(self.temp_dir), [])
+
+    def test_missing_file_field(self):
+        """测试缺少文件字段时返回400"""
+        response = self.client.post("/upload", data={"route": "text"}, files={"other": ("a.txt", b"x")})
+        self.assertEqual(response.status_code, 400)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,108 @@
+import os
+import threading
+import unittest
+from unittest import mock
+
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+
+from app import api
+from app.services import PDFConverterService
+from app.warmup import Warmup, synthetic_pdf
+
+
+class TestWarmup(unittest.TestCase):
+    """测试启动预热的状态变化"""
+
+    def test_ready_after_task(self):
+        """测试预热期间为warming，完成后为ready并记录耗时"""
+        release = threading.Event()
+        warmup = Warmup(lambda timeout: release.wait(5))
+        self.assertEqual(warmup.status(), {"status": "pending"})
+        warmup.start()
+        self.assertEqual(warmup.status()["status"], "warming")
+        self.assertFalse(warmup.ready)
+        release.set()
+        self.assertTrue(warmup.wait(5))
+        self.assertIn("duration", warmup.status())
+
+    def test_failed_task(self):
+        """测试预热失败时不就绪并记录错误"""
+        def task(timeout):
+            raise RuntimeError("加载转换模型失败")
+
+        warmup = Warmup(task, timeout=30)
+        warmup.start()
+        self.assertFalse(warmup.wait(5))
+        self.assertEqual(warmup.status()["status"], "failed")
+        self.assertIn("加载转换模型失败", warmup.status()["error"])
+
+    def test_disabled(self):
+        """测试不预热时直接就绪"""
+        warmup = Warmup(lambda timeout: self.fail("不应执行预热"), enabled=False)
+        warmup.start()
+        self.assertTrue(warmup.ready)
+
+    def test_synthetic_pdf(self):
+        """测试合成PDF可以被解析"""
+        try:
+            import pypdfium2
+        except ImportError:
+            self.skipTest("未安装pypdfium2")
+        document = pypdfium2.PdfDocument(synthetic_pdf("hello"))
+        self.assertEqual(len(document), 1)
+        self.assertEqual(document[0].get_textpage().get_text_range().strip(), "hello")
+
+
+class TestServiceWarmUp(unittest.TestCase):
+    """测试转换服务的预热"""
+
+    def test_every_worker_converts_once(self):
+        """测试每个工作进程都完成一次转换"""
+        env = {
+            'CONVERSION_CACHE_ENABLED': 'false',
+            'PAGE_CACHE_ENABLED': 'false',
+            'PDF_STORE_ENABLED': 'false',
+            'MARKER_BATCH_ENABLED': 'false',
+            'MARKER_WORKER_POOL_SIZE': '2',
+            'MARKER_CONVERTER_FACTORY': 'app.test_worker_pool:create_fake_converter',
+        }
+        with mock.patch.dict(os.environ, env):
+            service = PDFConverterService()
+            try:
+                service.warm_up(timeout=60)
+                workers = service.get_worker_pool().stats()["workers"]
+            finally:
+                service.shutdown()
+        self.assertEqual([worker["jobs_done"] for worker in workers], [1, 1])
+
+
+class TestReadinessProbe(unittest.TestCase):
+    """测试就绪探针与存活探针"""
+
+    def test_ready_only_after_warmup(self):
+        """测试预热完成前/ready返回503，/health始终返回200"""
+        release = threading.Event()
+        warmup = Warmup(lambda timeout: release.wait(5))
+        app = FastAPI()
+        app.include_router(api.router)
+        client = TestClient(app)
+        with mock.patch.object(api, 'warmup', warmup):
+            warmup.start()
+            response = client.get("/api/v1/ready")
+            self.assertEqual(response.status_code, 503)
+            self.assertEqual(response.json()["status"], "warming")
+            self.assertEqual(client.get("/api/v1/health").status_code, 200)
+            release.set()
+            warmup.wait(5)
+            self.assertEqual(client.get("/api/v1/ready").status_code, 200)
+
+    def test_import_does_not_create_service(self):
+        """测试导入接口模块不会创建转换服务和任务调度器（不会连接任务代理）"""
+        self.assertIsNone(api._pdf_converter_service)
+        self.assertIsNone(api._job_scheduler)
+        self.assertIsNone(api._batch_pipeline)
+
+
+if __name__ == "__main__":
+    unittest.main()
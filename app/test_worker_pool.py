@@ -0,0 +1,204 @@
+import os
+import shutil
+import tempfile
+import time
+import unittest
+
+from app.worker_pool import ConvertedDocument, MarkerWorkerPool, WorkerPoolError
+
+
+_RETAINED = []
+
+
+class FakeConverter:
+    """测试用转换器：读取文件内容作为Markdown，不加载任何模型"""
+
+    def __init__(self, config=None):
+        self.config = config or {}
+        self.pid = os.getpid()
+
+    def __call__(self, pdf_path, options=None):
+        with open(pdf_path, 'r', encoding='utf-8') as f:
+            content = f.read()
+        if content == 'boom':
+            raise RuntimeError('转换失败')
+        if content == 'hang':
+            time.sleep(60)
+        if content.startswith('crash-once:'):
+            # 第一次执行时进程直接退出，模拟被系统终止；重试时正常返回
+            marker = content.split(':', 1)[1]
+            if not os.path.exists(marker):
+                open(marker, 'w').close()
+                os._exit(1)
+        if content == 'grow':
+            # 占用并保留约150MB内存，模拟模型推理后残留的内存
+            _RETAINED.append(b'\x01' * (150 << 20))
+        if content == 'hog':
+            _RETAINED.append(b'\x01' * (150 << 20))
+            time.sleep(30)
+        return ConvertedDocument(
+            markdown=f"# {content}\n\n![图](_page_0_Picture_1.png)\n",
+            images={'_page_0_Picture_1.png': b'png-bytes'},
+            metadata={'pid': self.pid, 'options': options or {}},
+        )
+
+
+def create_fake_converter(config=None):
+    return FakeConverter(config)
+
+
+def create_crashing_converter(config=None):
+    # 模拟加载模型时段错误或被OOM终止：进程直接退出，不发送failed消息
+    os._exit(1)
+
+
+class TestMarkerWorkerPool(unittest.TestCase):
+    """测试常驻工作进程池"""
+
+    @classmethod
+    def setUpClass(cls):
+        cls.pool = MarkerWorkerPool(size=2, factory_path='app.test_worker_pool:create_fake_converter')
+        cls.pool.start()
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.pool.shutdown()
+
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.temp_dir, ignore_errors=True)
+
+    def _write_pdf(self, name, content):
+        path = os.path.join(self.temp_dir, name)
+        with open(path, 'w', encoding='utf-8') as f:
+            f.write(content)
+        return path
+
+    def test_convert_to_memory(self):
+        """测试不指定输出目录时返回内存中的转换结果"""
+        pdf_path = self._write_pdf('doc.pdf', 'hello')
+        document = self.pool.convert(pdf_path, options={'page_range': [0]}, timeout=60)
+        self.assertTrue(document.markdown.startswith('# hello'))
+        self.assertEqual(document.images, {'_page_0_Picture_1.png': b'png-bytes'})
+        self.assertEqual(document.metadata['options'], {'page_range': [0]})
+
+    def test_convert_to_output_dir(self):
+        """测试按照marker_single的目录结构写出结果"""
+        pdf_path = self._write_pdf('paper_ab12.pdf', 'paper')
+        output_dir = os.path.join(self.temp_dir, 'out')
+        self.assertIsNone(self.pool.convert(pdf_path, output_dir, timeout=60))
+        document_dir = os.path.join(output_dir, 'paper_ab12')
+        self.assertTrue(os.path.exists(os.path.join(document_dir, 'paper_ab12.md')))
+        self.assertTrue(os.path.exists(os.path.join(document_dir, '_page_0_Picture_1.png')))
+        self.assertTrue(os.path.exists(os.path.join(document_dir, 'paper_ab12_meta.json')))
+
+    def test_models_are_reused_across_jobs(self):
+        """测试多个任务复用同一批常驻进程"""
+        futures = [self.pool.submit(self._write_pdf(f'doc{i}.pdf', str(i))) for i in range(6)]
+        pids = {future.result(timeout=60).metadata['pid'] for future in futures}
+        self.assertLessEqual(len(pids), 2)
+
+    def test_converter_error(self):
+        """测试转换器抛出的异常会传递给调用方"""
+        pdf_path = self._write_pdf('bad.pdf', 'boom')
+        with self.assertRaises(WorkerPoolError):
+            self.pool.convert(pdf_path, timeout=60)
+
+    def test_cancel_running_job(self):
+        """测试取消正在执行的任务时终止工作进程，之后的任务由补充的进程继续执行"""
+        future = self.pool.submit(self._write_pdf('hang.pdf', 'hang'))
+        for _ in range(100):
+            if future.running():
+                break
+            time.sleep(0.05)
+        self.assertTrue(self.pool.cancel(future))
+        with self.assertRaises(WorkerPoolError):
+            future.result(timeout=5)
+        self.assertFalse(self.pool.cancel(future))
+        document = self.pool.convert(self._write_pdf('after.pdf', 'after'), timeout=60)
+        self.assertTrue(document.markdown.startswith('# after'))
+
+
+class TestWorkerRecycling(unittest.TestCase):
+    """测试工作进程的回收、RSS看门狗和被中断任务的重试"""
+
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp()
+        self.pool = None
+
+    def tearDown(self):
+        if self.pool is not None:
+            self.pool.shutdown()
+        shutil.rmtree(self.temp_dir, ignore_errors=True)
+
+    def _start_pool(self, **kwargs):
+        self.pool = MarkerWorkerPool(size=1, factory_path='app.test_worker_pool:create_fake_converter', **kwargs)
+        self.pool.start()
+        return self.pool
+
+    def _write_pdf(self, name, content):
+        path = os.path.join(self.temp_dir, name)
+        with open(path, 'w', encoding='utf-8') as f:
+            f.write(content)
+        return path
+
+    def _pid(self, name='doc.pdf'):
+        return self.pool.convert(self._write_pdf(name, 'doc'), timeout=60).metadata['pid']
+
+    def test_recycle_after_max_jobs(self):
+        """测试处理指定数量的任务后换成新的工作进程"""
+        self._start_pool(max_jobs_per_worker=2)
+        pids = [self._pid() for _ in range(4)]
+        self.assertEqual(pids[0], pids[1])
+        self.assertEqual(pids[2], pids[3])
+        self.assertNotEqual(pids[1], pids[2])
+        self.assertGreaterEqual(self.pool.stats()['recycles']['max_jobs'], 1)
+
+    def test_retry_after_crash(self):
+        """测试工作进程意外退出时，被中断的任务在新的工作进程上重试成功"""
+        self._start_pool()
+        marker = os.path.join(self.temp_dir, 'crashed')
+        document = self.pool.convert(self._write_pdf('crash.pdf', f'crash-once:{marker}'), timeout=60)
+        self.assertTrue(document.markdown.startswith('# crash-once'))
+        self.assertEqual(self.pool.stats()['recycles'], {'crash': 1})
+
+    def test_rss_ceiling_drains_worker(self):
+        """测试RSS超过上限的工作进程在任务完成后被重启"""
+        self._start_pool(max_rss_bytes=120 << 20, watchdog_interval=0.1)
+        first = self.pool.convert(self._write_pdf('grow.pdf', 'grow'), timeout=60).metadata['pid']
+        for _ in range(100):
+            if self.pool.stats()['recycles'].get('rss'):
+                break
+            time.sleep(0.05)
+        self.assertEqual(self.pool.stats()['recycles'], {'rss': 1})
+        self.assertNotEqual(self._pid(), first)
+
+    def test_rss_kill_retries_then_fails(self):
+        """测试RSS超过强制上限时立即终止进程，重试次数用尽后任务失败"""
+        self._start_pool(kill_rss_bytes=120 << 20, max_job_retries=1, watchdog_interval=0.1)
+        with self.assertRaises(WorkerPoolError):
+            self.pool.convert(self._write_pdf('hog.pdf', 'hog'), timeout=60)
+        self.assertEqual(self.pool.stats()['recycles'], {'rss_kill': 2})
+        self.assertTrue(self._pid())
+
+    def test_startup_crashes_back_off_then_fail_fast(self):
+        """测试加载模型期间反复退出的工作进程退避重启，达到上限后任务立即失败"""
+        self.pool = MarkerWorkerPool(
+            size=1, factory_path='app.test_worker_pool:create_crashing_converter',
+            max_startup_attempts=3, startup_backoff=0.05,
+        )
+        self.pool.start()
+        with self.assertRaises(WorkerPoolError):
+            self.pool.convert(self._write_pdf('doc.pdf', 'doc'), timeout=60)
+        stats = self.pool.stats()
+        self.assertEqual(stats['recycles'], {'startup': 3})
+        self.assertEqual(stats['startup_failures'], 3)
+        self.assertEqual(stats['workers'], [])
+        with self.assertRaises(WorkerPoolError):
+            self.pool.submit(self._write_pdf('next.pdf', 'doc'))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,179 @@
+"""
+文本型PDF的快速转换路径
+
+对带有完整文本层的原生数字PDF，直接读取文本层生成Markdown，跳过marker的版面分析和OCR模型。
+"""
+import re
+import statistics
+from dataclasses import dataclass
+from typing import List
+
+from app.worker_pool import ConvertedDocument
+
+# 句末标点，短行以这些字符结尾时视为段落结束
+SENTENCE_ENDINGS = ('.', '!', '?', ':', '。', '！', '？', '：', '；', ';')
+
+# 中日韩字符，拼接换行时两侧都是这类字符则不插入空格
+CJK_PATTERN = re.compile(r'[\u3000-\u303f\u3040-\u30ff\u3400-\u4dbf\u4e00-\u9fff\uff00-\uffef]')
+
+
+@dataclass
+class PDFClassification:
+    """
+    PDF文本层的检查结果
+
+    Attributes:
+        page_count: 总页数
+        text_pages: 文本字符数达到阈值的页数
+        image_pages: 包含图片对象的页数
+        image_only_pages: 有图片但几乎没有文本的页数（通常是扫描页）
+        total_chars: 文本层的总字符数
+        is_text_native: 是否适合走文本快速路径
+    """
+    page_count: int
+    text_pages: int
+    image_pages: int
+    image_only_pages: int
+    total_chars: int
+    is_text_native: bool
+
+    @property
+    def text_coverage(self) -> float:
+        """有文本层的页面比例"""
+        return self.text_pages / self.page_count if self.page_count else 0.0
+
+
+def classify_pdf(
+    pdf_path: str,
+    min_chars_per_page: int = 100,
+    min_text_coverage: float = 0.9,
+    max_image_page_ratio: float = 0.0,
+) -> PDFClassification:
+    """
+    检查PDF的文本层覆盖率和仅含图片的页面，判断是否可以跳过版面/OCR模型
+
+    Args:
+        pdf_path: PDF文件路径
+        min_chars_per_page: 视为有文本层的页面最少字符数
+        min_text_coverage: 走快速路径所需的最低文本页比例
+        max_image_page_ratio: 走快速路径允许的含图片页面最高比例（快速路径不提取图片）
+
+    Returns:
+        检查结果
+    """
+    import pypdfium2
+    import pypdfium2.raw as pdfium_c
+
+    pdf = pypdfium2.PdfDocument(pdf_path)
+    text_pages = image_pages = image_only_pages = total_chars = 0
+    try:
+        page_count = len(pdf)
+        for index in range(page_count):
+            page = pdf[index]
+            try:
+                textpage = page.get_textpage()
+                chars = textpage.count_chars()
+                textpage.close()
+                has_image = next(iter(page.get_objects(filter=(pdfium_c.FPDF_PAGEOBJ_IMAGE,))), None) is not None
+            finally:
+                page.close()
+            total_chars += chars
+            if chars >= min_chars_per_page:
+                text_pages += 1
+            if has_image:
+                image_pages += 1
+                if chars < min_chars_per_page:
+                    image_only_pages += 1
+    finally:
+        pdf.close()
+
+    is_text_native = (
+        page_count > 0
+        and image_only_pages == 0
+        and text_pages / page_count >= min_text_coverage
+        and image_pages / page_count <= max_image_page_ratio
+    )
+    return PDFClassification(
+        page_count=page_count,
+        text_pages=text_pages,
+        image_pages=image_pages,
+        image_only_pages=image_only_pages,
+        total_chars=total_chars,
+        is_text_native=is_text_native,
+    )
+
+
+def _join_lines(lines: List[str]) -> str:
+    """把同一段落的多行拼接为一行，处理英文断词连字符和中日韩文字"""
+    paragraph = lines[0]
+    for line in lines[1:]:
+        if paragraph.endswith('-') and line[:1].islower():
+            paragraph = paragraph[:-1] + line
+        elif CJK_PATTERN.match(paragraph[-1:]) and CJK_PATTERN.match(line[:1]):
+            paragraph += line
+        else:
+            paragraph += ' ' + line
+    # 避免正文被误解析为标题或引用
+    if paragraph.startswith(('#', '>')):
+        paragraph = '\\' + paragraph
+    return paragraph
+
+
+def text_to_markdown(text: str) -> str:
+    """
+    将单页文本层转换为Markdown段落
+
+    空行和以句末标点结尾的短行作为段落分隔，其余换行视为排版换行并合并。
+    """
+    lines = [line.strip() for line in text.replace('\r\n', '\n').replace('\r', '\n').split('\n')]
+    lengths = [len(line) for line in lines if line]
+    if not lengths:
+        return ''
+    typical_length = statistics.median(lengths)
+
+    paragraphs = []
+    current: List[str] = []
+    for line in lines:
+        if not line:
+            if current:
+                paragraphs.append(_join_lines(current))
+                current = []
+            continue
+        current.append(line)
+        if len(line) < typical_length * 0.6 and line.endswith(SENTENCE_ENDINGS):
+            paragraphs.append(_join_lines(current))
+            current = []
+    if current:
+        paragraphs.append(_join_lines(current))
+    return '\n\n'.join(paragraphs)
+
+
+def extract_markdown(pdf_path: str) -> ConvertedDocument:
+    """
+    直接读取文本层生成Markdown
+
+    Args:
+        pdf_path: PDF文件路径
+
+    Returns:
+        转换结果（不包含图片）
+    """
+    import pypdfium2
+
+    pdf = pypdfium2.PdfDocument(pdf_path)
+    pages = []
+    try:
+        for index in range(len(pdf)):
+            page = pdf[index]
+            try:
+                textpage = page.get_textpage()
+                pages.append(text_to_markdown(textpage.get_text_range()))
+                textpage.close()
+            finally:
+                page.close()
+    finally:
+        pdf.close()
+    return ConvertedDocument(
+        markdown='\n\n'.join(page for page in pages if page) + '\n',
+        metadata={'route': 'text', 'page_count': len(pages)},
+    )
@@ -0,0 +1,236 @@
+"""
+流式接收multipart上传的文档
+"""
+import hashlib
+import io
+import os
+from dataclasses import dataclass, field
+from typing import Callable, Dict, Optional
+
+from python_multipart.multipart import MultipartParser, parse_options_header
+from starlette.requests import Request
+
+# 表单中普通字段（转换选项）允许的最大字节数
+MAX_FIELD_BYTES = 64 * 1024
+
+
+class UploadError(Exception):
+    """上传请求格式错误时抛出的异常"""
+
+
+class UploadTooLargeError(UploadError):
+    """上传文件超过大小上限时抛出的异常"""
+
+
+class SpooledUpload:
+    """
+    上传文件的写入器
+
+    数据先缓存在内存中，超过阈值后写入目标路径并继续以流的方式追加；
+    写入过程中同时计算SHA-256，并在超过大小上限时立即中止。
+    """
+
+    def __init__(self, dest_path: str, max_bytes: int, spool_bytes: int):
+        """
+        初始化写入器
+
+        Args:
+            dest_path: 文件最终保存的路径
+            max_bytes: 允许的最大字节数
+            spool_bytes: 在内存中缓存的最大字节数，超过后转存到磁盘
+        """
+        self.dest_path = dest_path
+        self.max_bytes = max_bytes
+        self.spool_bytes = spool_bytes
+        self.size = 0
+        # 是否已经超过内存阈值转存到磁盘
+        self.spooled_to_disk = False
+        self._digest = hashlib.sha256()
+        self._buffer: Optional[io.BytesIO] = io.BytesIO()
+        self._file = None
+
+    def write(self, data: bytes) -> None:
+        """追加一块数据"""
+        self.size += len(data)
+        if self.size > self.max_bytes:
+            raise UploadTooLargeError(f"上传文件超过大小上限: {self.max_bytes} 字节")
+        self._digest.update(data)
+        if self._buffer is not None and self._buffer.tell() + len(data) > self.spool_bytes:
+            self._file = open(self.dest_path, 'wb')
+            self._file.write(self._buffer.getbuffer())
+            self._buffer = None
+            self.spooled_to_disk = True
+        if self._buffer is not None:
+            self._buffer.write(data)
+        else:
+            self._file.write(data)
+
+    def finish(self) -> str:
+        """
+        完成写入，把仍在内存中的数据写到目标路径
+
+        Returns:
+            文件内容的SHA-256
+        """
+        if self._buffer is not None:
+            with open(self.dest_path, 'wb') as f:
+                f.write(self._buffer.getbuffer())
+            self._buffer = None
+        elif self._file is not None:
+            self._file.close()
+            self._file = None
+        return self._digest.hexdigest()
+
+    def discard(self) -> None:
+        """放弃写入并删除已经写入磁盘的数据"""
+        self._buffer = None
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+        if os.path.exists(self.dest_path):
+            os.unlink(self.dest_path)
+
+
+@dataclass
+class ReceivedUpload:
+    """
+    接收完成的上传文件
+
+    Attributes:
+        path: 本地文件路径
+        filename: 客户端提供的原始文件名
+        content_hash: 文件内容的SHA-256
+        size: 文件字节数
+        spooled_to_disk: 接收过程中是否超过内存阈值转存到磁盘
+        fields: 表单中的其他字段
+    """
+    path: str
+    filename: str
+    content_hash: str
+    size: int
+    spooled_to_disk: bool
+    fields: Dict[str, str] = field(default_factory=dict)
+
+
+async def receive_upload(
+    request: Request,
+    dest_dir: str,
+    make_filename: Callable[[str], str],
+    max_bytes: int,
+    spool_bytes: int,
+    file_field: str = "file",
+) -> ReceivedUpload:
+    """
+    边接收请求体边解析multipart表单，把文件字段写入dest_dir
+
+    与先完整读取表单再处理不同，超过大小上限的上传会在接收过程中立即中止。
+
+    Args:
+        request: 请求对象
+        dest_dir: 保存上传文件的目录
+        make_filename: 根据原始文件名生成本地文件名的函数
+        max_bytes: 上传文件的最大字节数
+        spool_bytes: 在内存中缓存的最大字节数
+        file_field: 文件字段名
+
+    Returns:
+        接收完成的上传文件
+
+    Raises:
+        UploadTooLargeError: 上传文件超过大小上限
+        UploadError: 请求不是multipart表单或缺少文件字段
+    """
+    content_type, params = parse_options_header(request.headers.get('content-type'))
+    if content_type != b'multipart/form-data' or b'boundary' not in params:
+        raise UploadError("请求必须是包含文件字段的multipart/form-data表单")
+
+    content_length = request.headers.get('content-length')
+    if content_length and content_length.isdigit() and int(content_length) > max_bytes + MAX_FIELD_BYTES:
+        raise UploadTooLargeError(f"上传文件超过大小上限: {max_bytes} 字节")
+
+    state = {'header_field': b'', 'header_value': b'', 'headers': {}, 'name': None, 'filename': None}
+    fields: Dict[str, bytearray] = {}
+    uploads = {'writer': None, 'filename': None}
+    errors = []
+
+    def on_part_begin():
+        state['headers'] = {}
+        state['name'] = state['filename'] = None
+
+    def on_header_field(data, start, end):
+        state['header_field'] += data[start:end]
+
+    def on_header_value(data, start, end):
+        state['header_value'] += data[start:end]
+
+    def on_header_end():
+        state['headers'][state['header_field'].lower()] = state['header_value']
+        state['header_field'] = state['header_value'] = b''
+
+    def on_headers_finished():
+        _, disposition = parse_options_header(state['headers'].get(b'content-disposition'))
+        state['name'] = disposition.get(b'name', b'').decode('utf-8', errors='replace')
+        filename = disposition.get(b'filename')
+        if state['name'] == file_field and filename is not None:
+            if uploads['writer'] is not None:
+                errors.append(UploadError(f"只能上传一个文件: {file_field}"))
+                return
+            state['filename'] = os.path.basename(filename.decode('utf-8', errors='replace').replace('\\', '/'))
+            uploads['filename'] = state['filename']
+            uploads['writer'] = SpooledUpload(
+                os.path.join(dest_dir, make_filename(state['filename'])), max_bytes, spool_bytes
+            )
+        else:
+            fields[state['name']] = bytearray()
+
+    def on_part_data(data, start, end):
+        if errors:
+            return
+        if state['filename'] is not None:
+            try:
+                uploads['writer'].write(data[start:end])
+            except UploadError as e:
+                errors.append(e)
+        elif state['name'] is not None:
+            value = fields[state['name']]
+            value += data[start:end]
+            if len(value) > MAX_FIELD_BYTES:
+                errors.append(UploadError(f"表单字段过大: {state['name']}"))
+
+    parser = MultipartParser(params[b'boundary'], {
+        'on_part_begin': on_part_begin,
+        'on_header_field': on_header_field,
+        'on_header_value': on_header_value,
+        'on_header_end': on_header_end,
+        'on_headers_finished': on_headers_finished,
+        'on_part_data': on_part_data,
+    })
+
+    try:
+        async for chunk in request.stream():
+            parser.write(chunk)
+            if errors:
+                raise errors[0]
+        parser.finalize()
+        if errors:
+            raise errors[0]
+        if uploads['writer'] is None:
+            raise UploadError(f"缺少文件字段: {file_field}")
+        content_hash = uploads['writer'].finish()
+    except Exception as e:
+        # 中止接收时删除已经写入的部分文件
+        if uploads['writer'] is not None:
+            uploads['writer'].discard()
+        if isinstance(e, UploadError):
+            raise
+        raise UploadError(f"解析上传表单失败: {e}") from e
+
+    writer: SpooledUpload = uploads['writer']
+    return ReceivedUpload(
+        path=writer.dest_path,
+        filename=uploads['filename'],
+        content_hash=content_hash,
+        size=writer.size,
+        spooled_to_disk=writer.spooled_to_disk,
+        fields={name: bytes(value).decode('utf-8', errors='replace') for name, value in fields.items()},
+    )
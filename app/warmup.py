@@ -0,0 +1,129 @@
+"""
+服务启动预热和就绪状态
+
+导入接口模块时只读取配置，不创建COS客户端、不启动工作进程。服务启动后在后台线程中预热：
+创建转换服务、启动工作进程（各进程加载一次模型），并在每个工作进程上转换一个单页的合成PDF，
+使首次推理的初始化开销不落在第一个请求上。/ready在预热完成前返回503，滚动发布时只把流量切到已预热的实例；
+/health只表示进程存活，不受预热状态影响。
+"""
+import logging
+import threading
+import time
+from typing import Any, Callable, Dict, Optional
+
+from app.config import get_bool_env, get_float_env
+
+logger = logging.getLogger(__name__)
+
+
+def synthetic_pdf(text: str = "warm up") -> bytes:
+    """生成只有一页、一行文本的最小PDF，用于预热转换模型"""
+    stream = f"BT /F1 24 Tf 72 720 Td ({text}) Tj ET".encode('ascii')
+    objects = [
+        b"<< /Type /Catalog /Pages 2 0 R >>",
+        b"<< /Type /Pages /Kids [3 0 R] /Count 1 >>",
+        b"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 612 792] /Contents 4 0 R "
+        b"/Resources << /Font << /F1 5 0 R >> >> >>",
+        b"<< /Length " + str(len(stream)).encode('ascii') + b" >>\nstream\n" + stream + b"\nendstream",
+        b"<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica >>",
+    ]
+    pdf = bytearray(b"%PDF-1.4\n")
+    offsets = []
+    for number, body in enumerate(objects, start=1):
+        offsets.append(len(pdf))
+        pdf += f"{number} 0 obj\n".encode('ascii') + body + b"\nendobj\n"
+    xref_offset = len(pdf)
+    pdf += f"xref\n0 {len(objects) + 1}\n0000000000 65535 f \n".encode('ascii')
+    for offset in offsets:
+        pdf += f"{offset:010d} 00000 n \n".encode('ascii')
+    pdf += f"trailer\n<< /Size {len(objects) + 1} /Root 1 0 R >>\nstartxref\n{xref_offset}\n%%EOF\n".encode('ascii')
+    return bytes(pdf)
+
+
+class Warmup:
+    """
+    服务预热及其状态
+
+    状态依次为pending（尚未开始）、warming（正在预热）、ready（可以接收流量）；预热失败时为failed，
+    此时服务仍然可以处理请求（首个请求会重新尝试加载），但就绪探针保持失败，便于发现配置或模型问题。
+    """
+
+    def __init__(self, task: Callable[[Optional[float]], Any], enabled: bool = True, timeout: Optional[float] = None):
+        """
+        初始化预热（不会立即开始）
+
+        Args:
+            task: 执行预热的函数，接收超时秒数（None表示不限制），失败时抛出异常
+            enabled: 是否在启动时预热；为False时直接视为就绪，模型在首次请求时加载
+            timeout: 预热的最长秒数，None或不大于0表示不限制
+        """
+        self.task = task
+        self.enabled = enabled
+        self.timeout = timeout if timeout and timeout > 0 else None
+        self.state = "pending"
+        self.error: Optional[str] = None
+        self.started_at: Optional[float] = None
+        self.duration: Optional[float] = None
+        self._thread: Optional[threading.Thread] = None
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_env(cls, task: Callable[[Optional[float]], Any]) -> 'Warmup':
+        """根据环境变量创建预热"""
+        return cls(
+            task,
+            enabled=get_bool_env('WARMUP_ENABLED', True),
+            timeout=get_float_env('WARMUP_TIMEOUT_SECONDS', 600),
+        )
+
+    @property
+    def ready(self) -> bool:
+        return self.state == "ready"
+
+    def start(self) -> None:
+        """在后台线程中开始预热（只执行一次），不阻塞服务启动"""
+        with self._lock:
+            if self._thread is not None or self.state != "pending":
+                return
+            if not self.enabled:
+                self.state = "ready"
+                logger.info("未启用启动预热，模型在首次请求时加载")
+                return
+            self.state = "warming"
+            self.started_at = time.time()
+            self._thread = threading.Thread(target=self._run, name='service-warmup', daemon=True)
+            self._thread.start()
+
+    def wait(self, timeout: Optional[float] = None) -> bool:
+        """等待预热结束，返回是否已就绪"""
+        thread = self._thread
+        if thread is not None:
+            thread.join(timeout)
+        return self.ready
+
+    def status(self) -> Dict[str, Any]:
+        """返回就绪探针使用的预热状态"""
+        status: Dict[str, Any] = {"status": self.state}
+        if self.state == "warming" and self.started_at is not None:
+            status["elapsed"] = round(time.time() - self.started_at, 3)
+        if self.duration is not None:
+            status["duration"] = round(self.duration, 3)
+        if self.error:
+            status["error"] = self.error
+        return status
+
+    def _run(self) -> None:
+        """后台线程：执行预热并记录结果"""
+        started = time.perf_counter()
+        logger.info("开始预热转换服务")
+        try:
+            self.task(self.timeout)
+        except Exception as e:
+            self.duration = time.perf_counter() - started
+            self.error = f"{type(e).__name__}: {e}"
+            self.state = "failed"
+            logger.error(f"预热失败，耗时: {self.duration:.2f}秒，错误: {self.error}")
+        else:
+            self.duration = time.perf_counter() - started
+            self.state = "ready"
+            logger.info(f"预热完成，耗时: {self.duration:.2f}秒")
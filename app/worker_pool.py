@@ -0,0 +1,746 @@
+"""
+常驻模型的marker转换工作进程池
+
+每个工作进程启动时只加载一次marker的版面/OCR模型，之后通过管道接收转换任务，
+避免每个请求都重新启动解释器、激活虚拟环境并加载全部模型。
+
+模型推理和大页面图片占用的内存都在工作进程中，不会撑爆API进程：工作进程处理一定数量的任务后被回收，
+看门狗定期检查每个工作进程（连同其子进程）的RSS，超过上限时不再分配新任务，当前任务完成后重启；
+超过强制上限时立即终止。工作进程意外退出时，被中断的任务在新的工作进程上自动重试。
+"""
+import importlib
+import io
+import json
+import logging
+import multiprocessing
+import os
+import signal
+import threading
+import time
+import uuid
+from collections import deque
+from concurrent.futures import Future, InvalidStateError
+from dataclasses import dataclass, field
+from multiprocessing.connection import wait
+from typing import Any, Callable, Deque, Dict, List, Optional
+
+from app import metrics
+from app.config import get_float_env, get_int_env, get_json_env, get_str_env
+
+logger = logging.getLogger(__name__)
+
+# 默认的转换器工厂，格式为 "模块路径:可调用对象名"
+DEFAULT_CONVERTER_FACTORY = "app.worker_pool:create_marker_converter"
+
+# 不同图片扩展名对应的PIL保存格式
+IMAGE_FORMATS = {
+    '.png': 'PNG',
+    '.jpg': 'JPEG',
+    '.jpeg': 'JPEG',
+    '.gif': 'GIF',
+    '.webp': 'WEBP',
+    '.bmp': 'BMP',
+}
+
+
+class WorkerPoolError(Exception):
+    """工作进程池无法完成转换任务时抛出的异常"""
+
+
+@dataclass
+class ConvertedDocument:
+    """
+    一次转换的结果
+
+    Attributes:
+        markdown: 转换得到的Markdown文本
+        images: 图片相对路径到编码后图片字节的映射
+        metadata: marker输出的元数据
+    """
+    markdown: str
+    images: Dict[str, bytes] = field(default_factory=dict)
+    metadata: Dict[str, Any] = field(default_factory=dict)
+
+
+def _encode_image(name: str, image: Any) -> bytes:
+    """将marker返回的PIL图片按照文件扩展名编码为字节"""
+    if isinstance(image, (bytes, bytearray)):
+        return bytes(image)
+    image_format = IMAGE_FORMATS.get(os.path.splitext(name)[1].lower(), 'PNG')
+    if image_format == 'JPEG' and image.mode not in ('RGB', 'L'):
+        image = image.convert('RGB')
+    buffer = io.BytesIO()
+    image.save(buffer, image_format)
+    return buffer.getvalue()
+
+
+class MarkerConverter:
+    """基于marker Python API的转换器，构造时加载一次全部模型"""
+
+    def __init__(self, config: Optional[Dict[str, Any]] = None):
+        from marker.models import create_model_dict
+
+        self.config = dict(config or {})
+        self.artifact_dict = create_model_dict()
+
+    def __call__(self, pdf_path: str, options: Optional[Dict[str, Any]] = None) -> ConvertedDocument:
+        from marker.converters.pdf import PdfConverter
+        from marker.output import text_from_rendered
+
+        # 转换器本身很轻量，每个任务按需创建以便应用任务级选项，模型通过artifact_dict复用
+        config = {**self.config, **(options or {})}
+        converter = PdfConverter(config=config, artifact_dict=self.artifact_dict)
+        rendered = converter(pdf_path)
+        markdown, _, images = text_from_rendered(rendered)
+        return ConvertedDocument(
+            markdown=markdown,
+            images={name: _encode_image(name, image) for name, image in images.items()},
+            metadata=rendered.metadata or {},
+        )
+
+
+def create_marker_converter(config: Optional[Dict[str, Any]] = None) -> MarkerConverter:
+    """默认转换器工厂"""
+    return MarkerConverter(config)
+
+
+def load_converter_factory(factory_path: str) -> Callable[[Dict[str, Any]], Callable]:
+    """根据 "模块路径:可调用对象名" 加载转换器工厂"""
+    module_name, _, attr_name = factory_path.partition(':')
+    if not module_name or not attr_name:
+        raise ValueError(f"无效的转换器工厂路径: {factory_path}")
+    return getattr(importlib.import_module(module_name), attr_name)
+
+
+def encode_metadata(metadata: Dict[str, Any]) -> bytes:
+    """把转换元数据编码为与marker_single输出一致的JSON字节"""
+    return json.dumps(metadata, ensure_ascii=False, indent=2, default=str).encode('utf-8')
+
+
+def write_document(document: ConvertedDocument, output_dir: str, name: str) -> str:
+    """
+    按照marker_single的目录结构写出转换结果
+
+    Args:
+        document: 转换结果
+        output_dir: 输出根目录
+        name: 文档名称（不含扩展名）
+
+    Returns:
+        输出的Markdown文件路径
+    """
+    document_dir = os.path.join(output_dir, name)
+    os.makedirs(document_dir, exist_ok=True)
+    markdown_path = os.path.join(document_dir, f"{name}.md")
+    with open(markdown_path, 'w', encoding='utf-8') as f:
+        f.write(document.markdown)
+    for rel_path, data in document.images.items():
+        image_path = os.path.join(document_dir, rel_path)
+        os.makedirs(os.path.dirname(image_path), exist_ok=True)
+        with open(image_path, 'wb') as f:
+            f.write(data)
+    with open(os.path.join(document_dir, f"{name}_meta.json"), 'wb') as f:
+        f.write(encode_metadata(document.metadata))
+    return markdown_path
+
+
+def read_document(output_dir: str, name: str) -> ConvertedDocument:
+    """
+    读取按照marker_single目录结构写出的转换结果
+
+    Args:
+        output_dir: 输出根目录
+        name: 文档名称（不含扩展名）
+
+    Returns:
+        转换结果，除Markdown和元数据外的所有文件都作为资源文件读入内存
+    """
+    document_dir = os.path.join(output_dir, name)
+    markdown_path = os.path.join(document_dir, f"{name}.md")
+    meta_path = os.path.join(document_dir, f"{name}_meta.json")
+    with open(markdown_path, 'r', encoding='utf-8') as f:
+        markdown = f.read()
+    metadata: Dict[str, Any] = {}
+    if os.path.exists(meta_path):
+        with open(meta_path, 'r', encoding='utf-8') as f:
+            metadata = json.load(f)
+    images: Dict[str, bytes] = {}
+    for root, _, files in os.walk(document_dir):
+        for file in files:
+            file_path = os.path.join(root, file)
+            if file_path in (markdown_path, meta_path):
+                continue
+            with open(file_path, 'rb') as f:
+                images[os.path.relpath(file_path, document_dir).replace(os.sep, '/')] = f.read()
+    return ConvertedDocument(markdown=markdown, images=images, metadata=metadata)
+
+
+def _worker_main(conn, factory_path: str, converter_config: Dict[str, Any]) -> None:
+    """工作进程入口：加载一次模型，然后循环处理管道中的任务"""
+    # 成为新进程组的组长，取消任务时可以连同模型创建的子进程一起终止
+    if hasattr(os, 'setsid'):
+        os.setsid()
+    try:
+        converter = load_converter_factory(factory_path)(converter_config)
+    except Exception as e:
+        conn.send(('failed', None, f"加载转换模型失败: {type(e).__name__}: {e}"))
+        return
+    conn.send(('ready', None, None))
+
+    while True:
+        try:
+            message = conn.recv()
+        except (EOFError, KeyboardInterrupt):
+            break
+        if message is None:
+            break
+        job_id, pdf_path, output_dir, options = message
+        try:
+            document = converter(pdf_path, options)
+            if output_dir:
+                name = os.path.splitext(os.path.basename(pdf_path))[0]
+                write_document(document, output_dir, name)
+                document = None
+            conn.send(('done', job_id, document))
+        except Exception as e:
+            conn.send(('error', job_id, f"{type(e).__name__}: {e}"))
+
+
+def _kill_process_tree(process) -> None:
+    """强制终止工作进程及其进程组中的子进程"""
+    if process.pid is None:
+        return
+    try:
+        if hasattr(os, 'killpg'):
+            os.killpg(process.pid, signal.SIGKILL)
+        else:
+            process.kill()
+    except (ProcessLookupError, PermissionError):
+        # 进程已经退出，或者尚未调用setsid（仍在父进程的进程组中）
+        if process.is_alive():
+            process.kill()
+
+
+def _process_tree_rss(pid: int) -> Optional[int]:
+    """
+    返回工作进程及其会话中所有子进程的RSS总和（字节）
+
+    工作进程启动时调用了setsid，会话ID等于其PID。只支持Linux（读取/proc），其他平台返回None。
+    """
+    if not os.path.isdir('/proc'):
+        return None
+    page_size = os.sysconf('SC_PAGE_SIZE')
+    total = 0
+    for entry in os.listdir('/proc'):
+        if not entry.isdigit():
+            continue
+        try:
+            with open(f'/proc/{entry}/stat', 'rb') as f:
+                # 第二个字段是括号中的进程名，可能包含空格，从最后一个右括号之后开始解析
+                fields = f.read().rsplit(b')', 1)[1].split()
+            if int(fields[3]) != pid and int(entry) != pid:
+                continue
+            with open(f'/proc/{entry}/statm', 'rb') as f:
+                total += int(f.read().split()[1]) * page_size
+        except (OSError, IndexError, ValueError):
+            # 进程在读取期间退出
+            continue
+    return total
+
+
+class _PoolJob:
+    """提交到进程池中的单个任务"""
+
+    def __init__(self, pdf_path: str, output_dir: Optional[str], options: Optional[Dict[str, Any]]):
+        self.job_id = uuid.uuid4().hex
+        self.pdf_path = pdf_path
+        self.output_dir = output_dir
+        self.options = options
+        self.future: Future = Future()
+        # 因工作进程意外退出而重试的次数
+        self.retries = 0
+
+
+class _WorkerHandle:
+    """父进程中对单个工作进程的记录"""
+
+    def __init__(self, process, conn):
+        self.process = process
+        self.conn = conn
+        self.ready = False
+        self.job: Optional[_PoolJob] = None
+        self.jobs_done = 0
+        # 正在回收的原因（max_jobs、rss、rss_kill、cancelled），回收中的进程不再分配新任务
+        self.retiring: Optional[str] = None
+        self.rss: Optional[int] = None
+
+
+class MarkerWorkerPool:
+    """
+    常驻模型的转换工作进程池
+
+    工作进程使用spawn方式启动，每个进程独立持有一份模型，同一时刻只处理一个任务。
+    父进程中的调度线程负责把排队的任务分配给空闲的工作进程，并把结果回填到Future中。
+    """
+
+    def __init__(
+        self,
+        size: int = 1,
+        factory_path: str = DEFAULT_CONVERTER_FACTORY,
+        converter_config: Optional[Dict[str, Any]] = None,
+        max_jobs_per_worker: int = 0,
+        max_rss_bytes: int = 0,
+        kill_rss_bytes: int = 0,
+        max_job_retries: int = 1,
+        watchdog_interval: float = 2.0,
+        max_startup_attempts: int = 5,
+        startup_backoff: float = 1.0,
+    ):
+        """
+        初始化工作进程池（不会立即启动进程）
+
+        Args:
+            size: 工作进程数量
+            factory_path: 转换器工厂路径，格式为 "模块路径:可调用对象名"
+            converter_config: 传给转换器工厂的marker配置
+            max_jobs_per_worker: 每个工作进程处理多少个任务后回收重启，0表示不回收
+            max_rss_bytes: 工作进程RSS上限，超过后不再分配新任务，当前任务完成后重启；0表示不检查
+            kill_rss_bytes: 工作进程RSS强制上限，超过后立即终止进程，任务在新的进程上重试；0表示不检查
+            max_job_retries: 工作进程意外退出（崩溃、被系统或看门狗终止）时，被中断的任务最多重试的次数
+            watchdog_interval: 看门狗检查RSS的间隔（秒）
+            max_startup_attempts: 工作进程连续多少次在加载模型期间退出（例如段错误、OOM）后放弃重启，
+                之后提交的任务立即失败
+            startup_backoff: 加载模型期间退出后重启前的等待秒数，连续失败时每次加倍（最多60秒）
+        """
+        self.size = max(1, size)
+        self.factory_path = factory_path
+        self.converter_config = dict(converter_config or {})
+        self.max_jobs_per_worker = max(0, max_jobs_per_worker)
+        self.max_rss_bytes = max(0, max_rss_bytes)
+        self.kill_rss_bytes = max(0, kill_rss_bytes)
+        self.max_job_retries = max(0, max_job_retries)
+        self.watchdog_interval = max(0.1, watchdog_interval)
+        self.max_startup_attempts = max(1, max_startup_attempts)
+        self.startup_backoff = max(0.0, startup_backoff)
+        # 连续在加载模型期间退出的次数（任一进程就绪后清零），以及等待退避后重启的时间点
+        self._startup_failures = 0
+        self._deferred_spawns: List[float] = []
+        self._last_watchdog = 0.0
+        self._recycles: Dict[str, int] = {}
+        self._context = multiprocessing.get_context('spawn')
+        self._lock = threading.Lock()
+        self._pending: Deque[_PoolJob] = deque()
+        self._workers: List[_WorkerHandle] = []
+        self._wakeup_reader, self._wakeup_writer = self._context.Pipe(duplex=False)
+        self._dispatcher: Optional[threading.Thread] = None
+        self._startup_error: Optional[str] = None
+        self._closed = False
+
+    @classmethod
+    def from_env(cls) -> 'MarkerWorkerPool':
+        """根据环境变量创建工作进程池"""
+        return cls(
+            size=get_int_env('MARKER_WORKER_POOL_SIZE', 1),
+            factory_path=get_str_env('MARKER_CONVERTER_FACTORY', DEFAULT_CONVERTER_FACTORY),
+            converter_config=get_json_env('MARKER_CONFIG'),
+            max_jobs_per_worker=get_int_env('MARKER_WORKER_MAX_JOBS', 0),
+            max_rss_bytes=get_int_env('MARKER_WORKER_MAX_RSS_MB', 0) * 1024 * 1024,
+            kill_rss_bytes=get_int_env('MARKER_WORKER_KILL_RSS_MB', 0) * 1024 * 1024,
+            max_job_retries=get_int_env('MARKER_WORKER_JOB_RETRIES', 1),
+            watchdog_interval=get_float_env('MARKER_WORKER_WATCHDOG_INTERVAL', 2.0),
+            max_startup_attempts=get_int_env('MARKER_WORKER_STARTUP_ATTEMPTS', 5),
+            startup_backoff=get_float_env('MARKER_WORKER_STARTUP_BACKOFF', 1.0),
+        )
+
+    def start(self) -> None:
+        """启动工作进程和调度线程"""
+        with self._lock:
+            if self._dispatcher is not None:
+                return
+            for _ in range(self.size):
+                self._workers.append(self._spawn_worker())
+            self._dispatcher = threading.Thread(
+                target=self._dispatch_loop, name='marker-pool-dispatcher', daemon=True
+            )
+            self._dispatcher.start()
+        logger.info(f"marker工作进程池已启动，进程数: {self.size}")
+
+    def submit(
+        self,
+        pdf_path: str,
+        output_dir: Optional[str] = None,
+        options: Optional[Dict[str, Any]] = None,
+    ) -> Future:
+        """
+        提交一个转换任务
+
+        Args:
+            pdf_path: 待转换的PDF文件路径
+            output_dir: 输出目录，指定时按marker_single的目录结构写出结果，否则在Future中返回ConvertedDocument
+            options: 任务级的marker配置
+
+        Returns:
+            任务结果的Future
+        """
+        self.start()
+        job = _PoolJob(pdf_path, output_dir, options)
+        with self._lock:
+            if self._closed:
+                raise WorkerPoolError("工作进程池已关闭")
+            if self._startup_error and not self._workers:
+                raise WorkerPoolError(self._startup_error)
+            self._pending.append(job)
+            self._wakeup_writer.send_bytes(b'1')
+        return job.future
+
+    def convert(
+        self,
+        pdf_path: str,
+        output_dir: Optional[str] = None,
+        options: Optional[Dict[str, Any]] = None,
+        timeout: Optional[float] = None,
+    ) -> Optional[ConvertedDocument]:
+        """提交转换任务并阻塞等待结果，等待超时时取消任务并抛出TimeoutError"""
+        future = self.submit(pdf_path, output_dir, options)
+        try:
+            return future.result(timeout=timeout)
+        except TimeoutError:
+            self.cancel(future)
+            raise
+
+    def shutdown(self) -> None:
+        """关闭工作进程池，未完成的任务以异常结束"""
+        with self._lock:
+            if self._closed:
+                return
+            self._closed = True
+            pending = list(self._pending)
+            self._pending.clear()
+            self._wakeup_writer.send_bytes(b'1')
+        for job in pending:
+            job.future.set_exception(WorkerPoolError("工作进程池已关闭"))
+        if self._dispatcher is not None:
+            self._dispatcher.join(timeout=10)
+        logger.info("marker工作进程池已关闭")
+
+    def cancel(self, future: Future) -> bool:
+        """
+        取消一个已提交的任务
+
+        排队中的任务直接取消；正在执行的任务会终止其工作进程（连同子进程），
+        调度线程检测到进程退出后补充一个新的工作进程。
+
+        Args:
+            future: submit返回的Future
+
+        Returns:
+            是否取消了任务（任务已经结束时返回False）
+        """
+        if future.cancel():
+            return True
+        with self._lock:
+            requeued = next((job for job in self._pending if job.future is future), None)
+            if requeued is not None:
+                # 等待重试的任务已经处于运行状态，不能直接取消
+                self._pending.remove(requeued)
+                future.set_exception(WorkerPoolError("任务已取消"))
+                return True
+            worker = next((w for w in self._workers if w.job is not None and w.job.future is future), None)
+            if worker is None:
+                return False
+            # 先解除任务关联，进程退出时不再把它当作意外退出的任务处理；
+            # 同时标记为回收中，避免调度线程在检测到进程退出之前把新任务分配给它
+            worker.job = None
+            worker.retiring = 'cancelled'
+        logger.warning(f"终止正在执行已取消任务的marker工作进程，PID: {worker.process.pid}")
+        _kill_process_tree(worker.process)
+        try:
+            future.set_exception(WorkerPoolError("任务已取消，工作进程已终止"))
+        except InvalidStateError:
+            pass
+        return True
+
+    def wait_ready(self, timeout: Optional[float] = None) -> bool:
+        """
+        等待所有工作进程加载完模型
+
+        Args:
+            timeout: 最长等待秒数，None表示不限制
+
+        Returns:
+            是否全部就绪（超时返回False）
+
+        Raises:
+            WorkerPoolError: 所有工作进程都启动失败
+        """
+        expires_at = None if timeout is None else time.monotonic() + timeout
+        while True:
+            with self._lock:
+                if not self._workers and self._startup_error:
+                    raise WorkerPoolError(self._startup_error)
+                if self._workers and not self._deferred_spawns and all(worker.ready for worker in self._workers):
+                    return True
+            if expires_at is not None and time.monotonic() >= expires_at:
+                return False
+            time.sleep(0.05)
+
+    def stats(self) -> Dict[str, Any]:
+        """返回工作进程池的统计信息：排队任务数、各工作进程的状态和RSS、各原因的回收次数"""
+        with self._lock:
+            return {
+                'pending_jobs': len(self._pending),
+                'workers': [
+                    {
+                        'pid': worker.process.pid,
+                        'ready': worker.ready,
+                        'busy': worker.job is not None,
+                        'jobs_done': worker.jobs_done,
+                        'rss_bytes': worker.rss,
+                        'retiring': worker.retiring,
+                    }
+                    for worker in self._workers
+                ],
+                'recycles': dict(self._recycles),
+                'startup_failures': self._startup_failures,
+            }
+
+    def _spawn_worker(self) -> _WorkerHandle:
+        """启动一个新的工作进程"""
+        parent_conn, child_conn = self._context.Pipe()
+        process = self._context.Process(
+            target=_worker_main,
+            args=(child_conn, self.factory_path, self.converter_config),
+            name='marker-worker',
+            daemon=True,
+        )
+        process.start()
+        child_conn.close()
+        return _WorkerHandle(process, parent_conn)
+
+    def _dispatch_loop(self) -> None:
+        """调度线程：分配任务、接收结果、处理工作进程退出"""
+        while True:
+            with self._lock:
+                if self._closed:
+                    break
+                self._spawn_deferred()
+                self._assign_jobs()
+                connections = [worker.conn for worker in self._workers]
+                next_spawn = min(self._deferred_spawns, default=None)
+            timeout = self.watchdog_interval if self.max_rss_bytes or self.kill_rss_bytes else 1.0
+            if next_spawn is not None:
+                timeout = max(0.0, min(timeout, next_spawn - time.monotonic()))
+            ready = wait(connections + [self._wakeup_reader], timeout=timeout)
+            for conn in ready:
+                if conn is self._wakeup_reader:
+                    self._drain_wakeups()
+                else:
+                    self._handle_worker_message(conn)
+            self._check_memory()
+        self._stop_workers()
+
+    def _spawn_deferred(self) -> None:
+        """启动退避时间已到的工作进程（调用方需持有锁）"""
+        now = time.monotonic()
+        due = [at for at in self._deferred_spawns if at <= now]
+        for at in due:
+            self._deferred_spawns.remove(at)
+            self._workers.append(self._spawn_worker())
+
+    def _drain_wakeups(self) -> None:
+        """清空唤醒管道中的数据"""
+        while self._wakeup_reader.poll():
+            self._wakeup_reader.recv_bytes()
+
+    def _assign_jobs(self) -> None:
+        """把排队中的任务分配给空闲的工作进程（调用方需持有锁）"""
+        for worker in self._workers:
+            if not self._pending:
+                return
+            if not worker.ready or worker.job is not None or worker.retiring:
+                continue
+            job = self._pending.popleft()
+            # 重试的任务已经处于运行状态
+            if not job.future.running() and not job.future.set_running_or_notify_cancel():
+                continue
+            worker.job = job
+            try:
+                worker.conn.send((job.job_id, job.pdf_path, job.output_dir, job.options))
+            except (BrokenPipeError, OSError) as e:
+                worker.job = None
+                job.future.set_exception(WorkerPoolError(f"向工作进程发送任务失败: {e}"))
+
+    def _find_worker(self, conn) -> Optional[_WorkerHandle]:
+        for worker in self._workers:
+            if worker.conn is conn:
+                return worker
+        return None
+
+    def _handle_worker_message(self, conn) -> None:
+        """处理来自某个工作进程的消息"""
+        with self._lock:
+            worker = self._find_worker(conn)
+        if worker is None:
+            return
+        try:
+            kind, job_id, payload = conn.recv()
+        except (EOFError, OSError):
+            self._handle_worker_exit(worker)
+            return
+
+        if kind == 'ready':
+            worker.ready = True
+            with self._lock:
+                self._startup_failures = 0
+            logger.info(f"marker工作进程已就绪，PID: {worker.process.pid}")
+        elif kind == 'failed':
+            logger.error(f"marker工作进程启动失败: {payload}")
+            with self._lock:
+                self._startup_error = payload
+                self._remove_worker(worker)
+                if not self._workers and not self._deferred_spawns:
+                    self._fail_pending(payload)
+        elif kind in ('done', 'error'):
+            with self._lock:
+                job = worker.job
+                worker.job = None
+                worker.jobs_done += 1
+                if self.max_jobs_per_worker and worker.jobs_done >= self.max_jobs_per_worker:
+                    worker.retiring = worker.retiring or 'max_jobs'
+                if worker.retiring:
+                    # 达到任务数上限，或者RSS超过上限后已经排空，通知进程退出，退出后补充新的进程
+                    self._stop_worker(worker)
+            if job is None or job.job_id != job_id:
+                return
+            if kind == 'done':
+                job.future.set_result(payload)
+            else:
+                job.future.set_exception(WorkerPoolError(payload))
+
+    def _stop_worker(self, worker: _WorkerHandle) -> None:
+        """通知空闲的工作进程退出（调用方需持有锁）"""
+        logger.info(f"回收marker工作进程，PID: {worker.process.pid}，原因: {worker.retiring}，"
+                    f"已处理任务数: {worker.jobs_done}")
+        try:
+            worker.conn.send(None)
+        except (BrokenPipeError, OSError):
+            pass
+
+    def _check_memory(self) -> None:
+        """看门狗：检查各工作进程的RSS，超过上限时排空后重启，超过强制上限时立即终止"""
+        if not (self.max_rss_bytes or self.kill_rss_bytes):
+            return
+        now = time.monotonic()
+        if now - self._last_watchdog < self.watchdog_interval:
+            return
+        self._last_watchdog = now
+        with self._lock:
+            workers = [worker for worker in self._workers if worker.ready]
+        for worker in workers:
+            rss = _process_tree_rss(worker.process.pid)
+            worker.rss = rss
+            if rss is None:
+                continue
+            with self._lock:
+                if worker not in self._workers or worker.retiring in ('rss_kill', 'cancelled'):
+                    continue
+                if self.kill_rss_bytes and rss > self.kill_rss_bytes:
+                    logger.warning(f"marker工作进程RSS {rss / 1048576:.0f}MB超过强制上限，终止进程，PID: {worker.process.pid}")
+                    worker.retiring = 'rss_kill'
+                    _kill_process_tree(worker.process)
+                elif self.max_rss_bytes and rss > self.max_rss_bytes and not worker.retiring:
+                    logger.warning(f"marker工作进程RSS {rss / 1048576:.0f}MB超过上限，"
+                                   f"{'当前任务完成后' if worker.job is not None else '立即'}重启，PID: {worker.process.pid}")
+                    worker.retiring = 'rss'
+                    if worker.job is None:
+                        self._stop_worker(worker)
+        rss_values = [worker.rss for worker in workers if worker.rss is not None]
+        if rss_values:
+            metrics.WORKER_MAX_RSS.set(max(rss_values))
+
+    def _handle_worker_exit(self, worker: _WorkerHandle) -> None:
+        """工作进程退出：补充一个新的工作进程，被中断的任务在新进程上重试或以异常结束"""
+        worker.process.join(timeout=1)
+        if not worker.ready and not worker.retiring:
+            self._handle_startup_death(worker)
+            return
+        reason = worker.retiring or 'crash'
+        if worker.retiring in ('max_jobs', 'rss'):
+            logger.info(f"marker工作进程已回收，PID: {worker.process.pid}，原因: {reason}")
+        else:
+            logger.warning(f"marker工作进程已退出，PID: {worker.process.pid}，退出码: {worker.process.exitcode}")
+        metrics.WORKER_RECYCLES.inc(reason=reason)
+        with self._lock:
+            self._recycles[reason] = self._recycles.get(reason, 0) + 1
+            job = worker.job
+            worker.job = None
+            self._remove_worker(worker)
+            if not self._closed:
+                self._workers.append(self._spawn_worker())
+            if job is not None and not job.future.done() and job.retries < self.max_job_retries and not self._closed:
+                # 放到队首，由下一个空闲的工作进程（通常是刚补充的新进程）重新执行
+                job.retries += 1
+                self._pending.appendleft(job)
+                metrics.WORKER_JOB_RETRIES.inc()
+                logger.warning(f"在新的工作进程上重试被中断的任务（第{job.retries}次）: {job.pdf_path}")
+                return
+        if job is not None and not job.future.done():
+            job.future.set_exception(WorkerPoolError(f"工作进程异常退出，退出码: {worker.process.exitcode}"))
+
+    def _handle_startup_death(self, worker: _WorkerHandle) -> None:
+        """
+        工作进程在加载模型期间退出（没有发送failed消息，例如段错误或被OOM终止）
+
+        退避后再重启，避免反复崩溃时占满CPU；连续失败达到上限后不再重启，排队和之后提交的任务立即失败
+        """
+        metrics.WORKER_RECYCLES.inc(reason='startup')
+        with self._lock:
+            self._recycles['startup'] = self._recycles.get('startup', 0) + 1
+            self._startup_failures += 1
+            failures = self._startup_failures
+            self._remove_worker(worker)
+            if self._closed:
+                return
+            if failures >= self.max_startup_attempts:
+                error = f"marker工作进程加载模型时连续{failures}次异常退出，退出码: {worker.process.exitcode}"
+                logger.error(f"{error}，不再重启")
+                self._startup_error = error
+                if not self._workers and not self._deferred_spawns:
+                    self._fail_pending(error)
+                return
+            delay = min(60.0, self.startup_backoff * 2 ** (failures - 1))
+            self._deferred_spawns.append(time.monotonic() + delay)
+        logger.warning(f"marker工作进程加载模型时异常退出，PID: {worker.process.pid}，"
+                       f"退出码: {worker.process.exitcode}，{delay:.1f}秒后重启（第{failures}次）")
+
+    def _remove_worker(self, worker: _WorkerHandle) -> None:
+        """从进程池中移除工作进程记录（调用方需持有锁）"""
+        if worker in self._workers:
+            self._workers.remove(worker)
+        worker.conn.close()
+
+    def _fail_pending(self, error: str) -> None:
+        """让所有排队中的任务失败（调用方需持有锁）"""
+        while self._pending:
+            job = self._pending.popleft()
+            if not job.future.done():
+                job.future.set_exception(WorkerPoolError(error))
+
+    def _stop_workers(self) -> None:
+        """通知所有工作进程退出并等待其结束"""
+        with self._lock:
+            workers = list(self._workers)
+            self._workers.clear()
+        for worker in workers:
+            try:
+                worker.conn.send(None)
+            except (BrokenPipeError, OSError):
+                pass
+        for worker in workers:
+            worker.process.join(timeout=5)
+            if worker.process.is_alive():
+                worker.process.terminate()
+                worker.process.join(timeout=5)
+            if worker.job is not None and not worker.job.future.done():
+                worker.job.future.set_exception(WorkerPoolError("工作进程池已关闭"))
+            worker.conn.close()